@@ -0,0 +1,595 @@
+# vim: set fileencoding=utf-8
+"""
+benchmarks/dbus_benchmark.py
+
+This file measures the d-bus throughput and latency of
+pythoneda-artifact/nix-flake-infrastructure: how many
+ChangeStagingCodeDescribed -> ChangeStagingCodePackaged round trips per
+second NixFlakeDbusSignalListener and NixFlakeDbusSignalEmitter sustain,
+and the p50/p95/p99 latency of each round trip.
+
+It starts a private dbus-daemon (unless --bus-address is given), and a
+service process whose listener and emitter use it as their session bus.
+The service answers each ChangeStagingCodeDescribed with a
+ChangeStagingCodePackaged carrying the same payload, so it measures the
+transport alone: flakes are not resolved nor built. The driver keeps a
+fixed number of requests in flight, for each payload size and concurrency
+level, and prints (or writes, with --output) the results as JSON:
+
+    python -m benchmarks.dbus_benchmark --sizes 64,4096,131072 \\
+        --concurrency 1,8,32 --requests 1000 --output dbus.json
+
+Both sides understand out-of-band payloads, so those of --out-of-band bytes
+or more travel as UNIX file descriptors (0 sends them all inline).
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Prefix of the synthetic payloads, followed by the request number.
+MARKER = "nix-flake-dbus-benchmark:"
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:dir={folder}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+  <limit name="max_incoming_bytes">1000000000</limit>
+  <limit name="max_outgoing_bytes">1000000000</limit>
+  <limit name="max_message_size">134217728</limit>
+</busconfig>
+"""
+
+
+def start_private_bus(folder: str) -> Tuple[subprocess.Popen, str]:
+    """
+    Starts a private dbus-daemon.
+    :param folder: The folder for its configuration and socket.
+    :type folder: str
+    :return: The daemon process, and its address.
+    :rtype: Tuple[subprocess.Popen, str]
+    """
+    daemon = shutil.which("dbus-daemon")
+    if daemon is None:
+        raise RuntimeError("dbus-daemon not found; use --bus-address instead")
+    config = Path(folder) / "bus.conf"
+    config.write_text(BUS_CONFIG.format(folder=folder))
+    process = subprocess.Popen(
+        [daemon, f"--config-file={config}", "--nofork", "--print-address=1"],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    address = process.stdout.readline().strip()
+    if not address:
+        process.kill()
+        raise RuntimeError("dbus-daemon did not report its address")
+    return process, address
+
+
+def synthetic_payload(number: int, size: int) -> str:
+    """
+    Builds the payload of a request.
+    :param number: The request number.
+    :type number: int
+    :param size: The payload size, in bytes.
+    :type size: int
+    :return: The payload.
+    :rtype: str
+    """
+    prefix = f"{MARKER}{number}:"
+    return prefix + "x" * max(0, size - len(prefix))
+
+
+def payload_of(event) -> str:
+    """
+    Retrieves the synthetic payload of given event.
+    :param event: The event.
+    :type event: pythoneda.Event
+    :return: The payload, or None if it has none.
+    :rtype: str
+    """
+    for value in vars(event).values():
+        if isinstance(value, str) and value.startswith(MARKER):
+            return value
+    return None
+
+
+def request_number(event) -> int:
+    """
+    Retrieves the number of the request given event answers.
+    :param event: The event.
+    :type event: pythoneda.Event
+    :return: The request number, or None if it's not an answer.
+    :rtype: int
+    """
+    payload = payload_of(event)
+    if payload is None:
+        return None
+    return int(payload[len(MARKER) :].split(":", 1)[0])
+
+
+class EchoApp:
+    """
+    Answers each ChangeStagingCodeDescribed with a ChangeStagingCodePackaged
+    carrying the same payload.
+    """
+
+    def __init__(self, emitter):
+        """
+        Creates a new EchoApp instance.
+        :param emitter: The emitter.
+        :type emitter: pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter
+        """
+        self._emitter = emitter
+
+    async def accept(self, event):
+        """
+        Answers given event.
+        :param event: The event.
+        :type event: pythoneda.shared.artifact.events.code.ChangeStagingCodeDescribed
+        """
+        from pythoneda.shared.artifact.events.code import ChangeStagingCodePackaged
+
+        await self._emitter.emit(
+            ChangeStagingCodePackaged(payload_of(event), [event.id])
+        )
+
+
+async def serve(window: float, maxBatch: int):
+    """
+    Runs the service side: a NixFlakeDbusSignalListener and a
+    NixFlakeDbusSignalEmitter on the session bus, answering every request.
+    :param window: The coalescing window of the emitter, in seconds.
+    :type window: float
+    :param maxBatch: The maximum batch of the emitter.
+    :type maxBatch: int
+    """
+    from dbus_next import BusType
+    from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+        DbusConnectionPool,
+        NixFlakeDbusSignalEmitter,
+        NixFlakeDbusSignalListener,
+    )
+
+    NixFlakeDbusSignalListener.bus_type(BusType.SESSION)
+    NixFlakeDbusSignalEmitter.bus_type(BusType.SESSION)
+    NixFlakeDbusSignalEmitter.coalescing(window, maxBatch)
+    # subscriptions get registered right away once connected
+    await DbusConnectionPool.instance().connect(BusType.SESSION)
+    await NixFlakeDbusSignalListener().accept(EchoApp(NixFlakeDbusSignalEmitter()))
+    print("ready", flush=True)
+    await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)
+    await DbusConnectionPool.instance().close()
+
+
+class Driver:
+    """
+    Sends requests to the service, and waits for their answers.
+    """
+
+    def __init__(self, address: str, timeout: float):
+        """
+        Creates a new Driver instance.
+        :param address: The address of the bus.
+        :type address: str
+        :param timeout: How long to wait for each answer, in seconds.
+        :type timeout: float
+        """
+        self._address = address
+        self._timeout = timeout
+        self._bus = None
+        self._waiting = {}
+        self._next_number = 0
+
+    async def connect(self):
+        """
+        Connects to the bus, and subscribes to the answers.
+        """
+        from dbus_next import Message
+        from dbus_next.aio import MessageBus
+        from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+            DbusConnectionPool,
+            OutOfBandPayload,
+        )
+        from pythoneda.shared.artifact.events.code.infrastructure.dbus import (
+            DbusChangeStagingCodePackaged,
+        )
+
+        self._bus = await MessageBus(
+            bus_address=self._address, negotiate_unix_fd=True
+        ).connect()
+        self._bus.add_message_handler(self._on_message)
+        interface = DbusConnectionPool.interface_name(DbusChangeStagingCodePackaged)
+        for rule in [
+            f"type='signal',interface='{interface}'",
+            OutOfBandPayload.match_rule(),
+        ]:
+            await self._bus.call(
+                Message(
+                    destination="org.freedesktop.DBus",
+                    path="/org/freedesktop/DBus",
+                    interface="org.freedesktop.DBus",
+                    member="AddMatch",
+                    signature="s",
+                    body=[rule],
+                )
+            )
+
+    def _on_message(self, message):
+        """
+        Resolves the request given answer is for.
+        :param message: The message.
+        :type message: dbus_next.Message
+        """
+        from dbus_next import MessageType
+        from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+            DbusConnectionPool,
+            OutOfBandPayload,
+        )
+        from pythoneda.shared.artifact.events.code.infrastructure.dbus import (
+            DbusChangeStagingCodePackaged,
+        )
+
+        if message.message_type != MessageType.SIGNAL:
+            return None
+        if message.interface == OutOfBandPayload.INTERFACE:
+            if not message.body[0].endswith(".ChangeStagingCodePackaged"):
+                OutOfBandPayload.discard(message)
+                return None
+            _, message = OutOfBandPayload.original(message)
+        if message.interface != DbusConnectionPool.interface_name(
+            DbusChangeStagingCodePackaged
+        ):
+            return None
+        number = request_number(DbusChangeStagingCodePackaged.parse(message))
+        answer = self._waiting.pop(number, None)
+        if answer is not None and not answer.done():
+            answer.set_result(time.perf_counter())
+        return None
+
+    async def round_trip(self, size: int) -> float:
+        """
+        Sends a request, and waits for its answer.
+        :param size: The payload size, in bytes.
+        :type size: int
+        :return: The latency, in seconds, or None if it timed out.
+        :rtype: float
+        """
+        from dbus_next import Message
+        from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+            DbusConnectionPool,
+            OutOfBandPayload,
+        )
+        from pythoneda.shared.artifact.events.code import ChangeStagingCodeDescribed
+        from pythoneda.shared.artifact.events.code.infrastructure.dbus import (
+            DbusChangeStagingCodeDescribed,
+        )
+
+        number = self._next_number
+        self._next_number += 1
+        event = ChangeStagingCodeDescribed(synthetic_payload(number, size))
+        interface_class = DbusChangeStagingCodeDescribed
+        path = interface_class.path()
+        interface = DbusConnectionPool.interface_name(interface_class)
+        signature = interface_class.sign(event)
+        body = interface_class.transform(event)
+        fd = None
+        if OutOfBandPayload.is_large(body):
+            message, fd = OutOfBandPayload.signal(
+                event, path, interface, signature, body
+            )
+        else:
+            message = Message.new_signal(
+                path, interface, event.__class__.__name__, signature, body
+            )
+        answer = asyncio.get_running_loop().create_future()
+        self._waiting[number] = answer
+        started = time.perf_counter()
+        try:
+            await self._bus.send(message)
+        finally:
+            if fd is not None:
+                os.close(fd)
+        try:
+            return await asyncio.wait_for(answer, self._timeout) - started
+        except asyncio.TimeoutError:
+            self._waiting.pop(number, None)
+            return None
+
+    async def run(self, size: int, concurrency: int, requests: int) -> Dict:
+        """
+        Sends given number of requests, keeping some of them in flight.
+        :param size: The payload size, in bytes.
+        :type size: int
+        :param concurrency: How many requests to keep in flight.
+        :type concurrency: int
+        :param requests: How many requests to send.
+        :type requests: int
+        :return: The throughput and latency.
+        :rtype: Dict
+        """
+        latencies = []
+        remaining = [requests]
+
+        async def client():
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                latencies.append(await self.round_trip(size))
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+        answered = [latency for latency in latencies if latency is not None]
+        return {
+            "payload_bytes": size,
+            "concurrency": concurrency,
+            "requests": requests,
+            "answered": len(answered),
+            "timed_out": requests - len(answered),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(answered) / elapsed if elapsed else 0.0,
+            "latency_ms": summarize(answered),
+        }
+
+    def disconnect(self):
+        """
+        Disconnects from the bus.
+        """
+        if self._bus is not None:
+            self._bus.disconnect()
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarizes given latencies.
+    :param samples: The latencies, in seconds.
+    :type samples: List[float]
+    :return: The p50, p95, p99, mean and max, in milliseconds.
+    :rtype: Dict[str, float]
+    """
+    if not samples:
+        return {}
+    milliseconds = [sample * 1000 for sample in samples]
+    if len(milliseconds) > 1:
+        cuts = statistics.quantiles(milliseconds, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = milliseconds[0]
+    return {
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "mean": statistics.fmean(milliseconds),
+        "max": max(milliseconds),
+    }
+
+
+async def drive(
+    address: str,
+    sizes: List[int],
+    concurrencies: List[int],
+    requests: int,
+    warmup: int,
+    timeout: float,
+) -> List[Dict]:
+    """
+    Runs every scenario against the service.
+    :param address: The address of the bus.
+    :type address: str
+    :param sizes: The payload sizes, in bytes.
+    :type sizes: List[int]
+    :param concurrencies: The concurrency levels.
+    :type concurrencies: List[int]
+    :param requests: How many requests per scenario.
+    :type requests: int
+    :param warmup: How many requests to send before measuring.
+    :type warmup: int
+    :param timeout: How long to wait for each answer, in seconds.
+    :type timeout: float
+    :return: The results of each scenario.
+    :rtype: List[Dict]
+    """
+    driver = Driver(address, timeout)
+    await driver.connect()
+    try:
+        if warmup:
+            await driver.run(min(sizes), 1, warmup)
+        result = []
+        for size in sizes:
+            for concurrency in concurrencies:
+                result.append(await driver.run(size, concurrency, requests))
+        return result
+    finally:
+        driver.disconnect()
+
+
+def parse_list(value: str) -> List[int]:
+    """
+    Parses a comma-separated list of integers.
+    :param value: The list.
+    :type value: str
+    :return: The integers.
+    :rtype: List[int]
+    """
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the d-bus throughput and latency of the listener and emitter"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=parse_list,
+        default=[64, 4096, 131072],
+        help="Comma-separated payload sizes, in bytes",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=parse_list,
+        default=[1, 8, 32],
+        help="Comma-separated numbers of requests in flight",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=500, help="Requests per scenario"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=20, help="Requests before measuring"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=10.0, help="Seconds to wait for each answer"
+    )
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=0.0,
+        help="Coalescing window of the emitter, in seconds (0 disables it)",
+    )
+    parser.add_argument(
+        "--max-batch", type=int, default=32, help="Maximum batch of the emitter"
+    )
+    parser.add_argument(
+        "--bus-address",
+        help="Use this bus instead of starting a private dbus-daemon",
+    )
+    parser.add_argument(
+        "--out-of-band",
+        type=int,
+        default=64 * 1024,
+        help="Payload size from which payloads travel as file descriptors, in bytes "
+        "(0 disables it)",
+    )
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.out_of_band:
+        from pythoneda.artifact.nix.flake.infrastructure.dbus import OutOfBandPayload
+
+        OutOfBandPayload.threshold(args.out_of_band)
+
+    if args.serve:
+        asyncio.run(serve(args.window, args.max_batch))
+        return
+
+    env = dict(os.environ)
+    # appended, so the pythoneda namespace root of the domain package wins
+    env["PYTHONPATH"] = os.pathsep.join(
+        [path for path in [env.get("PYTHONPATH")] if path] + [str(REPO_ROOT)]
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        daemon = None
+        address = args.bus_address
+        if address is None:
+            daemon, address = start_private_bus(folder)
+        env["DBUS_SESSION_BUS_ADDRESS"] = address
+        service = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.dbus_benchmark",
+                "--serve",
+                "--window",
+                str(args.window),
+                "--max-batch",
+                str(args.max_batch),
+                "--out-of-band",
+                str(args.out_of_band),
+            ],
+            cwd=folder,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            if service.stdout.readline().strip() != "ready":
+                raise RuntimeError(
+                    f"The service failed to start (status {service.wait()})"
+                )
+            scenarios = asyncio.run(
+                drive(
+                    address,
+                    args.sizes,
+                    args.concurrency,
+                    args.requests,
+                    args.warmup,
+                    args.timeout,
+                )
+            )
+        finally:
+            service.stdin.close()
+            try:
+                service.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                service.kill()
+            if daemon is not None:
+                daemon.terminate()
+                daemon.wait()
+
+    results = {
+        "benchmark": "dbus",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "private_bus": args.bus_address is None,
+        "window_s": args.window,
+        "max_batch": args.max_batch,
+        "out_of_band_bytes": args.out_of_band or None,
+        "scenarios": scenarios,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,433 @@
+# vim: set fileencoding=utf-8
+"""
+benchmarks/github_stub_server.py
+
+This file defines the GithubStubServer class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Dict, List, Tuple
+import urllib.error
+import urllib.request
+
+# Packages published as "<package>-<version>" tags in rydnr/nix-flakes.
+NIX_FLAKES_PACKAGES = [
+    "cachetools",
+    "dbus-next",
+    "dulwich",
+    "GitPython",
+    "grpcio",
+    "joblib",
+    "jupyterlab",
+    "nbformat",
+    "paramiko",
+    "requests",
+    "semver",
+    "stringtemplate3",
+    "unidiff",
+]
+
+
+class GithubStubServer:
+
+    """
+    A local stand-in for the gitHub API endpoints used by NixFlakeGitRepo.
+
+    By default, it generates deterministic tags for any repository. With
+    fixtures, it replays recorded responses instead. With an upstream, it
+    forwards the requests it has no fixture for, and records the responses,
+    so they can be saved and replayed later.
+
+    Class name: GithubStubServer
+
+    Responsibilities:
+        - Serve /repos/{owner}/{repo}/tags and /repos/{owner}/{repo}/commits/{sha}.
+        - Generate, replay or record the responses.
+        - Simulate latency, and gitHub's rate limits per token.
+        - Count the requests it serves.
+
+    Collaborators:
+        - http.server.ThreadingHTTPServer: Serves the requests.
+    """
+
+    _tags_path = re.compile(r"^/repos/([^/]+)/([^/]+)/tags/?(\?.*)?$")
+    _commit_path = re.compile(r"^/repos/([^/]+)/([^/]+)/commits/([0-9a-f]+)/?$")
+
+    # stands for the base URL of the API in the saved fixtures
+    _api_placeholder = "{github_api_url}"
+
+    def __init__(
+        self,
+        tagCount: int = 3,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        rateLimit: int = None,
+        rateLimitWindow: float = 3600.0,
+        fixtures: str = None,
+        upstream: str = None,
+        upstreamToken: str = None,
+    ):
+        """
+        Creates a new GithubStubServer instance.
+        :param tagCount: How many versions to publish per package.
+        :type tagCount: int
+        :param host: The host to bind to.
+        :type host: str
+        :param port: The port to bind to. Zero means any free port.
+        :type port: int
+        :param latency: The delay before each response, in seconds.
+        :type latency: float
+        :param rateLimit: How many requests each token (or anonymous client) can send per window. Unlimited if omitted.
+        :type rateLimit: int
+        :param rateLimitWindow: The length of the rate-limit window, in seconds.
+        :type rateLimitWindow: float
+        :param fixtures: A file saved by save_fixtures(), to replay. Optional.
+        :type fixtures: str
+        :param upstream: The base URL of the API to forward unknown requests to, i.e. https://api.github.com. Optional.
+        :type upstream: str
+        :param upstreamToken: The token to send upstream. Optional.
+        :type upstreamToken: str
+        """
+        super().__init__()
+        self._tag_count = tagCount
+        self._latency = latency
+        self._rate_limit = rateLimit
+        self._rate_limit_window = rateLimitWindow
+        # authorization -> (window end, requests left)
+        self._quotas = {}
+        self._upstream = upstream.rstrip("/") if upstream else None
+        self._upstream_token = upstreamToken
+        # path -> (status, body text, with the API URL as a placeholder)
+        self._fixtures = None
+        if fixtures is not None:
+            self.load_fixtures(fixtures)
+        elif upstream is not None:
+            self._fixtures = {}
+        self._request_counts = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Retrieves the base URL of this server.
+        :return: Such URL.
+        :rtype: str
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_counts(self) -> Dict[str, int]:
+        """
+        Retrieves how many requests have been served, per endpoint kind.
+        :return: Such counts.
+        :rtype: Dict[str, int]
+        """
+        with self._lock:
+            return dict(self._request_counts)
+
+    def start(self) -> "GithubStubServer":
+        """
+        Starts serving in a background thread.
+        :return: This instance.
+        :rtype: GithubStubServer
+        """
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="github-stub", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_counts(self):
+        """
+        Forgets the requests served so far.
+        """
+        with self._lock:
+            self._request_counts = {}
+
+    def load_fixtures(self, path: str):
+        """
+        Loads recorded responses, to replay them.
+        :param path: The file, as written by save_fixtures().
+        :type path: str
+        """
+        with open(path) as handle:
+            recorded = json.load(handle)
+        self._fixtures = {
+            path: (response["status"], response["body"])
+            for path, response in recorded["responses"].items()
+        }
+
+    def save_fixtures(self, path: str):
+        """
+        Saves the recorded responses.
+        :param path: The file.
+        :type path: str
+        """
+        with self._lock:
+            responses = {
+                path: {"status": status, "body": body}
+                for path, (status, body) in sorted((self._fixtures or {}).items())
+            }
+        with open(path, "w") as handle:
+            json.dump({"upstream": self._upstream, "responses": responses}, handle)
+            handle.write("\n")
+
+    def _throttle(self, authorization: str) -> Tuple[int, Dict[str, str]]:
+        """
+        Applies the rate limit to a request.
+        :param authorization: The Authorization header of the request, if any.
+        :type authorization: str
+        :return: The status to reply with (403 if throttled, None otherwise), and the rate-limit headers.
+        :rtype: Tuple[int, Dict[str, str]]
+        """
+        if self._rate_limit is None:
+            return None, {}
+        now = time.time()
+        key = authorization or "anonymous"
+        with self._lock:
+            reset, left = self._quotas.get(key, (0.0, 0))
+            if reset <= now:
+                reset, left = now + self._rate_limit_window, self._rate_limit
+            status = None
+            if left > 0:
+                left -= 1
+            else:
+                status = 403
+            self._quotas[key] = (reset, left)
+        headers = {
+            "X-RateLimit-Limit": str(self._rate_limit),
+            "X-RateLimit-Remaining": str(left),
+            "X-RateLimit-Reset": str(int(reset)),
+        }
+        return status, headers
+
+    def _forward(self, path: str) -> Tuple[int, str]:
+        """
+        Forwards a request upstream, and records the response.
+        :param path: The path of the request.
+        :type path: str
+        :return: The status and body of the response, with the API URL as a placeholder.
+        :rtype: Tuple[int, str]
+        """
+        request = urllib.request.Request(f"{self._upstream}{path}")
+        request.add_header("Accept", "application/vnd.github+json")
+        if self._upstream_token:
+            request.add_header("Authorization", f"token {self._upstream_token}")
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                status, body = response.status, response.read().decode("utf-8")
+        except urllib.error.HTTPError as error:
+            status, body = error.code, error.read().decode("utf-8")
+        body = body.replace(self._upstream, self.__class__._api_placeholder)
+        if status == 200:
+            with self._lock:
+                self._fixtures[path] = (status, body)
+        return status, body
+
+    def respond(self, path: str, authorization: str = None) -> Tuple[int, str, Dict]:
+        """
+        Builds the response to a request.
+        :param path: The path of the request.
+        :type path: str
+        :param authorization: The Authorization header of the request, if any.
+        :type authorization: str
+        :return: The status, the JSON body and the additional headers.
+        :rtype: Tuple[int, str, Dict]
+        """
+        if self._latency > 0:
+            time.sleep(self._latency)
+        status, headers = self._throttle(authorization)
+        if status is not None:
+            self._count("throttled")
+            message = {"message": "API rate limit exceeded"}
+            return status, json.dumps(message), headers
+        kind = "other"
+        if self._tags_path.match(path):
+            kind = "tags"
+        elif self._commit_path.match(path):
+            kind = "commits"
+        self._count(kind)
+        if self._fixtures is not None:
+            recorded = self._fixtures.get(path, None)
+            if recorded is None and self._upstream is not None:
+                self._count("upstream")
+                recorded = self._forward(path)
+            if recorded is None:
+                status, body = 404, json.dumps({"message": "Not Found"})
+            else:
+                status, body = recorded
+                body = body.replace(self.__class__._api_placeholder, self.url)
+            return status, body, headers
+        match = self._tags_path.match(path)
+        if match:
+            return 200, json.dumps(self.tags(match.group(1), match.group(2))), headers
+        match = self._commit_path.match(path)
+        if match:
+            commit = self.commit(*match.groups())
+            if commit is not None:
+                return 200, json.dumps(commit), headers
+        return 404, json.dumps({"message": "Not Found"}), headers
+
+    def _count(self, kind: str):
+        """
+        Counts a served request.
+        :param kind: The kind of request.
+        :type kind: str
+        """
+        with self._lock:
+            self._request_counts[kind] = self._request_counts.get(kind, 0) + 1
+
+    def tag_names(self, owner: str, repo: str) -> List[str]:
+        """
+        Retrieves the names of the tags of given repository.
+        :param owner: The owner of the repository.
+        :type owner: str
+        :param repo: The name of the repository.
+        :type repo: str
+        :return: Such names.
+        :rtype: List[str]
+        """
+        versions = [f"0.0.{index}" for index in range(1, self._tag_count + 1)]
+        if (owner, repo) == ("rydnr", "nix-flakes"):
+            return [
+                f"{package}-{version}"
+                for package in NIX_FLAKES_PACKAGES
+                for version in versions
+            ]
+        return versions
+
+    @classmethod
+    def sha(cls, owner: str, repo: str, tag: str) -> str:
+        """
+        Computes a deterministic commit SHA for given tag.
+        :param owner: The owner of the repository.
+        :type owner: str
+        :param repo: The name of the repository.
+        :type repo: str
+        :param tag: The tag name.
+        :type tag: str
+        :return: The SHA.
+        :rtype: str
+        """
+        return hashlib.sha1(f"{owner}/{repo}@{tag}".encode("utf-8")).hexdigest()
+
+    def tags(self, owner: str, repo: str) -> List[Dict]:
+        """
+        Builds the body of the /tags response for given repository.
+        :param owner: The owner of the repository.
+        :type owner: str
+        :param repo: The name of the repository.
+        :type repo: str
+        :return: The tags, as the gitHub API would return them.
+        :rtype: List[Dict]
+        """
+        result = []
+        for name in self.tag_names(owner, repo):
+            sha = self.__class__.sha(owner, repo, name)
+            result.append(
+                {
+                    "name": name,
+                    "commit": {
+                        "sha": sha,
+                        "url": f"{self.url}/repos/{owner}/{repo}/commits/{sha}",
+                    },
+                }
+            )
+        return result
+
+    def commit(self, owner: str, repo: str, sha: str) -> Dict:
+        """
+        Builds the body of the /commits/{sha} response.
+        Later tags (in tag_names order) get later commit dates.
+        :param owner: The owner of the repository.
+        :type owner: str
+        :param repo: The name of the repository.
+        :type repo: str
+        :param sha: The commit SHA.
+        :type sha: str
+        :return: The commit, or None if unknown.
+        :rtype: Dict
+        """
+        for index, name in enumerate(self.tag_names(owner, repo)):
+            if self.__class__.sha(owner, repo, name) == sha:
+                date = datetime(2023, 1, 1) + timedelta(hours=index)
+                return {
+                    "sha": sha,
+                    "commit": {"committer": {"date": date.isoformat() + "Z"}},
+                }
+        return None
+
+    def _handler_class(self):
+        """
+        Builds the request handler class bound to this server.
+        :return: Such class.
+        :rtype: type
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                status, body, headers = stub.respond(
+                    self.path, self.headers.get("Authorization", None)
+                )
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
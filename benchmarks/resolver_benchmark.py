@@ -0,0 +1,370 @@
+# vim: set fileencoding=utf-8
+"""
+benchmarks/resolver_benchmark.py
+
+This file measures how NixFlakeGitRepo resolves flakes:
+    - cold, warm (in memory) and warm (on disk) resolve() of every key of
+      flake_mapping(),
+    - the resolution of the full graph, cold and warm,
+    - the full graph under gitHub's rate limits, with several tokens.
+
+GitHub is replaced by a local GithubStubServer, which generates tags, or
+replays responses recorded from the real API. Every measurement reports the
+requests it sent along with its wall time, so changes in the fetch path can
+be quantified. Results are printed (or written, with --output) as JSON:
+
+    python -m benchmarks.resolver_benchmark --latency 50 --output resolver.json
+
+To record fixtures from the real API once, and replay them afterwards:
+
+    python -m benchmarks.resolver_benchmark --record github.json -t $GITHUB_TOKEN
+    python -m benchmarks.resolver_benchmark --fixtures github.json
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import atexit
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from .github_stub_server import GithubStubServer
+from .startup_benchmark import summarize
+
+
+def forget_tags(repoClass: type, disk: bool = True):
+    """
+    Forgets the tags already looked up.
+    :param repoClass: The NixFlakeGitRepo class.
+    :type repoClass: type
+    :param disk: Whether to clear the disk cache too.
+    :type disk: bool
+    """
+    repoClass.forget_latest_tags()
+    if disk:
+        repoClass.tag_cache.clear(warn=False)
+        # the cache counters are kept in it
+        os.makedirs(repoClass.tag_cache.location, exist_ok=True)
+
+
+def measure(stub: GithubStubServer, action: Callable[[], bool]) -> Dict:
+    """
+    Runs given action, measuring its wall time and the requests it sent.
+    :param stub: The gitHub stand-in.
+    :type stub: GithubStubServer
+    :param action: The action. It returns whether it succeeded.
+    :type action: Callable[[], bool]
+    :return: The wall time, the requests per kind, and whether it succeeded.
+    :rtype: Dict
+    """
+    stub.reset_counts()
+    started = time.perf_counter()
+    try:
+        ok = bool(action())
+        error = None
+    except Exception as exception:
+        ok = False
+        error = f"{exception.__class__.__name__}: {exception}"
+    wall = time.perf_counter() - started
+    result = {"wall": wall, "requests": stub.request_counts, "ok": ok}
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def report(runs: List[Dict]) -> Dict:
+    """
+    Summarizes the runs of a measurement.
+    :param runs: The runs, as returned by measure().
+    :type runs: List[Dict]
+    :return: The wall time summary, and the requests and outcome of the last run.
+    :rtype: Dict
+    """
+    last = runs[-1]
+    result = {
+        "wall_s": summarize([run["wall"] for run in runs]),
+        "requests": last["requests"],
+        "requests_total": sum(last["requests"].values()),
+        "ok": all(run["ok"] for run in runs),
+    }
+    errors = sorted({run["error"] for run in runs if "error" in run})
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+def resolve(repo, specName: str) -> bool:
+    """
+    Resolves given spec name.
+    :param repo: The repository.
+    :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+    :param specName: The spec name.
+    :type specName: str
+    :return: Whether it got resolved.
+    :rtype: bool
+    """
+    return repo.resolve(SimpleNamespace(name=specName, code_request=None)) is not None
+
+
+def resolve_graph(repo, specNames: List[str]) -> bool:
+    """
+    Resolves given spec names, sharing their common inputs.
+    :param repo: The repository.
+    :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+    :param specNames: The spec names.
+    :type specNames: List[str]
+    :return: Whether all of them got resolved.
+    :rtype: bool
+    """
+    with repo.shared_latest_flakes():
+        resolved = [resolve(repo, spec_name) for spec_name in specNames]
+    return all(resolved)
+
+
+def benchmark_specs(
+    repoClass: type, stub: GithubStubServer, specNames: List[str], repeat: int
+) -> Dict:
+    """
+    Measures cold and warm resolve() for each spec name.
+    :param repoClass: The NixFlakeGitRepo class.
+    :type repoClass: type
+    :param stub: The gitHub stand-in.
+    :type stub: GithubStubServer
+    :param specNames: The spec names.
+    :type specNames: List[str]
+    :param repeat: How many times to run each measurement.
+    :type repeat: int
+    :return: For each spec name, the cold, warm-memory and warm-disk results.
+    :rtype: Dict
+    """
+    result = {}
+    for spec_name in specNames:
+        cold, warm_memory, warm_disk = [], [], []
+        for _ in range(repeat):
+            forget_tags(repoClass)
+            repo = repoClass()
+            cold.append(measure(stub, lambda: resolve(repo, spec_name)))
+            warm_memory.append(measure(stub, lambda: resolve(repo, spec_name)))
+            forget_tags(repoClass, disk=False)
+            warm_disk.append(measure(stub, lambda: resolve(repo, spec_name)))
+        result[spec_name] = {
+            "cold": report(cold),
+            "warm_memory": report(warm_memory),
+            "warm_disk": report(warm_disk),
+        }
+    return result
+
+
+def benchmark_graph(
+    repoClass: type, stub: GithubStubServer, specNames: List[str], repeat: int
+) -> Dict:
+    """
+    Measures the resolution of every spec name at once, cold and warm.
+    :param repoClass: The NixFlakeGitRepo class.
+    :type repoClass: type
+    :param stub: The gitHub stand-in.
+    :type stub: GithubStubServer
+    :param specNames: The spec names.
+    :type specNames: List[str]
+    :param repeat: How many times to run each measurement.
+    :type repeat: int
+    :return: The cold and warm results.
+    :rtype: Dict
+    """
+    cold, warm = [], []
+    for _ in range(repeat):
+        forget_tags(repoClass)
+        cold.append(measure(stub, lambda: resolve_graph(repoClass(), specNames)))
+        warm.append(measure(stub, lambda: resolve_graph(repoClass(), specNames)))
+    return {"cold": report(cold), "warm": report(warm)}
+
+
+def benchmark_throttling(
+    repoClass: type,
+    stub: GithubStubServer,
+    specNames: List[str],
+    tokens: int,
+) -> Dict:
+    """
+    Measures a cold resolution of the full graph while the stand-in rate-limits each token.
+    :param repoClass: The NixFlakeGitRepo class.
+    :type repoClass: type
+    :param stub: The rate-limiting gitHub stand-in.
+    :type stub: GithubStubServer
+    :param specNames: The spec names.
+    :type specNames: List[str]
+    :param tokens: How many tokens to spread the requests across.
+    :type tokens: int
+    :return: The results, including which spec names could not be resolved.
+    :rtype: Dict
+    """
+    previous_tokens, previous_url = repoClass.github_settings()
+    repoClass.github_api_url(stub.url)
+    repoClass.github_tokens([f"benchmark-{index}" for index in range(tokens)])
+    try:
+        forget_tags(repoClass)
+        repo = repoClass()
+        unresolved = []
+
+        def action():
+            with repo.shared_latest_flakes():
+                for spec_name in specNames:
+                    if not resolve(repo, spec_name):
+                        unresolved.append(spec_name)
+            return not unresolved
+
+        result = report([measure(stub, action)])
+        result["tokens"] = tokens
+        result["unresolved"] = unresolved
+    finally:
+        repoClass.github_tokens(previous_tokens)
+        repoClass.github_api_url(previous_url)
+    return result
+
+
+def main():
+    """
+    Runs the benchmarks.
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure how NixFlakeGitRepo resolves flakes"
+    )
+    parser.add_argument(
+        "-n", "--repeat", type=int, default=3, help="Runs per measurement"
+    )
+    parser.add_argument(
+        "-s",
+        "--spec",
+        action="append",
+        help="Spec names to resolve (every key of flake_mapping() by default)",
+    )
+    parser.add_argument(
+        "--tags", type=int, default=3, help="Tags per generated repository"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Delay per response, in ms"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=40,
+        help="Requests per token in the throttling scenario (0 to skip it)",
+    )
+    parser.add_argument(
+        "--tokens", type=int, default=2, help="Tokens in the throttling scenario"
+    )
+    parser.add_argument(
+        "--fixtures", help="Replay the responses recorded in this file"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="Resolve every spec against the real API once, and save its responses",
+    )
+    parser.add_argument(
+        "--upstream",
+        default="https://api.github.com",
+        help="The API to record from",
+    )
+    parser.add_argument(
+        "-t", "--github-token", help="The token to record with"
+    )
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+    for option in ("fixtures", "record", "output"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    # the tag cache lives in the working folder; registered first, so it's
+    # removed after the cache counters get saved at exit
+    workspace = tempfile.mkdtemp(prefix="resolver-benchmark-")
+    atexit.register(shutil.rmtree, workspace, True)
+    os.chdir(workspace)
+    from pythoneda.artifact.nix.flake.infrastructure import NixFlakeGitRepo
+
+    spec_names = args.spec or sorted(NixFlakeGitRepo().flake_mapping())
+
+    if args.record:
+        with GithubStubServer(
+            upstream=args.upstream, upstreamToken=args.github_token
+        ) as recorder:
+            NixFlakeGitRepo.github_api_url(recorder.url)
+            forget_tags(NixFlakeGitRepo)
+            resolve_graph(NixFlakeGitRepo(), spec_names)
+            recorder.save_fixtures(args.record)
+            print(
+                f"Recorded {recorder.request_counts.get('upstream', 0)} responses "
+                f"to {args.record}",
+                file=sys.stderr,
+            )
+        return
+
+    settings = {
+        "tagCount": args.tags,
+        "latency": args.latency / 1000,
+        "fixtures": args.fixtures,
+    }
+    results = {
+        "benchmark": "resolver",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "tags": args.tags,
+        "latency_ms": args.latency,
+        "fixtures": args.fixtures,
+    }
+    with GithubStubServer(**settings) as stub:
+        NixFlakeGitRepo.github_api_url(stub.url)
+        results["specs"] = benchmark_specs(
+            NixFlakeGitRepo, stub, spec_names, args.repeat
+        )
+        results["graph"] = benchmark_graph(
+            NixFlakeGitRepo, stub, spec_names, args.repeat
+        )
+    if args.rate_limit > 0:
+        with GithubStubServer(rateLimit=args.rate_limit, **settings) as stub:
+            results["throttling"] = benchmark_throttling(
+                NixFlakeGitRepo, stub, spec_names, args.tokens
+            )
+            results["throttling"]["rate_limit"] = args.rate_limit
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
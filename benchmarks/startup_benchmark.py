@@ -0,0 +1,363 @@
+# vim: set fileencoding=utf-8
+"""
+benchmarks/startup_benchmark.py
+
+This file measures the startup cost of every entry point of
+pythoneda-artifact/nix-flake-infrastructure:
+    - cold and warm import time,
+    - per-module import cost (-X importtime breakdown),
+    - time from process start to a ready NixFlakeDbusSignalListener and
+      NixFlakeDbusSignalEmitter, to a parsed GithubTokenCli, and to the first
+      NixFlakeGitRepo.resolve() on a cold and on a warm cache.
+
+GitHub is replaced by a local GithubStubServer. Results are printed (or
+written, with --output) as JSON, to compare them across releases:
+
+    python -m benchmarks.startup_benchmark --repeat 10 --output startup.json
+
+With --check-imports, it only verifies that no entry point imports modules
+it does not need, and exits with a non-zero status otherwise.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from .github_stub_server import GithubStubServer
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+INFRASTRUCTURE = "pythoneda.artifact.nix.flake.infrastructure"
+
+# For each entry point: the import statement, and what "ready" means.
+ENTRY_POINTS = {
+    "github-token-cli": (
+        f"from {INFRASTRUCTURE}.cli import GithubTokenCli",
+        """
+import asyncio
+class _App:
+    def accept_github_token(self, token):
+        self.token = token
+sys.argv += ["--github-token", "benchmark"]
+asyncio.run(GithubTokenCli().accept(_App()))
+""",
+    ),
+    "dbus-signal-listener": (
+        f"from {INFRASTRUCTURE}.dbus import NixFlakeDbusSignalListener",
+        "NixFlakeDbusSignalListener().signal_receivers(None)",
+    ),
+    "dbus-signal-emitter": (
+        f"from {INFRASTRUCTURE}.dbus import NixFlakeDbusSignalEmitter",
+        "NixFlakeDbusSignalEmitter().signal_emitters()",
+    ),
+    "nix-flake-git-repo": (
+        f"from {INFRASTRUCTURE} import NixFlakeGitRepo",
+        """
+from types import SimpleNamespace
+NixFlakeGitRepo.github_api_url(os.environ["NIX_FLAKE_BENCHMARK_GITHUB_API"])
+NixFlakeGitRepo().resolve(
+    SimpleNamespace(name=os.environ["NIX_FLAKE_BENCHMARK_SPEC"], code_request=None)
+)
+""",
+    ),
+}
+
+# Modules each entry point must not import.
+FORBIDDEN_IMPORTS = {
+    "github-token-cli": [
+        "dbus_next",
+        "joblib",
+        "requests",
+        f"{INFRASTRUCTURE}.nix_flake_git_repo",
+        f"{INFRASTRUCTURE}.dbus",
+    ],
+    "dbus-signal-listener": [
+        "joblib",
+        "requests",
+        f"{INFRASTRUCTURE}.nix_flake_git_repo",
+    ],
+    "dbus-signal-emitter": [
+        "joblib",
+        "requests",
+        f"{INFRASTRUCTURE}.nix_flake_git_repo",
+    ],
+}
+
+CHILD = """
+import json, os, sys, time
+started = time.perf_counter()
+results_path = sys.argv.pop(1)
+{import_statement}
+imported = time.perf_counter()
+{ready}
+ready = time.perf_counter()
+with open(results_path, "w") as output:
+    json.dump(
+        {{
+            "import": imported - started,
+            "ready": ready - started,
+            "modules": sorted(sys.modules.keys()),
+        }},
+        output,
+    )
+"""
+
+
+def run_child(
+    entryPoint: str,
+    pycachePrefix: str,
+    cwd: str,
+    env: Dict[str, str],
+    importTime: bool = False,
+) -> Dict:
+    """
+    Runs given entry point in a fresh interpreter.
+    :param entryPoint: The entry point.
+    :type entryPoint: str
+    :param pycachePrefix: The bytecode cache folder. A new one means a cold import.
+    :type pycachePrefix: str
+    :param cwd: The working folder, where the tag cache lives.
+    :type cwd: str
+    :param env: The environment variables.
+    :type env: Dict[str, str]
+    :param importTime: Whether to collect the -X importtime breakdown.
+    :type importTime: bool
+    :return: The measurements.
+    :rtype: Dict
+    """
+    import_statement, ready = ENTRY_POINTS[entryPoint]
+    code = CHILD.format(import_statement=import_statement, ready=ready)
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as handle:
+        output = handle.name
+    command = [sys.executable]
+    if importTime:
+        command += ["-X", "importtime"]
+    command += ["-c", code, output]
+    child_env = dict(env)
+    child_env["PYTHONPYCACHEPREFIX"] = pycachePrefix
+    started = time.perf_counter()
+    process = subprocess.run(
+        command, cwd=cwd, env=child_env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    try:
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"{entryPoint} failed with status {process.returncode}:\n{process.stderr}"
+            )
+        with open(output) as handle:
+            result = json.load(handle)
+    finally:
+        os.unlink(output)
+    result["wall"] = wall
+    if importTime:
+        result["importtime"] = parse_importtime(process.stderr)
+    return result
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """
+    Parses the output of -X importtime.
+    :param stderr: The standard error of the child process.
+    :type stderr: str
+    :return: For each module, its self and cumulative import time, in microseconds.
+    :rtype: List[Dict]
+    """
+    result = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        result.append(
+            {
+                "module": module.strip(),
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            }
+        )
+    return result
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarizes given samples.
+    :param samples: The samples, in seconds.
+    :type samples: List[float]
+    :return: The min, median, mean and max.
+    :rtype: Dict[str, float]
+    """
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+        "samples": len(samples),
+    }
+
+
+def benchmark_entry_point(
+    entryPoint: str, repeat: int, env: Dict[str, str], top: int
+) -> Dict:
+    """
+    Benchmarks given entry point.
+    :param entryPoint: The entry point.
+    :type entryPoint: str
+    :param repeat: How many times to run each measurement.
+    :type repeat: int
+    :param env: The environment variables.
+    :type env: Dict[str, str]
+    :param top: How many modules to report in the import breakdown.
+    :type top: int
+    :return: The results.
+    :rtype: Dict
+    """
+    cold = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as pycache, tempfile.TemporaryDirectory() as cwd:
+            cold.append(run_child(entryPoint, pycache, cwd, env))
+
+    with tempfile.TemporaryDirectory() as pycache, tempfile.TemporaryDirectory() as cwd:
+        # prime both the bytecode and the tag caches
+        run_child(entryPoint, pycache, cwd, env)
+        warm = [run_child(entryPoint, pycache, cwd, env) for _ in range(repeat)]
+        breakdown = run_child(entryPoint, pycache, cwd, env, importTime=True)
+
+    modules = sorted(
+        breakdown["importtime"], key=lambda item: item["cumulative_us"], reverse=True
+    )
+    result = {}
+    for label, runs in [("cold", cold), ("warm", warm)]:
+        result[label] = {
+            "import_s": summarize([run["import"] for run in runs]),
+            "ready_s": summarize([run["ready"] for run in runs]),
+            "process_wall_s": summarize([run["wall"] for run in runs]),
+        }
+    result["modules_loaded"] = len(breakdown["modules"])
+    result["importtime_top"] = modules[:top]
+    return result
+
+
+def check_imports(env: Dict[str, str]) -> List[str]:
+    """
+    Checks no entry point imports a forbidden module.
+    :param env: The environment variables.
+    :type env: Dict[str, str]
+    :return: The violations found.
+    :rtype: List[str]
+    """
+    result = []
+    for entry_point, forbidden in FORBIDDEN_IMPORTS.items():
+        with tempfile.TemporaryDirectory() as pycache, tempfile.TemporaryDirectory() as cwd:
+            modules = run_child(entry_point, pycache, cwd, env)["modules"]
+        for module in forbidden:
+            if module in modules:
+                result.append(f"{entry_point} imports {module}")
+    return result
+
+
+def main():
+    """
+    Runs the benchmarks.
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the startup cost of each entry point"
+    )
+    parser.add_argument(
+        "-n", "--repeat", type=int, default=5, help="Runs per measurement"
+    )
+    parser.add_argument(
+        "-s",
+        "--spec",
+        default="pythoneda-shared-pythoneda-domain",
+        help="The spec name to resolve",
+    )
+    parser.add_argument(
+        "-e",
+        "--entry-point",
+        action="append",
+        choices=sorted(ENTRY_POINTS),
+        help="Entry points to benchmark (all by default)",
+    )
+    parser.add_argument(
+        "-t", "--top", type=int, default=25, help="Modules in the import breakdown"
+    )
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file")
+    parser.add_argument(
+        "--check-imports",
+        action="store_true",
+        help="Only check entry points do not import unneeded modules",
+    )
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # appended, so the pythoneda namespace root of the domain package wins
+    env["PYTHONPATH"] = os.pathsep.join(
+        [path for path in [env.get("PYTHONPATH")] if path] + [str(REPO_ROOT)]
+    )
+    env["NIX_FLAKE_BENCHMARK_SPEC"] = args.spec
+
+    with GithubStubServer() as stub:
+        env["NIX_FLAKE_BENCHMARK_GITHUB_API"] = stub.url
+
+        if args.check_imports:
+            violations = check_imports(env)
+            for violation in violations:
+                print(violation, file=sys.stderr)
+            sys.exit(1 if violations else 0)
+
+        results = {
+            "benchmark": "startup",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "spec": args.spec,
+            "entry_points": {},
+        }
+        for entry_point in args.entry_point or sorted(ENTRY_POINTS):
+            results["entry_points"][entry_point] = benchmark_entry_point(
+                entry_point, args.repeat, env, args.top
+            )
+        results["github_requests"] = stub.request_counts
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
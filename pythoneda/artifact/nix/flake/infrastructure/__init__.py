@@ -21,7 +21,36 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 __path__ = __import__("pkgutil").extend_path(__path__, __name__)
 
-from .nix_flake_git_repo import NixFlakeGitRepo
+from .lazy_attributes import LazyAttributes
+
+# Public attributes, and the submodules defining them. They get imported on
+# first access (PEP 562), so entry points only pay for what they use.
+_LAZY_ATTRIBUTES = {
+    "FlakeArtifactCache": ".flake_artifact_cache",
+    "GithubTokenPool": ".github_token_pool",
+    "InMemoryRemoteCache": ".in_memory_remote_cache",
+    "Metrics": ".metrics",
+    "NixFlakeGitRepo": ".nix_flake_git_repo",
+    "PackagingExecutor": ".packaging_executor",
+    "RedisRemoteCache": ".redis_remote_cache",
+    "RemoteCache": ".remote_cache",
+    "ResolutionProfiler": ".resolution_profiler",
+    "ResolverClient": ".resolver_client",
+    "ResolverDaemon": ".resolver_daemon",
+    "Span": ".span",
+    "TagCacheManager": ".tag_cache_manager",
+    "TagIndexSnapshot": ".tag_index_snapshot",
+    "TagLookupState": ".tag_lookup_state",
+    "TagRefresher": ".tag_refresher",
+    "TagWebhookReceiver": ".tag_webhook_receiver",
+    "Tracer": ".tracer",
+}
+
+_lazy_attributes = LazyAttributes(__name__, _LAZY_ATTRIBUTES)
+__getattr__ = _lazy_attributes.getattr
+__dir__ = _lazy_attributes.dir
+__all__ = _lazy_attributes.names
+
 
 # vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
 # Local Variables:
@@ -1,8 +1,8 @@
 # vim: set fileencoding=utf-8
 """
-pythoneda/artifact/nix/flake/infrastructure/__init__.py
+pythoneda/artifact/nix/flake/infrastructure/cli/__init__.py
 
-This file ensures pythoneda.artifact.nix.flake.infrastructure is a namespace.
+This file ensures pythoneda.artifact.nix.flake.infrastructure.cli is a namespace.
 
 Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
 
@@ -20,6 +20,27 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 __path__ = __import__("pkgutil").extend_path(__path__, __name__)
+
+from ..lazy_attributes import LazyAttributes
+
+# Public attributes, and the submodules defining them. They get imported on
+# first access (PEP 562), so entry points only pay for what they use.
+_LAZY_ATTRIBUTES = {
+    "BatchResolutionCli": ".batch_resolution_cli",
+    "DeadlineCli": ".deadline_cli",
+    "GithubTokenCli": ".github_token_cli",
+    "MetricsCli": ".metrics_cli",
+    "RemoteCacheCli": ".remote_cache_cli",
+    "ResolverDaemonCli": ".resolver_daemon_cli",
+    "TagCacheCli": ".tag_cache_cli",
+    "TagWebhookCli": ".tag_webhook_cli",
+}
+
+_lazy_attributes = LazyAttributes(__name__, _LAZY_ATTRIBUTES)
+__getattr__ = _lazy_attributes.getattr
+__dir__ = _lazy_attributes.dir
+__all__ = _lazy_attributes.names
+
 # vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
 # Local Variables:
 # mode: python
@@ -0,0 +1,320 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/cli/batch_resolution_cli.py
+
+This file defines the BatchResolutionCli class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .deadline_cli import DeadlineCli
+from .github_token_cli import GithubTokenCli
+from .remote_cache_cli import RemoteCacheCli
+import argparse
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+from pythoneda.shared import BaseObject, PrimaryPort
+import sys
+import time
+from typing import Dict, Iterable, TextIO
+
+
+class BatchResolutionCli(BaseObject, PrimaryPort):
+
+    """
+    A PrimaryPort that resolves many flakes at once, streaming the results as NDJSON.
+
+    Each input line is either:
+        - a spec name, i.e. "pythoneda-shared-pythoneda-domain",
+        - a spec name and a version, i.e. "pythoneda-shared-pythoneda-domain@0.0.1",
+        - repository coordinates, i.e. "pythoneda-shared-pythoneda/domain",
+        - or a JSON object with "name" (and optionally "version"), or "coordinates".
+    Empty lines and lines starting with # are ignored.
+
+    Each result is written as soon as it's ready, as a JSON line including
+    the (0-based) index of its input line, since results come in order of
+    completion.
+
+    Class name: BatchResolutionCli
+
+    Responsibilities:
+        - Parse the command-line to retrieve the input and the concurrency.
+        - Resolve every input line through a single, shared NixFlakeGitRepo.
+        - Write each result as an NDJSON line.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Resolves the flakes.
+    """
+
+    def __init__(self, repo=None):
+        """
+        Creates a new BatchResolutionCli instance.
+        :param repo: The repository. A new NixFlakeGitRepo if omitted.
+        :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        """
+        super().__init__()
+        self._repo = repo
+
+    @property
+    def repo(self):
+        """
+        Retrieves the repository.
+        :return: Such repository.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        """
+        if self._repo is None:
+            from pythoneda.artifact.nix.flake.infrastructure import NixFlakeGitRepo
+
+            self._repo = NixFlakeGitRepo()
+        return self._repo
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """
+        Adds the arguments of the batch resolution to given parser.
+        :param parser: The parser.
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument(
+            "-b",
+            "--resolve-batch",
+            nargs="?",
+            const="-",
+            default=None,
+            metavar="FILE",
+            help="Resolve the specs in FILE (or stdin, if omitted or -), one per line",
+        )
+        parser.add_argument(
+            "-j",
+            "--concurrency",
+            type=int,
+            default=8,
+            help="How many specs to resolve concurrently",
+        )
+        parser.add_argument(
+            "--profile",
+            default=None,
+            metavar="FILE",
+            help="Write a resolution profile to FILE (folded stacks if *.folded)",
+        )
+
+    async def accept(self, app):
+        """
+        Processes the command specified from the command line.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        parser = argparse.ArgumentParser(description="Resolve flakes in batch")
+        self.__class__.add_arguments(parser)
+        args, unknown_args = parser.parse_known_args()
+        if args.resolve_batch is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                self.run_from,
+                args.resolve_batch,
+                sys.stdout,
+                args.concurrency,
+                args.profile,
+            )
+
+    def run_from(
+        self, source: str, output: TextIO, concurrency: int, profile: str = None
+    ) -> int:
+        """
+        Resolves the specs in given file, or in stdin.
+        :param source: The file, or - for stdin.
+        :type source: str
+        :param output: Where to write the results.
+        :type output: TextIO
+        :param concurrency: How many specs to resolve concurrently.
+        :type concurrency: int
+        :param profile: The file to write the resolution profile to. Optional.
+        :type profile: str
+        :return: The number of specs that could not be resolved.
+        :rtype: int
+        """
+        if profile is not None:
+            with self.repo.profiling() as profiler:
+                result = self.run_from(source, output, concurrency)
+            profiler.save(profile)
+            return result
+        if source == "-":
+            return self.run(sys.stdin, output, concurrency)
+        with open(source) as lines:
+            return self.run(lines, output, concurrency)
+
+    def run(self, lines: Iterable[str], output: TextIO, concurrency: int = 8) -> int:
+        """
+        Resolves the specs in given lines, writing each result as soon as it's ready.
+        Lines are read lazily, so the input can be an unbounded pipe.
+        :param lines: The input lines.
+        :type lines: Iterable[str]
+        :param output: Where to write the results.
+        :type output: TextIO
+        :param concurrency: How many specs to resolve concurrently.
+        :type concurrency: int
+        :return: The number of specs that could not be resolved.
+        :rtype: int
+        """
+        failures = 0
+        concurrency = max(1, concurrency)
+        pending = set()
+        # the flakes every spec depends on (nixos, flake-utils...) get resolved once
+        with self.repo.shared_latest_flakes(), ThreadPoolExecutor(
+            max_workers=concurrency
+        ) as executor:
+            for index, line in enumerate(lines):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                pending.add(executor.submit(self.resolve_line, index, line))
+                if len(pending) >= 2 * concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    failures += self._write(done, output)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                failures += self._write(done, output)
+        return failures
+
+    def _write(self, futures: Iterable, output: TextIO) -> int:
+        """
+        Writes the results of given futures.
+        :param futures: The finished futures.
+        :type futures: Iterable[concurrent.futures.Future]
+        :param output: Where to write the results.
+        :type output: TextIO
+        :return: How many of them failed.
+        :rtype: int
+        """
+        result = 0
+        for future in futures:
+            record = future.result()
+            if not record["ok"]:
+                result += 1
+            output.write(json.dumps(record) + "\n")
+        output.flush()
+        return result
+
+    def resolve_line(self, index: int, line: str) -> Dict:
+        """
+        Resolves given input line.
+        :param index: The index of the line.
+        :type index: int
+        :param line: The line.
+        :type line: str
+        :return: The result.
+        :rtype: Dict
+        """
+        started = time.perf_counter()
+        result = {"index": index, "input": line}
+        try:
+            # every resolution gets the default deadline, if any
+            with self.repo.__class__.deadline():
+                request = self.__class__.parse_line(line)
+                if "coordinates" in request:
+                    version = self.repo.latest_version_by_coordinates(
+                        request["coordinates"]
+                    )
+                    result["coordinates"] = request["coordinates"]
+                    result["version"] = version
+                    result["ok"] = version is not None
+                else:
+                    if request.get("version", None) is None:
+                        flake = self.repo.resolve_by_name(request["name"])
+                    else:
+                        finder = self.repo.version_finder(request["name"])
+                        flake = (
+                            None if finder is None else finder(request["version"])
+                        )
+                    result.update(self.__class__.describe(flake))
+                    result["ok"] = flake is not None
+                if not result["ok"]:
+                    result["error"] = "not found"
+        except Exception as error:
+            result["ok"] = False
+            result["error"] = f"{error.__class__.__name__}: {error}"
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    @classmethod
+    def parse_line(cls, line: str) -> Dict:
+        """
+        Parses given input line.
+        :param line: The line.
+        :type line: str
+        :return: Either "name" (and "version"), or "coordinates".
+        :rtype: Dict
+        """
+        if line.startswith("{"):
+            return json.loads(line)
+        if "/" in line:
+            return {"coordinates": line}
+        name, _, version = line.partition("@")
+        return {"name": name, "version": version or None}
+
+    @classmethod
+    def describe(cls, flake) -> Dict:
+        """
+        Describes given flake.
+        :param flake: The flake.
+        :type flake: pythoneda.shared.nix.flake.NixFlake
+        :return: Its name, version and url.
+        :rtype: Dict
+        """
+        if flake is None:
+            return {}
+        return {
+            "name": getattr(flake, "name", None),
+            "version": getattr(flake, "version", None),
+            "url": getattr(flake, "url", None),
+        }
+
+
+def main():
+    """
+    Resolves flakes in batch, outside of any PythonEDA application.
+    """
+    parser = argparse.ArgumentParser(
+        description="Resolve flakes in batch, writing the results as NDJSON"
+    )
+    BatchResolutionCli.add_arguments(parser)
+    DeadlineCli.add_arguments(parser)
+    GithubTokenCli.add_arguments(parser)
+    RemoteCacheCli.add_arguments(parser)
+    args = parser.parse_args()
+    RemoteCacheCli.connect(args)
+    DeadlineCli.configure(args)
+    cli = BatchResolutionCli()
+    tokens = GithubTokenCli.joined(args.github_token)
+    if tokens:
+        cli.repo.__class__.github_token(tokens)
+    failures = cli.run_from(
+        args.resolve_batch or "-", sys.stdout, args.concurrency, args.profile
+    )
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,101 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/cli/deadline_cli.py
+
+This file defines the DeadlineCli class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+from pythoneda.shared import BaseObject, PrimaryPort
+
+
+class DeadlineCli(BaseObject, PrimaryPort):
+
+    """
+    A PrimaryPort that bounds how long resolutions and gitHub requests take, as requested from the command line.
+
+    Class name: DeadlineCli
+
+    Responsibilities:
+        - Parse the command-line to retrieve the timeouts and the hedging percentile.
+        - Apply them to NixFlakeGitRepo.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Sends the gitHub requests.
+    """
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """
+        Adds the deadline arguments to given parser.
+        :param parser: The parser.
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument(
+            "--resolve-timeout",
+            type=float,
+            default=None,
+            help="Seconds a resolution can wait for gitHub, before using outdated tags",
+        )
+        parser.add_argument(
+            "--github-timeout",
+            type=float,
+            default=30.0,
+            help="Seconds each gitHub request can take",
+        )
+        parser.add_argument(
+            "--hedge-percentile",
+            type=float,
+            default=0.95,
+            help="Send a second gitHub request once the first one is slower than this "
+            "latency percentile (0 disables it)",
+        )
+
+    @classmethod
+    def configure(cls, args: argparse.Namespace):
+        """
+        Applies the deadlines, according to given arguments.
+        :param args: The parsed arguments.
+        :type args: argparse.Namespace
+        """
+        from pythoneda.artifact.nix.flake.infrastructure import NixFlakeGitRepo
+
+        NixFlakeGitRepo.request_deadlines(args.resolve_timeout, args.github_timeout)
+        NixFlakeGitRepo.hedge_requests(args.hedge_percentile or None)
+
+    async def accept(self, app):
+        """
+        Processes the command specified from the command line.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        parser = argparse.ArgumentParser(
+            description="Bound how long resolutions and gitHub requests take"
+        )
+        self.__class__.add_arguments(parser)
+        args, unknown_args = parser.parse_known_args()
+        self.__class__.configure(args)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
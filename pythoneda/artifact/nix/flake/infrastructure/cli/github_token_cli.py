@@ -21,17 +21,21 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import argparse
 from pythoneda.shared import BaseObject, PrimaryPort
+from typing import List
 
 
 class GithubTokenCli(BaseObject, PrimaryPort):
 
     """
-    A PrimaryPort that extracts the GitHub token from the CLI.
+    A PrimaryPort that extracts the GitHub tokens from the CLI.
+
+    Several tokens can be provided, either repeating --github-token or
+    separating them with commas. The requests get spread across their quotas.
 
     Class name: GithubTokenCli
 
     Responsibilities:
-        - Parse the command-line to retrieve the GitHub token.
+        - Parse the command-line to retrieve the GitHub tokens.
 
     Collaborators:
         None
@@ -44,12 +48,37 @@ class GithubTokenCli(BaseObject, PrimaryPort):
         :type app: pythoneda.shared.application.PythonEDA
         """
         parser = argparse.ArgumentParser(description="Provide the Github token")
+        self.__class__.add_arguments(parser)
+        args, unknown_args = parser.parse_known_args()
+
+        app.accept_github_token(self.__class__.joined(args.github_token))
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """
+        Adds the gitHub token argument to given parser.
+        :param parser: The parser.
+        :type parser: argparse.ArgumentParser
+        """
         parser.add_argument(
-            "-t", "--github-token", required=False, help="The github token"
+            "-t",
+            "--github-token",
+            required=False,
+            action="append",
+            help="The github token. Repeat it, or use commas, to provide several",
         )
-        args, unknown_args = parser.parse_known_args()
 
-        app.accept_github_token(args.github_token)
+    @classmethod
+    def joined(cls, tokens: List[str]) -> str:
+        """
+        Joins the parsed tokens.
+        :param tokens: The values of --github-token.
+        :type tokens: List[str]
+        :return: The tokens, separated by commas, or None if there're none.
+        :rtype: str
+        """
+        result = ",".join(token for token in tokens or [] if token)
+        return result or None
 
 
 # vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
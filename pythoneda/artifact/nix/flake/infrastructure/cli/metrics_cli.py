@@ -0,0 +1,102 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/cli/metrics_cli.py
+
+This file defines the MetricsCli class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+from pythoneda.shared import BaseObject, PrimaryPort
+
+
+class MetricsCli(BaseObject, PrimaryPort):
+
+    """
+    A PrimaryPort that exposes the metrics, if requested from the command line.
+
+    Class name: MetricsCli
+
+    Responsibilities:
+        - Parse the command-line to retrieve the metrics port or textfile.
+        - Start exposing the metrics.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.Metrics: The metrics.
+    """
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """
+        Adds the metrics arguments to given parser.
+        :param parser: The parser.
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=None,
+            help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+        )
+        parser.add_argument(
+            "--metrics-textfile",
+            default=None,
+            metavar="FILE",
+            help="Write Prometheus metrics to FILE, i.e. for node_exporter",
+        )
+        parser.add_argument(
+            "--metrics-interval",
+            type=float,
+            default=15.0,
+            help="How often to rewrite --metrics-textfile, in seconds",
+        )
+
+    @classmethod
+    def expose(cls, args: argparse.Namespace):
+        """
+        Exposes the metrics, according to given arguments.
+        :param args: The parsed arguments.
+        :type args: argparse.Namespace
+        """
+        from pythoneda.artifact.nix.flake.infrastructure import Metrics
+
+        if args.metrics_port is not None:
+            Metrics.instance().serve(args.metrics_port)
+        if args.metrics_textfile:
+            Metrics.instance().write_textfile_every(
+                args.metrics_textfile, args.metrics_interval
+            )
+
+    async def accept(self, app):
+        """
+        Processes the command specified from the command line.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        parser = argparse.ArgumentParser(description="Expose Prometheus metrics")
+        self.__class__.add_arguments(parser)
+        args, unknown_args = parser.parse_known_args()
+        self.__class__.expose(args)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
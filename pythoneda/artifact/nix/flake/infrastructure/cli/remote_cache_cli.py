@@ -0,0 +1,112 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/cli/remote_cache_cli.py
+
+This file defines the RemoteCacheCli class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import os
+from pythoneda.shared import BaseObject, PrimaryPort
+
+
+class RemoteCacheCli(BaseObject, PrimaryPort):
+
+    """
+    A PrimaryPort that shares gitHub tags through a remote cache, if requested from the command line.
+
+    The URL is read from the PYTHONEDA_NIX_FLAKE_REMOTE_CACHE environment
+    variable, unless --remote-cache is given, so passwords don't show up in
+    the process list.
+
+    Class name: RemoteCacheCli
+
+    Responsibilities:
+        - Parse the command-line to retrieve the remote cache URL and TTL.
+        - Connect NixFlakeGitRepo to it.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.RemoteCache: The remote cache.
+    """
+
+    URL_VARIABLE = "PYTHONEDA_NIX_FLAKE_REMOTE_CACHE"
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """
+        Adds the remote cache arguments to given parser.
+        :param parser: The parser.
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument(
+            "--remote-cache",
+            default=None,
+            metavar="URL",
+            help="Share gitHub tags with other hosts, i.e. redis://cache:6379/0 "
+            f"(defaults to ${cls.URL_VARIABLE})",
+        )
+        parser.add_argument(
+            "--remote-cache-ttl",
+            type=float,
+            default=3600.0,
+            help="How long shared tags are valid, in seconds",
+        )
+
+    @classmethod
+    def connect(cls, args: argparse.Namespace):
+        """
+        Connects to the remote cache, according to given arguments.
+        :param args: The parsed arguments.
+        :type args: argparse.Namespace
+        :return: The remote cache, or None if not requested.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.RemoteCache
+        """
+        url = args.remote_cache or os.environ.get(cls.URL_VARIABLE, None)
+        if not url:
+            return None
+        from pythoneda.artifact.nix.flake.infrastructure import (
+            NixFlakeGitRepo,
+            RemoteCache,
+        )
+
+        result = RemoteCache.from_url(url)
+        NixFlakeGitRepo.remote_cache(result, args.remote_cache_ttl)
+        RemoteCacheCli.logger().info(f"Sharing gitHub tags through {result.url}")
+        return result
+
+    async def accept(self, app):
+        """
+        Processes the command specified from the command line.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        parser = argparse.ArgumentParser(
+            description="Share gitHub tags through a remote cache"
+        )
+        self.__class__.add_arguments(parser)
+        args, unknown_args = parser.parse_known_args()
+        self.__class__.connect(args)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,201 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/cli/resolver_daemon_cli.py
+
+This file defines the ResolverDaemonCli class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .deadline_cli import DeadlineCli
+from .github_token_cli import GithubTokenCli
+from .metrics_cli import MetricsCli
+from .remote_cache_cli import RemoteCacheCli
+from .tag_webhook_cli import TagWebhookCli
+import argparse
+import asyncio
+from pythoneda.shared import BaseObject, PrimaryPort
+
+
+class ResolverDaemonCli(BaseObject, PrimaryPort):
+
+    """
+    A PrimaryPort that runs the resolver daemon, if requested from the command line.
+
+    Class name: ResolverDaemonCli
+
+    Responsibilities:
+        - Parse the command-line to retrieve the socket and the daemon settings.
+        - Run the daemon, refreshing hot tags ahead if requested.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.ResolverDaemon: The daemon.
+        - pythoneda.artifact.nix.flake.infrastructure.TagRefresher: Refreshes hot tags.
+    """
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """
+        Adds the arguments of the daemon to given parser.
+        :param parser: The parser.
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument(
+            "--resolver-socket",
+            nargs="?",
+            const="",
+            default=None,
+            metavar="SOCKET",
+            help="Serve resolutions on this UNIX socket (the default one if omitted)",
+        )
+        parser.add_argument(
+            "--resolver-concurrency",
+            type=int,
+            default=8,
+            help="How many specs the daemon resolves concurrently",
+        )
+        parser.add_argument(
+            "--resolver-ttl",
+            type=float,
+            default=300.0,
+            help="How long the daemon keeps results in memory, in seconds",
+        )
+        parser.add_argument(
+            "--refresh-ahead-budget",
+            type=int,
+            default=0,
+            help="gitHub requests per hour to refresh hot tags before they expire",
+        )
+        parser.add_argument(
+            "--refresh-ahead-lead",
+            type=float,
+            default=30.0,
+            help="How long before their expiration hot tags get refreshed, in seconds",
+        )
+        parser.add_argument(
+            "--tag-snapshot",
+            default=None,
+            metavar="FILE",
+            help='Answer tag lookups from a snapshot written by "tag-cache snapshot"',
+        )
+
+    @classmethod
+    def daemon(cls, args: argparse.Namespace):
+        """
+        Creates the daemon, according to given arguments.
+        :param args: The parsed arguments.
+        :type args: argparse.Namespace
+        :return: The daemon.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.ResolverDaemon
+        """
+        from pythoneda.artifact.nix.flake.infrastructure import ResolverDaemon
+
+        return ResolverDaemon(
+            args.resolver_socket or None,
+            concurrency=args.resolver_concurrency,
+            ttl=args.resolver_ttl,
+        )
+
+    @classmethod
+    def tag_snapshot(cls, args: argparse.Namespace):
+        """
+        Maps the tag index snapshot, according to given arguments.
+        :param args: The parsed arguments.
+        :type args: argparse.Namespace
+        :return: The snapshot, or None if not requested.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagIndexSnapshot
+        """
+        if args.tag_snapshot is None:
+            return None
+        from pythoneda.artifact.nix.flake.infrastructure import NixFlakeGitRepo
+
+        return NixFlakeGitRepo.tag_snapshot(args.tag_snapshot)
+
+    @classmethod
+    def refresher(cls, args: argparse.Namespace):
+        """
+        Starts refreshing hot tags, according to given arguments.
+        :param args: The parsed arguments.
+        :type args: argparse.Namespace
+        :return: The refresher, or None if not requested.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagRefresher
+        """
+        if args.refresh_ahead_budget <= 0:
+            return None
+        from pythoneda.artifact.nix.flake.infrastructure import TagRefresher
+
+        return TagRefresher(
+            budget=args.refresh_ahead_budget, lead=args.refresh_ahead_lead
+        ).start()
+
+    async def accept(self, app):
+        """
+        Processes the command specified from the command line.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        parser = argparse.ArgumentParser(description="Run the resolver daemon")
+        self.__class__.add_arguments(parser)
+        args, unknown_args = parser.parse_known_args()
+        if args.resolver_socket is not None:
+            self.__class__.tag_snapshot(args)
+            self.__class__.refresher(args)
+            await self.__class__.daemon(args).serve()
+
+
+def main():
+    """
+    Runs the resolver daemon, outside of any PythonEDA application.
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve nix flake resolutions on a UNIX socket"
+    )
+    ResolverDaemonCli.add_arguments(parser)
+    DeadlineCli.add_arguments(parser)
+    GithubTokenCli.add_arguments(parser)
+    MetricsCli.add_arguments(parser)
+    RemoteCacheCli.add_arguments(parser)
+    TagWebhookCli.add_arguments(parser)
+    args = parser.parse_args()
+    MetricsCli.expose(args)
+    RemoteCacheCli.connect(args)
+    DeadlineCli.configure(args)
+    TagWebhookCli.receive(args)
+    tokens = GithubTokenCli.joined(args.github_token)
+    if tokens:
+        from pythoneda.artifact.nix.flake.infrastructure import NixFlakeGitRepo
+
+        NixFlakeGitRepo.github_token(tokens)
+    if args.resolver_socket is None:
+        args.resolver_socket = ""
+    ResolverDaemonCli.tag_snapshot(args)
+    ResolverDaemonCli.refresher(args)
+    try:
+        asyncio.run(ResolverDaemonCli.daemon(args).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
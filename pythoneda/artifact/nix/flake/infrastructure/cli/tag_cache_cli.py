@@ -0,0 +1,344 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/cli/tag_cache_cli.py
+
+This file defines the TagCacheCli class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import json
+from pythoneda.shared import BaseObject, PrimaryPort
+import sys
+from typing import List, TextIO
+
+
+class TagCacheCli(BaseObject, PrimaryPort):
+
+    """
+    A PrimaryPort to inspect and manage the cache of gitHub tags.
+
+    Subcommands:
+        - stats: hits, misses, entries, ages and on-disk size, per repository.
+        - prune: remove entries by age (--older-than), total size (--max-size) or repository.
+        - export: write the cache to a single file.
+        - import: add the entries of an exported file to the cache.
+        - snapshot: write the tags of every cached repository to a memory-mappable file.
+
+    Within a PythonEDA application, they follow --tag-cache, i.e.
+    "--tag-cache prune --older-than 30d".
+
+    Class name: TagCacheCli
+
+    Responsibilities:
+        - Parse the command-line to retrieve the subcommand and its options.
+        - Run it, and report the outcome.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.TagCacheManager: Manages the cache.
+    """
+
+    _duration_units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    _size_units = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+    @classmethod
+    def parse_duration(cls, value: str) -> float:
+        """
+        Parses a duration, i.e. "90", "45m", "12h", "30d".
+        :param value: The duration.
+        :type value: str
+        :return: The duration, in seconds.
+        :rtype: float
+        """
+        value = value.strip().lower()
+        unit = value[-1] if value and value[-1] in cls._duration_units else "s"
+        number = value[:-1] if value and value[-1].isalpha() else value
+        return float(number) * cls._duration_units[unit]
+
+    @classmethod
+    def parse_size(cls, value: str) -> int:
+        """
+        Parses a size, i.e. "1048576", "500k", "200M", "2G".
+        :param value: The size.
+        :type value: str
+        :return: The size, in bytes.
+        :rtype: int
+        """
+        value = value.strip().lower().rstrip("b")
+        unit = value[-1] if value and value[-1] in cls._size_units else ""
+        number = value[:-1] if unit else value
+        return int(float(number) * cls._size_units[unit])
+
+    @classmethod
+    def parser(cls) -> argparse.ArgumentParser:
+        """
+        Builds the parser of the subcommands.
+        :return: Such parser.
+        :rtype: argparse.ArgumentParser
+        """
+        result = argparse.ArgumentParser(
+            description="Inspect and manage the cache of gitHub tags"
+        )
+        result.add_argument(
+            "-c",
+            "--cache",
+            default=None,
+            help="The cache folder (.nix_flake_git_repo_cache by default)",
+        )
+        commands = result.add_subparsers(dest="command", required=True)
+        stats = commands.add_parser("stats", help="Show the cache, per repository")
+        stats.add_argument("--json", action="store_true", help="Print JSON")
+        prune = commands.add_parser("prune", help="Remove cache entries")
+        prune.add_argument(
+            "--older-than",
+            type=cls.parse_duration,
+            help="Remove the entries older than this, i.e. 30d",
+        )
+        prune.add_argument(
+            "--max-size",
+            type=cls.parse_size,
+            help="Remove the oldest entries until the cache fits, i.e. 200M",
+        )
+        prune.add_argument(
+            "--repository",
+            help="Remove the entries of this repository, i.e. rydnr/nix-flakes",
+        )
+        prune.add_argument(
+            "--dry-run", action="store_true", help="Only list what would be removed"
+        )
+        export = commands.add_parser("export", help="Write the cache to a file")
+        export.add_argument("file", help="The file, i.e. cache.tar.gz")
+        import_ = commands.add_parser("import", help="Add the entries of a file")
+        import_.add_argument("file", help="A file written by export")
+        snapshot = commands.add_parser(
+            "snapshot", help="Write the tag index to a memory-mappable file"
+        )
+        snapshot.add_argument("file", help="The file, i.e. tags.nfti")
+        snapshot.add_argument(
+            "--repository",
+            action="append",
+            default=[],
+            help="Include this repository too, i.e. rydnr/nix-flakes (repeatable)",
+        )
+        return result
+
+    async def accept(self, app):
+        """
+        Processes the command specified from the command line.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        parser = argparse.ArgumentParser(
+            description="Manage the cache of gitHub tags"
+        )
+        parser.add_argument(
+            "--tag-cache",
+            nargs=argparse.REMAINDER,
+            help="A tag cache subcommand: stats, prune, export, import or snapshot",
+        )
+        args, unknown_args = parser.parse_known_args()
+        if args.tag_cache:
+            self.run(args.tag_cache)
+
+    def run(self, argv: List[str], output: TextIO = None) -> int:
+        """
+        Runs the subcommand in given arguments.
+        :param argv: The arguments.
+        :type argv: List[str]
+        :param output: Where to write the outcome. Defaults to stdout.
+        :type output: TextIO
+        :return: The exit status.
+        :rtype: int
+        """
+        from pythoneda.artifact.nix.flake.infrastructure import TagCacheManager
+
+        output = output or sys.stdout
+        args = self.__class__.parser().parse_args(argv)
+        manager = (
+            TagCacheManager.instance()
+            if args.cache is None
+            else TagCacheManager(args.cache)
+        )
+        if args.command == "stats":
+            stats = manager.stats()
+            if args.json:
+                output.write(json.dumps(stats, indent=2, sort_keys=True) + "\n")
+            else:
+                self._print_stats(stats, output)
+        elif args.command == "prune":
+            if (
+                args.older_than is None
+                and args.max_size is None
+                and args.repository is None
+            ):
+                output.write(
+                    "Nothing to prune: use --older-than, --max-size or --repository\n"
+                )
+                return 2
+            removed = manager.prune(
+                args.older_than, args.max_size, args.repository, args.dry_run
+            )
+            verb = "Would remove" if args.dry_run else "Removed"
+            freed = sum(entry["bytes"] for entry in removed)
+            output.write(f"{verb} {len(removed)} entries ({self._human(freed)})\n")
+        elif args.command == "export":
+            count = manager.export(args.file)
+            output.write(f"Exported {count} entries to {args.file}\n")
+        elif args.command == "import":
+            count = manager.import_(args.file)
+            output.write(f"Imported {count} entries from {args.file}\n")
+        elif args.command == "snapshot":
+            return self._snapshot(manager, args.file, args.repository, output)
+        return 0
+
+    def _snapshot(
+        self, manager, path: str, repositories: List[str], output: TextIO
+    ) -> int:
+        """
+        Fetches the tags of the cached repositories, and writes them as a snapshot.
+        :param manager: The tag cache.
+        :type manager: pythoneda.artifact.nix.flake.infrastructure.TagCacheManager
+        :param path: The snapshot file.
+        :type path: str
+        :param repositories: Additional repositories, i.e. "rydnr/nix-flakes".
+        :type repositories: List[str]
+        :param output: Where to write the outcome.
+        :type output: TextIO
+        :return: The exit status.
+        :rtype: int
+        """
+        from pythoneda.artifact.nix.flake.infrastructure import (
+            NixFlakeGitRepo,
+            TagIndexSnapshot,
+        )
+
+        index = NixFlakeGitRepo.tag_index()
+        wanted = {entry["repository"] for entry in manager.entries()}
+        wanted.update(repositories)
+        failed = []
+        for repository in sorted(wanted - set(index)):
+            owner, name = repository.split("/", 1)
+            tags = NixFlakeGitRepo.github_tags(owner, name)
+            if tags is None:
+                failed.append(repository)
+            else:
+                index[repository] = tags
+        size = TagIndexSnapshot.write(path, index)
+        count = sum(len(tags) for tags in index.values())
+        output.write(
+            f"Wrote {count} tags of {len(index)} repositories to {path} "
+            f"({self._human(size)})\n"
+        )
+        for repository in failed:
+            output.write(f"Could not retrieve the tags of {repository}\n")
+        return 1 if failed else 0
+
+    @classmethod
+    def _human(cls, size: int) -> str:
+        """
+        Formats given size.
+        :param size: The size, in bytes.
+        :type size: int
+        :return: The size, i.e. "12.3 KiB".
+        :rtype: str
+        """
+        for unit in ["B", "KiB", "MiB"]:
+            if size < 1024:
+                return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+            size /= 1024
+        return f"{size:.1f} GiB"
+
+    @classmethod
+    def _age(cls, seconds: float) -> str:
+        """
+        Formats given age.
+        :param seconds: The age, in seconds.
+        :type seconds: float
+        :return: The age, i.e. "3.5h".
+        :rtype: str
+        """
+        if seconds is None:
+            return "-"
+        for unit, size in [("d", 86400), ("h", 3600), ("m", 60)]:
+            if seconds >= size:
+                return f"{seconds / size:.1f}{unit}"
+        return f"{seconds:.0f}s"
+
+    def _print_stats(self, stats, output: TextIO):
+        """
+        Prints given stats as a table.
+        :param stats: The stats, per repository.
+        :type stats: Dict[str, Dict]
+        :param output: Where to print them.
+        :type output: TextIO
+        """
+        header = [
+            "repository",
+            "entries",
+            "size",
+            "oldest",
+            "newest",
+            "hits",
+            "misses",
+            "hit%",
+        ]
+        rows = []
+        for repository, summary in sorted(stats.items()):
+            lookups = summary["hits"] + summary["misses"]
+            rows.append(
+                [
+                    repository,
+                    str(summary["entries"]),
+                    self._human(summary["bytes"]),
+                    self._age(summary["oldest_s"]),
+                    self._age(summary["newest_s"]),
+                    str(summary["hits"]),
+                    str(summary["misses"]),
+                    f"{100 * summary['hits'] / lookups:.0f}" if lookups else "-",
+                ]
+            )
+        widths = [
+            max(len(row[column]) for row in [header] + rows)
+            for column in range(len(header))
+        ]
+        for row in [header] + rows:
+            output.write(
+                "  ".join(
+                    cell.ljust(width) if column == 0 else cell.rjust(width)
+                    for column, (cell, width) in enumerate(zip(row, widths))
+                )
+                + "\n"
+            )
+
+
+def main():
+    """
+    Runs a tag cache subcommand, outside of any PythonEDA application.
+    """
+    sys.exit(TagCacheCli().run(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
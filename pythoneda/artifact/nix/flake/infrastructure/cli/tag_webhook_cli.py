@@ -0,0 +1,120 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/cli/tag_webhook_cli.py
+
+This file defines the TagWebhookCli class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import os
+from pythoneda.shared import BaseObject, PrimaryPort
+
+
+class TagWebhookCli(BaseObject, PrimaryPort):
+
+    """
+    A PrimaryPort that receives gitHub tag webhooks, if requested from the command line.
+
+    The secret is read from the PYTHONEDA_NIX_FLAKE_WEBHOOK_SECRET
+    environment variable, unless --tag-webhook-secret is given, so it
+    doesn't show up in the process list.
+
+    Class name: TagWebhookCli
+
+    Responsibilities:
+        - Parse the command-line to retrieve the webhook port and secret.
+        - Start the receiver, and remember tags for longer.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.TagWebhookReceiver: The receiver.
+    """
+
+    SECRET_VARIABLE = "PYTHONEDA_NIX_FLAKE_WEBHOOK_SECRET"
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """
+        Adds the webhook arguments to given parser.
+        :param parser: The parser.
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument(
+            "--tag-webhook-port",
+            type=int,
+            default=None,
+            help="Receive gitHub tag webhooks on this port",
+        )
+        parser.add_argument(
+            "--tag-webhook-host",
+            default="127.0.0.1",
+            help="The address to receive webhooks on",
+        )
+        parser.add_argument(
+            "--tag-webhook-secret",
+            default=None,
+            help=f"The webhook secret (defaults to ${cls.SECRET_VARIABLE})",
+        )
+        parser.add_argument(
+            "--tag-webhook-ttl",
+            type=float,
+            default=86400.0,
+            help="How long to remember tags in memory while receiving webhooks",
+        )
+
+    @classmethod
+    def receive(cls, args: argparse.Namespace):
+        """
+        Starts receiving webhooks, according to given arguments.
+        :param args: The parsed arguments.
+        :type args: argparse.Namespace
+        :return: The receiver, or None if not requested.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagWebhookReceiver
+        """
+        if args.tag_webhook_port is None:
+            return None
+        from pythoneda.artifact.nix.flake.infrastructure import (
+            NixFlakeGitRepo,
+            TagWebhookReceiver,
+        )
+
+        receiver = TagWebhookReceiver(
+            args.tag_webhook_secret or os.environ.get(cls.SECRET_VARIABLE, None)
+        )
+        receiver.serve(args.tag_webhook_port, args.tag_webhook_host)
+        NixFlakeGitRepo.latest_tags_ttl(args.tag_webhook_ttl)
+        return receiver
+
+    async def accept(self, app):
+        """
+        Processes the command specified from the command line.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        parser = argparse.ArgumentParser(description="Receive gitHub tag webhooks")
+        self.__class__.add_arguments(parser)
+        args, unknown_args = parser.parse_known_args()
+        self.__class__.receive(args)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -21,8 +21,28 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 __path__ = __import__("pkgutil").extend_path(__path__, __name__)
 
-from .nix_flake_dbus_signal_emitter import NixFlakeDbusSignalEmitter
-from .nix_flake_dbus_signal_listener import NixFlakeDbusSignalListener
+from ..lazy_attributes import LazyAttributes
+
+# Public attributes, and the submodules defining them. They get imported on
+# first access (PEP 562), so entry points only pay for what they use.
+_LAZY_ATTRIBUTES = {
+    "DbusConnectionPool": ".dbus_connection_pool",
+    "EventWorkQueue": ".event_work_queue",
+    "ExecutionRequestDeduplicator": ".execution_request_deduplicator",
+    "ExecutionRequestPackager": ".execution_request_packager",
+    "LocalEventBus": ".local_event_bus",
+    "NixFlakeDbusSignalEmitter": ".nix_flake_dbus_signal_emitter",
+    "NixFlakeDbusSignalListener": ".nix_flake_dbus_signal_listener",
+    "OutOfBandPayload": ".out_of_band_payload",
+    "OverflowPolicy": ".event_work_queue",
+    "QueuedApp": ".nix_flake_dbus_signal_listener",
+}
+
+_lazy_attributes = LazyAttributes(__name__, _LAZY_ATTRIBUTES)
+__getattr__ = _lazy_attributes.getattr
+__dir__ = _lazy_attributes.dir
+__all__ = _lazy_attributes.names
+
 
 # vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
 # Local Variables:
@@ -0,0 +1,387 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/dbus/dbus_connection_pool.py
+
+This file defines the DbusConnectionPool class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from collections import deque
+from dbus_next import BusType, Message
+from dbus_next.aio import MessageBus
+from pythoneda import BaseObject
+import random
+from typing import Awaitable, Callable, Dict
+import weakref
+
+
+class DbusConnectionPool(BaseObject):
+
+    """
+    Long-lived d-bus connections, one per bus type, which survive bus restarts.
+
+    Class name: DbusConnectionPool
+
+    Responsibilities:
+        - Keep a single connection per bus type, shared by emitters and listeners.
+        - Reconnect with exponential backoff when a connection drops.
+        - Re-register message handlers and match rules after reconnecting.
+        - Buffer (up to a limit) the messages sent while disconnected, or whose sending failed.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter: Sends signals.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalListener: Subscribes to signals.
+    """
+
+    _singleton = None
+    _interface_names = {}
+    _default_initial_delay = 0.1
+    _default_max_delay = 30.0
+    _default_max_buffered = 1024
+
+    def __init__(
+        self,
+        initialDelay: float = None,
+        maxDelay: float = None,
+        maxBuffered: int = None,
+    ):
+        """
+        Creates a new DbusConnectionPool instance.
+        :param initialDelay: The delay (in seconds) before the first reconnection attempt.
+        :type initialDelay: float
+        :param maxDelay: The maximum delay (in seconds) between reconnection attempts.
+        :type maxDelay: float
+        :param maxBuffered: How many messages to buffer, per bus type, while disconnected.
+        :type maxBuffered: int
+        """
+        super().__init__()
+        cls = self.__class__
+        self._initial_delay = (
+            cls._default_initial_delay if initialDelay is None else initialDelay
+        )
+        self._max_delay = cls._default_max_delay if maxDelay is None else maxDelay
+        self._max_buffered = (
+            cls._default_max_buffered if maxBuffered is None else maxBuffered
+        )
+        self._buses = {}
+        self._connected = {}
+        self._subscriptions = {}
+        self._buffers = {}
+        self._supervisors = {}
+        self._closing = []
+        self._reconnections = 0
+        self._dropped = 0
+
+    @classmethod
+    def instance(cls) -> "DbusConnectionPool":
+        """
+        Retrieves the process-wide instance.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.dbus.DbusConnectionPool
+        """
+        if cls._singleton is None:
+            cls._singleton = cls()
+        return cls._singleton
+
+    @classmethod
+    def reconnection(cls, initialDelay: float, maxDelay: float, maxBuffered: int):
+        """
+        Specifies the default reconnection settings of new instances.
+        :param initialDelay: The delay (in seconds) before the first reconnection attempt.
+        :type initialDelay: float
+        :param maxDelay: The maximum delay (in seconds) between reconnection attempts.
+        :type maxDelay: float
+        :param maxBuffered: How many messages to buffer, per bus type, while disconnected.
+        :type maxBuffered: int
+        """
+        cls._default_initial_delay = initialDelay
+        cls._default_max_delay = maxDelay
+        cls._default_max_buffered = maxBuffered
+
+    @classmethod
+    def interface_name(cls, interfaceClass: type) -> str:
+        """
+        Retrieves the d-bus name of given interface.
+        :param interfaceClass: The d-bus interface.
+        :type interfaceClass: type
+        :return: Its name.
+        :rtype: str
+        """
+        result = cls._interface_names.get(interfaceClass, None)
+        if result is None:
+            result = interfaceClass().name
+            cls._interface_names[interfaceClass] = result
+        return result
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the statistics of this pool.
+        :return: The connection state and buffered messages per bus type, and the counters.
+        :rtype: Dict
+        """
+        return {
+            "connected": {
+                bus_type.name: event.is_set()
+                for bus_type, event in self._connected.items()
+            },
+            "buffered": {
+                bus_type.name: len(buffer) for bus_type, buffer in self._buffers.items()
+            },
+            "reconnections": self._reconnections,
+            "dropped": self._dropped,
+        }
+
+    def _connected_event(self, busType: BusType) -> asyncio.Event:
+        """
+        Retrieves the event signalling given bus type is connected.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        :return: Such event.
+        :rtype: asyncio.Event
+        """
+        result = self._connected.get(busType, None)
+        if result is None:
+            result = asyncio.Event()
+            self._connected[busType] = result
+        return result
+
+    def _supervise(self, busType: BusType):
+        """
+        Makes sure a task keeps the connection to given bus type alive.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        """
+        supervisor = self._supervisors.get(busType, None)
+        if supervisor is None or supervisor.done():
+            self._supervisors[busType] = asyncio.ensure_future(
+                self._keep_connected(busType)
+            )
+
+    async def _keep_connected(self, busType: BusType):
+        """
+        Connects to given bus type, and reconnects whenever the connection drops.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        """
+        delay = self._initial_delay
+        connected = self._connected_event(busType)
+        while True:
+            bus = None
+            try:
+                bus = await MessageBus(
+                    bus_type=busType, negotiate_unix_fd=True
+                ).connect()
+                subscriptions = self._subscriptions.setdefault(busType, [])
+                index = 0
+                # subscriptions may get added meanwhile
+                while index < len(subscriptions):
+                    await self._register(bus, *subscriptions[index])
+                    index += 1
+            except Exception as error:
+                if bus is not None:
+                    bus.disconnect()
+                DbusConnectionPool.logger().warning(
+                    f"Cannot connect to the {busType.name} bus ({error}), retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay * (1 + random.random() / 2))
+                delay = min(delay * 2, self._max_delay)
+                continue
+
+            delay = self._initial_delay
+            self._buses[busType] = bus
+            connected.set()
+            await self._flush(busType, bus)
+            try:
+                await bus.wait_for_disconnect()
+            except Exception as error:
+                DbusConnectionPool.logger().warning(
+                    f"Lost the connection to the {busType.name} bus: {error}"
+                )
+            connected.clear()
+            self._buses.pop(busType, None)
+            self._reconnections += 1
+
+    async def _register(self, bus: MessageBus, matchRule: str, handler: Callable):
+        """
+        Registers given handler and match rule in given connection.
+        :param bus: The connection.
+        :type bus: dbus_next.aio.MessageBus
+        :param matchRule: The match rule.
+        :type matchRule: str
+        :param handler: The message handler.
+        :type handler: Callable[[dbus_next.Message], Any]
+        """
+        bus.add_message_handler(handler)
+        await bus.call(
+            Message(
+                destination="org.freedesktop.DBus",
+                path="/org/freedesktop/DBus",
+                interface="org.freedesktop.DBus",
+                member="AddMatch",
+                signature="s",
+                body=[matchRule],
+            )
+        )
+
+    async def connect(self, busType: BusType) -> MessageBus:
+        """
+        Retrieves the connection to given bus type, waiting until it's available.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        :return: The connection.
+        :rtype: dbus_next.aio.MessageBus
+        """
+        self._supervise(busType)
+        await self._connected_event(busType).wait()
+        return self._buses[busType]
+
+    async def subscribe(self, busType: BusType, matchRule: str, handler: Callable):
+        """
+        Subscribes given handler to the messages matching given rule, now and after every reconnection.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        :param matchRule: The match rule.
+        :type matchRule: str
+        :param handler: The message handler.
+        :type handler: Callable[[dbus_next.Message], Any]
+        """
+        self._subscriptions.setdefault(busType, []).append((matchRule, handler))
+        self._supervise(busType)
+        if self._connected_event(busType).is_set():
+            await self._register(self._buses[busType], matchRule, handler)
+
+    async def send(
+        self, busType: BusType, message: Message, onSent: Callable[[], None] = None
+    ):
+        """
+        Sends given message, or buffers it while disconnected.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        :param message: The message.
+        :type message: dbus_next.Message
+        :param onSent: What to do once the message is sent, or dropped. Optional.
+        :type onSent: Callable[[], None]
+        """
+        self._supervise(busType)
+        if self._connected_event(busType).is_set():
+            bus = self._buses[busType]
+            try:
+                await bus.send(message)
+                if onSent is not None:
+                    onSent()
+                return
+            except Exception as error:
+                DbusConnectionPool.logger().warning(
+                    f"Cannot send {message.member} to the {busType.name} bus ({error}), buffering it"
+                )
+                # the buffer gets flushed once reconnected
+                self._drop(busType, bus)
+        buffer = self._buffers.setdefault(busType, deque())
+        buffer.append((message, onSent))
+        while len(buffer) > self._max_buffered:
+            dropped, dropped_on_sent = buffer.popleft()
+            self._dropped += 1
+            DbusConnectionPool.logger().warning(
+                f"Buffer full, dropping {dropped.member} for the {busType.name} bus"
+            )
+            if dropped_on_sent is not None:
+                dropped_on_sent()
+
+    def _drop(self, busType: BusType, bus: MessageBus):
+        """
+        Drops given connection, since it failed to send, so it gets reestablished.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        :param bus: The connection.
+        :type bus: dbus_next.aio.MessageBus
+        """
+        if self._buses.get(busType, None) is bus:
+            # new messages get buffered meanwhile
+            self._connected_event(busType).clear()
+        try:
+            bus.disconnect()
+        except Exception as error:
+            DbusConnectionPool.logger().warning(
+                f"Cannot disconnect from the {busType.name} bus: {error}"
+            )
+
+    async def _flush(self, busType: BusType, bus: MessageBus):
+        """
+        Sends the messages buffered while disconnected.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        :param bus: The connection.
+        :type bus: dbus_next.aio.MessageBus
+        """
+        buffer = self._buffers.get(busType, deque())
+        while buffer and bus.connected:
+            message, on_sent = buffer[0]
+            try:
+                await bus.send(message)
+            except Exception as error:
+                DbusConnectionPool.logger().warning(
+                    f"Cannot flush the buffer of the {busType.name} bus: {error}"
+                )
+                self._drop(busType, bus)
+                return
+            buffer.popleft()
+            if on_sent is not None:
+                on_sent()
+
+    def before_close(self, callback: Callable[[], Awaitable]):
+        """
+        Registers a coroutine method to await before the connections get closed, i.e. to send pending signals.
+        :param callback: The bound coroutine method. Its instance is referenced weakly.
+        :type callback: Callable[[], Awaitable]
+        """
+        self._closing = [
+            reference for reference in self._closing if reference() is not None
+        ]
+        self._closing.append(weakref.WeakMethod(callback))
+
+    async def close(self):
+        """
+        Sends what's pending, closes every connection, and stops reconnecting.
+        """
+        callbacks = [reference() for reference in self._closing]
+        self._closing = []
+        results = await asyncio.gather(
+            *[callback() for callback in callbacks if callback is not None],
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                DbusConnectionPool.logger().error(f"Error before closing: {result}")
+        for supervisor in self._supervisors.values():
+            supervisor.cancel()
+        await asyncio.gather(*self._supervisors.values(), return_exceptions=True)
+        self._supervisors = {}
+        for bus in self._buses.values():
+            bus.disconnect()
+        self._buses = {}
+        for connected in self._connected.values():
+            connected.clear()
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
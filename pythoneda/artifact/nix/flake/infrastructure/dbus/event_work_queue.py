@@ -0,0 +1,263 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/dbus/event_work_queue.py
+
+This file defines the EventWorkQueue class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from enum import Enum
+from pythoneda import BaseObject, Event
+import time
+from typing import Awaitable, Callable, Dict
+
+
+class OverflowPolicy(Enum):
+    """
+    What to do with a new event when the queue is full.
+
+    With BLOCK, producers wait for room. At most as many events as the queue
+    holds can be waiting so, or waiting to drop older ones; newer ones get
+    rejected.
+    """
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    REJECT = "reject"
+
+
+class EventWorkQueue(BaseObject):
+
+    """
+    A bounded queue of events, processed by a fixed number of workers.
+
+    Class name: EventWorkQueue
+
+    Responsibilities:
+        - Admit events up to a maximum depth, applying an overflow policy beyond it.
+        - Limit how many events are processed concurrently.
+        - Keep track of the queue depth and of how long events wait.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalListener: Feeds it.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Event], Awaitable],
+        maxSize: int = 64,
+        workers: int = 4,
+        policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        onDrop: Callable[[Event], None] = None,
+    ):
+        """
+        Creates a new EventWorkQueue instance.
+        :param handler: The coroutine function processing each event.
+        :type handler: Callable[[pythoneda.Event], Awaitable]
+        :param maxSize: The maximum number of queued events.
+        :type maxSize: int
+        :param workers: The number of events processed concurrently.
+        :type workers: int
+        :param policy: What to do when the queue is full.
+        :type policy: pythoneda.artifact.nix.flake.infrastructure.dbus.OverflowPolicy
+        :param onDrop: The function notified of each event dropped to make room.
+        :type onDrop: Callable[[pythoneda.Event], None]
+        """
+        super().__init__()
+        self._handler = handler
+        self._max_size = maxSize
+        self._worker_count = workers
+        self._policy = policy
+        self._on_drop = onDrop
+        self._queue = None
+        self._workers = []
+        self._in_flight = 0
+        self._admitting = 0
+        self._accepted = 0
+        self._rejected = 0
+        self._dropped = 0
+        self._processed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._last_wait = 0.0
+
+    @property
+    def depth(self) -> int:
+        """
+        Retrieves the number of events waiting for a worker.
+        :return: Such number.
+        :rtype: int
+        """
+        return 0 if self._queue is None else self._queue.qsize()
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Retrieves the number of events being processed.
+        :return: Such number.
+        :rtype: int
+        """
+        return self._in_flight
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the statistics of this queue.
+        :return: The depth, the counters, and the wait times (in seconds).
+        :rtype: Dict
+        """
+        started = self._processed + self._failed + self._in_flight
+        return {
+            "depth": self.depth,
+            "max_size": self._max_size,
+            "workers": self._worker_count,
+            "policy": self._policy.value,
+            "in_flight": self._in_flight,
+            "admitting": self._admitting,
+            "accepted": self._accepted,
+            "rejected": self._rejected,
+            "dropped": self._dropped,
+            "processed": self._processed,
+            "failed": self._failed,
+            "wait_last_s": self._last_wait,
+            "wait_max_s": self._max_wait,
+            "wait_mean_s": self._total_wait / started if started else 0.0,
+        }
+
+    def _start(self):
+        """
+        Creates the queue and the workers, within the running event loop.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_size)
+            self._workers = [
+                asyncio.ensure_future(self._work())
+                for _ in range(self._worker_count)
+            ]
+
+    def reserve(self, event: Event) -> bool:
+        """
+        Reserves room for given event, before any work gets spawned for it,
+        applying the overflow policy if there's none. Callers put the event
+        (or give up on it), and then release the reservation.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True if there's room, or the event may wait for it.
+        :rtype: bool
+        """
+        self._start()
+        if self.depth + self._admitting >= self._max_size:
+            if self._policy == OverflowPolicy.DROP_OLDEST and self.depth > 0:
+                self._drop_oldest()
+            elif (
+                self._policy == OverflowPolicy.REJECT
+                or self.depth + self._admitting >= 2 * self._max_size
+            ):
+                self._rejected += 1
+                EventWorkQueue.logger().warning(f"Queue full, rejecting {event}")
+                return False
+        self._admitting += 1
+        return True
+
+    def release(self):
+        """
+        Releases a reservation made by reserve().
+        """
+        self._admitting -= 1
+
+    def _drop_oldest(self):
+        """
+        Drops the oldest queued event, to make room.
+        """
+        _, oldest = self._queue.get_nowait()
+        self._queue.task_done()
+        self._dropped += 1
+        EventWorkQueue.logger().warning(f"Queue full, dropping {oldest}")
+        if self._on_drop is not None:
+            self._on_drop(oldest)
+
+    async def put(self, event: Event) -> bool:
+        """
+        Queues given event, applying the overflow policy if the queue is full.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True if the event got queued.
+        :rtype: bool
+        """
+        self._start()
+        item = (time.monotonic(), event)
+        if self._queue.full():
+            if self._policy == OverflowPolicy.REJECT:
+                self._rejected += 1
+                EventWorkQueue.logger().warning(f"Queue full, rejecting {event}")
+                return False
+            if self._policy == OverflowPolicy.DROP_OLDEST:
+                self._drop_oldest()
+        # with BLOCK, this waits for room: backpressure
+        await self._queue.put(item)
+        self._accepted += 1
+        return True
+
+    async def _work(self):
+        """
+        Processes queued events, one at a time.
+        """
+        while True:
+            enqueued_at, event = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self._last_wait = wait
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._in_flight += 1
+            try:
+                await self._handler(event)
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self._failed += 1
+                EventWorkQueue.logger().error(f"Error processing {event}: {error}")
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+    async def join(self):
+        """
+        Waits until every queued event has been processed.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        """
+        Stops the workers. Queued events are discarded.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,292 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/dbus/execution_request_deduplicator.py
+
+This file defines the ExecutionRequestDeduplicator class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from ..flake_artifact_cache import FlakeArtifactCache
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+from pythoneda import BaseObject, Event
+from pythoneda.shared.artifact.events.code import (
+    ChangeStagingCodeExecutionPackaged,
+    ChangeStagingCodeExecutionRequested,
+)
+import time
+from typing import Awaitable, Callable, Dict, List
+import uuid
+
+
+class ExecutionRequestDeduplicator(BaseObject):
+
+    """
+    Collapses repeated ChangeStagingCodeExecutionRequested events onto a single job.
+
+    Class name: ExecutionRequestDeduplicator
+
+    Responsibilities:
+        - Compute an idempotency key from the payload of each request.
+        - Let only the first of several in-flight duplicates through.
+        - Keep the latest results in a bounded LRU, and replay them for repeated requests.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalListener: Admits requests.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter: Reports and replays results.
+        - pythoneda.artifact.nix.flake.infrastructure.FlakeArtifactCache: Describes the payloads.
+    """
+
+    _singleton = None
+
+    # attributes telling events apart, rather than describing what they request
+    _identity_attributes = [
+        "id",
+        "previous_event_ids",
+        "reconstructed_id",
+        "reconstructed_previous_event_ids",
+        "timestamp",
+    ]
+
+    def __init__(
+        self,
+        requestClass: type = ChangeStagingCodeExecutionRequested,
+        resultClass: type = ChangeStagingCodeExecutionPackaged,
+        maxCompleted: int = 256,
+        inFlightTimeout: float = 600.0,
+    ):
+        """
+        Creates a new ExecutionRequestDeduplicator instance.
+        :param requestClass: The class of the requests.
+        :type requestClass: type
+        :param resultClass: The class of the results.
+        :type resultClass: type
+        :param maxCompleted: How many results to keep.
+        :type maxCompleted: int
+        :param inFlightTimeout: How long (in seconds) to wait for a result before admitting duplicates again.
+        :type inFlightTimeout: float
+        """
+        super().__init__()
+        self._request_class_name = self.__class__.full_class_name(requestClass)
+        self._result_class_name = self.__class__.full_class_name(resultClass)
+        self._max_completed = maxCompleted
+        self._in_flight_timeout = inFlightTimeout
+        # idempotency key -> (started at, request id, duplicates waiting),
+        # oldest first
+        self._in_flight = OrderedDict()
+        # request id -> idempotency key
+        self._keys_by_request_id = {}
+        # idempotency key -> result
+        self._completed = OrderedDict()
+        self._replay = None
+        self._hits = 0
+        self._collapsed = 0
+
+    @classmethod
+    def instance(cls) -> "ExecutionRequestDeduplicator":
+        """
+        Retrieves the process-wide instance.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.dbus.ExecutionRequestDeduplicator
+        """
+        if cls._singleton is None:
+            cls._singleton = cls()
+        return cls._singleton
+
+    def replay_with(self, emit: Callable[[Event], Awaitable]):
+        """
+        Specifies how to emit the results replayed for repeated requests.
+        :param emit: The coroutine function emitting events.
+        :type emit: Callable[[pythoneda.Event], Awaitable]
+        """
+        self._replay = emit
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the statistics of this instance.
+        :return: The in-flight and completed entries, and how many requests were answered from them.
+        :rtype: Dict
+        """
+        return {
+            "in_flight": len(self._in_flight),
+            "completed": len(self._completed),
+            "hits": self._hits,
+            "collapsed": self._collapsed,
+        }
+
+    def handles_request(self, event: Event) -> bool:
+        """
+        Checks whether given event is a request this instance deduplicates.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True in such case.
+        :rtype: bool
+        """
+        return (
+            self.__class__.full_class_name(event.__class__) == self._request_class_name
+        )
+
+    def handles_result(self, event: Event) -> bool:
+        """
+        Checks whether given event is a result this instance keeps.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True in such case.
+        :rtype: bool
+        """
+        return (
+            self.__class__.full_class_name(event.__class__) == self._result_class_name
+        )
+
+    @classmethod
+    def idempotency_key(cls, event: Event) -> str:
+        """
+        Computes the idempotency key of given request, from its payload.
+        :param event: The request.
+        :type event: pythoneda.Event
+        :return: The key.
+        :rtype: str
+        """
+        # nested values, i.e. the code request, carry ids of their own
+        serialized = json.dumps(
+            FlakeArtifactCache.describe(event, cls._identity_attributes),
+            sort_keys=True,
+        )
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    async def admit(self, event: Event) -> bool:
+        """
+        Decides whether given request needs to be processed.
+        Duplicates of in-flight requests wait for their result, and
+        repeats of completed requests get the cached result right away.
+        :param event: The request.
+        :type event: pythoneda.Event
+        :return: True if the request needs to be processed.
+        :rtype: bool
+        """
+        if not self.handles_request(event):
+            return True
+        key = self.__class__.idempotency_key(event)
+        self._expire()
+
+        result = self._completed.get(key, None)
+        if result is not None and self._replay is not None:
+            self._completed.move_to_end(key)
+            self._hits += 1
+            ExecutionRequestDeduplicator.logger().debug(
+                f"Replaying the result of {event}"
+            )
+            await self._replay(self._replay_for(result, event))
+            return False
+
+        in_flight = self._in_flight.get(key, None)
+        if in_flight is not None:
+            in_flight[2].append(event)
+            self._collapsed += 1
+            ExecutionRequestDeduplicator.logger().debug(
+                f"Collapsing {event} onto an in-flight duplicate"
+            )
+            return False
+
+        request_id = getattr(event, "id", None)
+        self._in_flight[key] = (time.monotonic(), request_id, [])
+        self._keys_by_request_id[request_id] = key
+        return True
+
+    def _expire(self):
+        """
+        Forgets the in-flight requests that got no result in time, so their duplicates get admitted again.
+        """
+        deadline = time.monotonic() - self._in_flight_timeout
+        while self._in_flight:
+            key, (started_at, request_id, _) = next(iter(self._in_flight.items()))
+            if started_at > deadline:
+                break
+            del self._in_flight[key]
+            self._keys_by_request_id.pop(request_id, None)
+
+    def abandon(self, event: Event) -> List[Event]:
+        """
+        Forgets given request, unless a result answered it already, i.e.
+        because processing it failed, it got dropped, or it produced no result.
+        :param event: The request.
+        :type event: pythoneda.Event
+        :return: The duplicates that were waiting for it.
+        :rtype: List[pythoneda.Event]
+        """
+        key = self._keys_by_request_id.pop(getattr(event, "id", None), None)
+        if key is None:
+            return []
+        _, _, duplicates = self._in_flight.pop(key, (None, None, []))
+        return duplicates
+
+    def complete(self, result: Event) -> List[Event]:
+        """
+        Records given result, if it answers an admitted request.
+        :param result: The result.
+        :type result: pythoneda.Event
+        :return: The replays of the result, for the duplicates that were waiting for it.
+        :rtype: List[pythoneda.Event]
+        """
+        if not self.handles_result(result):
+            return []
+        key = None
+        for request_id in getattr(result, "previous_event_ids", None) or []:
+            key = self._keys_by_request_id.pop(request_id, None)
+            if key is not None:
+                break
+        if key is None:
+            return []
+
+        self._completed[key] = result
+        self._completed.move_to_end(key)
+        while len(self._completed) > self._max_completed:
+            self._completed.popitem(last=False)
+
+        _, _, duplicates = self._in_flight.pop(key, (None, None, []))
+        return [self._replay_for(result, duplicate) for duplicate in duplicates]
+
+    def _replay_for(self, result: Event, request: Event) -> Event:
+        """
+        Builds a copy of given result, with an id of its own, answering given request.
+        :param result: The result.
+        :type result: pythoneda.Event
+        :param request: The request.
+        :type request: pythoneda.Event
+        :return: The copy.
+        :rtype: pythoneda.Event
+        """
+        replay = copy.copy(result)
+        if hasattr(replay, "_id"):
+            replay._id = str(uuid.uuid4())
+        if hasattr(replay, "_reconstructed_id"):
+            replay._reconstructed_id = None
+        request_id = getattr(request, "id", None)
+        if request_id is not None and hasattr(replay, "_previous_event_ids"):
+            replay._previous_event_ids = [request_id]
+        return replay
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
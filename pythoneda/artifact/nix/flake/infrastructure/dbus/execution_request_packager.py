@@ -0,0 +1,215 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/dbus/execution_request_packager.py
+
+This file defines the ExecutionRequestPackager class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from ..tracer import Tracer
+import asyncio
+import os
+from pythoneda import BaseObject, Event
+from pythoneda.shared.artifact.events.code import (
+    ChangeStagingCodeExecutionPackaged,
+    ChangeStagingCodeExecutionRequested,
+)
+import tempfile
+
+
+class ExecutionRequestPackager(BaseObject):
+
+    """
+    Packages the code of ChangeStagingCodeExecutionRequested events within the
+    infrastructure, so identical code requests reuse the generated flakes.
+
+    Each request gets its flake resolved, and its files generated through
+    the flake artifact cache into a folder of its own, under the packaging
+    folder. The result gets emitted as a ChangeStagingCodeExecutionPackaged.
+    With an executor, that work runs in its worker processes, so requests
+    package in parallel, and results get emitted as they complete.
+
+    Class name: ExecutionRequestPackager
+
+    Responsibilities:
+        - Tell the requests it packages apart.
+        - Resolve and generate the flake of each one, reusing cached files, in worker processes if requested.
+        - Emit the results.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.QueuedApp: Hands it the requests.
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Resolves and generates the flakes.
+        - pythoneda.artifact.nix.flake.infrastructure.FlakeArtifactCache: Reuses generated flakes.
+        - pythoneda.artifact.nix.flake.infrastructure.PackagingExecutor: Packages in worker processes.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter: Emits the results.
+    """
+
+    def __init__(
+        self,
+        repo=None,
+        emitter=None,
+        folder: str = None,
+        requestClass: type = ChangeStagingCodeExecutionRequested,
+        resultClass: type = ChangeStagingCodeExecutionPackaged,
+        executor=None,
+    ):
+        """
+        Creates a new ExecutionRequestPackager instance.
+        :param repo: The repository resolving and generating the flakes. A new NixFlakeGitRepo if omitted.
+        :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        :param emitter: The emitter of the results. A new NixFlakeDbusSignalEmitter if omitted.
+        :type emitter: pythoneda.EventEmitter
+        :param folder: The folder to generate the flakes into. A temporary one if omitted.
+        :type folder: str
+        :param requestClass: The class of the requests.
+        :type requestClass: type
+        :param resultClass: The class of the results, built from the flake and the ids of the requests.
+        :type resultClass: type
+        :param executor: The pool of worker processes to package in. This process if omitted.
+        :type executor: pythoneda.artifact.nix.flake.infrastructure.PackagingExecutor
+        """
+        super().__init__()
+        self._repo = repo
+        self._emitter = emitter
+        self._folder = folder or os.path.join(
+            tempfile.gettempdir(), "nix-flake-packages"
+        )
+        self._request_class_name = self.__class__.full_class_name(requestClass)
+        self._result_class = resultClass
+        self._executor = executor
+
+    @property
+    def repo(self):
+        """
+        Retrieves the repository resolving and generating the flakes.
+        :return: Such repository.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        """
+        if self._repo is None:
+            from ..nix_flake_git_repo import NixFlakeGitRepo
+
+            self._repo = NixFlakeGitRepo()
+        return self._repo
+
+    @property
+    def emitter(self):
+        """
+        Retrieves the emitter of the results.
+        :return: Such emitter.
+        :rtype: pythoneda.EventEmitter
+        """
+        if self._emitter is None:
+            from .nix_flake_dbus_signal_emitter import NixFlakeDbusSignalEmitter
+
+            self._emitter = NixFlakeDbusSignalEmitter()
+        return self._emitter
+
+    @property
+    def executor(self):
+        """
+        Retrieves the pool of worker processes requests get packaged in.
+        :return: Such pool, or None if they get packaged in this process.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.PackagingExecutor
+        """
+        return self._executor
+
+    @property
+    def folder(self) -> str:
+        """
+        Retrieves the folder the flakes get generated into.
+        :return: Such folder.
+        :rtype: str
+        """
+        return self._folder
+
+    def handles(self, event: Event) -> bool:
+        """
+        Checks whether given event is a request this instance packages.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True in such case.
+        :rtype: bool
+        """
+        return (
+            self.__class__.full_class_name(event.__class__) == self._request_class_name
+        )
+
+    async def package(self, event: Event) -> Event:
+        """
+        Packages the code request of given event, and emits the result.
+        :param event: The ChangeStagingCodeExecutionRequested event.
+        :type event: pythoneda.Event
+        :return: The ChangeStagingCodeExecutionPackaged event.
+        :rtype: pythoneda.Event
+        """
+        os.makedirs(self._folder, exist_ok=True)
+        flake_folder = tempfile.mkdtemp(prefix="code-request-", dir=self._folder)
+        with Tracer.instance().span("nix_flake.package") as span:
+            flake, reused = await self._generate(event.code_request, flake_folder)
+            span.set_attribute("cache.hit", reused)
+        ExecutionRequestPackager.logger().debug(
+            f"Packaged {event} into {flake_folder}"
+            + (", reusing cached files" if reused else "")
+        )
+        result = self._result_class(flake, [event.id])
+        await self.emitter.emit(result)
+        return result
+
+    async def _generate(self, codeRequest, flakeFolder: str):
+        """
+        Resolves the flake of given code request, and generates its files, off the event loop:
+        in a worker process of the executor, if any, or in a thread.
+        :param codeRequest: The code request.
+        :type codeRequest: pythoneda.shared.code_requests.CodeRequest
+        :param flakeFolder: The folder to generate the files into.
+        :type flakeFolder: str
+        :return: The flake, and whether its files came from the artifact cache.
+        :rtype: Tuple[pythoneda.shared.nix.flake.NixFlake, bool]
+        """
+        if self._executor is not None:
+            return await self._executor.package(
+                self._executor.CODE_EXECUTION, codeRequest, flakeFolder
+            )
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._generate_now, codeRequest, flakeFolder
+        )
+
+    def _generate_now(self, codeRequest, flakeFolder: str):
+        """
+        Resolves the flake of given code request, and generates its files.
+        :param codeRequest: The code request.
+        :type codeRequest: pythoneda.shared.code_requests.CodeRequest
+        :param flakeFolder: The folder to generate the files into.
+        :type flakeFolder: str
+        :return: The flake, and whether its files came from the artifact cache.
+        :rtype: Tuple[pythoneda.shared.nix.flake.NixFlake, bool]
+        """
+        repo = self.repo
+        with repo.__class__.deadline():
+            flake = repo.latest_code_execution(codeRequest)
+        if flake is None:
+            raise LookupError(f"Cannot resolve the flake of {codeRequest}")
+        return flake, repo.generate_flake(flake, flakeFolder, codeRequest)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
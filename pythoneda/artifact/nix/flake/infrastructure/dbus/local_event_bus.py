@@ -0,0 +1,183 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/dbus/local_event_bus.py
+
+This file defines the LocalEventBus class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from collections import OrderedDict
+import inspect
+from pythoneda import BaseObject, Event
+from typing import Any, Callable, List
+
+
+class LocalEventBus(BaseObject):
+
+    """
+    An in-process transport for events, with no serialization at all.
+
+    Subscribers run as tasks of their own: publishing doesn't wait for them,
+    so a slow subscriber cannot delay d-bus emission. They get started in
+    subscription order, one event after another.
+
+    Class name: LocalEventBus
+
+    Responsibilities:
+        - Keep track of the in-process subscribers of each event class.
+        - Hand domain events directly to them.
+        - Remember which events were delivered locally, to ignore their d-bus echo.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter: Publishes events.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalListener: Subscribes to them.
+    """
+
+    _singleton = None
+
+    def __init__(self, maxRemembered: int = 1024):
+        """
+        Creates a new LocalEventBus instance.
+        :param maxRemembered: How many delivered event ids to remember.
+        :type maxRemembered: int
+        """
+        super().__init__()
+        self._subscribers = {}
+        self._tasks = set()
+        self._delivered = OrderedDict()
+        self._max_remembered = maxRemembered
+
+    @classmethod
+    def instance(cls) -> "LocalEventBus":
+        """
+        Retrieves the process-wide instance.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.dbus.LocalEventBus
+        """
+        if cls._singleton is None:
+            cls._singleton = cls()
+        return cls._singleton
+
+    def subscribe(self, eventClassName: str, handler: Callable[[Event], Any]):
+        """
+        Subscribes given handler to the events of given class.
+        :param eventClassName: The full class name of the events.
+        :type eventClassName: str
+        :param handler: The function, or coroutine function, receiving the events.
+        :type handler: Callable[[pythoneda.Event], Any]
+        """
+        self._subscribers.setdefault(eventClassName, []).append(handler)
+
+    def unsubscribe(self, eventClassName: str, handler: Callable[[Event], Any]):
+        """
+        Unsubscribes given handler from the events of given class.
+        :param eventClassName: The full class name of the events.
+        :type eventClassName: str
+        :param handler: The handler.
+        :type handler: Callable[[pythoneda.Event], Any]
+        """
+        handlers = self._subscribers.get(eventClassName, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def subscribers(self, eventClassName: str) -> List[Callable[[Event], Any]]:
+        """
+        Retrieves the subscribers to the events of given class.
+        :param eventClassName: The full class name of the events.
+        :type eventClassName: str
+        :return: Such subscribers.
+        :rtype: List[Callable[[pythoneda.Event], Any]]
+        """
+        return list(self._subscribers.get(eventClassName, []))
+
+    async def publish(self, event: Event) -> bool:
+        """
+        Hands given event to its in-process subscribers, if any, without waiting for them.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True if some subscriber received it.
+        :rtype: bool
+        """
+        handlers = self.subscribers(self.__class__.full_class_name(event.__class__))
+        if not handlers:
+            return False
+        self._remember(event)
+        for handler in handlers:
+            try:
+                result = handler(event)
+            except Exception as error:
+                LocalEventBus.logger().error(f"Error delivering {event}: {error}")
+                continue
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self._tasks.add(task)
+                task.add_done_callback(lambda done: self._finished(event, done))
+        return True
+
+    async def join(self):
+        """
+        Waits until the subscribers have handled the events published so far.
+        """
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def _finished(self, event: Event, task: asyncio.Future):
+        """
+        Forgets the task of a subscriber, logging its error if any.
+        :param event: The event it handled.
+        :type event: pythoneda.Event
+        :param task: The task.
+        :type task: asyncio.Future
+        """
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            LocalEventBus.logger().error(
+                f"Error delivering {event}: {task.exception()}"
+            )
+
+    def _remember(self, event: Event):
+        """
+        Remembers given event got delivered locally.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        event_id = getattr(event, "id", None)
+        if event_id is not None:
+            self._delivered[event_id] = True
+            while len(self._delivered) > self._max_remembered:
+                self._delivered.popitem(last=False)
+
+    def delivered(self, event: Event) -> bool:
+        """
+        Checks whether given event (or the one it was reconstructed from) got delivered locally.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True in such case.
+        :rtype: bool
+        """
+        event_id = getattr(event, "id", None)
+        return event_id is not None and event_id in self._delivered
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -19,7 +19,18 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-from dbus_next import BusType
+from .dbus_connection_pool import DbusConnectionPool
+from .execution_request_deduplicator import ExecutionRequestDeduplicator
+from .local_event_bus import LocalEventBus
+from .out_of_band_payload import OutOfBandPayload
+from ..metrics import Metrics
+from ..span import Span
+from ..tracer import Tracer
+import asyncio
+from collections import OrderedDict
+from dbus_next import BusType, Message
+import os
+from pythoneda import Event
 from pythoneda.shared.artifact.events.code import (
     ChangeStagingCodeExecutionPackaged,
     ChangeStagingCodePackaged,
@@ -29,7 +40,8 @@ from pythoneda.shared.artifact.events.code.infrastructure.dbus import (
     DbusChangeStagingCodePackaged,
 )
 from pythoneda.shared.infrastructure.dbus import DbusSignalEmitter
-from typing import Dict
+from typing import Dict, Tuple
+import weakref
 
 
 class NixFlakeDbusSignalEmitter(DbusSignalEmitter):
@@ -40,20 +52,273 @@ class NixFlakeDbusSignalEmitter(DbusSignalEmitter):
     Class name: NixFlakeDbusSignalEmitter
 
     Responsibilities:
-        - Connect to d-bus.
+        - Connect to d-bus, through long-lived connections that survive bus restarts.
         - Emit nix-flake-artifact events as d-bus signals.
+        - Coalesce bursts of events, dropping the superseded ones, and send them pipelined.
+        - Hand events directly to in-process subscribers, skipping d-bus.
+        - Report execution results, and replay them for repeated requests.
+        - Send large payloads out-of-band, as UNIX file descriptors, if enabled.
 
     Collaborators:
         - pythoneda.shared.application.PythonEDA: Requests emitting events.
         - pythoneda.shared.artifact.events.code.infrastructure.dbus.DbusChangeStagingCodePackaged
         - pythoneda.shared.artifact.events.code.infrastructure.dbus.DbusChangeStagingCodeExecutionPackaged
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.LocalEventBus: In-process transport.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.ExecutionRequestDeduplicator: Keeps the results.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.OutOfBandPayload: Moves large payloads.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.DbusConnectionPool: Connects to d-bus.
+        - pythoneda.artifact.nix.flake.infrastructure.Tracer: Ends the trace of each request.
     """
 
-    def __init__(self):
+    _default_window = 0.01
+    _default_max_batch = 32
+    _remote_delivery = True
+    _bus_type = BusType.SYSTEM
+    _instances = weakref.WeakSet()
+    # the instance replaying results, and what the class-level hooks got registered in
+    _replay_emitter = None
+    _hooked_deduplicator = None
+    _hooked_pool = None
+
+    def __init__(self, window: float = None, maxBatch: int = None):
         """
         Creates a new NixFlakeDbusSignalEmitter instance.
+        :param window: How long (in seconds) to collect events before sending them. Zero disables coalescing.
+        :type window: float
+        :param maxBatch: How many pending events trigger sending them right away.
+        :type maxBatch: int
         """
         super().__init__()
+        cls = self.__class__
+        self._window = cls._default_window if window is None else window
+        self._max_batch = cls._default_max_batch if maxBatch is None else maxBatch
+        self._pending = OrderedDict()
+        self._flush_task = None
+        cls._instances.add(self)
+        cls._hook(self)
+
+    @classmethod
+    def _hook(cls, emitter: "NixFlakeDbusSignalEmitter"):
+        """
+        Registers the class-level hooks, once per deduplicator and connection pool.
+        :param emitter: A new instance, which replays results unless another one does already.
+        :type emitter: pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter
+        """
+        deduplicator = ExecutionRequestDeduplicator.instance()
+        if deduplicator is not cls._hooked_deduplicator:
+            cls._hooked_deduplicator = deduplicator
+            # kept by the class, so replays never go through a discarded instance
+            cls._replay_emitter = emitter
+            deduplicator.replay_with(cls._replay)
+        pool = DbusConnectionPool.instance()
+        if pool is not cls._hooked_pool:
+            cls._hooked_pool = pool
+            # events still coalescing get sent before the connections close
+            pool.before_close(cls._close_all)
+
+    @classmethod
+    async def _replay(cls, event: Event):
+        """
+        Emits a result replayed for a repeated request.
+        :param event: The result.
+        :type event: pythoneda.Event
+        """
+        await cls._replay_emitter.emit(event)
+
+    @classmethod
+    async def _close_all(cls):
+        """
+        Closes every instance, so the events still coalescing get sent.
+        """
+        instances = list(cls._instances)
+        results = await asyncio.gather(
+            *[instance.close() for instance in instances], return_exceptions=True
+        )
+        for instance, result in zip(instances, results):
+            if isinstance(result, BaseException):
+                NixFlakeDbusSignalEmitter.logger().error(
+                    f"Error closing {instance}: {result}"
+                )
+
+    @classmethod
+    def coalescing(cls, window: float, maxBatch: int):
+        """
+        Specifies the default coalescing settings of new instances.
+        :param window: How long (in seconds) to collect events before sending them. Zero disables coalescing.
+        :type window: float
+        :param maxBatch: How many pending events trigger sending them right away.
+        :type maxBatch: int
+        """
+        cls._default_window = window
+        cls._default_max_batch = maxBatch
+
+    @classmethod
+    def remote_delivery(cls, enabled: bool):
+        """
+        Specifies whether events delivered to in-process subscribers get sent over d-bus as well.
+        Disable it only if there're no remote consumers.
+        :param enabled: True to send them over d-bus as well.
+        :type enabled: bool
+        """
+        cls._remote_delivery = enabled
+
+    @classmethod
+    def bus_type(cls, busType: BusType):
+        """
+        Specifies the bus the signals are emitted on.
+        The session bus honors DBUS_SESSION_BUS_ADDRESS, e.g. to use a private dbus-daemon.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        """
+        cls._bus_type = busType
+
+    @classmethod
+    def coalescing_key(cls, event: Event) -> Tuple:
+        """
+        Retrieves the key identifying the change given event is about.
+        A pending event is superseded by a newer one with the same key.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: Such key.
+        :rtype: Tuple
+        """
+        previous_event_ids = getattr(event, "previous_event_ids", None)
+        if previous_event_ids:
+            return (cls.full_class_name(event.__class__), tuple(previous_event_ids))
+        # nothing to tell which change it's about: never superseded
+        return (cls.full_class_name(event.__class__), id(event))
+
+    @property
+    def pending(self) -> int:
+        """
+        Retrieves the number of events waiting to be sent.
+        :return: Such number.
+        :rtype: int
+        """
+        return len(self._pending)
+
+    async def emit(self, event: Event):
+        """
+        Hands given event to in-process subscribers, if any, and emits it as a
+        d-bus signal once the coalescing window closes or enough events are pending.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        replays = ExecutionRequestDeduplicator.instance().complete(event)
+        await self._emit(event)
+        for replay in replays:
+            await self._emit(replay)
+
+    async def _emit(self, event: Event):
+        """
+        Hands given event to in-process subscribers, if any, and queues it for d-bus
+        if it's one of the signals this emitter sends. Other events, i.e. requests
+        emitted within this process, reach in-process subscribers only.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        delivered = await LocalEventBus.instance().publish(event)
+        key = self.__class__.full_class_name(event.__class__)
+        if key not in self.signal_emitters():
+            return
+        if delivered and not self.__class__._remote_delivery:
+            return
+
+        if self._window <= 0:
+            await self._send(event)
+            return
+
+        key = self.__class__.coalescing_key(event)
+        superseded = self._pending.pop(key, None)
+        if superseded is not None:
+            NixFlakeDbusSignalEmitter.logger().debug(
+                f"Dropping {superseded}, superseded by {event}"
+            )
+        self._pending[key] = event
+
+        if len(self._pending) >= self._max_batch:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        """
+        Flushes the pending events once the coalescing window closes.
+        """
+        await asyncio.sleep(self._window)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Sends all pending events, without waiting for each one before sending the next.
+        """
+        if self._flush_task is not None:
+            if self._flush_task is not asyncio.current_task():
+                self._flush_task.cancel()
+            self._flush_task = None
+        if not self._pending:
+            return
+        batch = list(self._pending.values())
+        self._pending.clear()
+        results = await asyncio.gather(
+            *[self._send(event) for event in batch], return_exceptions=True
+        )
+        for event, result in zip(batch, results):
+            if isinstance(result, BaseException):
+                NixFlakeDbusSignalEmitter.logger().error(
+                    f"Error emitting {event}: {result}"
+                )
+
+    async def close(self):
+        """
+        Sends the pending events, and stops coalescing: later events get sent right away.
+        DbusConnectionPool.close() calls it, for every instance, before closing the connections.
+        """
+        self._window = 0
+        await self.flush()
+
+    async def _send(self, event: Event):
+        """
+        Sends given event as a d-bus signal, out-of-band if its payload is large
+        and OutOfBandPayload.threshold() enabled it.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        emitter = self.signal_emitters().get(
+            self.__class__.full_class_name(event.__class__), None
+        )
+        if emitter is None:
+            return
+        interface_class, bus_type = emitter
+        pool = DbusConnectionPool.instance()
+        tracer = Tracer.instance()
+        with tracer.span(
+            "dbus.emit",
+            {"messaging.system": "dbus", "dbus.member": event.__class__.__name__},
+            parent=tracer.outcome_of(event),
+            kind=Span.PRODUCER,
+        ) as span:
+            path = interface_class.path()
+            interface = pool.interface_name(interface_class)
+            signature = interface_class.sign(event)
+            body = interface_class.transform(event)
+            out_of_band = OutOfBandPayload.is_large(body)
+            span.set_attribute("dbus.out_of_band", out_of_band)
+            if out_of_band:
+                message, fd = OutOfBandPayload.signal(
+                    event, path, interface, signature, body
+                )
+                await pool.send(bus_type, message, lambda: os.close(fd))
+            else:
+                message = Message.new_signal(
+                    path, interface, event.__class__.__name__, signature, body
+                )
+                await pool.send(bus_type, message)
+        Metrics.instance().inc(
+            "nix_flake_dbus_signals_emitted_total", {"type": event.__class__.__name__}
+        )
+        tracer.conclude(event)
 
     def signal_emitters(self) -> Dict:
         """
@@ -62,10 +327,11 @@ class NixFlakeDbusSignalEmitter(DbusSignalEmitter):
         :rtype: Dict
         """
         result = {}
+        bus_type = self.__class__._bus_type
         key = self.__class__.full_class_name(ChangeStagingCodePackaged)
-        result[key] = [DbusChangeStagingCodePackaged, BusType.SYSTEM]
+        result[key] = [DbusChangeStagingCodePackaged, bus_type]
         key = self.__class__.full_class_name(ChangeStagingCodeExecutionPackaged)
-        result[key] = [DbusChangeStagingCodeExecutionPackaged, BusType.SYSTEM]
+        result[key] = [DbusChangeStagingCodeExecutionPackaged, bus_type]
 
         return result
 
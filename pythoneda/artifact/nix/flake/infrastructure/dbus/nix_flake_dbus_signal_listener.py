@@ -19,7 +19,19 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-from dbus_next import BusType
+from .dbus_connection_pool import DbusConnectionPool
+from .event_work_queue import EventWorkQueue, OverflowPolicy
+from .execution_request_deduplicator import ExecutionRequestDeduplicator
+from .execution_request_packager import ExecutionRequestPackager
+from .local_event_bus import LocalEventBus
+from .out_of_band_payload import OutOfBandPayload
+from ..metrics import Metrics
+from ..span import Span
+from ..tracer import Tracer
+import asyncio
+from dbus_next import BusType, Message, MessageType
+from functools import partial
+from pythoneda import BaseObject, Event
 from pythoneda.shared.artifact.events.code import (
     ChangeStagingCodeDescribed,
     ChangeStagingCodeExecutionRequested,
@@ -29,7 +41,7 @@ from pythoneda.shared.artifact.events.code.infrastructure.dbus import (
     DbusChangeStagingCodeExecutionRequested,
 )
 from pythoneda.shared.infrastructure.dbus import DbusSignalListener
-from typing import Dict
+from typing import Dict, List
 
 
 class NixFlakeDbusSignalListener(DbusSignalListener):
@@ -40,20 +52,245 @@ class NixFlakeDbusSignalListener(DbusSignalListener):
     Class name: NixFlakeDbusSignalListener
 
     Responsibilities:
-        - Connect to d-bus.
+        - Connect to d-bus, through long-lived connections that survive bus restarts.
         - Listen to signals relevant to nix-flake artifact.
+        - Hand the received events over to the application through a bounded work queue.
+        - Receive events emitted within the same process, skipping d-bus.
+        - Collapse repeated execution requests onto a single job.
+        - Package execution requests through the flake artifact cache, if requested.
+        - Receive large payloads out-of-band, as UNIX file descriptors.
 
     Collaborators:
         - pythoneda.shared.application.PythonEDA: Receives relevant domain events.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.EventWorkQueue: Admission control.
         - pythoneda.shared.artifact.events.code.infrastructure.dbus.DbusChangeStagingCodeDescribed
         - pythoneda.shared.artifact.events.code.infrastructure.dbus.DbusChangeStagingCodeExecutionRequested
     """
 
-    def __init__(self):
+    _default_max_queue_size = 64
+    _default_workers = 4
+    _default_overflow_policy = OverflowPolicy.BLOCK
+    _bus_type = BusType.SYSTEM
+    _packager = None
+
+    def __init__(
+        self,
+        maxQueueSize: int = None,
+        workers: int = None,
+        overflowPolicy: OverflowPolicy = None,
+    ):
         """
         Creates a new NixFlakeDbusSignalListener instance.
+        :param maxQueueSize: The maximum number of events waiting to be processed.
+        :type maxQueueSize: int
+        :param workers: The maximum number of events processed concurrently.
+        :type workers: int
+        :param overflowPolicy: What to do with new events when the queue is full.
+        :type overflowPolicy: pythoneda.artifact.nix.flake.infrastructure.dbus.OverflowPolicy
         """
         super().__init__()
+        cls = self.__class__
+        self._max_queue_size = (
+            cls._default_max_queue_size if maxQueueSize is None else maxQueueSize
+        )
+        self._workers = cls._default_workers if workers is None else workers
+        self._overflow_policy = (
+            cls._default_overflow_policy if overflowPolicy is None else overflowPolicy
+        )
+        self._queue = None
+
+    @classmethod
+    def admission_control(
+        cls, maxQueueSize: int, workers: int, overflowPolicy: OverflowPolicy
+    ):
+        """
+        Specifies the default admission control settings of new instances.
+        :param maxQueueSize: The maximum number of events waiting to be processed.
+        :type maxQueueSize: int
+        :param workers: The maximum number of events processed concurrently.
+        :type workers: int
+        :param overflowPolicy: What to do with new events when the queue is full.
+        :type overflowPolicy: pythoneda.artifact.nix.flake.infrastructure.dbus.OverflowPolicy
+        """
+        cls._default_max_queue_size = maxQueueSize
+        cls._default_workers = workers
+        cls._default_overflow_policy = overflowPolicy
+
+    @classmethod
+    def bus_type(cls, busType: BusType):
+        """
+        Specifies the bus the signals are listened to on.
+        The session bus honors DBUS_SESSION_BUS_ADDRESS, e.g. to use a private dbus-daemon.
+        :param busType: The bus type.
+        :type busType: dbus_next.BusType
+        """
+        cls._bus_type = busType
+
+    @classmethod
+    def packaging(cls, packager: ExecutionRequestPackager):
+        """
+        Specifies the packager of the execution requests, instead of the application.
+        :param packager: The packager, or None to let the application handle them.
+        :type packager: pythoneda.artifact.nix.flake.infrastructure.dbus.ExecutionRequestPackager
+        """
+        cls._packager = packager
+
+    @property
+    def queue(self) -> EventWorkQueue:
+        """
+        Retrieves the work queue between d-bus and the application.
+        :return: Such queue, or None if not listening yet.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.dbus.EventWorkQueue
+        """
+        return self._queue
+
+    async def accept(self, app):
+        """
+        Starts listening to d-bus signals and in-process events, queueing the received events.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        """
+        queued_app = QueuedApp(app, self.__class__._packager)
+        self._queue = EventWorkQueue(
+            queued_app.process,
+            self._max_queue_size,
+            self._workers,
+            self._overflow_policy,
+            queued_app.dropped,
+        )
+        queued_app.queue = self._queue
+        for key in self.signal_receivers(app).keys():
+            LocalEventBus.instance().subscribe(key, queued_app.offer_local)
+        await self._subscribe(app, queued_app)
+
+    async def _subscribe(self, app, queuedApp):
+        """
+        Subscribes to the signals of interest, and to the out-of-band signals
+        carrying large payloads, through long-lived connections.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        :param queuedApp: The queued application.
+        :type queuedApp: pythoneda.artifact.nix.flake.infrastructure.dbus.QueuedApp
+        """
+        pool = DbusConnectionPool.instance()
+        receivers = self.signal_receivers(app)
+        for key, (interface_class, bus_type) in receivers.items():
+            interface = pool.interface_name(interface_class)
+            member = key.split(".")[-1]
+            await pool.subscribe(
+                bus_type,
+                f"type='signal',interface='{interface}',member='{member}'",
+                partial(
+                    self._on_signal, interface_class, interface, member, queuedApp
+                ),
+            )
+        for bus_type in {receiver[1] for receiver in receivers.values()}:
+            await pool.subscribe(
+                bus_type,
+                OutOfBandPayload.match_rule(),
+                partial(self._on_out_of_band, receivers, queuedApp),
+            )
+
+    def _on_signal(
+        self,
+        interfaceClass: type,
+        interface: str,
+        member: str,
+        queuedApp,
+        message: Message,
+    ):
+        """
+        Processes a signal, if it's the one given interface is about.
+        :param interfaceClass: The d-bus interface of the event.
+        :type interfaceClass: type
+        :param interface: The name of the interface.
+        :type interface: str
+        :param member: The name of the signal.
+        :type member: str
+        :param queuedApp: The queued application.
+        :type queuedApp: pythoneda.artifact.nix.flake.infrastructure.dbus.QueuedApp
+        :param message: The message.
+        :type message: dbus_next.Message
+        """
+        if (
+            message.message_type == MessageType.SIGNAL
+            and message.interface == interface
+            and message.member == member
+        ):
+            root = self._trace_receipt(message, False)
+            self._received(interfaceClass.parse(message), root, queuedApp)
+        return None
+
+    def _on_out_of_band(self, receivers: Dict, queuedApp, message: Message):
+        """
+        Processes an out-of-band signal.
+        :param receivers: The signal receivers.
+        :type receivers: Dict
+        :param queuedApp: The queued application.
+        :type queuedApp: pythoneda.artifact.nix.flake.infrastructure.dbus.QueuedApp
+        :param message: The message.
+        :type message: dbus_next.Message
+        """
+        if (
+            message.message_type != MessageType.SIGNAL
+            or message.interface != OutOfBandPayload.INTERFACE
+            or message.member != OutOfBandPayload.MEMBER
+        ):
+            return None
+        receiver = receivers.get(message.body[0], None)
+        if receiver is None:
+            OutOfBandPayload.discard(message)
+            return None
+        try:
+            _, original = OutOfBandPayload.original(message)
+        except (OSError, ValueError) as error:
+            NixFlakeDbusSignalListener.logger().warning(
+                f"Dropping an out-of-band {message.body[0]} from {message.sender}: {error}"
+            )
+            return None
+        root = self._trace_receipt(message, True)
+        self._received(receiver[0].parse(original), root, queuedApp)
+        return None
+
+    def _trace_receipt(self, message: Message, outOfBand: bool) -> Span:
+        """
+        Starts the trace of a received signal.
+        :param message: The message.
+        :type message: dbus_next.Message
+        :param outOfBand: Whether it carries its payload out-of-band.
+        :type outOfBand: bool
+        :return: The root span.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        return Tracer.instance().start(
+            "dbus.receive",
+            {
+                "messaging.system": "dbus",
+                "dbus.member": message.body[0].split(".")[-1]
+                if outOfBand
+                else message.member,
+                "dbus.sender": message.sender or "",
+                "dbus.out_of_band": outOfBand,
+            },
+            kind=Span.CONSUMER,
+        )
+
+    def _received(self, event: Event, root: Span, queuedApp):
+        """
+        Hands a received event to the queued application.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :param root: The root span of its trace.
+        :type root: pythoneda.artifact.nix.flake.infrastructure.Span
+        :param queuedApp: The queued application.
+        :type queuedApp: pythoneda.artifact.nix.flake.infrastructure.dbus.QueuedApp
+        """
+        Tracer.instance().follow(event, root)
+        Metrics.instance().inc(
+            "nix_flake_dbus_signals_received_total",
+            {"type": event.__class__.__name__},
+        )
+        queuedApp.offer(event)
 
     def signal_receivers(self, app) -> Dict:
         """
@@ -64,13 +301,189 @@ class NixFlakeDbusSignalListener(DbusSignalListener):
         :rtype: Dict
         """
         result = {}
+        bus_type = self.__class__._bus_type
         key = self.__class__.full_class_name(ChangeStagingCodeDescribed)
-        result[key] = [DbusChangeStagingCodeDescribed, BusType.SYSTEM]
+        result[key] = [DbusChangeStagingCodeDescribed, bus_type]
         key = self.__class__.full_class_name(ChangeStagingCodeExecutionRequested)
-        result[key] = [DbusChangeStagingCodeExecutionRequested, BusType.SYSTEM]
+        result[key] = [DbusChangeStagingCodeExecutionRequested, bus_type]
         return result
 
 
+class QueuedApp(BaseObject):
+
+    """
+    A proxy of the PythonEDA application, whose accept() goes through a work queue.
+
+    Class name: QueuedApp
+
+    Responsibilities:
+        - Queue the events to accept, applying the overflow policy before spawning work for them.
+        - Ignore the d-bus copy of events already received in-process.
+        - Skip repeated execution requests.
+        - Hand execution requests over to the packager, if any.
+        - Delegate anything else to the application.
+
+    Collaborators:
+        - pythoneda.shared.application.PythonEDA: The proxied application.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.EventWorkQueue: The queue.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.ExecutionRequestDeduplicator: Deduplicates requests.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.ExecutionRequestPackager: Packages execution requests.
+    """
+
+    def __init__(self, app, packager: ExecutionRequestPackager = None):
+        """
+        Creates a new QueuedApp instance.
+        :param app: The PythonEDA instance.
+        :type app: pythoneda.shared.application.PythonEDA
+        :param packager: The packager of the execution requests, if not the application.
+        :type packager: pythoneda.artifact.nix.flake.infrastructure.dbus.ExecutionRequestPackager
+        """
+        super().__init__()
+        self._app = app
+        self._packager = packager
+        self._queue = None
+
+    @property
+    def queue(self) -> EventWorkQueue:
+        """
+        Retrieves the work queue.
+        :return: Such queue.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.dbus.EventWorkQueue
+        """
+        return self._queue
+
+    @queue.setter
+    def queue(self, queue: EventWorkQueue):
+        """
+        Specifies the work queue.
+        :param queue: The queue.
+        :type queue: pythoneda.artifact.nix.flake.infrastructure.dbus.EventWorkQueue
+        """
+        self._queue = queue
+
+    def offer(self, event: Event, local: bool = False) -> bool:
+        """
+        Hands given event, received via d-bus, over to the queue. The overflow
+        policy applies before any work gets spawned for it, so a flood of
+        signals cannot pile up pending tasks.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :param local: Whether it got published within this process instead.
+        :type local: bool
+        :return: True if it got a place in the queue.
+        :rtype: bool
+        """
+        if not self._queue.reserve(event):
+            Tracer.instance().discard(event, "rejected")
+            return False
+        asyncio.ensure_future(self._admit(event, local))
+        return True
+
+    def offer_local(self, event: Event) -> bool:
+        """
+        Hands given event, published by the LocalEventBus, over to the queue.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :return: True if it got a place in the queue.
+        :rtype: bool
+        """
+        return self.offer(event, True)
+
+    async def _admit(self, event: Event, local: bool):
+        """
+        Queues given event, for which room was reserved.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :param local: Whether it got published within this process.
+        :type local: bool
+        """
+        try:
+            if local:
+                await self.enqueue(event)
+            else:
+                await self.accept(event)
+        finally:
+            self._queue.release()
+
+    async def accept(self, event: Event):
+        """
+        Queues given event, received via d-bus, to be accepted by the application.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        if LocalEventBus.instance().delivered(event):
+            QueuedApp.logger().debug(f"Ignoring {event}, already received in-process")
+            Tracer.instance().discard(event, "delivered in-process")
+            return
+        await self.enqueue(event)
+
+    async def enqueue(self, event: Event):
+        """
+        Queues given event, to be accepted by the application, unless it repeats a previous request.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        deduplicator = ExecutionRequestDeduplicator.instance()
+        if await deduplicator.admit(event):
+            if not await self._queue.put(event):
+                Tracer.instance().discard(event, "rejected")
+                await self._retry(deduplicator.abandon(event))
+
+    def dropped(self, event: Event):
+        """
+        Forgets given event, dropped by the queue to make room, along with the duplicates waiting for it.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        tracer = Tracer.instance()
+        tracer.discard(event, "dropped")
+        for duplicate in ExecutionRequestDeduplicator.instance().abandon(event):
+            tracer.discard(duplicate, "dropped")
+
+    async def process(self, event: Event):
+        """
+        Lets the application accept given event, or the packager package it.
+        :param event: The event.
+        :type event: pythoneda.Event
+        """
+        tracer = Tracer.instance()
+        with tracer.activate(tracer.trace_of(event)), tracer.span(
+            "nix_flake.process", {"event": event.__class__.__name__}
+        ):
+            try:
+                if self._packager is not None and self._packager.handles(event):
+                    await self._packager.package(event)
+                else:
+                    await self._app.accept(event)
+            except Exception as error:
+                tracer.abort(event, error)
+                raise
+            finally:
+                # no-op if a result answered it; otherwise, a duplicate takes over
+                await self._retry(
+                    ExecutionRequestDeduplicator.instance().abandon(event)
+                )
+
+    async def _retry(self, duplicates: List[Event]):
+        """
+        Queues the duplicates of an abandoned request: the first one takes its place.
+        :param duplicates: The duplicates.
+        :type duplicates: List[pythoneda.Event]
+        """
+        for duplicate in duplicates:
+            await self.enqueue(duplicate)
+
+    def __getattr__(self, name: str):
+        """
+        Delegates any other attribute to the application.
+        :param name: The name of the attribute.
+        :type name: str
+        :return: The attribute of the application.
+        :rtype: object
+        """
+        return getattr(self._app, name)
+
+
 # vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
 # Local Variables:
 # mode: python
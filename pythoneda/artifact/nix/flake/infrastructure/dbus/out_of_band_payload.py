@@ -0,0 +1,254 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/dbus/out_of_band_payload.py
+
+This file defines the OutOfBandPayload class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from dbus_next import Message, MessageType
+import fcntl
+import json
+import mmap
+import os
+from pythoneda import BaseObject, Event
+import tempfile
+from typing import List, Tuple
+
+
+class OutOfBandPayload(BaseObject):
+
+    """
+    Moves large signal payloads out of d-bus messages, through UNIX file descriptors.
+
+    It's opt-in: only consumers aware of the Payload signal get them, so
+    payloads travel inline until threshold() gets called.
+
+    Class name: OutOfBandPayload
+
+    Responsibilities:
+        - Decide which payloads are too large to travel inline.
+        - Write them to a sealed memfd (or an unlinked temporary file).
+        - Build the d-bus signal carrying the file descriptor.
+        - Map the file read-only on the receiving side, and rebuild the original signal.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter: Sends them.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalListener: Receives them.
+    """
+
+    INTERFACE = "pythoneda.artifact.nix_flake.OutOfBand"
+    PATH = "/pythoneda/artifact/nix_flake/out_of_band"
+    MEMBER = "Payload"
+    SIGNATURE = "sssh"
+
+    # off unless every consumer understands the Payload signal
+    _threshold = None
+
+    @classmethod
+    def threshold(cls, size: int):
+        """
+        Specifies the payload size from which payloads travel out-of-band.
+        Consumers only subscribed to the original signals never get such payloads,
+        so enable it only once all of them listen to the Payload signal as well.
+        :param size: The size, in bytes. None sends every payload inline.
+        :type size: int
+        """
+        cls._threshold = size
+
+    @classmethod
+    def is_large(cls, body: List) -> bool:
+        """
+        Checks whether given signal body is too large to travel inline.
+        :param body: The body.
+        :type body: List
+        :return: True in such case.
+        :rtype: bool
+        """
+        if cls._threshold is None:
+            return False
+        size = 0
+        for value in body:
+            size += len(value.encode("utf-8")) if isinstance(value, str) else 8
+            if size >= cls._threshold:
+                return True
+        return False
+
+    @classmethod
+    def match_rule(cls) -> str:
+        """
+        Retrieves the d-bus match rule for out-of-band signals.
+        :return: Such rule.
+        :rtype: str
+        """
+        return f"type='signal',interface='{cls.INTERFACE}',member='{cls.MEMBER}'"
+
+    @classmethod
+    def _open(cls) -> int:
+        """
+        Opens an anonymous, writable file.
+        :return: Its file descriptor.
+        :rtype: int
+        """
+        if hasattr(os, "memfd_create"):
+            flags = getattr(os, "MFD_CLOEXEC", 0) | getattr(os, "MFD_ALLOW_SEALING", 0)
+            return os.memfd_create("pythoneda-out-of-band", flags)
+        handle = tempfile.TemporaryFile()
+        result = os.dup(handle.fileno())
+        handle.close()
+        return result
+
+    @classmethod
+    def _seal(cls, fd: int):
+        """
+        Prevents further changes to given memfd, if the platform supports it.
+        :param fd: The file descriptor.
+        :type fd: int
+        """
+        seals = 0
+        for name in ["F_SEAL_SEAL", "F_SEAL_SHRINK", "F_SEAL_GROW", "F_SEAL_WRITE"]:
+            seals |= getattr(fcntl, name, 0)
+        if seals and hasattr(fcntl, "F_ADD_SEALS"):
+            try:
+                fcntl.fcntl(fd, fcntl.F_ADD_SEALS, seals)
+            except OSError:
+                pass
+
+    @classmethod
+    def write(cls, signature: str, body: List) -> int:
+        """
+        Writes given signal body to a new anonymous file.
+        :param signature: The signature of the body.
+        :type signature: str
+        :param body: The body.
+        :type body: List
+        :return: The file descriptor, positioned at the start.
+        :rtype: int
+        """
+        data = json.dumps({"signature": signature, "body": body}).encode("utf-8")
+        result = cls._open()
+        view = memoryview(data)
+        while view:
+            written = os.write(result, view)
+            view = view[written:]
+        os.lseek(result, 0, os.SEEK_SET)
+        cls._seal(result)
+        return result
+
+    @classmethod
+    def read(cls, fd: int) -> Tuple[str, List]:
+        """
+        Reads a signal body from given file descriptor, mapping it read-only. Closes the descriptor.
+        Raises ValueError if the file is empty, or does not hold a signal body.
+        :param fd: The file descriptor.
+        :type fd: int
+        :return: The signature and the body.
+        :rtype: Tuple[str, List]
+        """
+        try:
+            size = os.fstat(fd).st_size
+            # mmap refuses empty files
+            if size == 0:
+                raise ValueError("Empty out-of-band payload")
+            with mmap.mmap(fd, size, prot=mmap.PROT_READ) as mapped:
+                data = json.loads(mapped[:size])
+        finally:
+            os.close(fd)
+        try:
+            return data["signature"], data["body"]
+        except (KeyError, TypeError) as error:
+            raise ValueError(f"Invalid out-of-band payload: {error}") from error
+
+    @classmethod
+    def signal(
+        cls, event: Event, path: str, interface: str, signature: str, body: List
+    ) -> Tuple[Message, int]:
+        """
+        Builds the out-of-band signal for given event.
+        :param event: The event.
+        :type event: pythoneda.Event
+        :param path: The path of the original signal.
+        :type path: str
+        :param interface: The interface of the original signal.
+        :type interface: str
+        :param signature: The signature of the original signal.
+        :type signature: str
+        :param body: The body of the original signal.
+        :type body: List
+        :return: The message and the file descriptor it carries, to close once sent.
+        :rtype: Tuple[dbus_next.Message, int]
+        """
+        fd = cls.write(signature, body)
+        message = Message.new_signal(
+            cls.PATH,
+            cls.INTERFACE,
+            cls.MEMBER,
+            cls.SIGNATURE,
+            [cls.full_class_name(event.__class__), path, interface, 0],
+            [fd],
+        )
+        return message, fd
+
+    @classmethod
+    def original(cls, message: Message) -> Tuple[str, Message]:
+        """
+        Rebuilds the original signal out of an out-of-band one.
+        Raises ValueError if its payload is missing, empty or invalid.
+        :param message: The out-of-band signal.
+        :type message: dbus_next.Message
+        :return: The full class name of the event, and the original signal.
+        :rtype: Tuple[str, dbus_next.Message]
+        """
+        event_class_name, path, interface, index = message.body
+        fds = list(message.unix_fds or [])
+        # the index refers to the attached descriptors, never to our own ones
+        if not 0 <= index < len(fds):
+            cls.discard(message)
+            raise ValueError(f"{cls.MEMBER} signal without its file descriptor")
+        for position, fd in enumerate(fds):
+            if position != index:
+                os.close(fd)
+        signature, body = cls.read(fds[index])
+        result = Message(
+            path=path,
+            interface=interface,
+            member=event_class_name.split(".")[-1],
+            message_type=MessageType.SIGNAL,
+            signature=signature,
+            body=body,
+            sender=message.sender,
+        )
+        return event_class_name, result
+
+    @classmethod
+    def discard(cls, message: Message):
+        """
+        Closes the file descriptors of an out-of-band signal nobody's interested in.
+        :param message: The out-of-band signal.
+        :type message: dbus_next.Message
+        """
+        for fd in message.unix_fds or []:
+            os.close(fd)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
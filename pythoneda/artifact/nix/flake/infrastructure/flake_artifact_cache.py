@@ -0,0 +1,572 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/flake_artifact_cache.py
+
+This file defines the FlakeArtifactCache class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+from pathlib import Path
+from pythoneda import BaseObject
+import re
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+
+class FlakeArtifactCache(BaseObject):
+
+    """
+    A content-addressed cache of generated flake folders.
+
+    The key is a hash of the code request, of the resolved flake graph, and
+    of the packages rendering it (templates included), so two requests with
+    the same code and the same input versions share the generated files,
+    until the templates change. Hits clone them into the target folder through
+    reflinks (copy-on-write) when the filesystem supports them, or through
+    hardlinks otherwise. Cached files are read-only: consumers must replace
+    generated files, not edit them in place.
+
+    Class name: FlakeArtifactCache
+
+    Responsibilities:
+        - Compute the key of a flake.
+        - Materialize the cached files of a key, or render and store them.
+        - Keep the cache under a size limit, evicting the least recently used entries.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Renders flakes through it.
+    """
+
+    _singleton = None
+    _default_location = ".nix_flake_artifact_cache"
+    _default_max_bytes = 1024**3
+
+    # package folder -> digest of its files, i.e. of the templates rendering flakes
+    _package_digests = {}
+
+    # Linux ioctl to clone a file (reflink)
+    _FICLONE = 0x40049409
+
+    def __init__(
+        self, location: str = None, maxBytes: int = None, linkMode: str = "auto"
+    ):
+        """
+        Creates a new FlakeArtifactCache instance.
+        :param location: The folder of the cache.
+        :type location: str
+        :param maxBytes: The size limit.
+        :type maxBytes: int
+        :param linkMode: "auto" (reflink, or hardlink), "reflink" (reflink, or copy), or "copy".
+        :type linkMode: str
+        """
+        super().__init__()
+        self._location = Path(location or self.__class__._default_location)
+        self._max_bytes = (
+            self.__class__._default_max_bytes if maxBytes is None else maxBytes
+        )
+        self._link_mode = linkMode
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def instance(cls) -> "FlakeArtifactCache":
+        """
+        Retrieves the process-wide instance.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.FlakeArtifactCache
+        """
+        if cls._singleton is None:
+            cls._singleton = cls()
+        return cls._singleton
+
+    @classmethod
+    def configure(cls, location: str = None, maxBytes: int = None):
+        """
+        Specifies the folder and size limit of the process-wide instance.
+        :param location: The folder of the cache.
+        :type location: str
+        :param maxBytes: The size limit.
+        :type maxBytes: int
+        """
+        if location is not None:
+            cls._default_location = location
+        if maxBytes is not None:
+            cls._default_max_bytes = maxBytes
+        cls._singleton = None
+
+    @property
+    def location(self) -> Path:
+        """
+        Retrieves the folder of the cache.
+        :return: Such folder.
+        :rtype: pathlib.Path
+        """
+        return self._location
+
+    @property
+    def max_bytes(self) -> int:
+        """
+        Retrieves the size limit of the cache.
+        :return: Such limit, in bytes.
+        :rtype: int
+        """
+        return self._max_bytes
+
+    @classmethod
+    def describe(cls, value: Any, ignored: List[str] = None, depth: int = 0) -> Any:
+        """
+        Describes given value as JSON-compatible data, for hashing.
+        :param value: The value.
+        :type value: Any
+        :param ignored: The attributes to leave out, at any depth, regardless of leading underscores.
+        :type ignored: List[str]
+        :param depth: How deep in the value we are.
+        :type depth: int
+        :return: The description.
+        :rtype: Any
+        """
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if depth > 16:
+            return cls._repr(value)
+        if isinstance(value, dict):
+            return {
+                str(key): cls.describe(item, ignored, depth + 1)
+                for key, item in value.items()
+            }
+        if isinstance(value, (list, tuple, set, frozenset)):
+            items = [cls.describe(item, ignored, depth + 1) for item in value]
+            if isinstance(value, (set, frozenset)):
+                items.sort(key=lambda item: json.dumps(item, sort_keys=True))
+            return items
+        attributes = getattr(value, "__dict__", None)
+        if attributes is None:
+            return cls._repr(value)
+        if ignored:
+            attributes = {
+                name: item
+                for name, item in attributes.items()
+                if name.lstrip("_") not in ignored
+            }
+        return [
+            cls.full_class_name(value.__class__),
+            cls.describe(attributes, ignored, depth + 1),
+        ]
+
+    @classmethod
+    def _repr(cls, value: Any) -> str:
+        """
+        Describes given value through its representation, without memory addresses.
+        :param value: The value.
+        :type value: Any
+        :return: The representation.
+        :rtype: str
+        """
+        return re.sub(r" at 0x[0-9a-fA-F]+", "", repr(value))
+
+    @classmethod
+    def _flake_graph(cls, flake, seen: set = None) -> Any:
+        """
+        Describes the resolved graph of given flake: its name, version and url, and its inputs'.
+        :param flake: The flake.
+        :type flake: pythoneda.shared.nix.flake.NixFlake
+        :param seen: The flakes already described, to stop on cycles.
+        :type seen: set
+        :return: The description.
+        :rtype: Any
+        """
+        if flake is None:
+            return None
+        seen = seen or set()
+        if id(flake) in seen:
+            return getattr(flake, "name", None)
+        seen = seen | {id(flake)}
+        return {
+            "class": cls.full_class_name(flake.__class__),
+            "name": cls.describe(getattr(flake, "name", None)),
+            "version": cls.describe(getattr(flake, "version", None)),
+            "url": cls.describe(getattr(flake, "url", None)),
+            "inputs": [
+                cls._flake_graph(flake_input, seen)
+                for flake_input in getattr(flake, "inputs", None) or []
+            ],
+        }
+
+    @classmethod
+    def _package_digest(cls, folder: str) -> str:
+        """
+        Computes a digest of the files of given package, leaving its subpackages out.
+        :param folder: The folder of the package.
+        :type folder: str
+        :return: The digest, computed once per process.
+        :rtype: str
+        """
+        result = cls._package_digests.get(folder, None)
+        if result is not None:
+            return result
+        digest = hashlib.sha256()
+        for root, folders, files in os.walk(folder):
+            # data folders (i.e. templates) belong to the package, subpackages don't
+            folders[:] = sorted(
+                name
+                for name in folders
+                if name != "__pycache__"
+                and not os.path.exists(os.path.join(root, name, "__init__.py"))
+            )
+            for name in sorted(files):
+                if name.endswith((".pyc", ".pyo")):
+                    continue
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode("utf-8") + b"\0")
+                try:
+                    with open(path, "rb") as file:
+                        for chunk in iter(lambda: file.read(1 << 16), b""):
+                            digest.update(chunk)
+                except OSError:
+                    continue
+        result = digest.hexdigest()
+        cls._package_digests[folder] = result
+        return result
+
+    @classmethod
+    def renderer_digest(cls, flake) -> str:
+        """
+        Computes a digest of the packages defining the class of given flake, and its ancestors.
+        :param flake: The flake.
+        :type flake: pythoneda.shared.nix.flake.NixFlake
+        :return: The digest, which changes when their code or templates do.
+        :rtype: str
+        """
+        folders = set()
+        for ancestor in type(flake).__mro__:
+            module = sys.modules.get(ancestor.__module__, None)
+            path = getattr(module, "__file__", None)
+            if path is not None:
+                folders.add(os.path.dirname(os.path.abspath(path)))
+        result = hashlib.sha256()
+        for folder in sorted(folders):
+            result.update(cls._package_digest(folder).encode("ascii"))
+        return result.hexdigest()
+
+    @classmethod
+    def key_for(cls, flake, codeRequest=None) -> str:
+        """
+        Computes the key of given flake.
+        :param flake: The resolved flake.
+        :type flake: pythoneda.shared.nix.flake.NixFlake
+        :param codeRequest: The code request it packages, if any.
+        :type codeRequest: pythoneda.shared.code_requests.CodeRequest
+        :return: The key.
+        :rtype: str
+        """
+        serialized = json.dumps(
+            [
+                cls.describe(codeRequest),
+                cls._flake_graph(flake),
+                cls.renderer_digest(flake),
+            ],
+            sort_keys=True,
+        )
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        """
+        Retrieves the folder of given key.
+        :param key: The key.
+        :type key: str
+        :return: The folder.
+        :rtype: pathlib.Path
+        """
+        return self._location / key[:2] / key
+
+    @contextmanager
+    def _exclusively(self) -> Iterator[None]:
+        """
+        Locks the cache against other threads and processes, within the block.
+        """
+        self._location.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self._location / ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def materialize(
+        self, key: str, folder: str, render: Callable[[str], Any]
+    ) -> bool:
+        """
+        Makes the files of given key available in given folder, rendering them only on a miss.
+        :param key: The key, i.e. from key_for().
+        :type key: str
+        :param folder: The target folder.
+        :type folder: str
+        :param render: Generates the files into a folder, on misses.
+        :type render: Callable[[str], Any]
+        :return: True if the files came from the cache.
+        :rtype: bool
+        """
+        entry = self._entry(key)
+        target = Path(folder)
+        if entry.is_dir():
+            try:
+                os.utime(entry)
+                self._clone_tree(entry, target, True)
+                self._counters["hits"] += 1
+                return True
+            except FileNotFoundError:
+                # evicted meanwhile
+                pass
+        self._counters["misses"] += 1
+        target.mkdir(parents=True, exist_ok=True)
+        before = self.__class__._snapshot(target)
+        render(str(target))
+        rendered = [
+            path
+            for path, signature in self.__class__._snapshot(target).items()
+            if before.get(path, None) != signature
+        ]
+        try:
+            self._store(key, target, rendered)
+        except OSError as error:
+            FlakeArtifactCache.logger().warning(f"Cannot cache flake {key}: {error}")
+        return False
+
+    @classmethod
+    def _snapshot(cls, folder: Path) -> Dict[str, Tuple[int, int]]:
+        """
+        Lists the files in given folder, with their size and modification time.
+        :param folder: The folder.
+        :type folder: pathlib.Path
+        :return: For each relative path, its size and modification time.
+        :rtype: Dict[str, Tuple[int, int]]
+        """
+        result = {}
+        for root, folders, files in os.walk(folder):
+            folders[:] = [name for name in folders if name != ".git"]
+            for name in files:
+                path = os.path.join(root, name)
+                info = os.lstat(path)
+                if stat.S_ISREG(info.st_mode):
+                    result[os.path.relpath(path, folder)] = (
+                        info.st_size,
+                        info.st_mtime_ns,
+                    )
+        return result
+
+    def _store(self, key: str, folder: Path, files: List[str]):
+        """
+        Stores given rendered files under given key, and enforces the size limit.
+        :param key: The key.
+        :type key: str
+        :param folder: The folder the files were rendered into.
+        :type folder: pathlib.Path
+        :param files: The rendered files, relative to the folder.
+        :type files: List[str]
+        """
+        entry = self._entry(key)
+        staging_root = self._location / "tmp"
+        staging_root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f"{key[:12]}-", dir=staging_root))
+        size = 0
+        try:
+            for relative in files:
+                target = staging / relative
+                target.parent.mkdir(parents=True, exist_ok=True)
+                # never hardlink the consumer's files: it may edit them later
+                self._clone_file(folder / relative, target, False)
+                os.chmod(target, stat.S_IMODE(os.stat(target).st_mode) & 0o555)
+                size += os.path.getsize(target)
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            with self._exclusively():
+                if entry.exists():
+                    return
+                os.rename(staging, entry)
+                metadata = {"bytes": size, "files": len(files), "time": time.time()}
+                (entry.parent / f"{key}.json").write_text(json.dumps(metadata))
+                self._evict()
+        finally:
+            if staging.exists():
+                shutil.rmtree(staging, ignore_errors=True)
+
+    def entries(self) -> List[Dict]:
+        """
+        Lists the cache entries, from the least to the most recently used.
+        :return: For each entry, its key, size and last use.
+        :rtype: List[Dict]
+        """
+        result = []
+        for metadata in self._location.glob("??/*.json"):
+            entry = metadata.with_suffix("")
+            try:
+                size = json.loads(metadata.read_text()).get("bytes", 0)
+                used = entry.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            result.append({"key": entry.name, "bytes": size, "used": used})
+        result.sort(key=lambda item: item["used"])
+        return result
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache fits. Expects the lock to be held.
+        """
+        entries = self.entries()
+        total = sum(entry["bytes"] for entry in entries)
+        while entries and total > self._max_bytes:
+            oldest = entries.pop(0)
+            self._remove(oldest["key"])
+            total -= oldest["bytes"]
+            self._counters["evictions"] += 1
+
+    def _remove(self, key: str):
+        """
+        Removes given entry.
+        :param key: The key.
+        :type key: str
+        """
+        entry = self._entry(key)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            (entry.parent / f"{key}.json").unlink()
+        except FileNotFoundError:
+            pass
+
+    def prune(self, maxBytes: int = 0) -> int:
+        """
+        Removes the least recently used entries until the cache fits in given size.
+        :param maxBytes: The size. Defaults to 0, emptying the cache.
+        :type maxBytes: int
+        :return: How many entries were removed.
+        :rtype: int
+        """
+        result = 0
+        with self._exclusively():
+            entries = self.entries()
+            total = sum(entry["bytes"] for entry in entries)
+            while entries and total > maxBytes:
+                oldest = entries.pop(0)
+                self._remove(oldest["key"])
+                total -= oldest["bytes"]
+                result += 1
+        return result
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the counters of this instance, and the size of the cache.
+        :return: Such information.
+        :rtype: Dict
+        """
+        entries = self.entries()
+        return dict(
+            self._counters,
+            entries=len(entries),
+            bytes=sum(entry["bytes"] for entry in entries),
+            max_bytes=self._max_bytes,
+        )
+
+    def _clone_tree(self, source: Path, target: Path, mayHardlink: bool):
+        """
+        Clones the files of given folder into another one.
+        :param source: The folder to clone.
+        :type source: pathlib.Path
+        :param target: The target folder.
+        :type target: pathlib.Path
+        :param mayHardlink: Whether hardlinks are acceptable.
+        :type mayHardlink: bool
+        """
+        for root, folders, files in os.walk(source):
+            relative = os.path.relpath(root, source)
+            destination = target / relative
+            destination.mkdir(parents=True, exist_ok=True)
+            for name in files:
+                self._clone_file(Path(root) / name, destination / name, mayHardlink)
+
+    def _clone_file(self, source: Path, target: Path, mayHardlink: bool):
+        """
+        Clones a file, through a reflink, a hardlink or a copy, in that order.
+        :param source: The file.
+        :type source: pathlib.Path
+        :param target: The clone.
+        :type target: pathlib.Path
+        :param mayHardlink: Whether a hardlink is acceptable.
+        :type mayHardlink: bool
+        """
+        if target.exists() or target.is_symlink():
+            target.unlink()
+        if mayHardlink and self._link_mode == "auto":
+            if self.__class__._reflink(source, target):
+                self.__class__._writable(target)
+                return
+            try:
+                os.link(source, target)
+                return
+            except OSError:
+                pass
+        elif self._link_mode != "copy" and self.__class__._reflink(source, target):
+            self.__class__._writable(target)
+            return
+        shutil.copy2(source, target)
+        self.__class__._writable(target)
+
+    @classmethod
+    def _writable(cls, path: Path):
+        """
+        Makes given file writable by its owner.
+        :param path: The file.
+        :type path: pathlib.Path
+        """
+        os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | stat.S_IWUSR)
+
+    @classmethod
+    def _reflink(cls, source: Path, target: Path) -> bool:
+        """
+        Clones a file sharing its blocks (copy-on-write), if the filesystem supports it.
+        :param source: The file.
+        :type source: pathlib.Path
+        :param target: The clone.
+        :type target: pathlib.Path
+        :return: True if it could.
+        :rtype: bool
+        """
+        try:
+            with open(source, "rb") as reader, open(target, "wb") as writer:
+                fcntl.ioctl(writer.fileno(), cls._FICLONE, reader.fileno())
+            shutil.copystat(source, target)
+            return True
+        except OSError:
+            try:
+                target.unlink()
+            except FileNotFoundError:
+                pass
+            return False
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
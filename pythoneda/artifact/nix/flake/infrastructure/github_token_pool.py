@@ -0,0 +1,206 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/github_token_pool.py
+
+This file defines the GithubTokenPool class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .metrics import Metrics
+from pythoneda import BaseObject
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping
+
+
+class GithubTokenPool(BaseObject):
+
+    """
+    Spreads gitHub API requests across several tokens, according to their quota.
+
+    Class name: GithubTokenPool
+
+    Responsibilities:
+        - Pick the token with the most remaining requests, in round-robin among equals.
+        - Track the X-RateLimit-Remaining and X-RateLimit-Reset headers of each token.
+        - Skip exhausted tokens until their quota gets reset.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Uses the tokens.
+    """
+
+    def __init__(self, tokens: Iterable[str] = None):
+        """
+        Creates a new GithubTokenPool instance.
+        :param tokens: The gitHub tokens.
+        :type tokens: Iterable[str]
+        """
+        super().__init__()
+        self._tokens = list(dict.fromkeys(token for token in tokens or [] if token))
+        # token -> remaining requests (None if unknown yet)
+        self._remaining = {token: None for token in self._tokens}
+        # token -> epoch seconds when its quota gets reset
+        self._reset = {token: 0.0 for token in self._tokens}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, value: str) -> "GithubTokenPool":
+        """
+        Creates a pool from a comma-separated list of tokens.
+        :param value: The tokens, i.e. "ghp_a,ghp_b".
+        :type value: str
+        :return: The pool.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.GithubTokenPool
+        """
+        return cls([token.strip() for token in (value or "").split(",")])
+
+    @property
+    def tokens(self) -> List[str]:
+        """
+        Retrieves the tokens.
+        :return: Such tokens.
+        :rtype: List[str]
+        """
+        return list(self._tokens)
+
+    def __len__(self) -> int:
+        """
+        Retrieves how many tokens the pool has.
+        :return: Such number.
+        :rtype: int
+        """
+        return len(self._tokens)
+
+    def _available(self, token: str, now: float) -> bool:
+        """
+        Checks whether given token can be used. Expects the lock to be held.
+        :param token: The token.
+        :type token: str
+        :param now: The current epoch seconds.
+        :type now: float
+        :return: True in such case.
+        :rtype: bool
+        """
+        return self._remaining[token] != 0 or self._reset[token] <= now
+
+    def acquire(self, exclude: Iterable[str] = None) -> str:
+        """
+        Picks a token for the next request, counting the request against its quota.
+        :param exclude: Tokens not to pick, i.e. the ones that just failed.
+        :type exclude: Iterable[str]
+        :return: The token with the most remaining requests, or None if none is available.
+        :rtype: str
+        """
+        result = None
+        excluded = set(exclude or [])
+        now = time.time()
+        with self._lock:
+            best = -1
+            count = len(self._tokens)
+            for offset in range(count):
+                token = self._tokens[(self._next + offset) % count]
+                if token in excluded or not self._available(token, now):
+                    continue
+                if self._reset[token] <= now and self._remaining[token] == 0:
+                    # the quota got reset
+                    self._remaining[token] = None
+                remaining = self._remaining[token]
+                # unknown quotas go first, to learn them
+                score = float("inf") if remaining is None else remaining
+                if score > best:
+                    best = score
+                    result = token
+            if result is not None:
+                self._next = (self._tokens.index(result) + 1) % count
+                if self._remaining[result] is not None:
+                    self._remaining[result] -= 1
+        return result
+
+    def update(self, token: str, statusCode: int, headers: Mapping[str, str]):
+        """
+        Updates the quota of given token, from the response to a request.
+        :param token: The token.
+        :type token: str
+        :param statusCode: The HTTP status of the response.
+        :type statusCode: int
+        :param headers: The response headers.
+        :type headers: Mapping[str, str]
+        """
+        if token not in self._remaining:
+            return
+        remaining = headers.get("X-RateLimit-Remaining", None)
+        reset = headers.get("X-RateLimit-Reset", None)
+        retry_after = headers.get("Retry-After", None)
+        with self._lock:
+            try:
+                if remaining is not None:
+                    self._remaining[token] = int(remaining)
+                if reset is not None:
+                    self._reset[token] = float(reset)
+                if retry_after is not None and statusCode in (403, 429):
+                    # secondary rate limit
+                    self._remaining[token] = 0
+                    self._reset[token] = time.time() + float(retry_after)
+            except ValueError:
+                return
+            index = self._tokens.index(token)
+            metrics = Metrics.instance()
+            if self._remaining[token] is not None:
+                metrics.set(
+                    "nix_flake_github_rate_limit_remaining",
+                    self._remaining[token],
+                    {"token": str(index)},
+                )
+            if self._reset[token]:
+                metrics.set(
+                    "nix_flake_github_rate_limit_reset_timestamp_seconds",
+                    self._reset[token],
+                    {"token": str(index)},
+                )
+            if statusCode in (403, 429) and self._remaining[token] == 0:
+                GithubTokenPool.logger().warning(
+                    f"GitHub token #{index} exhausted until "
+                    f"{time.strftime('%H:%M:%S', time.localtime(self._reset[token]))}"
+                )
+
+    def stats(self) -> List[Dict]:
+        """
+        Describes the quota of each token, without revealing them.
+        :return: For each token, its position, remaining requests, reset time and availability.
+        :rtype: List[Dict]
+        """
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "token": index,
+                    "remaining": self._remaining[token],
+                    "reset": self._reset[token],
+                    "available": self._available(token, now),
+                }
+                for index, token in enumerate(self._tokens)
+            ]
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
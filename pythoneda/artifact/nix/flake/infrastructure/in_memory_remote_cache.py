@@ -0,0 +1,163 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/in_memory_remote_cache.py
+
+This file defines the InMemoryRemoteCache class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .remote_cache import RemoteCache
+import threading
+import time
+from typing import Dict
+
+
+class InMemoryRemoteCache(RemoteCache):
+
+    """
+    A RemoteCache kept in this process, i.e. to try out a shared cache without a server.
+
+    Instances with the same name ("memory://name") are the same store.
+
+    Class name: InMemoryRemoteCache
+
+    Responsibilities:
+        - Keep entries in memory until they expire.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.RemoteCache: Its interface.
+    """
+
+    _named = {}
+    _named_lock = threading.Lock()
+
+    def __init__(self, name: str = "default"):
+        """
+        Creates a new InMemoryRemoteCache instance.
+        :param name: Its name.
+        :type name: str
+        """
+        super().__init__(f"memory://{name}")
+        # key -> (expiration, value)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._counters = {"get": 0, "set": 0, "add": 0, "delete": 0}
+
+    @classmethod
+    def named(cls, name: str) -> "InMemoryRemoteCache":
+        """
+        Retrieves the store of given name, creating it if needed.
+        :param name: The name.
+        :type name: str
+        :return: The store.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.InMemoryRemoteCache
+        """
+        with cls._named_lock:
+            result = cls._named.get(name, None)
+            if result is None:
+                result = cls(name)
+                cls._named[name] = result
+            return result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Retrieves how many times each operation got called.
+        :return: Such counters, and the number of entries.
+        :rtype: Dict[str, int]
+        """
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries))
+
+    def _alive(self, key: str) -> str:
+        """
+        Retrieves an entry, forgetting it if expired. The lock must be held.
+        :param key: The key.
+        :type key: str
+        :return: The value, or None.
+        :rtype: str
+        """
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def get(self, key: str) -> str:
+        """
+        Retrieves an entry.
+        :param key: The key.
+        :type key: str
+        :return: The value, or None if missing or expired.
+        :rtype: str
+        """
+        with self._lock:
+            self._counters["get"] += 1
+            return self._alive(key)
+
+    def set(self, key: str, value: str, ttl: float):
+        """
+        Stores an entry, replacing any previous one.
+        :param key: The key.
+        :type key: str
+        :param value: The value.
+        :type value: str
+        :param ttl: How long it's kept, in seconds.
+        :type ttl: float
+        """
+        with self._lock:
+            self._counters["set"] += 1
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        """
+        Stores an entry, unless there's one already.
+        :param key: The key.
+        :type key: str
+        :param value: The value.
+        :type value: str
+        :param ttl: How long it's kept, in seconds.
+        :type ttl: float
+        :return: True if it got stored.
+        :rtype: bool
+        """
+        with self._lock:
+            self._counters["add"] += 1
+            if self._alive(key) is not None:
+                return False
+            self._entries[key] = (time.monotonic() + ttl, value)
+            return True
+
+    def delete(self, key: str):
+        """
+        Removes an entry, if any.
+        :param key: The key.
+        :type key: str
+        """
+        with self._lock:
+            self._counters["delete"] += 1
+            self._entries.pop(key, None)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,103 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/lazy_attributes.py
+
+This file defines the LazyAttributes class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import importlib
+import sys
+from typing import Dict, List
+
+
+class LazyAttributes:
+
+    """
+    The public attributes of a package, imported from their submodules on first access (PEP 562).
+
+    Packages assign its getattr and dir methods to their module-level
+    __getattr__ and __dir__, so entry points only pay for what they use.
+    It doesn't extend BaseObject, since packages create it while being
+    imported, and importing pythoneda is what it defers.
+
+    Class name: LazyAttributes
+
+    Responsibilities:
+        - Import each attribute from its submodule, on first access.
+        - List the attributes, including the ones not imported yet.
+
+    Collaborators:
+        - None
+    """
+
+    def __init__(self, packageName: str, attributes: Dict[str, str]):
+        """
+        Creates a new LazyAttributes instance.
+        :param packageName: The name of the package.
+        :type packageName: str
+        :param attributes: The public attributes, and the submodules defining them, relative to the package.
+        :type attributes: Dict[str, str]
+        """
+        self._package_name = packageName
+        self._attributes = attributes
+
+    @property
+    def names(self) -> List[str]:
+        """
+        Retrieves the names of the public attributes, i.e. for __all__.
+        :return: Such names.
+        :rtype: List[str]
+        """
+        return list(self._attributes)
+
+    def getattr(self, name: str):
+        """
+        Imports given attribute on first access.
+        :param name: The name of the attribute.
+        :type name: str
+        :return: The attribute.
+        :rtype: object
+        """
+        module = self._attributes.get(name, None)
+        if module is None:
+            raise AttributeError(
+                f"module {self._package_name!r} has no attribute {name!r}"
+            )
+        result = getattr(importlib.import_module(module, self._package_name), name)
+        # later accesses don't get here
+        setattr(sys.modules[self._package_name], name, result)
+        return result
+
+    def dir(self) -> List[str]:
+        """
+        Lists the attributes of the package, including the ones not imported yet.
+        :return: Such attributes.
+        :rtype: List[str]
+        """
+        return sorted(
+            set(vars(sys.modules[self._package_name])) | set(self._attributes)
+        )
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,406 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/metrics.py
+
+This file defines the Metrics class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import atexit
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+from pythoneda import BaseObject
+import threading
+import time
+from typing import Dict, Tuple
+
+
+class Metrics(BaseObject):
+
+    """
+    A registry of counters, gauges and histograms, in the Prometheus text format.
+
+    The metrics are declared upfront (see _definitions), so their names,
+    types and help texts live in a single place.
+
+    Class name: Metrics
+
+    Responsibilities:
+        - Keep the value of each metric, per label set.
+        - Render them in the Prometheus text exposition format.
+        - Expose them on a local HTTP port, or write them to a textfile collector path.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Reports tag lookups, HTTP requests and resolutions.
+        - pythoneda.artifact.nix.flake.infrastructure.GithubTokenPool: Reports quotas.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalListener: Reports received signals.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter: Reports emitted signals.
+        - pythoneda.artifact.nix.flake.infrastructure.cli.MetricsCli: Exposes them.
+    """
+
+    _singleton = None
+
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+    _latency_buckets = (
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    )
+
+    # name -> (type, help, buckets)
+    _definitions = {
+        # outcomes: memory_hit, snapshot_hit, disk_hit, remote_hit, network,
+        # rate_limited, stale, error
+        "nix_flake_github_tag_lookups_total": (
+            COUNTER,
+            "get_latest_github_tag calls, by outcome",
+            None,
+        ),
+        # outcomes: remote_hit, network, rate_limited, error
+        "nix_flake_tag_refreshes_total": (
+            COUNTER,
+            "Tags refreshed ahead of their expiration, by outcome",
+            None,
+        ),
+        # outcomes: hit, miss, ok, error
+        "nix_flake_remote_cache_requests_total": (
+            COUNTER,
+            "Requests to the remote cache, by operation and outcome",
+            None,
+        ),
+        "nix_flake_http_requests_total": (
+            COUNTER,
+            "HTTP requests to the gitHub API, by status code (or timeout, unreachable)",
+            None,
+        ),
+        # winners: primary, hedge
+        "nix_flake_http_hedged_requests_total": (
+            COUNTER,
+            "gitHub requests sent twice because the first was slow, by winner",
+            None,
+        ),
+        "nix_flake_http_request_duration_seconds": (
+            HISTOGRAM,
+            "Duration of the HTTP requests to the gitHub API",
+            _latency_buckets,
+        ),
+        "nix_flake_http_response_bytes_total": (
+            COUNTER,
+            "Bytes received from the gitHub API",
+            None,
+        ),
+        "nix_flake_github_rate_limit_remaining": (
+            GAUGE,
+            "Requests left in the quota of each gitHub token, by position",
+            None,
+        ),
+        "nix_flake_github_rate_limit_reset_timestamp_seconds": (
+            GAUGE,
+            "When the quota of each gitHub token gets reset, by position",
+            None,
+        ),
+        "nix_flake_resolve_duration_seconds": (
+            HISTOGRAM,
+            "Duration of NixFlakeGitRepo.resolve(), by spec name",
+            _latency_buckets,
+        ),
+        "nix_flake_dbus_signals_received_total": (
+            COUNTER,
+            "d-bus signals received, by event type",
+            None,
+        ),
+        "nix_flake_dbus_signals_emitted_total": (
+            COUNTER,
+            "d-bus signals emitted, by event type",
+            None,
+        ),
+    }
+
+    def __init__(self):
+        """
+        Creates a new Metrics instance.
+        """
+        super().__init__()
+        # name -> {label items -> value}; histograms keep [bucket counts..., sum, count]
+        self._values = {name: {} for name in self.__class__._definitions}
+        self._lock = threading.Lock()
+        self._server = None
+        self._textfile = None
+
+    @classmethod
+    def instance(cls) -> "Metrics":
+        """
+        Retrieves the process-wide instance.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Metrics
+        """
+        if cls._singleton is None:
+            cls._singleton = cls()
+        return cls._singleton
+
+    @classmethod
+    def _key(cls, labels: Dict[str, str]) -> Tuple:
+        """
+        Builds the key of given labels.
+        :param labels: The labels.
+        :type labels: Dict[str, str]
+        :return: The key.
+        :rtype: Tuple
+        """
+        return tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, labels: Dict[str, str] = None, value: float = 1):
+        """
+        Increments a counter.
+        :param name: The name of the counter.
+        :type name: str
+        :param labels: Its labels.
+        :type labels: Dict[str, str]
+        :param value: The increment.
+        :type value: float
+        """
+        key = self.__class__._key(labels)
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: Dict[str, str] = None):
+        """
+        Sets a gauge.
+        :param name: The name of the gauge.
+        :type name: str
+        :param value: Its value.
+        :type value: float
+        :param labels: Its labels.
+        :type labels: Dict[str, str]
+        """
+        key = self.__class__._key(labels)
+        with self._lock:
+            self._values[name][key] = value
+
+    def observe(self, name: str, value: float, labels: Dict[str, str] = None):
+        """
+        Records a value in a histogram.
+        :param name: The name of the histogram.
+        :type name: str
+        :param value: The value.
+        :type value: float
+        :param labels: Its labels.
+        :type labels: Dict[str, str]
+        """
+        buckets = self.__class__._definitions[name][2]
+        key = self.__class__._key(labels)
+        with self._lock:
+            values = self._values[name].get(key, None)
+            if values is None:
+                values = [0] * (len(buckets) + 2)
+                self._values[name][key] = values
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def value(self, name: str, labels: Dict[str, str] = None) -> float:
+        """
+        Retrieves the value of a counter or gauge.
+        :param name: The name of the metric.
+        :type name: str
+        :param labels: Its labels.
+        :type labels: Dict[str, str]
+        :return: The value, or 0 if it was never set.
+        :rtype: float
+        """
+        with self._lock:
+            return self._values[name].get(self.__class__._key(labels), 0)
+
+    @classmethod
+    def _labels(cls, key: Tuple, extra: Tuple = ()) -> str:
+        """
+        Renders given labels.
+        :param key: The labels.
+        :type key: Tuple
+        :param extra: Additional labels.
+        :type extra: Tuple
+        :return: The rendered labels, i.e. '{outcome="network"}'.
+        :rtype: str
+        """
+        items = list(key) + list(extra)
+        if not items:
+            return ""
+        rendered = ",".join(
+            f'{label}="{cls._escape(str(value))}"' for label, value in items
+        )
+        return "{" + rendered + "}"
+
+    @classmethod
+    def _escape(cls, value: str) -> str:
+        """
+        Escapes given label value.
+        :param value: The value.
+        :type value: str
+        :return: The escaped value.
+        :rtype: str
+        """
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    @classmethod
+    def _number(cls, value: float) -> str:
+        """
+        Renders given number.
+        :param value: The number.
+        :type value: float
+        :return: The rendered number.
+        :rtype: str
+        """
+        if value == float("inf"):
+            return "+Inf"
+        if float(value).is_integer():
+            return str(int(value))
+        return repr(float(value))
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+        :return: The rendered metrics.
+        :rtype: str
+        """
+        lines = []
+        with self._lock:
+            snapshot = {
+                name: {
+                    key: list(value) if isinstance(value, list) else value
+                    for key, value in values.items()
+                }
+                for name, values in self._values.items()
+            }
+        for name, (kind, description, buckets) in self.__class__._definitions.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(snapshot[name].items()):
+                labels = self._labels(key)
+                if kind != self.__class__.HISTOGRAM:
+                    lines.append(f"{name}{labels} {self._number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    bucket = self._labels(key, (("le", self._number(bound)),))
+                    lines.append(f"{name}_bucket{bucket} {cumulative}")
+                bucket = self._labels(key, (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{bucket} {value[-1]}")
+                lines.append(f"{name}_sum{labels} {self._number(value[-2])}")
+                lines.append(f"{name}_count{labels} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> int:
+        """
+        Exposes the metrics on http://host:port/metrics, in a background thread.
+        :param port: The port. 0 picks a free one.
+        :type port: int
+        :param host: The address to listen on. Only local by default.
+        :type host: str
+        :return: The port.
+        :rtype: int
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        if self._server is None:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(
+                target=self._server.serve_forever, name="metrics", daemon=True
+            ).start()
+            Metrics.logger().info(
+                f"Serving metrics on http://{host}:{self._server.server_port}/metrics"
+            )
+        return self._server.server_port
+
+    def write_textfile(self, path: str):
+        """
+        Writes the metrics to given file, atomically, i.e. for node_exporter's textfile collector.
+        :param path: The file, usually ending in .prom.
+        :type path: str
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w") as output:
+                output.write(self.render())
+            os.replace(temporary, path)
+        except OSError as error:
+            Metrics.logger().warning(f"Cannot write metrics to {path}: {error}")
+
+    def write_textfile_every(self, path: str, interval: float = 15.0):
+        """
+        Writes the metrics to given file periodically, in a background thread, and at exit.
+        :param path: The file, usually ending in .prom.
+        :type path: str
+        :param interval: The seconds between writes.
+        :type interval: float
+        """
+        if self._textfile is not None:
+            return
+        self._textfile = path
+
+        def write_periodically():
+            while True:
+                self.write_textfile(path)
+                time.sleep(interval)
+
+        threading.Thread(
+            target=write_periodically, name="metrics-textfile", daemon=True
+        ).start()
+        atexit.register(self.write_textfile, path)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
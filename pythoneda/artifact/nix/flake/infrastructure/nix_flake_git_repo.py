@@ -19,8 +19,30 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+from .flake_artifact_cache import FlakeArtifactCache
+from .github_token_pool import GithubTokenPool
+from .metrics import Metrics
+from .remote_cache import RemoteCache
+from .resolution_profiler import ResolutionProfiler
+from .span import Span
+from .tag_cache_manager import TagCacheManager
+from .tag_index_snapshot import TagIndexSnapshot
+from .tag_lookup_state import TagLookupState
+from .tracer import Tracer
+from collections import OrderedDict
+from concurrent.futures import (
+    as_completed,
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait,
+)
+from contextlib import contextmanager
+from contextvars import ContextVar
 from joblib import Memory
 from datetime import datetime
+import json
+import multiprocessing
+import os
 from pythoneda import BaseObject
 from pythoneda.artifact.nix.flake import CodeExecutionNixFlakeFactory, NixFlakeRepo
 from pythoneda.artifact.nix.flake.jupyterlab import JupyterlabCodeRequestNixFlakeFactory
@@ -36,7 +58,8 @@ from pythoneda.shared.nix.flake import (
     PythonedaSharedPythonedaDomainNixFlake,
 )
 import requests
-from typing import Dict
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 
 class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
@@ -53,24 +76,665 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
         - None
     """
 
-    tag_cache = Memory(".nix_flake_git_repo_cache", verbose=0)
-    _github_token = None
+    tag_cache = Memory(TagCacheManager.DEFAULT_LOCATION, verbose=0)
+    # set by get_latest_github_tag, flagged by _raw_get_latest_github_tag on misses
+    _tag_lookup = ContextVar("nix_flake_git_repo_tag_lookup", default=None)
+    # time.monotonic() by which the gitHub requests must complete, set by deadline()
+    _deadline = ContextVar("nix_flake_git_repo_deadline", default=None)
+    # the tag lookups of every instance share it
+    _state = TagLookupState()
+    _bulk_worker_repo = None
+    # how many latest_* flakes shared_latest_flakes() keeps, least recently used first
+    _max_shared_latest_flakes = 256
 
-    def __init__(self):
+    def __init__(self, artifactCache: FlakeArtifactCache = None):
         """
         Creates a new NixFlakeGitRepo instance.
+        :param artifactCache: The cache of generated flakes. The process-wide one if omitted.
+        :type artifactCache: pythoneda.artifact.nix.flake.infrastructure.FlakeArtifactCache
         """
         super().__init__()
+        self._artifact_cache = artifactCache
         self._flake_mapping = None
+        self._shared_latest_flakes = None
+        self._profiler = None
+
+    @classmethod
+    def lookup_state(cls) -> TagLookupState:
+        """
+        Retrieves the state shared by the tag lookups.
+        :return: Such state.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagLookupState
+        """
+        return cls._state
+
+    @classmethod
+    def use_lookup_state(cls, state: TagLookupState) -> TagLookupState:
+        """
+        Replaces the state shared by the tag lookups, i.e. to isolate tests.
+        :param state: The new state.
+        :type state: pythoneda.artifact.nix.flake.infrastructure.TagLookupState
+        :return: The previous one.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagLookupState
+        """
+        result = cls._state
+        cls._state = state
+        return result
 
     @classmethod
     def github_token(cls, token: str):
         """
         Specifies the gitHub token.
-        :param token: The gitHub token.
+        :param token: The gitHub token, or several ones separated by commas.
         :type token: str
         """
-        cls._github_token = token
+        cls._state.github_tokens = GithubTokenPool.parse(token)
+
+    @classmethod
+    def github_tokens(cls, tokens: List[str]):
+        """
+        Specifies several gitHub tokens, to spread the requests across their quotas.
+        :param tokens: The gitHub tokens.
+        :type tokens: List[str]
+        """
+        cls._state.github_tokens = GithubTokenPool(tokens)
+
+    @classmethod
+    def github_settings(cls) -> Tuple[List[str], str]:
+        """
+        Retrieves the gitHub settings, i.e. to pass them to other processes.
+        :return: The gitHub tokens, and the base URL of the gitHub API.
+        :rtype: Tuple[List[str], str]
+        """
+        return cls._state.github_tokens.tokens, cls._state.github_api_url
+
+    @classmethod
+    def http_session(cls) -> requests.Session:
+        """
+        Retrieves the HTTP session of the gitHub requests, which keeps their connections alive.
+        :return: Such session.
+        :rtype: requests.Session
+        """
+        state = cls._state
+        if state.http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            state.http_session = session
+        return state.http_session
+
+    @classmethod
+    def request_deadlines(cls, resolveTimeout: float = None, httpTimeout: float = 30.0):
+        """
+        Bounds how long resolutions, and each gitHub request, can take.
+        :param resolveTimeout: The default timeout of deadline(), in seconds. None for no deadline.
+        :type resolveTimeout: float
+        :param httpTimeout: The timeout of each gitHub request, in seconds.
+        :type httpTimeout: float
+        """
+        cls._state.request_deadlines(resolveTimeout, httpTimeout)
+
+    @classmethod
+    def hedge_requests(cls, percentile: float = 0.95, minDelay: float = 0.05):
+        """
+        Sends a second gitHub request when the first one is unusually slow, and takes the first response.
+        :param percentile: The latency percentile after which to send it, i.e. 0.95. None disables hedging.
+        :type percentile: float
+        :param minDelay: The minimum delay before sending it, in seconds.
+        :type minDelay: float
+        """
+        cls._state.hedge_requests(percentile, minDelay)
+
+    @classmethod
+    def deadline_settings(cls) -> Dict[str, float]:
+        """
+        Retrieves the deadline and hedging settings, i.e. to pass them to other processes.
+        :return: The "resolveTimeout", "httpTimeout", "hedgePercentile" and "hedgeMinDelay".
+        :rtype: Dict[str, float]
+        """
+        return cls._state.deadline_settings()
+
+    @classmethod
+    @contextmanager
+    def deadline(cls, timeout: float = None) -> Iterator[float]:
+        """
+        Context manager within which gitHub requests must complete before a deadline.
+        Nested deadlines cannot extend the enclosing one.
+        :param timeout: The seconds from now. Defaults to the one of request_deadlines().
+        :type timeout: float
+        :return: The deadline, in time.monotonic() seconds, or None if there's none.
+        :rtype: float
+        """
+        if timeout is None:
+            timeout = cls._state.resolve_timeout
+        current = cls._deadline.get()
+        if timeout is None:
+            yield current
+            return
+        wanted = time.monotonic() + timeout
+        if current is not None and current < wanted:
+            wanted = current
+        token = cls._deadline.set(wanted)
+        try:
+            yield wanted
+        finally:
+            cls._deadline.reset(token)
+
+    @classmethod
+    def _remaining_time(cls, url: str) -> float:
+        """
+        Retrieves how long a gitHub request can take.
+        :param url: The url of the request.
+        :type url: str
+        :return: The seconds, or None if unbounded.
+        :rtype: float
+        """
+        result = cls._state.http_timeout
+        deadline = cls._deadline.get()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Deadline exceeded before GET {url}")
+            result = remaining if result is None else min(result, remaining)
+        return result
+
+    @classmethod
+    def hedge_delay(cls) -> float:
+        """
+        Retrieves how long to wait for a gitHub response before sending a second request.
+        :return: The seconds, or None if hedging is disabled, or the latencies are unknown yet.
+        :rtype: float
+        """
+        return cls._state.hedge_delay()
+
+    @classmethod
+    def _send(cls, url: str, headers: Dict[str, str], timeout: float):
+        """
+        Sends a GET request, and records its metrics.
+        :param url: The url.
+        :type url: str
+        :param headers: The headers.
+        :type headers: Dict[str, str]
+        :param timeout: How long to wait for the server, in seconds.
+        :type timeout: float
+        :return: The response.
+        :rtype: requests.Response
+        """
+        metrics = Metrics.instance()
+        started = time.monotonic()
+        try:
+            response = cls.http_session().get(url, headers=headers, timeout=timeout)
+        except requests.exceptions.Timeout as error:
+            metrics.inc("nix_flake_http_requests_total", {"status": "timeout"})
+            raise TimeoutError(f"GET {url} timed out after {timeout}s") from error
+        except requests.exceptions.ConnectionError as error:
+            # DNS failures, refused or reset connections
+            metrics.inc("nix_flake_http_requests_total", {"status": "unreachable"})
+            raise ConnectionError(f"GET {url} failed: {error}") from error
+        elapsed = time.monotonic() - started
+        cls._state.record_latency(elapsed)
+        metrics.observe("nix_flake_http_request_duration_seconds", elapsed)
+        metrics.inc(
+            "nix_flake_http_requests_total", {"status": str(response.status_code)}
+        )
+        metrics.inc("nix_flake_http_response_bytes_total", value=len(response.content))
+        return response
+
+    @classmethod
+    def _hedged_get(cls, url: str, headers: Dict[str, str], lookup: Dict):
+        """
+        Sends a GET request, and a second one if the first is slower than usual.
+        :param url: The url.
+        :type url: str
+        :param headers: The headers.
+        :type headers: Dict[str, str]
+        :param lookup: The current tag lookup, if any, to count the requests.
+        :type lookup: Dict
+        :return: The first response.
+        :rtype: requests.Response
+        """
+        timeout = cls._remaining_time(url)
+        delay = cls.hedge_delay()
+        if lookup is not None:
+            lookup["requests"] = lookup.get("requests", 0) + 1
+        # a None timeout waits for as long as it takes
+        hedging = delay is not None and (timeout is None or delay < timeout)
+        if cls._deadline.get() is None and not hedging:
+            return cls._send(url, headers, timeout)
+        executor = cls._state.http_executor()
+        started = time.monotonic()
+        primary = executor.submit(cls._send, url, headers, timeout)
+        pending = {primary}
+        hedged = False
+        if hedging:
+            done, pending = wait(pending, timeout=delay)
+            if not done:
+                hedged = True
+                if lookup is not None:
+                    lookup["requests"] += 1
+                pending.add(
+                    executor.submit(
+                        cls._send, url, headers, cls._remaining_time(url)
+                    )
+                )
+            else:
+                pending = done
+        error = None
+        # the slower request keeps running in the background, and gets ignored
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=None
+                if timeout is None
+                else max(0.0, started + timeout - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                raise TimeoutError(f"GET {url} timed out after {timeout:.3f}s")
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as failure:
+                    error = failure
+                    continue
+                if hedged:
+                    Metrics.instance().inc(
+                        "nix_flake_http_hedged_requests_total",
+                        {"winner": "primary" if future is primary else "hedge"},
+                    )
+                return response
+        raise error
+
+    @classmethod
+    def _github_get(cls, url: str) -> requests.Response:
+        """
+        Sends a GET request to the gitHub API, with the token having the most quota left.
+        If the quota of the token gets exhausted, retries with the next one.
+        Without tokens available, the request is sent anonymously.
+        The request is bounded by the current deadline, and hedged if slow.
+        :param url: The url.
+        :type url: str
+        :return: The response.
+        :rtype: requests.Response
+        """
+        pool = cls._state.github_tokens
+        tried = []
+        token = pool.acquire()
+        lookup = cls._tag_lookup.get()
+        while True:
+            headers = {} if token is None else {"Authorization": f"token {token}"}
+            response = cls._hedged_get(url, headers, lookup)
+            if token is None:
+                return response
+            pool.update(token, response.status_code, response.headers)
+            if response.status_code not in (403, 429):
+                return response
+            tried.append(token)
+            token = pool.acquire(tried)
+            if token is None:
+                return response
+
+    @classmethod
+    def forget_latest_tags(cls, repoOwner: str = None, repoName: str = None):
+        """
+        Forgets the tags remembered in memory, so the next lookups go to the disk cache.
+        :param repoOwner: The owner of the repository. All of them if omitted.
+        :type repoOwner: str
+        :param repoName: The name of the repository. All of them if omitted.
+        :type repoName: str
+        """
+        cls._state.forget_latest_tags(repoOwner, repoName)
+
+    @classmethod
+    def latest_tags_ttl(cls, ttl: float):
+        """
+        Specifies how long tags are remembered in memory.
+        Long TTLs are safe when tag_changed() gets called on new tags, i.e. from a webhook.
+        :param ttl: The seconds.
+        :type ttl: float
+        """
+        cls._state.latest_tags_ttl = ttl
+
+    @classmethod
+    def latest_tags_settings(cls) -> float:
+        """
+        Retrieves how long tags are remembered in memory, i.e. to configure other processes.
+        :return: The seconds.
+        :rtype: float
+        """
+        return cls._state.latest_tags_ttl
+
+    @classmethod
+    def on_tag_changed(cls, listener: Callable[[str, str, str, bool], None]):
+        """
+        Registers a listener of tag changes, i.e. to invalidate resolutions depending on them.
+        :param listener: Receives the owner and name of the repository, the tag, and whether it got deleted.
+        :type listener: Callable[[str, str, str, bool], None]
+        """
+        cls._state.tag_listeners.append(listener)
+
+    @classmethod
+    def on_tag_lookup(cls, listener: Callable[[str, str, str], None]):
+        """
+        Registers a listener of tag lookups, i.e. to find out which tags are hot.
+        It gets called on every lookup, so it must be cheap.
+        :param listener: Receives the owner and name of the repository, and the prefix.
+        :type listener: Callable[[str, str, str], None]
+        """
+        cls._state.tag_lookup_listeners.append(listener)
+
+    @classmethod
+    def lookups_in_flight(cls) -> int:
+        """
+        Retrieves how many tag lookups are reading the disk cache or gitHub right now.
+        :return: Such number.
+        :rtype: int
+        """
+        return cls._state.lookups_in_flight
+
+    @classmethod
+    def latest_tag_expiration(
+        cls, repoOwner: str, repoName: str, prefix: str = None
+    ) -> float:
+        """
+        Retrieves when the tag remembered in memory for a lookup expires.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param prefix: The prefix of the lookup.
+        :type prefix: str
+        :return: The expiration, in time.monotonic() seconds, or None if not remembered.
+        :rtype: float
+        """
+        remembered = cls._state.remembered((repoOwner, repoName, prefix))
+        return None if remembered is None else remembered[0]
+
+    @classmethod
+    def refresh_latest_github_tag(
+        cls, repoOwner: str, repoName: str, prefix: str = None, lookup: Dict = None
+    ) -> str:
+        """
+        Looks up the latest tag on gitHub, bypassing the local caches, and updates them.
+        The remote cache, if any, still gets used, so hosts sharing it refresh each
+        repository once per remote cache TTL. If it cannot be retrieved, the cached tag is kept.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param prefix: The prefix of the tags we're interested in. Optional.
+        :type prefix: str
+        :param lookup: Gets the "outcome" and the HTTP "requests" it took. Optional.
+        :type lookup: Dict
+        :return: The latest tag, or None if it could not be retrieved.
+        :rtype: str
+        """
+        if lookup is None:
+            lookup = {}
+        lookup["hit"] = False
+        token = cls._tag_lookup.set(lookup)
+        try:
+            result = cls._raw_get_latest_github_tag(repoOwner, repoName, prefix)
+        finally:
+            cls._tag_lookup.reset(token)
+        Metrics.instance().inc(
+            "nix_flake_tag_refreshes_total", {"outcome": lookup["outcome"]}
+        )
+        if result is not None:
+            cls._state.remember((repoOwner, repoName, prefix), result)
+            # tag_cache is fresher than the snapshot from now on
+            cls._state.mark_snapshot_stale(f"{repoOwner}/{repoName}")
+            TagCacheManager.instance().refresh(
+                f"{repoOwner}/{repoName}", prefix, result
+            )
+        return result
+
+    @classmethod
+    def tag_changed(
+        cls, repoOwner: str, repoName: str, tag: str, deleted: bool = False
+    ) -> int:
+        """
+        Updates the remembered tags of a repository which got a new tag, or lost one.
+        A new tag becomes the latest one for every prefix it matches.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param tag: The tag.
+        :type tag: str
+        :param deleted: Whether the tag got deleted or moved, so it's forgotten instead.
+        :type deleted: bool
+        :return: The number of entries updated, in memory and on disk.
+        :rtype: int
+        """
+        # other hosts fetch the tags again, instead of sharing outdated ones
+        cls._remote_call("delete", f"nix-flake:tags:{repoOwner}/{repoName}")
+        result = cls._state.tag_changed(repoOwner, repoName, tag, deleted)
+        result += len(
+            TagCacheManager.instance().update(f"{repoOwner}/{repoName}", tag, deleted)
+        )
+        for listener in list(cls._state.tag_listeners):
+            try:
+                listener(repoOwner, repoName, tag, deleted)
+            except Exception as error:
+                NixFlakeGitRepo.logger().warning(
+                    f"Tag listener failed on {repoOwner}/{repoName}@{tag}: {error}"
+                )
+        return result
+
+    @classmethod
+    def tag_index(cls) -> Dict[str, List[Tuple[str, str, datetime]]]:
+        """
+        Retrieves the tags fetched from gitHub by this process.
+        :return: For each repository, i.e. "rydnr/nix-flakes", its tags, as returned by fetch_github_tags().
+        :rtype: Dict[str, List[Tuple[str, str, datetime.datetime]]]
+        """
+        return cls._state.tag_index()
+
+    @classmethod
+    def tag_snapshot(cls, path: str) -> TagIndexSnapshot:
+        """
+        Answers tag lookups from a snapshot of the tag index, written by "tag-cache snapshot".
+        The file is memory-mapped, so loading it is immediate whatever its size, and
+        processes mapping the same file share its pages.
+        :param path: The snapshot. None stops using it.
+        :type path: str
+        :return: The snapshot, or None if it cannot be read.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagIndexSnapshot
+        """
+        result = None
+        if path is not None:
+            try:
+                result = TagIndexSnapshot(path)
+            except (OSError, ValueError) as error:
+                # the next layers answer instead
+                NixFlakeGitRepo.logger().warning(
+                    f"Ignoring the tag index snapshot: {error}"
+                )
+        cls._state.use_tag_snapshot(result)
+        return result
+
+    @classmethod
+    def tag_snapshot_path(cls) -> str:
+        """
+        Retrieves the snapshot of the tag index in use.
+        :return: Its path, or None.
+        :rtype: str
+        """
+        snapshot = cls._state.tag_snapshot
+        return None if snapshot is None else snapshot.path
+
+    @classmethod
+    def remote_cache(cls, cache: RemoteCache, ttl: float = None):
+        """
+        Shares the tags fetched from gitHub with other hosts, through given cache.
+        Within a refresh interval (the TTL), only one host fetches the tags of each repository.
+        :param cache: The cache, i.e. RemoteCache.from_url("redis://cache:6379/0"). None stops sharing.
+        :type cache: pythoneda.artifact.nix.flake.infrastructure.RemoteCache
+        :param ttl: How long the tags are shared, in seconds. Optional.
+        :type ttl: float
+        """
+        cls._state.use_remote_cache(cache, ttl)
+
+    @classmethod
+    def remote_cache_settings(cls) -> Tuple[str, float]:
+        """
+        Retrieves the remote cache settings, i.e. for worker processes.
+        :return: The URL of the remote cache, with credentials (None if there's none), and the TTL.
+        :rtype: Tuple[str, float]
+        """
+        state = cls._state
+        cache = state.remote_cache
+        return (None if cache is None else cache.connection_url, state.remote_cache_ttl)
+
+    @classmethod
+    def process_settings(cls) -> Dict:
+        """
+        Retrieves the settings other processes need to look up tags as this one does.
+        :return: The gitHub, tag snapshot, remote cache, deadline and in-memory tag settings.
+        :rtype: Dict
+        """
+        tokens, api_url = cls.github_settings()
+        return {
+            "githubTokens": tokens,
+            "githubApiUrl": api_url,
+            "tagSnapshot": cls.tag_snapshot_path(),
+            "remoteCache": cls.remote_cache_settings(),
+            "deadlines": cls.deadline_settings(),
+            "latestTagsTtl": cls.latest_tags_settings(),
+        }
+
+    @classmethod
+    def apply_process_settings(cls, settings: Dict):
+        """
+        Looks up tags as the process the settings come from, i.e. within a worker process.
+        :param settings: The settings, from process_settings().
+        :type settings: Dict
+        """
+        cls.github_tokens(settings["githubTokens"])
+        cls.github_api_url(settings["githubApiUrl"])
+        if settings["tagSnapshot"] is not None:
+            cls.tag_snapshot(settings["tagSnapshot"])
+        url, ttl = settings["remoteCache"]
+        if url is not None:
+            cls.remote_cache(RemoteCache.from_url(url), ttl)
+        deadlines = settings["deadlines"]
+        cls.request_deadlines(deadlines["resolveTimeout"], deadlines["httpTimeout"])
+        cls.hedge_requests(deadlines["hedgePercentile"], deadlines["hedgeMinDelay"])
+        cls.latest_tags_ttl(settings["latestTagsTtl"])
+        # connections inherited from the parent process must not be reused
+        cls._state.http_session = None
+
+    @classmethod
+    def _remote_call(cls, operation: str, *args):
+        """
+        Calls the remote cache, treating failures as misses.
+        :param operation: The RemoteCache method.
+        :type operation: str
+        :param args: Its arguments.
+        :type args: List
+        :return: Its result, or None if it failed.
+        :rtype: object
+        """
+        cache = cls._state.remote_cache
+        if cache is None:
+            return None
+        try:
+            result = getattr(cache, operation)(*args)
+        except Exception as error:
+            Metrics.instance().inc(
+                "nix_flake_remote_cache_requests_total",
+                {"operation": operation, "outcome": "error"},
+            )
+            NixFlakeGitRepo.logger().debug(f"Remote cache {operation} failed: {error}")
+            return None
+        if operation == "get":
+            outcome = "miss" if result is None else "hit"
+        else:
+            outcome = "ok"
+        Metrics.instance().inc(
+            "nix_flake_remote_cache_requests_total",
+            {"operation": operation, "outcome": outcome},
+        )
+        return result
+
+    @classmethod
+    def github_tags(
+        cls, repoOwner: str, repoName: str
+    ) -> List[Tuple[str, str, datetime]]:
+        """
+        Retrieves the tags of a given repository from the remote cache, or from gitHub.
+        Tags fetched from gitHub get stored in the remote cache. While another host
+        fetches them, this one waits for its outcome, for a few seconds at most.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :return: The tags, as returned by fetch_github_tags().
+        :rtype: List[Tuple[str, str, datetime.datetime]]
+        """
+        state = cls._state
+        if state.remote_cache is None:
+            return cls.fetch_github_tags(repoOwner, repoName)
+        key = f"nix-flake:tags:{repoOwner}/{repoName}"
+        locked = None
+        deadline = time.monotonic() + state.remote_cache_wait
+        if cls._deadline.get() is not None:
+            deadline = min(deadline, cls._deadline.get())
+        while True:
+            shared = cls._remote_call("get", key)
+            if shared is not None:
+                try:
+                    result = [
+                        (
+                            name,
+                            sha,
+                            None if date is None else datetime.fromisoformat(date),
+                        )
+                        for name, sha, date in json.loads(shared)
+                    ]
+                except (TypeError, ValueError):
+                    break
+                lookup = cls._tag_lookup.get()
+                if lookup is not None:
+                    lookup["outcome"] = "remote_hit"
+                state.index_tags(f"{repoOwner}/{repoName}", result)
+                return result
+            # one host per repository fetches the tags; a failed call means no lock
+            locked = cls._remote_call(
+                "add", f"{key}:lock", str(os.getpid()), state.remote_cache_wait
+            )
+            if locked is not False or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        try:
+            result = cls.fetch_github_tags(repoOwner, repoName)
+            if result is not None:
+                cls._remote_call(
+                    "set",
+                    key,
+                    json.dumps(
+                        [
+                            [name, sha, None if date is None else date.isoformat()]
+                            for name, sha, date in result
+                        ]
+                    ),
+                    state.remote_cache_ttl,
+                )
+        finally:
+            if locked is True:
+                cls._remote_call("delete", f"{key}:lock")
+        return result
+
+    @classmethod
+    def github_api_url(cls, url: str):
+        """
+        Specifies the base URL of the gitHub API, i.e. to point to a local stand-in.
+        :param url: The base URL, without trailing slash.
+        :type url: str
+        """
+        cls._state.github_api_url = url
 
     @classmethod
     @tag_cache.cache
@@ -105,27 +769,63 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
         :return: The latest tag, or None if the tags could not be retrieved.
         :rtype: str
         """
-        print("in _raw!")
+        lookup = cls._tag_lookup.get()
+        if lookup is not None:
+            lookup["hit"] = False
         result = None
-        url = f"https://api.github.com/repos/{repoOwner}/{repoName}/tags"
-        if cls._github_token is None:
-            headers = {}
+        tags = cls.github_tags(repoOwner, repoName)
+        if tags is None:
+            return None
+        sorted_tags = [name for name, sha, date in tags]
+
+        if prefix is None:
+            aux = sorted_tags
         else:
-            headers = {"Authorization": f"token {cls._github_token}"}
-        response = requests.get(url, headers=headers)
-        if response.status_code == 403:
+            aux = [tag for tag in sorted_tags if tag.startswith(prefix)]
+
+        if len(aux) > 0:
+            result = aux[0]
+
+            if prefix is not None:
+                result = result[len(prefix) :]
+
+        return result
+
+    @classmethod
+    def fetch_github_tags(
+        cls, repoOwner: str, repoName: str
+    ) -> List[Tuple[str, str, datetime]]:
+        """
+        Retrieves the tags of a given repository, latest first, and adds them to the tag index.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :return: The name, commit SHA and commit date of each tag (the date is None if there's only one), or None if they could not be retrieved.
+        :rtype: List[Tuple[str, str, datetime.datetime]]
+        """
+        lookup = cls._tag_lookup.get()
+        if lookup is None:
+            lookup = {}
+        lookup["outcome"] = "error"
+        url = f"{cls._state.github_api_url}/repos/{repoOwner}/{repoName}/tags"
+        response = cls._github_get(url)
+        if response.status_code in (403, 429):
+            lookup["outcome"] = "rate_limited"
             # Examine the headers for rate-limiting information
             NixFlakeGitRepo.logger().debug(
-                "Rate limit remaining: ", response.headers.get("X-RateLimit-Remaining")
+                f"Rate limit remaining: {response.headers.get('X-RateLimit-Remaining')}"
             )
             NixFlakeGitRepo.logger().debug(
-                "Rate limit reset time: ", response.headers.get("X-RateLimit-Reset")
+                f"Rate limit reset time: {response.headers.get('X-RateLimit-Reset')}"
             )
 
             # Examine the JSON content for more details
-            NixFlakeGitRepo.logger().debug(
-                "Error message: ", response.json().get("message")
-            )
+            try:
+                message = response.json().get("message")
+            except ValueError:
+                message = response.text
+            NixFlakeGitRepo.logger().debug(f"Error message: {message}")
             return None
         elif response.status_code != 200:
             NixFlakeGitRepo.logger().error(
@@ -134,47 +834,93 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
             return None
 
         tags = response.json()
-        print(tags)
         if not tags:
             NixFlakeGitRepo.logger().error(
                 f"No tags found for repository {repoOwner}/{repoName}."
             )
             return None
+        lookup["outcome"] = "network"
 
         # Store tags with their commit date
         tag_dates = {}
 
         if len(tags) == 1:
-            sorted_tags = [tag["name"] for tag in tags]
+            result = [(tags[0]["name"], tags[0]["commit"].get("sha", None), None)]
         else:
             for tag in tags:
                 commit_url = tag["commit"]["url"]
-                commit_response = requests.get(commit_url, headers=headers)
+                commit_response = cls._github_get(commit_url)
 
                 if commit_response.status_code != 200:
                     continue
 
                 commit_data = commit_response.json()
                 commit_date = commit_data["commit"]["committer"]["date"]
-                tag_dates[tag["name"]] = datetime.fromisoformat(
-                    commit_date[:-1]
-                )  # Remove the 'Z'
+                tag_dates[tag["name"]] = (
+                    tag["commit"].get("sha", None),
+                    datetime.fromisoformat(commit_date[:-1]),  # Remove the 'Z'
+                )
 
             # Sort tags by date
-            sorted_tags = sorted(tag_dates, key=lambda k: tag_dates[k], reverse=True)
-
-        if prefix is None:
-            aux = sorted_tags
-        else:
-            aux = [tag for tag in sorted_tags if tag.startswith(prefix)]
-
-        if len(aux) > 0:
-            result = aux[0]
+            result = [
+                (name, sha, date)
+                for name, (sha, date) in sorted(
+                    tag_dates.items(), key=lambda item: item[1][1], reverse=True
+                )
+            ]
+
+        cls._state.index_tags(f"{repoOwner}/{repoName}", result)
+        return result
 
-            if prefix is not None:
-                result = result[len(prefix) :]
+    @classmethod
+    def _stale_latest_tag(
+        cls, remembered: Tuple[float, str], repoOwner: str, repoName: str, prefix: str
+    ) -> str:
+        """
+        Retrieves the last known tag of a lookup, even if outdated.
+        :param remembered: The expired in-memory entry of the lookup, if any.
+        :type remembered: Tuple[float, str]
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param prefix: The prefix of the lookup.
+        :type prefix: str
+        :return: The tag, or None if it was never known.
+        :rtype: str
+        """
+        if remembered is not None:
+            return remembered[1]
+        return cls._snapshot_latest(repoOwner, repoName, prefix)[1]
 
-        return result
+    @classmethod
+    def _snapshot_latest(
+        cls, repoOwner: str, repoName: str, prefix: str
+    ) -> Tuple[bool, str]:
+        """
+        Looks up the latest tag in the snapshot of the tag index, if any.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param prefix: The prefix of the lookup.
+        :type prefix: str
+        :return: Whether the snapshot has the repository, and its latest tag.
+        :rtype: Tuple[bool, str]
+        """
+        snapshot = cls._state.tag_snapshot
+        if snapshot is None:
+            return False, None
+        try:
+            if f"{repoOwner}/{repoName}" not in snapshot:
+                return False, None
+            return True, snapshot.latest(repoOwner, repoName, prefix)
+        except ValueError as error:
+            # a damaged snapshot is a miss
+            NixFlakeGitRepo.logger().warning(
+                f"Cannot look up {repoOwner}/{repoName} in the snapshot: {error}"
+            )
+            return False, None
 
     def get_latest_github_tag(
         self, repoOwner: str, repoName: str, prefix: str = None
@@ -190,9 +936,90 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
         :return: The latest tag, or None if the tags could not be retrieved.
         :rtype: str
         """
-        return self.__class__._cacheable_get_latest_github_tag(
-            repoOwner, repoName, prefix
-        )
+        with Tracer.instance().span(
+            "github.latest_tag",
+            {
+                "github.repository": f"{repoOwner}/{repoName}",
+                "github.prefix": prefix or "",
+            },
+            kind=Span.CLIENT,
+        ) as span:
+            cls = self.__class__
+            state = cls._state
+            key = (repoOwner, repoName, prefix)
+            for listener in state.tag_lookup_listeners:
+                listener(repoOwner, repoName, prefix)
+            remembered = state.remembered(key)
+            if remembered is not None and remembered[0] > time.monotonic():
+                span.set_attribute("cache.hit", True)
+                Metrics.instance().inc(
+                    "nix_flake_github_tag_lookups_total", {"outcome": "memory_hit"}
+                )
+                if self._profiler is not None:
+                    self._profiler.lookup("memory_hit", 0)
+                return remembered[1]
+            found = False
+            if not state.snapshot_stale(f"{repoOwner}/{repoName}"):
+                found, result = cls._snapshot_latest(repoOwner, repoName, prefix)
+            if found:
+                span.set_attribute("cache.hit", True)
+                Metrics.instance().inc(
+                    "nix_flake_github_tag_lookups_total", {"outcome": "snapshot_hit"}
+                )
+                if self._profiler is not None:
+                    self._profiler.lookup("snapshot_hit", 0)
+                if result is not None:
+                    state.remember(key, result)
+                return result
+            lookup = {"hit": True}
+            token = cls._tag_lookup.set(lookup)
+            state.lookup_started()
+            stale = None
+            try:
+                result = cls._cacheable_get_latest_github_tag(
+                    repoOwner, repoName, prefix
+                )
+            except (TimeoutError, ConnectionError) as error:
+                failure = error
+                stale = cls._stale_latest_tag(remembered, repoOwner, repoName, prefix)
+                if stale is None:
+                    Metrics.instance().inc(
+                        "nix_flake_github_tag_lookups_total", {"outcome": "error"}
+                    )
+                    raise
+            except Exception:
+                Metrics.instance().inc(
+                    "nix_flake_github_tag_lookups_total", {"outcome": "error"}
+                )
+                raise
+            finally:
+                cls._tag_lookup.reset(token)
+                state.lookup_finished()
+            if stale is not None:
+                NixFlakeGitRepo.logger().warning(
+                    f"Cannot look up {repoOwner}/{repoName} ({prefix or ''}) on "
+                    f"gitHub ({failure}), using the last known tag {stale}"
+                )
+                span.set_attribute("cache.stale", True)
+                Metrics.instance().inc(
+                    "nix_flake_github_tag_lookups_total", {"outcome": "stale"}
+                )
+                if self._profiler is not None:
+                    self._profiler.lookup("stale", lookup.get("requests", 0))
+                return stale
+            span.set_attribute("cache.hit", lookup["hit"])
+            TagCacheManager.instance().record(
+                f"{repoOwner}/{repoName}", lookup["hit"]
+            )
+            outcome = "disk_hit" if lookup["hit"] else lookup["outcome"]
+            Metrics.instance().inc(
+                "nix_flake_github_tag_lookups_total", {"outcome": outcome}
+            )
+            if self._profiler is not None:
+                self._profiler.lookup(outcome, lookup.get("requests", 0))
+            if result is not None:
+                state.remember(key, result)
+            return result
 
     def latest_version_by_coordinates(self, coordinates: str) -> str:
         """
@@ -303,9 +1130,46 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
         :return: Such flake, or None if not found.
         :rtype: pythoneda.shared.code_requests.CodeExecutionNixFlake
         """
-        return CodeExecutionNixFlakeFactory.instance().create(
-            codeRequest, self.default_latest_flakes()
-        )
+        with Tracer.instance().span(
+            "nix_flake.factory.create", {"factory": "CodeExecutionNixFlakeFactory"}
+        ):
+            return CodeExecutionNixFlakeFactory.instance().create(
+                codeRequest, self.default_latest_flakes()
+            )
+
+    @property
+    def artifact_cache(self) -> FlakeArtifactCache:
+        """
+        Retrieves the cache generate_flake() reuses generated flakes from.
+        :return: Such cache.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.FlakeArtifactCache
+        """
+        if self._artifact_cache is None:
+            return FlakeArtifactCache.instance()
+        return self._artifact_cache
+
+    def generate_flake(
+        self, flake: NixFlake, flakeFolder: str, codeRequest: CodeRequest = None
+    ) -> bool:
+        """
+        Generates the files of given flake, reusing the ones of an identical earlier flake if possible.
+        :param flake: The flake, i.e. from latest_code_execution().
+        :type flake: pythoneda.shared.nix.flake.NixFlake
+        :param flakeFolder: The folder to generate the files into.
+        :type flakeFolder: str
+        :param codeRequest: The code request the flake packages, if any.
+        :type codeRequest: pythoneda.shared.code_requests.CodeRequest
+        :return: True if the files were reused.
+        :rtype: bool
+        """
+        cache = self.artifact_cache
+        key = cache.key_for(flake, codeRequest)
+        with Tracer.instance().span(
+            "nix_flake.generate", {"flake": getattr(flake, "name", ""), "key": key}
+        ) as span:
+            result = cache.materialize(key, flakeFolder, flake.generate)
+            span.set_attribute("cache.hit", result)
+        return result
 
     def latest_GitPython_version(self) -> str:
         """
@@ -425,9 +1289,12 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
         :return: Such flake, or None if not found.
         :rtype: pythoneda.shared.code_requests.jupyterlab.JupyterlabCodeRequestNixFlake
         """
-        return JupyterlabCodeRequestNixFlakeFactory.instance().create(
-            codeRequest, self.default_latest_flakes()
-        )
+        with Tracer.instance().span(
+            "nix_flake.factory.create", {"factory": "JupyterlabCodeRequestNixFlakeFactory"}
+        ):
+            return JupyterlabCodeRequestNixFlakeFactory.instance().create(
+                codeRequest, self.default_latest_flakes()
+            )
 
     def latest_Jupyterlab_version(self) -> str:
         """
@@ -1551,28 +2418,86 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
             "https://github.com/matiasb/python-unidiff",
         )
 
-    def resolve(self, spec: NixFlakeSpec) -> NixFlake:
+    def resolve(self, spec: NixFlakeSpec, timeout: float = None) -> NixFlake:
         """
         Resolves the Nix flake matching given specification.
+        Past the deadline, tags come from the caches, even if outdated; if they were
+        never known, TimeoutError is raised.
         :param spec: The specification.
         :type spec: pythoneda.shared.nix.flake.NixFlakeSpec
+        :param timeout: The seconds the resolution can take. Defaults to the one of request_deadlines().
+        :type timeout: float
         :return: The matching Nix flake, or None if none could be found.
         :rtype: pythoneda.shared.nix.flake.NixFlake
         """
-        if spec.name == "code-request-for-execution":
-            result = self.latest_code_execution(spec.code_request)
-        elif spec.name == "jupyterlab-code-request":
-            result = self.latest_Jupyterlab_for_code_requests(spec.code_request)
+        if spec.name not in (
+            "code-request-for-execution",
+            "jupyterlab-code-request",
+        ):
+            result = self.resolve_by_name(spec.name, timeout)
         else:
-            result = self.flake_mapping().get(spec.name, None)
-            if result is not None:
-                result = result()
+            with self._resolution(spec.name, timeout) as span:
+                if spec.name == "code-request-for-execution":
+                    result = self.latest_code_execution(spec.code_request)
+                else:
+                    result = self.latest_Jupyterlab_for_code_requests(
+                        spec.code_request
+                    )
+                span.set_attribute("resolved", result is not None)
 
         if result is None:
             NixFlakeGitRepo.logger().error(f"Cannot resolve {spec}")
 
         return result
 
+    def resolve_by_name(self, specName: str, timeout: float = None) -> NixFlake:
+        """
+        Resolves the latest Nix flake for given spec name.
+        :param specName: The spec name, i.e. "pythoneda-shared-pythoneda-domain".
+        :type specName: str
+        :param timeout: The seconds the resolution can take. Defaults to the one of request_deadlines().
+        :type timeout: float
+        :return: The matching Nix flake, or None if the spec name is unknown.
+        :rtype: pythoneda.shared.nix.flake.NixFlake
+        """
+        with self._resolution(specName, timeout) as span:
+            result = self.flake_mapping().get(specName, None)
+            if result is not None:
+                result = result()
+            span.set_attribute("resolved", result is not None)
+        return result
+
+    @contextmanager
+    def _resolution(self, specName: str, timeout: float = None) -> Iterator[Span]:
+        """
+        Context manager which traces and times a resolution, within its deadline.
+        :param specName: The spec name.
+        :type specName: str
+        :param timeout: The seconds the resolution can take. Defaults to the one of request_deadlines().
+        :type timeout: float
+        :return: The span of the resolution.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        started = time.monotonic()
+        try:
+            with self.__class__.deadline(timeout), Tracer.instance().span(
+                "nix_flake.resolve", {"spec": specName}
+            ) as span:
+                yield span
+        finally:
+            # unknown names would make the label unbounded
+            label = specName
+            if label not in self.flake_mapping() and label not in (
+                "code-request-for-execution",
+                "jupyterlab-code-request",
+            ):
+                label = "other"
+            Metrics.instance().observe(
+                "nix_flake_resolve_duration_seconds",
+                time.monotonic() - started,
+                {"spec": label},
+            )
+
     def flake_mapping(self) -> Dict:
         """
         Retrieves the mapping for spec names to Nix flakes.
@@ -1620,6 +2545,264 @@ class NixFlakeGitRepo(NixFlakeRepo, BaseObject):
             self._flake_mapping = result
         return result
 
+    def _flake_suffix(self, specName: str) -> str:
+        """
+        Retrieves the suffix of the latest_*/find_*_version methods for given spec name.
+        :param specName: The spec name, i.e. "pythoneda-shared-pythoneda-domain".
+        :type specName: str
+        :return: The suffix, i.e. "PythonedaSharedPythonedaDomain", or None if the spec name is unknown.
+        :rtype: str
+        """
+        result = None
+        if specName in self.flake_mapping():
+            result = "".join(part.capitalize() for part in specName.split("-"))
+        return result
+
+    def version_finder(self, specName: str) -> Callable[[str], NixFlake]:
+        """
+        Retrieves the find_*_version method for given spec name.
+        :param specName: The spec name, i.e. "pythoneda-shared-pythoneda-domain".
+        :type specName: str
+        :return: The method building the flake for a given version, or None if the spec name is unknown.
+        :rtype: Callable[[str], pythoneda.shared.nix.flake.NixFlake]
+        """
+        result = None
+        suffix = self._flake_suffix(specName)
+        if suffix is not None:
+            result = getattr(self, f"find_{suffix}_version", None)
+        return result
+
+    def _share_latest_flakes(self):
+        """
+        Memoizes every latest_* flake of this instance, so that the inputs shared by
+        several find_*_version calls get resolved only once.
+        """
+        if self._shared_latest_flakes is None:
+            # build the mapping first, so it keeps the original methods
+            self.flake_mapping()
+            self._shared_latest_flakes = OrderedDict()
+            for name in dir(self.__class__):
+                if name.startswith("find_") and name.endswith("_version"):
+                    latest = f"latest_{name[len('find_'):-len('_version')]}"
+                    if getattr(self, latest, None) is not None:
+                        self.__dict__[latest] = self._memoized_latest(latest)
+
+    def _unshare_latest_flakes(self):
+        """
+        Reverts the effect of _share_latest_flakes.
+        """
+        if self._shared_latest_flakes is not None:
+            for name in [
+                key
+                for key in self.__dict__.keys()
+                if key.startswith("latest_") and not key.endswith("_version")
+            ]:
+                del self.__dict__[name]
+            self._shared_latest_flakes = None
+
+    def _memoized_latest(self, name: str) -> Callable[[], NixFlake]:
+        """
+        Wraps given latest_* method so that it gets evaluated only once.
+        :param name: The name of the method.
+        :type name: str
+        :return: The memoized method.
+        :rtype: Callable[[], pythoneda.shared.nix.flake.NixFlake]
+        """
+        original = getattr(self, name)
+
+        def memoized():
+            shared = self._shared_latest_flakes
+            if name in shared:
+                shared.move_to_end(name)
+                return shared[name]
+            result = original()
+            self._share(name, result)
+            return result
+
+        return memoized
+
+    def _share(self, name: str, flake: NixFlake):
+        """
+        Shares given latest_* flake, forgetting the least recently used ones past
+        the limit.
+        :param name: The name of the latest_* method.
+        :type name: str
+        :param flake: The flake.
+        :type flake: pythoneda.shared.nix.flake.NixFlake
+        """
+        shared = self._shared_latest_flakes
+        shared[name] = flake
+        shared.move_to_end(name)
+        while len(shared) > self.__class__._max_shared_latest_flakes:
+            shared.popitem(last=False)
+
+    def latest_flakes_snapshot(self) -> Dict[str, NixFlake]:
+        """
+        Resolves the latest flakes every code request depends on, and takes a snapshot
+        of all latest_* flakes resolved so far, i.e. to warm up other processes.
+        :return: The flakes, by latest_* method name.
+        :rtype: Dict[str, pythoneda.shared.nix.flake.NixFlake]
+        """
+        with self.shared_latest_flakes():
+            self.default_latest_flakes()
+            return dict(self._shared_latest_flakes)
+
+    def restore_latest_flakes(self, snapshot: Dict[str, NixFlake]):
+        """
+        Shares the latest_* flakes of given snapshot from now on, instead of resolving them.
+        :param snapshot: The snapshot, from latest_flakes_snapshot().
+        :type snapshot: Dict[str, pythoneda.shared.nix.flake.NixFlake]
+        """
+        self._share_latest_flakes()
+        for name, flake in snapshot.items():
+            # the memoized methods only ever look up their own names
+            if name in self.__dict__:
+                self._share(name, flake)
+
+    @contextmanager
+    def shared_latest_flakes(self):
+        """
+        Context manager in which latest_* flakes are resolved at most once.
+        """
+        already_shared = self._shared_latest_flakes is not None
+        self._share_latest_flakes()
+        try:
+            yield self
+        finally:
+            if not already_shared:
+                self._unshare_latest_flakes()
+
+    @contextmanager
+    def profiling(self, profiler: ResolutionProfiler = None):
+        """
+        Context manager in which the resolutions of this instance get profiled.
+        :param profiler: The profiler. A new one if omitted.
+        :type profiler: pythoneda.artifact.nix.flake.infrastructure.ResolutionProfiler
+        :return: The profiler.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.ResolutionProfiler
+        """
+        if self._profiler is not None:
+            yield self._profiler
+            return
+        self._profiler = profiler or ResolutionProfiler()
+        self._profiler.attach(self)
+        try:
+            yield self._profiler
+        finally:
+            self._profiler.detach(self)
+            self._profiler = None
+
+    def find_versions(
+        self, specName: str, versions: Iterable[str], processes: int = None
+    ) -> Dict[str, NixFlake]:
+        """
+        Builds the Nix flakes of given spec name, for many versions at once.
+        :param specName: The spec name, i.e. "pythoneda-shared-pythoneda-domain".
+        :type specName: str
+        :param versions: The versions, i.e. a list, or any iterable covering a range of versions.
+        :type versions: Iterable[str]
+        :param processes: The number of worker processes. Optional.
+        :type processes: int
+        :return: The flakes, indexed by version.
+        :rtype: Dict[str, pythoneda.shared.nix.flake.NixFlake]
+        """
+        return {
+            version: flake
+            for version, flake in self.stream_versions(specName, versions, processes)
+        }
+
+    def stream_versions(
+        self, specName: str, versions: Iterable[str], processes: int = None
+    ) -> Iterator[Tuple[str, NixFlake]]:
+        """
+        Builds the Nix flakes of given spec name, for many versions at once,
+        yielding each one as soon as it's built.
+        Inputs shared among versions (the latest_* flakes) are resolved only once.
+        If processes is greater than 1, flakes are built in a process pool, and get
+        yielded in order of completion.
+        :param specName: The spec name, i.e. "pythoneda-shared-pythoneda-domain".
+        :type specName: str
+        :param versions: The versions, i.e. a list, or any iterable covering a range of versions.
+        :type versions: Iterable[str]
+        :param processes: The number of worker processes. Optional.
+        :type processes: int
+        :return: An iterator of (version, flake) tuples.
+        :rtype: Iterator[Tuple[str, pythoneda.shared.nix.flake.NixFlake]]
+        """
+        finder = self.version_finder(specName)
+        if finder is None:
+            NixFlakeGitRepo.logger().error(f"Cannot find versions of {specName}")
+            return
+
+        pending = list(dict.fromkeys(versions))
+        if len(pending) == 0:
+            return
+
+        with self.shared_latest_flakes():
+            # the first version warms up the shared inputs (and the disk cache)
+            yield pending[0], finder(pending[0])
+
+            if processes is None or processes < 2 or len(pending) < 3:
+                for version in pending[1:]:
+                    yield version, finder(version)
+            else:
+                # workers don't inherit the sockets and threads of this process
+                with ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.__class__._init_bulk_worker,
+                    initargs=(
+                        self.__class__.process_settings(),
+                        dict(self._shared_latest_flakes),
+                        os.getcwd(),
+                    ),
+                ) as executor:
+                    futures = {
+                        executor.submit(
+                            self.__class__._find_version_in_bulk_worker,
+                            specName,
+                            version,
+                        ): version
+                        for version in pending[1:]
+                    }
+                    for future in as_completed(futures):
+                        yield futures[future], future.result()
+
+    @classmethod
+    def _init_bulk_worker(
+        cls,
+        settings: Dict,
+        snapshot: Dict[str, NixFlake],
+        workingDirectory: str,
+    ):
+        """
+        Initializes a worker process of stream_versions.
+        :param settings: The settings of the parent process, from process_settings().
+        :type settings: Dict
+        :param snapshot: The latest flakes the parent process resolved so far.
+        :type snapshot: Dict[str, pythoneda.shared.nix.flake.NixFlake]
+        :param workingDirectory: The working directory of the parent process.
+        :type workingDirectory: str
+        """
+        # the tag disk cache lives in the working directory
+        os.chdir(workingDirectory)
+        cls.apply_process_settings(settings)
+        cls._bulk_worker_repo = cls()
+        cls._bulk_worker_repo.restore_latest_flakes(snapshot)
+
+    @classmethod
+    def _find_version_in_bulk_worker(cls, specName: str, version: str) -> NixFlake:
+        """
+        Builds a flake within a worker process of stream_versions.
+        :param specName: The spec name.
+        :type specName: str
+        :param version: The version.
+        :type version: str
+        :return: The flake.
+        :rtype: pythoneda.shared.nix.flake.NixFlake
+        """
+        return cls._bulk_worker_repo.version_finder(specName)(version)
+
 
 # vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
 # Local Variables:
@@ -0,0 +1,309 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/packaging_executor.py
+
+This file defines the PackagingExecutor class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .flake_artifact_cache import FlakeArtifactCache
+from .nix_flake_git_repo import NixFlakeGitRepo
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from pythoneda import BaseObject
+from pythoneda.shared.code_requests import CodeRequest
+from pythoneda.shared.nix.flake import NixFlake
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterable, Tuple
+
+
+class PackagingExecutor(BaseObject):
+
+    """
+    Packages code requests in a pool of worker processes.
+
+    Resolving the flake of a code request and rendering its files is
+    CPU-bound, so packaging several requests within the PythonEDA process
+    runs them one after another on one core. The workers start warm: they
+    receive a snapshot of the latest flakes resolved by this process, and
+    share the gitHub tokens and the flake artifact cache.
+
+    Class name: PackagingExecutor
+
+    Responsibilities:
+        - Keep a pool of worker processes, warmed with the latest flakes.
+        - Package code requests in them, concurrently.
+        - Refresh the snapshot of the workers once it gets old.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Resolves and generates the flakes.
+        - pythoneda.artifact.nix.flake.infrastructure.FlakeArtifactCache: Reuses generated flakes.
+    """
+
+    _singleton = None
+    _default_workers = None
+    # the specs of the flakes packaging code requests
+    CODE_EXECUTION = "code-request-for-execution"
+    JUPYTERLAB = "jupyterlab-code-request"
+
+    _worker_repo = None
+
+    def __init__(
+        self,
+        workers: int = None,
+        repo: NixFlakeGitRepo = None,
+        snapshotTtl: float = 600.0,
+    ):
+        """
+        Creates a new PackagingExecutor instance.
+        :param workers: How many worker processes to use. Defaults to the number of CPUs.
+        :type workers: int
+        :param repo: The repository to take the snapshot from. A new NixFlakeGitRepo if omitted.
+        :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        :param snapshotTtl: How long the workers use a snapshot, in seconds.
+        :type snapshotTtl: float
+        """
+        super().__init__()
+        self._workers = (
+            workers or self.__class__._default_workers or os.cpu_count() or 1
+        )
+        self._repo = repo
+        self._snapshot_ttl = snapshotTtl
+        self._pool = None
+        self._pool_started = 0.0
+        self._lock = threading.Lock()
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "reused": 0}
+
+    @classmethod
+    def instance(cls) -> "PackagingExecutor":
+        """
+        Retrieves the process-wide instance.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.PackagingExecutor
+        """
+        if cls._singleton is None:
+            cls._singleton = cls()
+        return cls._singleton
+
+    @classmethod
+    def workers(cls, count: int):
+        """
+        Specifies how many worker processes the process-wide instance uses.
+        :param count: The number of workers. None for the number of CPUs.
+        :type count: int
+        """
+        cls._default_workers = count
+        if cls._singleton is not None:
+            cls._singleton.shutdown()
+            cls._singleton = None
+
+    @property
+    def repo(self) -> NixFlakeGitRepo:
+        """
+        Retrieves the repository the snapshots are taken from.
+        :return: Such repository.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        """
+        if self._repo is None:
+            self._repo = NixFlakeGitRepo()
+        return self._repo
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the counters of this instance.
+        :return: Such counters, and the number of workers.
+        :rtype: Dict
+        """
+        return dict(self._counters, workers=self._workers)
+
+    def _current_pool(self) -> ProcessPoolExecutor:
+        """
+        Retrieves the pool, starting a new one if there's none or its snapshot is too old.
+        :return: The pool.
+        :rtype: concurrent.futures.ProcessPoolExecutor
+        """
+        with self._lock:
+            if (
+                self._pool is not None
+                and time.monotonic() - self._pool_started > self._snapshot_ttl
+            ):
+                # running jobs finish in the old pool
+                self._pool.shutdown(wait=False)
+                self._pool = None
+            if self._pool is None:
+                snapshot = self.repo.latest_flakes_snapshot()
+                cache = self.repo.artifact_cache
+                # workers don't inherit the sockets and threads of this process
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.__class__._init_worker,
+                    initargs=(
+                        NixFlakeGitRepo.process_settings(),
+                        snapshot,
+                        os.path.abspath(cache.location),
+                        cache.max_bytes,
+                        # the tag disk cache lives in the working directory
+                        os.getcwd(),
+                        self.repo.__class__,
+                    ),
+                )
+                self._pool_started = time.monotonic()
+            return self._pool
+
+    async def package(
+        self, specName: str, codeRequest: CodeRequest, flakeFolder: str
+    ) -> Tuple[NixFlake, bool]:
+        """
+        Resolves the flake of given code request, and generates its files, in a worker.
+        :param specName: Either PackagingExecutor.CODE_EXECUTION or PackagingExecutor.JUPYTERLAB.
+        :type specName: str
+        :param codeRequest: The code request.
+        :type codeRequest: pythoneda.shared.code_requests.CodeRequest
+        :param flakeFolder: The folder to generate the flake into.
+        :type flakeFolder: str
+        :return: The flake, and whether its files came from the artifact cache.
+        :rtype: Tuple[pythoneda.shared.nix.flake.NixFlake, bool]
+        """
+        loop = asyncio.get_running_loop()
+        pool = await loop.run_in_executor(None, self._current_pool)
+        self._counters["submitted"] += 1
+        try:
+            result = await asyncio.wrap_future(
+                pool.submit(
+                    self.__class__._package_in_worker,
+                    specName,
+                    codeRequest,
+                    flakeFolder,
+                )
+            )
+        except Exception:
+            self._counters["failed"] += 1
+            raise
+        self._counters["completed"] += 1
+        if result[1]:
+            self._counters["reused"] += 1
+        return result
+
+    async def package_all(
+        self, requests: Iterable[Tuple[str, CodeRequest, str]]
+    ) -> AsyncIterator[Tuple[int, NixFlake, bool]]:
+        """
+        Packages several code requests in parallel, yielding them as they complete.
+        :param requests: The spec name, code request and flake folder of each one.
+        :type requests: Iterable[Tuple[str, pythoneda.shared.code_requests.CodeRequest, str]]
+        :return: The index of each request, its flake, and whether the files were reused.
+        :rtype: AsyncIterator[Tuple[int, pythoneda.shared.nix.flake.NixFlake, bool]]
+        """
+
+        async def indexed(index: int, request: Tuple) -> Tuple[int, NixFlake, bool]:
+            flake, reused = await self.package(*request)
+            return index, flake, reused
+
+        tasks = [
+            asyncio.ensure_future(indexed(index, request))
+            for index, request in enumerate(requests)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def shutdown(self, wait: bool = False):
+        """
+        Stops the workers.
+        :param wait: Whether to wait for the running jobs.
+        :type wait: bool
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+    @classmethod
+    def _init_worker(
+        cls,
+        settings: Dict,
+        snapshot: Dict[str, NixFlake],
+        cacheLocation: str,
+        cacheMaxBytes: int,
+        workingDirectory: str = None,
+        repoClass: type = NixFlakeGitRepo,
+    ):
+        """
+        Initializes a worker process.
+        :param settings: The tag lookup settings, from NixFlakeGitRepo.process_settings().
+        :type settings: Dict
+        :param snapshot: The latest flakes, from NixFlakeGitRepo.latest_flakes_snapshot().
+        :type snapshot: Dict[str, pythoneda.shared.nix.flake.NixFlake]
+        :param cacheLocation: The folder of the flake artifact cache.
+        :type cacheLocation: str
+        :param cacheMaxBytes: The size limit of the flake artifact cache.
+        :type cacheMaxBytes: int
+        :param workingDirectory: The working directory of the parent process.
+        :type workingDirectory: str
+        :param repoClass: The class of the repository of the parent process.
+        :type repoClass: type
+        """
+        if workingDirectory is not None:
+            os.chdir(workingDirectory)
+        NixFlakeGitRepo.apply_process_settings(settings)
+        FlakeArtifactCache.configure(cacheLocation, cacheMaxBytes)
+        cls._worker_repo = repoClass()
+        cls._worker_repo.restore_latest_flakes(snapshot)
+
+    @classmethod
+    def _package_in_worker(
+        cls, specName: str, codeRequest: CodeRequest, flakeFolder: str
+    ) -> Tuple[NixFlake, bool]:
+        """
+        Packages a code request within a worker process.
+        :param specName: Either PackagingExecutor.CODE_EXECUTION or PackagingExecutor.JUPYTERLAB.
+        :type specName: str
+        :param codeRequest: The code request.
+        :type codeRequest: pythoneda.shared.code_requests.CodeRequest
+        :param flakeFolder: The folder to generate the flake into.
+        :type flakeFolder: str
+        :return: The flake, and whether its files came from the artifact cache.
+        :rtype: Tuple[pythoneda.shared.nix.flake.NixFlake, bool]
+        """
+        repo = cls._worker_repo
+        # a stuck gitHub request must not hold the packaging job forever
+        with NixFlakeGitRepo.deadline():
+            if specName == cls.CODE_EXECUTION:
+                flake = repo.latest_code_execution(codeRequest)
+            elif specName == cls.JUPYTERLAB:
+                flake = repo.latest_Jupyterlab_for_code_requests(codeRequest)
+            else:
+                raise ValueError(f"Cannot package code requests as {specName}")
+        if flake is None:
+            raise LookupError(f"Cannot resolve {specName}")
+        return flake, repo.generate_flake(flake, flakeFolder, codeRequest)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
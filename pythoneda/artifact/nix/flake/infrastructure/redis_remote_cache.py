@@ -0,0 +1,291 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/redis_remote_cache.py
+
+This file defines the RedisRemoteCache class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .remote_cache import RemoteCache
+import socket
+import threading
+import time
+from typing import List, Union
+from urllib.parse import quote
+
+
+class RedisRemoteCache(RemoteCache):
+
+    """
+    A RemoteCache on a server speaking the Redis protocol (Redis, Valkey, KeyDB...).
+
+    It uses GET, SET (with PX and NX) and DEL only, over one connection per
+    thread. When the server cannot be reached, calls fail fast for a while,
+    instead of delaying every lookup by the connection timeout.
+
+    Class name: RedisRemoteCache
+
+    Responsibilities:
+        - Speak the Redis protocol (RESP) to the server.
+        - Authenticate, and select the database.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.RemoteCache: Its interface.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        username: str = None,
+        timeout: float = 1.0,
+        retryAfter: float = 30.0,
+    ):
+        """
+        Creates a new RedisRemoteCache instance.
+        :param host: The host of the server.
+        :type host: str
+        :param port: Its port.
+        :type port: int
+        :param db: The database.
+        :type db: int
+        :param password: The password, if any.
+        :type password: str
+        :param username: The ACL user, if any.
+        :type username: str
+        :param timeout: How long to wait for the server, in seconds.
+        :type timeout: float
+        :param retryAfter: How long to fail fast after the server could not be reached, in seconds.
+        :type retryAfter: float
+        """
+        super().__init__(f"redis://{host}:{port}/{db}")
+        self._address = (host, port)
+        self._db = db
+        self._password = password
+        self._username = username
+        self._timeout = timeout
+        self._retry_after = retryAfter
+        self._down_until = 0.0
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    @property
+    def connection_url(self) -> str:
+        """
+        Retrieves the URL to connect to the server, with credentials.
+        :return: Such URL.
+        :rtype: str
+        """
+        if self._password is None:
+            return self.url
+        user = quote(self._username or "", safe="")
+        password = quote(self._password, safe="")
+        host, port = self._address
+        return f"redis://{user}:{password}@{host}:{port}/{self._db}"
+
+    @classmethod
+    def encode(cls, *args: Union[str, bytes, int]) -> bytes:
+        """
+        Encodes a command.
+        :param args: The command and its arguments.
+        :type args: Union[str, bytes, int]
+        :return: The command, as an array of bulk strings.
+        :rtype: bytes
+        """
+        result = [f"*{len(args)}\r\n".encode("ascii")]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            result.append(f"${len(arg)}\r\n".encode("ascii"))
+            result.append(arg)
+            result.append(b"\r\n")
+        return b"".join(result)
+
+    @classmethod
+    def decode(cls, reader) -> Union[bytes, int, List, None]:
+        """
+        Decodes a reply.
+        :param reader: The buffered reader of the connection.
+        :type reader: io.BufferedReader
+        :return: The reply: bytes for (bulk) strings, int, a list, or None.
+        :rtype: Union[bytes, int, List, None]
+        """
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the remote cache")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body
+        if kind == b"-":
+            raise ConnectionError(f"Remote cache error: {body.decode('utf-8')}")
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the remote cache")
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [cls.decode(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the remote cache: {line!r}")
+
+    def _connect(self):
+        """
+        Opens a connection for the current thread.
+        :return: The socket and its reader.
+        :rtype: Tuple[socket.socket, io.BufferedReader]
+        """
+        connection = socket.create_connection(self._address, timeout=self._timeout)
+        reader = connection.makefile("rb")
+        try:
+            if self._password is not None:
+                auth = ["AUTH", self._password]
+                if self._username is not None:
+                    auth.insert(1, self._username)
+                connection.sendall(self.__class__.encode(*auth))
+                self.__class__.decode(reader)
+            if self._db:
+                connection.sendall(self.__class__.encode("SELECT", self._db))
+                self.__class__.decode(reader)
+        except Exception:
+            reader.close()
+            connection.close()
+            raise
+        with self._lock:
+            self._connections.append(connection)
+        return connection, reader
+
+    def _drop(self):
+        """
+        Closes the connection of the current thread, if any.
+        """
+        current = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if current is not None:
+            with self._lock:
+                if current[0] in self._connections:
+                    self._connections.remove(current[0])
+            current[1].close()
+            current[0].close()
+
+    def command(self, *args: Union[str, bytes, int]) -> Union[bytes, int, List, None]:
+        """
+        Sends a command, and waits for its reply.
+        :param args: The command and its arguments.
+        :type args: Union[str, bytes, int]
+        :return: The reply.
+        :rtype: Union[bytes, int, List, None]
+        """
+        if time.monotonic() < self._down_until:
+            raise ConnectionError(f"{self.url} is unavailable")
+        # a stale pooled connection gets one retry on a fresh one
+        for attempt in range(2):
+            current = getattr(self._local, "connection", None)
+            fresh = current is None
+            try:
+                if fresh:
+                    current = self._connect()
+                    self._local.connection = current
+                current[0].sendall(self.__class__.encode(*args))
+                return self.__class__.decode(current[1])
+            except OSError as error:
+                self._drop()
+                if fresh or attempt == 1:
+                    self._down_until = time.monotonic() + self._retry_after
+                    RedisRemoteCache.logger().warning(
+                        f"Remote cache {self.url} unavailable: {error}"
+                    )
+                    raise
+
+    def get(self, key: str) -> str:
+        """
+        Retrieves an entry.
+        :param key: The key.
+        :type key: str
+        :return: The value, or None if missing or expired.
+        :rtype: str
+        """
+        result = self.command("GET", key)
+        return None if result is None else result.decode("utf-8")
+
+    def set(self, key: str, value: str, ttl: float):
+        """
+        Stores an entry, replacing any previous one.
+        :param key: The key.
+        :type key: str
+        :param value: The value.
+        :type value: str
+        :param ttl: How long it's kept, in seconds.
+        :type ttl: float
+        """
+        self.command("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        """
+        Stores an entry, unless there's one already.
+        :param key: The key.
+        :type key: str
+        :param value: The value.
+        :type value: str
+        :param ttl: How long it's kept, in seconds.
+        :type ttl: float
+        :return: True if it got stored.
+        :rtype: bool
+        """
+        return (
+            self.command("SET", key, value, "PX", max(1, int(ttl * 1000)), "NX")
+            is not None
+        )
+
+    def delete(self, key: str):
+        """
+        Removes an entry, if any.
+        :param key: The key.
+        :type key: str
+        """
+        self.command("DEL", key)
+
+    def close(self):
+        """
+        Closes the connections of every thread.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except OSError:
+                pass
+        self._local = threading.local()
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,162 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/remote_cache.py
+
+This file defines the RemoteCache class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import abc
+from pythoneda import BaseObject
+from urllib.parse import unquote, urlparse
+
+
+class RemoteCache(BaseObject, abc.ABC):
+
+    """
+    A key-value store shared by several hosts, underneath their local caches.
+
+    Values are strings, and every entry expires. Implementations raise
+    OSError when the store cannot be reached; callers treat that as a miss.
+
+    Class name: RemoteCache
+
+    Responsibilities:
+        - Get, set, add and delete entries with an expiration.
+        - Create the backend a URL refers to.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.RedisRemoteCache: Redis-protocol backend.
+        - pythoneda.artifact.nix.flake.infrastructure.InMemoryRemoteCache: In-process backend.
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Shares gitHub tags through it.
+    """
+
+    def __init__(self, url: str):
+        """
+        Creates a new RemoteCache instance.
+        :param url: The URL of the store, without credentials.
+        :type url: str
+        """
+        super().__init__()
+        self._url = url
+
+    @property
+    def url(self) -> str:
+        """
+        Retrieves the URL of the store, without credentials.
+        :return: Such URL.
+        :rtype: str
+        """
+        return self._url
+
+    @property
+    def connection_url(self) -> str:
+        """
+        Retrieves the URL to connect to the store, i.e. from another process.
+        :return: Such URL, with credentials if needed.
+        :rtype: str
+        """
+        return self._url
+
+    @abc.abstractmethod
+    def get(self, key: str) -> str:
+        """
+        Retrieves an entry.
+        :param key: The key.
+        :type key: str
+        :return: The value, or None if missing or expired.
+        :rtype: str
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, ttl: float):
+        """
+        Stores an entry, replacing any previous one.
+        :param key: The key.
+        :type key: str
+        :param value: The value.
+        :type value: str
+        :param ttl: How long it's kept, in seconds.
+        :type ttl: float
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        """
+        Stores an entry, unless there's one already, i.e. to take a lock.
+        :param key: The key.
+        :type key: str
+        :param value: The value.
+        :type value: str
+        :param ttl: How long it's kept, in seconds.
+        :type ttl: float
+        :return: True if it got stored.
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """
+        Removes an entry, if any.
+        :param key: The key.
+        :type key: str
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases the connections to the store, if any.
+        """
+        pass
+
+    @classmethod
+    def from_url(cls, url: str) -> "RemoteCache":
+        """
+        Creates the backend of given URL.
+        :param url: Either "redis://[:password@]host[:port][/db]" or "memory://name".
+        :type url: str
+        :return: The backend.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.RemoteCache
+        """
+        parsed = urlparse(url)
+        if parsed.scheme == "redis":
+            from .redis_remote_cache import RedisRemoteCache
+
+            return RedisRemoteCache(
+                parsed.hostname or "127.0.0.1",
+                parsed.port or 6379,
+                int(parsed.path.strip("/") or 0),
+                unquote(parsed.password) if parsed.password else None,
+                unquote(parsed.username) if parsed.username else None,
+            )
+        if parsed.scheme == "memory":
+            from .in_memory_remote_cache import InMemoryRemoteCache
+
+            return InMemoryRemoteCache.named(parsed.netloc or "default")
+        raise ValueError(f"Unsupported remote cache: {parsed.scheme}://")
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,282 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/resolution_profiler.py
+
+This file defines the ResolutionProfiler class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from functools import wraps
+from pythoneda import BaseObject
+import threading
+import time
+from typing import Callable, Dict, List, TextIO
+
+
+class ResolutionProfiler(BaseObject):
+
+    """
+    Records where the time of NixFlakeGitRepo resolutions goes.
+
+    Every find_*_version call (building a flake), latest_*_version call
+    (looking up its tag) and resolve_by_name call becomes a node of a call
+    tree. Calls with the same path get merged, so a node knows how often it
+    was built along that path.
+
+    Class name: ResolutionProfiler
+
+    Responsibilities:
+        - Wrap the resolution methods of a NixFlakeGitRepo instance.
+        - Keep, per node, its calls, inclusive and own time, network
+          requests and cache hits.
+        - Render the tree, or folded stacks for flamegraph.pl / speedscope.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Reports its tag lookups.
+    """
+
+    def __init__(self):
+        """
+        Creates a new ResolutionProfiler instance.
+        """
+        super().__init__()
+        self._root = self.__class__._new_node()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def _new_node(cls) -> Dict:
+        """
+        Creates an empty node.
+        :return: The node.
+        :rtype: Dict
+        """
+        return {
+            "calls": 0,
+            "inclusive": 0.0,
+            "own": 0.0,
+            "network": 0,
+            "hits": 0,
+            "children": {},
+        }
+
+    @classmethod
+    def profiled_names(cls, repo) -> List[str]:
+        """
+        Retrieves the names of the methods of given repository to profile.
+        :param repo: The repository.
+        :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        :return: Such names.
+        :rtype: List[str]
+        """
+        return [
+            name
+            for name in dir(repo.__class__)
+            if name == "resolve_by_name"
+            or (
+                name.endswith("_version")
+                and (name.startswith("find_") or name.startswith("latest_"))
+            )
+        ]
+
+    def attach(self, repo):
+        """
+        Starts profiling given repository.
+        :param repo: The repository.
+        :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        """
+        for name in self.__class__.profiled_names(repo):
+            repo.__dict__[name] = self._wrap(name, getattr(repo, name))
+
+    def detach(self, repo):
+        """
+        Stops profiling given repository.
+        :param repo: The repository.
+        :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        """
+        for name in self.__class__.profiled_names(repo):
+            repo.__dict__.pop(name, None)
+
+    def _stack(self) -> List[List]:
+        """
+        Retrieves the frames open in the current thread.
+        :return: For each frame, its node and the time spent in its children.
+        :rtype: List[List]
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = [[self._root, 0.0]]
+            self._local.stack = stack
+        return stack
+
+    def _wrap(self, name: str, method: Callable) -> Callable:
+        """
+        Wraps given method, so that each call becomes a node.
+        :param name: The name of the method.
+        :type name: str
+        :param method: The bound method.
+        :type method: Callable
+        :return: The wrapper.
+        :rtype: Callable
+        """
+        profiler = self
+
+        @wraps(method)
+        def profiled(*args, **kwargs):
+            frame = name
+            if name == "resolve_by_name" and args:
+                frame = f"{name}({args[0]})"
+            stack = profiler._stack()
+            parent = stack[-1][0]
+            with profiler._lock:
+                node = parent["children"].get(frame, None)
+                if node is None:
+                    node = profiler.__class__._new_node()
+                    parent["children"][frame] = node
+            stack.append([node, 0.0])
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                children = stack.pop()[1]
+                stack[-1][1] += elapsed
+                with profiler._lock:
+                    node["calls"] += 1
+                    node["inclusive"] += elapsed
+                    node["own"] += elapsed - children
+
+        return profiled
+
+    def lookup(self, outcome: str, requests: int):
+        """
+        Records a tag lookup in the current node.
+        :param outcome: The outcome, as in the nix_flake_github_tag_lookups_total metric.
+        :type outcome: str
+        :param requests: The HTTP requests it took.
+        :type requests: int
+        """
+        node = self._stack()[-1][0]
+        with self._lock:
+            node["network"] += requests
+            if outcome in (
+                "memory_hit",
+                "snapshot_hit",
+                "disk_hit",
+                "remote_hit",
+                "stale",
+            ):
+                node["hits"] += 1
+
+    def builds(self) -> Dict[str, int]:
+        """
+        Counts how many times each flake was built, along any path.
+        :return: For each find_*_version method, its calls.
+        :rtype: Dict[str, int]
+        """
+        result = {}
+        pending = [self._root]
+        with self._lock:
+            while pending:
+                for frame, node in pending.pop()["children"].items():
+                    if frame.startswith("find_"):
+                        result[frame] = result.get(frame, 0) + node["calls"]
+                    pending.append(node)
+        return result
+
+    def tree(self) -> str:
+        """
+        Renders the call tree, most expensive nodes first.
+        :return: The tree, followed by the flakes built more than once.
+        :rtype: str
+        """
+        lines = [
+            f"{'inclusive ms':>12} {'own ms':>9} {'calls':>5} {'net':>4} "
+            f"{'hits':>4}  node"
+        ]
+
+        def render(node: Dict, depth: int):
+            for frame, child in sorted(
+                node["children"].items(), key=lambda item: -item[1]["inclusive"]
+            ):
+                lines.append(
+                    f"{child['inclusive'] * 1000:12.2f} {child['own'] * 1000:9.2f} "
+                    f"{child['calls']:5d} {child['network']:4d} {child['hits']:4d}"
+                    f"  {'  ' * depth}{frame}"
+                )
+                render(child, depth + 1)
+
+        with self._lock:
+            render(self._root, 0)
+        rebuilt = sorted(
+            (item for item in self.builds().items() if item[1] > 1),
+            key=lambda item: -item[1],
+        )
+        if rebuilt:
+            lines.append("")
+            lines.append("Built more than once:")
+            for frame, calls in rebuilt:
+                lines.append(f"{calls:5d}  {frame}")
+        return "\n".join(lines) + "\n"
+
+    def folded(self) -> str:
+        """
+        Renders the own time of each node as folded stacks, in microseconds.
+        :return: One "frame;frame;frame microseconds" line per node.
+        :rtype: str
+        """
+        lines = []
+
+        def render(node: Dict, path: List[str]):
+            for frame, child in node["children"].items():
+                stack = path + [frame]
+                micros = int(round(child["own"] * 1_000_000))
+                if micros > 0:
+                    lines.append(f"{';'.join(stack)} {micros}")
+                render(child, stack)
+
+        with self._lock:
+            render(self._root, [])
+        return "\n".join(lines) + "\n"
+
+    def write(self, output: TextIO, folded: bool = False):
+        """
+        Writes the profile.
+        :param output: Where to write it.
+        :type output: TextIO
+        :param folded: Whether to write folded stacks instead of the tree.
+        :type folded: bool
+        """
+        output.write(self.folded() if folded else self.tree())
+
+    def save(self, path: str):
+        """
+        Saves the profile to given file: folded stacks if it ends in .folded, the tree otherwise.
+        :param path: The file.
+        :type path: str
+        """
+        with open(path, "w") as output:
+            self.write(output, path.endswith(".folded"))
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,279 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/resolver_client.py
+
+This file defines the ResolverClient class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import itertools
+import json
+import os
+from pythoneda import BaseObject
+import socket
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+
+class ResolverClient(BaseObject):
+
+    """
+    A thin client of ResolverDaemon, for short-lived processes.
+
+    It doesn't import the resolution stack (NixFlakeGitRepo, joblib, requests),
+    so queries cost a round trip through a UNIX socket.
+
+    The protocol is one JSON object per line, in both directions:
+        - request: {"id": 1, "op": "resolve", "spec": "pythoneda-shared-pythoneda-domain"}
+        - response: {"id": 1, "ok": true, "result": {...}}, or {"id": 1, "ok": false, "error": "..."}
+    Supported operations are "ping", "resolve", "latest_version_by_coordinates",
+    "batch" and "stats".
+
+    Class name: ResolverClient
+
+    Responsibilities:
+        - Connect to the daemon, and keep the connection for several queries.
+        - Send requests, and wait for their responses.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.ResolverDaemon: Answers the queries.
+    """
+
+    SOCKET_ENVIRONMENT_VARIABLE = "PYTHONEDA_NIX_FLAKE_RESOLVER_SOCKET"
+
+    def __init__(self, socketPath: str = None, timeout: float = 30.0):
+        """
+        Creates a new ResolverClient instance.
+        :param socketPath: The UNIX socket of the daemon. Defaults to default_socket().
+        :type socketPath: str
+        :param timeout: How long to wait for each response, in seconds.
+        :type timeout: float
+        """
+        super().__init__()
+        self._socket_path = socketPath or self.__class__.default_socket()
+        self._timeout = timeout
+        self._socket = None
+        self._input = None
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def default_socket(cls) -> str:
+        """
+        Retrieves the default socket of the daemon: the PYTHONEDA_NIX_FLAKE_RESOLVER_SOCKET
+        environment variable, or a per-user file in the runtime directory.
+        :return: The path of the socket.
+        :rtype: str
+        """
+        result = os.environ.get(cls.SOCKET_ENVIRONMENT_VARIABLE, None)
+        if not result:
+            runtime = os.environ.get("XDG_RUNTIME_DIR", None)
+            if runtime:
+                result = os.path.join(runtime, "pythoneda-nix-flake-resolver.sock")
+            else:
+                result = os.path.join(
+                    tempfile.gettempdir(),
+                    f"pythoneda-nix-flake-resolver-{os.getuid()}.sock",
+                )
+        return result
+
+    @property
+    def socket_path(self) -> str:
+        """
+        Retrieves the UNIX socket of the daemon.
+        :return: Such path.
+        :rtype: str
+        """
+        return self._socket_path
+
+    def connect(self) -> "ResolverClient":
+        """
+        Connects to the daemon, unless already connected.
+        :return: This client.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.ResolverClient
+        """
+        if self._socket is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self._timeout)
+            try:
+                connection.connect(self._socket_path)
+            except OSError:
+                connection.close()
+                raise
+            self._socket = connection
+            self._input = connection.makefile("rb")
+        return self
+
+    def close(self):
+        """
+        Closes the connection, if any.
+        """
+        if self._socket is not None:
+            self._input.close()
+            self._socket.close()
+            self._socket = None
+            self._input = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, op: str, **params) -> Any:
+        """
+        Sends a request, and waits for its response.
+        :param op: The operation.
+        :type op: str
+        :param params: Its parameters.
+        :type params: Dict
+        :return: The result.
+        :rtype: Any
+        """
+        self.connect()
+        request_id = next(self._ids)
+        line = json.dumps({"id": request_id, "op": op, **params}) + "\n"
+        try:
+            self._socket.sendall(line.encode("utf-8"))
+            response = self._input.readline()
+        except OSError:
+            self.close()
+            raise
+        if not response:
+            self.close()
+            raise ConnectionError(f"{self._socket_path} closed the connection")
+        response = json.loads(response)
+        if response.get("id", None) != request_id:
+            self.close()
+            raise ConnectionError(f"Unexpected response from {self._socket_path}")
+        if not response.get("ok", False):
+            raise RuntimeError(response.get("error", "unknown error"))
+        return response.get("result", None)
+
+    def ping(self) -> bool:
+        """
+        Checks whether the daemon is answering.
+        :return: True in such case.
+        :rtype: bool
+        """
+        try:
+            return self.request("ping") == "pong"
+        except OSError:
+            return False
+
+    def resolve(self, spec: str) -> Dict:
+        """
+        Resolves a spec.
+        :param spec: The spec, as accepted by BatchResolutionCli, i.e. "pythoneda-shared-pythoneda-domain@0.0.1".
+        :type spec: str
+        :return: The result, with "ok", and "name", "version" and "url", or "error".
+        :rtype: Dict
+        """
+        return self.request("resolve", spec=spec)
+
+    def latest_version_by_coordinates(self, coordinates: str) -> str:
+        """
+        Retrieves the latest version of a repository.
+        :param coordinates: The coordinates, i.e. "pythoneda-shared-pythoneda/domain".
+        :type coordinates: str
+        :return: The version, or None if not found.
+        :rtype: str
+        """
+        return self.request("latest_version_by_coordinates", coordinates=coordinates)
+
+    def batch(self, specs: List[str]) -> List[Dict]:
+        """
+        Resolves several specs at once.
+        :param specs: The specs.
+        :type specs: List[str]
+        :return: The results, in the same order.
+        :rtype: List[Dict]
+        """
+        return self.request("batch", specs=list(specs))
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the counters of the daemon.
+        :return: Such counters.
+        :rtype: Dict
+        """
+        return self.request("stats")
+
+
+def main():
+    """
+    Queries a running resolver daemon.
+    """
+    parser = argparse.ArgumentParser(
+        description="Query the nix flake resolver daemon"
+    )
+    parser.add_argument(
+        "-s", "--socket", default=None, help="The socket of the daemon"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="Seconds to wait for answers"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    resolve = commands.add_parser("resolve", help="Resolve specs")
+    resolve.add_argument(
+        "specs", nargs="+", help="i.e. name, name@version, owner/repo"
+    )
+    coordinates = commands.add_parser(
+        "latest-version", help="Retrieve the latest version of a repository"
+    )
+    coordinates.add_argument("coordinates", help="i.e. owner/repo")
+    commands.add_parser("ping", help="Check the daemon is running")
+    commands.add_parser("stats", help="Show the counters of the daemon")
+    args = parser.parse_args()
+
+    failed = False
+    try:
+        with ResolverClient(args.socket, args.timeout) as client:
+            if args.command == "resolve":
+                results = (
+                    [client.resolve(args.specs[0])]
+                    if len(args.specs) == 1
+                    else client.batch(args.specs)
+                )
+                for result in results:
+                    print(json.dumps(result))
+                    failed = failed or not result.get("ok", False)
+            elif args.command == "latest-version":
+                version = client.latest_version_by_coordinates(args.coordinates)
+                print(version or "")
+                failed = version is None
+            elif args.command == "ping":
+                failed = not client.ping()
+            else:
+                print(json.dumps(client.stats(), indent=2, sort_keys=True))
+    except (OSError, RuntimeError) as error:
+        print(f"{error}", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
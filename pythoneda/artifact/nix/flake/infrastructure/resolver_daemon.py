@@ -0,0 +1,342 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/resolver_daemon.py
+
+This file defines the ResolverDaemon class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .cli.batch_resolution_cli import BatchResolutionCli
+from .resolver_client import ResolverClient
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from pythoneda import BaseObject
+import socket
+import time
+from typing import Dict, List
+
+
+class ResolverDaemon(BaseObject):
+
+    """
+    A long-lived process answering resolution queries on a UNIX socket.
+
+    It keeps a warm NixFlakeGitRepo, whose gitHub connections are pooled, and
+    an in-memory cache of recent results, so short-lived clients don't pay
+    for starting Python, importing the stack and reopening the disk cache.
+    See ResolverClient for the protocol.
+
+    Class name: ResolverDaemon
+
+    Responsibilities:
+        - Listen on a UNIX socket, only accessible by its owner.
+        - Resolve specs and coordinates, one at a time or in batch.
+        - Cache successful results in memory for a while, and resolve
+          concurrent queries for the same spec only once.
+        - Forget them when a repository gets a new tag, including the ones
+          of resolutions still ongoing.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Resolves the flakes.
+        - pythoneda.artifact.nix.flake.infrastructure.cli.BatchResolutionCli: Parses and resolves specs.
+        - pythoneda.artifact.nix.flake.infrastructure.ResolverClient: Queries it.
+    """
+
+    # the longest request line, i.e. for large batches
+    _max_line = 16 * 1024 * 1024
+
+    def __init__(
+        self,
+        socketPath: str = None,
+        repo=None,
+        concurrency: int = 8,
+        ttl: float = 300.0,
+        maxCached: int = 4096,
+    ):
+        """
+        Creates a new ResolverDaemon instance.
+        :param socketPath: The UNIX socket to listen on. Defaults to ResolverClient.default_socket().
+        :type socketPath: str
+        :param repo: The repository. A new NixFlakeGitRepo if omitted.
+        :type repo: pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo
+        :param concurrency: How many specs to resolve concurrently.
+        :type concurrency: int
+        :param ttl: How long to keep results in memory, in seconds. 0 disables it.
+        :type ttl: float
+        :param maxCached: How many results to keep in memory, at most.
+        :type maxCached: int
+        """
+        super().__init__()
+        self._socket_path = socketPath or ResolverClient.default_socket()
+        self._resolver = BatchResolutionCli(repo)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, concurrency), thread_name_prefix="resolver"
+        )
+        self._ttl = ttl
+        self._max_cached = maxCached
+        # spec -> (expiration, result)
+        self._cached = OrderedDict()
+        # spec -> future of the ongoing resolution
+        self._ongoing = {}
+        # bumped whenever the cached results get forgotten
+        self._generation = 0
+        self._server = None
+        self._loop = None
+        self._started = time.time()
+        self._counters = {"requests": 0, "hits": 0, "misses": 0, "errors": 0}
+
+    @property
+    def socket_path(self) -> str:
+        """
+        Retrieves the UNIX socket.
+        :return: Such path.
+        :rtype: str
+        """
+        return self._socket_path
+
+    def _remove_stale_socket(self):
+        """
+        Removes the socket file of a previous daemon which is not running anymore.
+        """
+        if not os.path.exists(self._socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self._socket_path)
+        except OSError:
+            os.unlink(self._socket_path)
+        else:
+            raise OSError(f"Another daemon is listening on {self._socket_path}")
+        finally:
+            probe.close()
+
+    async def start(self):
+        """
+        Starts listening.
+        """
+        self._remove_stale_socket()
+        folder = os.path.dirname(self._socket_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if self._loop is None:
+            # any flake may depend on the one getting a new tag
+            self._resolver.repo.__class__.on_tag_changed(self._tag_changed)
+        self._loop = asyncio.get_running_loop()
+        umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(
+                self._serve_connection,
+                self._socket_path,
+                limit=self.__class__._max_line,
+            )
+        finally:
+            os.umask(umask)
+        ResolverDaemon.logger().info(f"Resolving flakes on {self._socket_path}")
+
+    def _tag_changed(self, repoOwner: str, repoName: str, tag: str, deleted: bool):
+        """
+        Forgets the cached results, since they may depend on a changed tag.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param tag: The tag.
+        :type tag: str
+        :param deleted: Whether the tag got deleted.
+        :type deleted: bool
+        """
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._forget)
+
+    def _forget(self):
+        """
+        Forgets the cached results, and the ones of the ongoing resolutions.
+        """
+        self._generation += 1
+        self._cached.clear()
+
+    async def serve(self):
+        """
+        Starts listening, and serves clients until cancelled.
+        """
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """
+        Stops listening, and removes the socket.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            try:
+                os.unlink(self._socket_path)
+            except FileNotFoundError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def _serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """
+        Answers the requests of a client, in order, until it disconnects.
+        :param reader: To read the requests.
+        :type reader: asyncio.StreamReader
+        :param writer: To write the responses.
+        :type writer: asyncio.StreamWriter
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.dispatch(line)
+                writer.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as error:
+            ResolverDaemon.logger().debug(f"Dropping resolver client: {error}")
+        finally:
+            writer.close()
+
+    async def dispatch(self, line: bytes) -> Dict:
+        """
+        Answers a request.
+        :param line: The request, as a JSON line.
+        :type line: bytes
+        :return: The response.
+        :rtype: Dict
+        """
+        self._counters["requests"] += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id", None)
+            op = request.get("op", None)
+            if op == "ping":
+                result = "pong"
+            elif op == "resolve":
+                result = await self.resolve(request["spec"])
+            elif op == "latest_version_by_coordinates":
+                coordinates = request["coordinates"]
+                if "/" not in coordinates:
+                    raise ValueError(f"Invalid coordinates: {coordinates}")
+                result = (await self.resolve(coordinates)).get("version", None)
+            elif op == "batch":
+                result = await self.batch(request["specs"])
+            elif op == "stats":
+                result = self.stats()
+            else:
+                raise ValueError(f"Unknown operation: {op}")
+            return {"id": request_id, "ok": True, "result": result}
+        except Exception as error:
+            self._counters["errors"] += 1
+            return {
+                "id": request_id,
+                "ok": False,
+                "error": f"{error.__class__.__name__}: {error}",
+            }
+
+    async def resolve(self, spec: str) -> Dict:
+        """
+        Resolves a spec, from memory if it was resolved recently.
+        :param spec: The spec, as accepted by BatchResolutionCli.
+        :type spec: str
+        :return: The result, as built by BatchResolutionCli.
+        :rtype: Dict
+        """
+        spec = spec.strip()
+        cached = self._cached.get(spec, None)
+        if cached is not None:
+            expiration, result = cached
+            if expiration > time.monotonic():
+                self._counters["hits"] += 1
+                self._cached.move_to_end(spec)
+                return dict(result, cached=True)
+            del self._cached[spec]
+        self._counters["misses"] += 1
+        future = self._ongoing.get(spec, None)
+        if future is None:
+            generation = self._generation
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, self._resolver.resolve_line, 0, spec
+            )
+            self._ongoing[spec] = future
+            try:
+                result = await future
+            finally:
+                del self._ongoing[spec]
+            result = self.__class__._without_index(result)
+            # a tag changed meanwhile: the result may be stale already
+            if result["ok"] and self._ttl > 0 and generation == self._generation:
+                self._cached[spec] = (time.monotonic() + self._ttl, result)
+                while len(self._cached) > self._max_cached:
+                    self._cached.popitem(last=False)
+        else:
+            # shared with the resolution's owner: never modified in place
+            result = self.__class__._without_index(await asyncio.shield(future))
+        return dict(result, cached=False)
+
+    @classmethod
+    def _without_index(cls, result: Dict) -> Dict:
+        """
+        Copies given result, without the index BatchResolutionCli adds.
+        :param result: The result.
+        :type result: Dict
+        :return: The copy.
+        :rtype: Dict
+        """
+        return {key: value for key, value in result.items() if key != "index"}
+
+    async def batch(self, specs: List[str]) -> List[Dict]:
+        """
+        Resolves several specs concurrently.
+        :param specs: The specs.
+        :type specs: List[str]
+        :return: The results, in the same order, each one with its index.
+        :rtype: List[Dict]
+        """
+        results = await asyncio.gather(*[self.resolve(spec) for spec in specs])
+        return [dict(result, index=index) for index, result in enumerate(results)]
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the counters of this daemon.
+        :return: Such counters, the cached results and the uptime.
+        :rtype: Dict
+        """
+        return dict(
+            self._counters,
+            cached=len(self._cached),
+            uptime_s=round(time.time() - self._started, 3),
+        )
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,226 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/span.py
+
+This file defines the Span class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+from pythoneda import BaseObject
+import time
+from typing import Any, Dict
+
+
+class Span(BaseObject):
+
+    """
+    A timed operation within a trace, modelled after OpenTelemetry spans.
+
+    Class name: Span
+
+    Responsibilities:
+        - Keep the identifiers, timing, attributes and status of an operation.
+        - Render itself in the OTLP/JSON format.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.Tracer: Creates and exports spans.
+    """
+
+    # OTLP span kinds
+    INTERNAL = 1
+    SERVER = 2
+    CLIENT = 3
+    PRODUCER = 4
+    CONSUMER = 5
+
+    def __init__(
+        self,
+        name: str,
+        traceId: str = None,
+        parentSpanId: str = None,
+        kind: int = INTERNAL,
+        attributes: Dict[str, Any] = None,
+        recording: bool = True,
+    ):
+        """
+        Creates a new Span instance, starting now.
+        :param name: The name of the operation.
+        :type name: str
+        :param traceId: The trace it belongs to. A new one if omitted.
+        :type traceId: str
+        :param parentSpanId: The id of its parent span, if any.
+        :type parentSpanId: str
+        :param kind: The span kind.
+        :type kind: int
+        :param attributes: The initial attributes.
+        :type attributes: Dict[str, Any]
+        :param recording: Whether the span gets recorded at all.
+        :type recording: bool
+        """
+        super().__init__()
+        self._name = name
+        self._recording = recording
+        self._trace_id = traceId or (os.urandom(16).hex() if recording else None)
+        self._span_id = os.urandom(8).hex() if recording else None
+        self._parent_span_id = parentSpanId
+        self._kind = kind
+        self._attributes = dict(attributes or {}) if recording else {}
+        self._start = time.time_ns()
+        self._end = None
+        self._error = None
+
+    @classmethod
+    def noop(cls) -> "Span":
+        """
+        Creates a span which records nothing.
+        :return: Such span.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        return cls("noop", recording=False)
+
+    @property
+    def name(self) -> str:
+        """
+        Retrieves the name of the operation.
+        :return: Such name.
+        :rtype: str
+        """
+        return self._name
+
+    @property
+    def recording(self) -> bool:
+        """
+        Checks whether this span gets recorded.
+        :return: True in such case.
+        :rtype: bool
+        """
+        return self._recording
+
+    @property
+    def trace_id(self) -> str:
+        """
+        Retrieves the id of the trace.
+        :return: Such id.
+        :rtype: str
+        """
+        return self._trace_id
+
+    @property
+    def span_id(self) -> str:
+        """
+        Retrieves the id of this span.
+        :return: Such id.
+        :rtype: str
+        """
+        return self._span_id
+
+    @property
+    def ended(self) -> bool:
+        """
+        Checks whether this span has ended.
+        :return: True in such case.
+        :rtype: bool
+        """
+        return self._end is not None
+
+    @property
+    def duration(self) -> float:
+        """
+        Retrieves how long this span lasted, so far.
+        :return: The duration, in seconds.
+        :rtype: float
+        """
+        return ((self._end or time.time_ns()) - self._start) / 1e9
+
+    def set_attribute(self, key: str, value: Any):
+        """
+        Sets an attribute.
+        :param key: The attribute name.
+        :type key: str
+        :param value: Its value.
+        :type value: Any
+        """
+        if self._recording:
+            self._attributes[key] = value
+
+    def set_error(self, error: BaseException):
+        """
+        Marks this span as failed.
+        :param error: The error.
+        :type error: BaseException
+        """
+        if self._recording:
+            self._error = f"{error.__class__.__name__}: {error}"
+
+    def end(self):
+        """
+        Ends this span, now.
+        """
+        if self._end is None:
+            self._end = time.time_ns()
+
+    @classmethod
+    def _any_value(cls, value: Any) -> Dict:
+        """
+        Renders given value as an OTLP AnyValue.
+        :param value: The value.
+        :type value: Any
+        :return: The AnyValue.
+        :rtype: Dict
+        """
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def to_otlp(self) -> Dict:
+        """
+        Renders this span in the OTLP/JSON format.
+        :return: The span.
+        :rtype: Dict
+        """
+        result = {
+            "traceId": self._trace_id,
+            "spanId": self._span_id,
+            "name": self._name,
+            "kind": self._kind,
+            "startTimeUnixNano": str(self._start),
+            "endTimeUnixNano": str(self._end or time.time_ns()),
+            "attributes": [
+                {"key": key, "value": self.__class__._any_value(value)}
+                for key, value in self._attributes.items()
+            ],
+            "status": {"code": 2, "message": self._error}
+            if self._error
+            else {"code": 0},
+        }
+        if self._parent_span_id:
+            result["parentSpanId"] = self._parent_span_id
+        return result
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
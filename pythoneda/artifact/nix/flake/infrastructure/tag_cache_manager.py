@@ -0,0 +1,538 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/tag_cache_manager.py
+
+This file defines the TagCacheManager class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import ast
+import atexit
+import fcntl
+import json
+import os
+from pathlib import Path
+from pythoneda import BaseObject
+import shutil
+import tarfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+class TagCacheManager(BaseObject):
+
+    """
+    Inspects and manages the on-disk cache of gitHub tags of NixFlakeGitRepo.
+
+    Class name: TagCacheManager
+
+    Responsibilities:
+        - Count the cache hits and misses of each repository, across processes.
+        - List the cache entries, with their repository, age and size.
+        - Prune entries by age, total size or repository.
+        - Export the cache as a single portable file, and import it elsewhere.
+        - Update the entries in place when a repository gets a new tag.
+        - Index the entries by repository, reading the metadata of new entries only.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Owns the cache.
+        - pythoneda.artifact.nix.flake.infrastructure.cli.TagCacheCli: Exposes it.
+    """
+
+    DEFAULT_LOCATION = ".nix_flake_git_repo_cache"
+    STATS_FILE = "stats.json"
+    # the folder, within the export archive, holding the cache
+    ARCHIVE_ROOT = "nix_flake_git_repo_cache"
+
+    _singleton = None
+
+    def __init__(self, location: str = DEFAULT_LOCATION, flushEvery: int = 256):
+        """
+        Creates a new TagCacheManager instance.
+        :param location: The folder of the cache.
+        :type location: str
+        :param flushEvery: How many lookups to count before saving the counters.
+        :type flushEvery: int
+        """
+        super().__init__()
+        self._location = Path(location)
+        self._flush_every = flushEvery
+        # repository -> [hits, misses], not saved yet
+        self._unsaved = {}
+        self._unsaved_count = 0
+        self._lock = threading.Lock()
+        self._flush_at_exit = False
+        # folder of a cached function -> (its mtime, or None to list it again,
+        # {folder of an entry -> (repository, prefix), or None if being written})
+        self._indexed_functions = {}
+        # repository -> folders of its entries
+        self._by_repository = {}
+        self._index_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> "TagCacheManager":
+        """
+        Retrieves the process-wide instance, for the default location.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagCacheManager
+        """
+        if cls._singleton is None:
+            cls._singleton = cls()
+        return cls._singleton
+
+    @property
+    def location(self) -> Path:
+        """
+        Retrieves the folder of the cache.
+        :return: Such folder.
+        :rtype: pathlib.Path
+        """
+        return self._location
+
+    def record(self, repository: str, hit: bool):
+        """
+        Counts a lookup.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :param hit: Whether the cache had it.
+        :type hit: bool
+        """
+        with self._lock:
+            counters = self._unsaved.setdefault(repository, [0, 0])
+            counters[0 if hit else 1] += 1
+            self._unsaved_count += 1
+            flush = self._unsaved_count >= self._flush_every
+            if not self._flush_at_exit:
+                atexit.register(self.flush)
+                self._flush_at_exit = True
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds the counters not saved yet to the stats file, which other processes may update too.
+        """
+        with self._lock:
+            unsaved = self._unsaved
+            self._unsaved = {}
+            self._unsaved_count = 0
+        if not unsaved:
+            return
+        try:
+            self._location.mkdir(parents=True, exist_ok=True)
+            with open(self._location / self.__class__.STATS_FILE, "a+") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                handle.seek(0)
+                content = handle.read()
+                stats = json.loads(content) if content.strip() else {}
+                for repository, (hits, misses) in unsaved.items():
+                    counters = stats.setdefault(repository, {"hits": 0, "misses": 0})
+                    counters["hits"] += hits
+                    counters["misses"] += misses
+                handle.seek(0)
+                handle.truncate()
+                json.dump(stats, handle, indent=2, sort_keys=True)
+        except (OSError, ValueError) as error:
+            TagCacheManager.logger().warning(f"Cannot save the cache counters: {error}")
+
+    def counters(self) -> Dict[str, Dict[str, int]]:
+        """
+        Retrieves the hit and miss counters of each repository.
+        :return: For each repository, its "hits" and "misses".
+        :rtype: Dict[str, Dict[str, int]]
+        """
+        self.flush()
+        path = self._location / self.__class__.STATS_FILE
+        try:
+            return json.loads(path.read_text()) if path.exists() else {}
+        except ValueError:
+            return {}
+
+    @classmethod
+    def _literal(cls, value: str) -> str:
+        """
+        Parses an argument as recorded by joblib.
+        :param value: Its representation.
+        :type value: str
+        :return: The value, or None.
+        :rtype: str
+        """
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+    @classmethod
+    def _key(cls, metadata: Dict) -> Tuple[str, str]:
+        """
+        Retrieves the repository and prefix of an entry.
+        :param metadata: The metadata of the entry, as written by joblib.
+        :type metadata: Dict
+        :return: The repository, i.e. "rydnr/nix-flakes", and the prefix.
+        :rtype: Tuple[str, str]
+        """
+        arguments = metadata.get("input_args", {})
+        owner = cls._literal(arguments.get("repoOwner", "None"))
+        name = cls._literal(arguments.get("repoName", "None"))
+        return f"{owner}/{name}", cls._literal(arguments.get("prefix", "None"))
+
+    def entries(self) -> List[Dict]:
+        """
+        Lists the cache entries.
+        :return: For each entry, its path, repository, prefix, creation time, age (in seconds) and size (in bytes).
+        :rtype: List[Dict]
+        """
+        result = []
+        now = time.time()
+        for metadata_path in self._location.glob("joblib/**/metadata.json"):
+            folder = metadata_path.parent
+            try:
+                metadata = json.loads(metadata_path.read_text())
+            except (OSError, ValueError):
+                continue
+            repository, prefix = self.__class__._key(metadata)
+            created = metadata.get("time", None) or folder.stat().st_mtime
+            result.append(
+                {
+                    "path": str(folder),
+                    "repository": repository,
+                    "prefix": prefix,
+                    "created": created,
+                    "age_s": now - created,
+                    "bytes": sum(
+                        child.stat().st_size
+                        for child in folder.iterdir()
+                        if child.is_file()
+                    ),
+                }
+            )
+        return result
+
+    def _functions(self, folder: str) -> List[str]:
+        """
+        Finds the folders of the cached functions, without listing their entries.
+        :param folder: The folder to search.
+        :type folder: str
+        :return: Such folders.
+        :rtype: List[str]
+        """
+        if folder in self._indexed_functions:
+            return [folder]
+        result = []
+        try:
+            children = [child.path for child in os.scandir(folder) if child.is_dir()]
+        except OSError:
+            return result
+        # joblib doesn't always write func_code.py: a function has entries instead
+        if any(
+            os.path.exists(os.path.join(child, "metadata.json")) for child in children
+        ):
+            return [folder]
+        for child in children:
+            result.extend(self._functions(child))
+        return result
+
+    def _index_function(self, function: str):
+        """
+        Indexes the entries of a cached function, reading the metadata of new ones only.
+        :param function: The folder of the function.
+        :type function: str
+        """
+        try:
+            modified = os.stat(function).st_mtime_ns
+            names = [child.name for child in os.scandir(function) if child.is_dir()]
+        except OSError:
+            names = []
+            modified = None
+        # entries added within the timestamp granularity may not change it:
+        # recently modified folders get listed again next time
+        if modified is not None and time.time_ns() - modified < 2_000_000_000:
+            modified = None
+        _, previous = self._indexed_functions.get(function, (None, {}))
+        entries = {}
+        for name in names:
+            folder = os.path.join(function, name)
+            key = previous.get(folder, None)
+            if key is None:
+                try:
+                    with open(os.path.join(folder, "metadata.json")) as handle:
+                        key = self.__class__._key(json.load(handle))
+                except (OSError, ValueError):
+                    # joblib creates the folder before writing the metadata
+                    modified = None
+            entries[folder] = key
+        for folder, key in previous.items():
+            if key is not None and entries.get(folder, None) != key:
+                self._by_repository.get(key[0], set()).discard(folder)
+        for folder, key in entries.items():
+            if key is not None:
+                self._by_repository.setdefault(key[0], set()).add(folder)
+        self._indexed_functions[function] = (modified, entries)
+
+    def _entries_of(self, repository: str) -> List[Dict]:
+        """
+        Lists the entries of a repository, through the index.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :return: For each entry, its path, repository and prefix.
+        :rtype: List[Dict]
+        """
+        with self._index_lock:
+            for function in self._functions(str(self._location / "joblib")):
+                modified, _ = self._indexed_functions.get(function, (None, {}))
+                try:
+                    current = os.stat(function).st_mtime_ns
+                except OSError:
+                    current = None
+                if modified is None or modified != current:
+                    self._index_function(function)
+            result = []
+            for folder in sorted(self._by_repository.get(repository, set())):
+                _, entries = self._indexed_functions[os.path.dirname(folder)]
+                _, prefix = entries[folder]
+                result.append(
+                    {"path": folder, "repository": repository, "prefix": prefix}
+                )
+            return result
+
+    def _forget(self, folder: str):
+        """
+        Removes an entry from the index.
+        :param folder: The folder of the entry.
+        :type folder: str
+        """
+        with self._index_lock:
+            function = os.path.dirname(folder)
+            modified, entries = self._indexed_functions.get(function, (None, {}))
+            key = entries.pop(folder, None)
+            if key is not None:
+                self._by_repository.get(key[0], set()).discard(folder)
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Summarizes the cache, per repository.
+        :return: For each repository, its entries, size, oldest and newest ages, hits and misses.
+        :rtype: Dict[str, Dict]
+        """
+        result = {}
+        for entry in self.entries():
+            summary = result.setdefault(
+                entry["repository"],
+                {
+                    "entries": 0,
+                    "bytes": 0,
+                    "oldest_s": 0.0,
+                    "newest_s": None,
+                    "hits": 0,
+                    "misses": 0,
+                },
+            )
+            summary["entries"] += 1
+            summary["bytes"] += entry["bytes"]
+            summary["oldest_s"] = max(summary["oldest_s"], entry["age_s"])
+            if summary["newest_s"] is None or entry["age_s"] < summary["newest_s"]:
+                summary["newest_s"] = entry["age_s"]
+        for repository, counters in self.counters().items():
+            summary = result.setdefault(
+                repository,
+                {
+                    "entries": 0,
+                    "bytes": 0,
+                    "oldest_s": None,
+                    "newest_s": None,
+                    "hits": 0,
+                    "misses": 0,
+                },
+            )
+            summary["hits"] = counters.get("hits", 0)
+            summary["misses"] = counters.get("misses", 0)
+        return result
+
+    def prune(
+        self,
+        olderThan: float = None,
+        maxBytes: int = None,
+        repository: str = None,
+        dryRun: bool = False,
+    ) -> List[Dict]:
+        """
+        Removes cache entries.
+        :param olderThan: Removes the entries older than these seconds. Optional.
+        :type olderThan: float
+        :param maxBytes: Removes the oldest entries until the cache fits in these bytes. Optional.
+        :type maxBytes: int
+        :param repository: Removes the entries of this repository, i.e. "rydnr/nix-flakes". Optional.
+        :type repository: str
+        :param dryRun: Whether to only list the entries to remove.
+        :type dryRun: bool
+        :return: The removed entries.
+        :rtype: List[Dict]
+        """
+        result = []
+        kept = []
+        for entry in sorted(self.entries(), key=lambda item: item["created"]):
+            if (repository is not None and entry["repository"] == repository) or (
+                olderThan is not None and entry["age_s"] > olderThan
+            ):
+                result.append(entry)
+            else:
+                kept.append(entry)
+        if maxBytes is not None:
+            total = sum(entry["bytes"] for entry in kept)
+            while kept and total > maxBytes:
+                oldest = kept.pop(0)
+                total -= oldest["bytes"]
+                result.append(oldest)
+        if not dryRun:
+            for entry in result:
+                shutil.rmtree(entry["path"], ignore_errors=True)
+        return result
+
+    def export(self, archive: str) -> int:
+        """
+        Exports the cache entries to a single compressed file.
+        :param archive: The file.
+        :type archive: str
+        :return: The number of exported entries.
+        :rtype: int
+        """
+        result = 0
+        root = self.__class__.ARCHIVE_ROOT
+        with tarfile.open(archive, "w:gz") as tar:
+            joblib_folder = self._location / "joblib"
+            if joblib_folder.exists():
+                tar.add(joblib_folder, arcname=f"{root}/joblib")
+                result = len(self.entries())
+        return result
+
+    def import_(self, archive: str) -> int:
+        """
+        Imports the cache entries of an exported file, keeping the existing ones.
+        :param archive: The file.
+        :type archive: str
+        :return: The number of imported entries.
+        :rtype: int
+        """
+        result = 0
+        prefix = f"{self.__class__.ARCHIVE_ROOT}/"
+        target = self._location.resolve()
+        with tarfile.open(archive, "r:*") as tar:
+            for member in tar.getmembers():
+                if not member.name.startswith(prefix) or not (
+                    member.isfile() or member.isdir()
+                ):
+                    continue
+                relative = member.name[len(prefix) :]
+                destination = (target / relative).resolve()
+                if target not in destination.parents:
+                    raise ValueError(f"Unsafe path in {archive}: {member.name}")
+                if member.isdir():
+                    destination.mkdir(parents=True, exist_ok=True)
+                    continue
+                if destination.exists():
+                    continue
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                with tar.extractfile(member) as source, open(
+                    destination, "wb"
+                ) as output:
+                    shutil.copyfileobj(source, output)
+                os.utime(destination, (member.mtime, member.mtime))
+                if destination.name == "metadata.json":
+                    result += 1
+        return result
+
+    def update(self, repository: str, tag: str, deleted: bool = False) -> List[Dict]:
+        """
+        Updates, in place, the entries of a repository which a new tag affects.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :param tag: The tag, i.e. "joblib-1.3.2".
+        :type tag: str
+        :param deleted: Whether the tag got deleted (or moved), so the entries get removed instead.
+        :type deleted: bool
+        :return: The affected entries, with their path, repository and prefix.
+        :rtype: List[Dict]
+        """
+        result = []
+        for entry in self._entries_of(repository):
+            prefix = entry["prefix"]
+            if prefix is not None and not tag.startswith(prefix):
+                continue
+            if deleted:
+                shutil.rmtree(entry["path"], ignore_errors=True)
+                self._forget(entry["path"])
+            else:
+                self._rewrite(Path(entry["path"]), tag[len(prefix or "") :])
+            result.append(entry)
+        return result
+
+    def refresh(self, repository: str, prefix: str, value: str) -> bool:
+        """
+        Replaces the value of the entry of given repository and prefix, if cached.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :param prefix: The prefix of the lookup, or None.
+        :type prefix: str
+        :param value: The latest tag, without the prefix.
+        :type value: str
+        :return: True if the entry was cached.
+        :rtype: bool
+        """
+        result = False
+        for entry in self._entries_of(repository):
+            if entry["prefix"] == prefix:
+                self._rewrite(Path(entry["path"]), value)
+                result = True
+        return result
+
+    def _rewrite(self, folder: Path, value: str):
+        """
+        Replaces the value of an entry, removing it if that's not possible.
+        :param folder: The folder of the entry.
+        :type folder: pathlib.Path
+        :param value: The new value.
+        :type value: str
+        """
+        from joblib import dump
+
+        try:
+            # written like joblib does, so the next lookup reads it
+            temporary = folder / f"output.pkl.{os.getpid()}.tmp"
+            dump(value, temporary)
+            os.replace(temporary, folder / "output.pkl")
+            metadata_path = folder / "metadata.json"
+            metadata = json.loads(metadata_path.read_text())
+            metadata["time"] = time.time()
+            temporary = folder / f"metadata.json.{os.getpid()}.tmp"
+            temporary.write_text(json.dumps(metadata))
+            os.replace(temporary, metadata_path)
+        except (OSError, ValueError) as error:
+            TagCacheManager.logger().warning(
+                f"Cannot update {folder}, removing it: {error}"
+            )
+            shutil.rmtree(folder, ignore_errors=True)
+            self._forget(str(folder))
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
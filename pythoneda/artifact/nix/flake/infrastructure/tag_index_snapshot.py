@@ -0,0 +1,330 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/tag_index_snapshot.py
+
+This file defines the TagIndexSnapshot class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from datetime import datetime, timezone
+import mmap
+import os
+from pythoneda import BaseObject
+import struct
+from typing import Dict, List, Tuple
+
+
+class TagIndexSnapshot(BaseObject):
+
+    """
+    A read-only, memory-mapped snapshot of the tags of many repositories.
+
+    Layout (little-endian):
+        - header: magic "NFTI", version, repository count, tag count, and the
+          offsets of the string table, the repository table and the tag table;
+        - string table: the UTF-8 names, sorted and deduplicated;
+        - repository table: name offset and length, first tag and tag count,
+          sorted by name, so a repository is found by binary search;
+        - tag table: name offset and length, commit date (seconds since the
+          epoch, 0 if unknown) and the 20-byte commit SHA, latest first within
+          each repository.
+
+    Opening it reads only the header. The pages get loaded on demand and
+    are shared by every process mapping the same file. Empty, truncated or
+    otherwise damaged files raise ValueError, when opened or looked up.
+
+    Class name: TagIndexSnapshot
+
+    Responsibilities:
+        - Write the tag index to a file, atomically.
+        - Map it, and answer latest-tag lookups from it.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Builds the tag index, and reads snapshots.
+    """
+
+    MAGIC = b"NFTI"
+    VERSION = 1
+    _header = struct.Struct("<4sIIIQQQ")
+    _repository = struct.Struct("<IIII")
+    _tag = struct.Struct("<IIq20s")
+
+    def __init__(self, path: str):
+        """
+        Maps given snapshot.
+        :param path: The file.
+        :type path: str
+        """
+        super().__init__()
+        self._path = path
+        cls = self.__class__
+        with open(path, "rb") as handle:
+            size = os.fstat(handle.fileno()).st_size
+            # mmap refuses empty files
+            if size < cls._header.size:
+                raise ValueError(f"{path} is not a tag index snapshot (truncated)")
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self._repository_count,
+            self._tag_count,
+            self._strings,
+            self._repositories,
+            self._tags,
+        ) = cls._header.unpack_from(self._map, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a tag index snapshot (version 1)")
+        # the tables follow each other, as write() lays them out
+        if not (
+            self._strings == cls._header.size
+            and self._strings <= self._repositories
+            and self._repositories + self._repository_count * cls._repository.size
+            == self._tags
+            and self._tags + self._tag_count * cls._tag.size <= size
+        ):
+            self._map.close()
+            raise ValueError(f"{path} is not a tag index snapshot (truncated)")
+
+    @property
+    def path(self) -> str:
+        """
+        Retrieves the file.
+        :return: Such path.
+        :rtype: str
+        """
+        return self._path
+
+    def __len__(self) -> int:
+        """
+        Retrieves the number of repositories.
+        :return: Such number.
+        :rtype: int
+        """
+        return self._repository_count
+
+    def close(self):
+        """
+        Unmaps the snapshot.
+        """
+        self._map.close()
+
+    def _unpack(self, record: struct.Struct, offset: int) -> Tuple:
+        """
+        Reads a record.
+        :param record: The layout of the record.
+        :type record: struct.Struct
+        :param offset: Its offset, within the file.
+        :type offset: int
+        :return: Its fields.
+        :rtype: Tuple
+        """
+        try:
+            return record.unpack_from(self._map, offset)
+        except struct.error as error:
+            raise ValueError(f"{self._path} is damaged: {error}") from error
+
+    def _string(self, offset: int, length: int) -> bytes:
+        """
+        Retrieves a string of the string table.
+        :param offset: Its offset, within the table.
+        :type offset: int
+        :param length: Its length, in bytes.
+        :type length: int
+        :return: The string, encoded.
+        :rtype: bytes
+        """
+        start = self._strings + offset
+        return self._map[start : start + length]
+
+    def _find(self, repository: str) -> int:
+        """
+        Finds a repository.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :return: Its position in the repository table, or -1.
+        :rtype: int
+        """
+        wanted = repository.encode("utf-8")
+        record = self.__class__._repository
+        low, high = 0, self._repository_count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            offset, length, _, _ = self._unpack(
+                record, self._repositories + middle * record.size
+            )
+            name = self._string(offset, length)
+            if name == wanted:
+                return middle
+            if name < wanted:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return -1
+
+    def __contains__(self, repository: str) -> bool:
+        """
+        Checks whether given repository is in the snapshot.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :return: True in such case.
+        :rtype: bool
+        """
+        return self._find(repository) >= 0
+
+    def _tag_range(self, repository: str) -> range:
+        """
+        Retrieves the positions of the tags of a repository.
+        :param repository: The repository.
+        :type repository: str
+        :return: Such positions, latest first; empty if it's unknown.
+        :rtype: range
+        """
+        position = self._find(repository)
+        if position < 0:
+            return range(0)
+        record = self.__class__._repository
+        _, _, first, count = self._unpack(
+            record, self._repositories + position * record.size
+        )
+        if first + count > self._tag_count:
+            raise ValueError(
+                f"{self._path} is damaged: the tags of {repository} are missing"
+            )
+        return range(first, first + count)
+
+    def tags(self, repository: str) -> List[Tuple[str, str, datetime]]:
+        """
+        Retrieves the tags of a repository.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :return: The name, commit SHA and commit date of each tag, latest first.
+        :rtype: List[Tuple[str, str, datetime.datetime]]
+        """
+        result = []
+        record = self.__class__._tag
+        for position in self._tag_range(repository):
+            offset, length, date, sha = self._unpack(
+                record, self._tags + position * record.size
+            )
+            result.append(
+                (
+                    self._string(offset, length).decode("utf-8"),
+                    sha.hex() if any(sha) else None,
+                    datetime.fromtimestamp(date, timezone.utc).replace(tzinfo=None)
+                    if date
+                    else None,
+                )
+            )
+        return result
+
+    def latest(self, repoOwner: str, repoName: str, prefix: str = None) -> str:
+        """
+        Retrieves the latest tag of a repository, as NixFlakeGitRepo.get_latest_github_tag does.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param prefix: The prefix of the tags we're interested in. Optional.
+        :type prefix: str
+        :return: The latest tag, without the prefix, or None if there's none.
+        :rtype: str
+        """
+        wanted = (prefix or "").encode("utf-8")
+        record = self.__class__._tag
+        for position in self._tag_range(f"{repoOwner}/{repoName}"):
+            offset, length, _, _ = self._unpack(
+                record, self._tags + position * record.size
+            )
+            name = self._string(offset, length)
+            if name.startswith(wanted):
+                return name[len(wanted) :].decode("utf-8")
+        return None
+
+    @classmethod
+    def write(cls, path: str, index: Dict[str, List[Tuple[str, str, datetime]]]) -> int:
+        """
+        Writes a snapshot, replacing the file atomically; processes mapping the old one keep it.
+        :param path: The file.
+        :type path: str
+        :param index: For each repository, its tags, as returned by NixFlakeGitRepo.fetch_github_tags().
+        :type index: Dict[str, List[Tuple[str, str, datetime.datetime]]]
+        :return: The size of the file, in bytes.
+        :rtype: int
+        """
+        repositories = sorted(
+            (name.encode("utf-8"), tags) for name, tags in index.items() if tags
+        )
+        strings = sorted(
+            {name for name, _ in repositories}
+            | {tag[0].encode("utf-8") for _, tags in repositories for tag in tags}
+        )
+        offsets = {}
+        table = bytearray()
+        for string in strings:
+            offsets[string] = len(table)
+            table += string
+        repository_table = bytearray()
+        tag_table = bytearray()
+        count = 0
+        for name, tags in repositories:
+            repository_table += cls._repository.pack(
+                offsets[name], len(name), count, len(tags)
+            )
+            for tag_name, sha, date in tags:
+                encoded = tag_name.encode("utf-8")
+                try:
+                    digest = bytes.fromhex(sha or "")
+                except ValueError:
+                    digest = b""
+                if date is not None and date.tzinfo is None:
+                    date = date.replace(tzinfo=timezone.utc)
+                tag_table += cls._tag.pack(
+                    offsets[encoded],
+                    len(encoded),
+                    int(date.timestamp()) if date is not None else 0,
+                    digest[:20].ljust(20, b"\0"),
+                )
+                count += 1
+        strings_offset = cls._header.size
+        repositories_offset = strings_offset + len(table)
+        tags_offset = repositories_offset + len(repository_table)
+        header = cls._header.pack(
+            cls.MAGIC,
+            cls.VERSION,
+            len(repositories),
+            count,
+            strings_offset,
+            repositories_offset,
+            tags_offset,
+        )
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as output:
+            for chunk in (header, table, repository_table, tag_table):
+                output.write(chunk)
+        os.replace(temporary, path)
+        return tags_offset + len(tag_table)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,475 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/tag_lookup_state.py
+
+This file defines the TagLookupState class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .github_token_pool import GithubTokenPool
+from .remote_cache import RemoteCache
+from .tag_index_snapshot import TagIndexSnapshot
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pythoneda import BaseObject
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+
+class TagLookupState(BaseObject):
+
+    """
+    The process-wide state NixFlakeGitRepo's tag lookups share.
+
+    It holds the layers in front of gitHub (the in-memory tags, the tag
+    index, the snapshot and the remote cache), how gitHub gets queried
+    (tokens, HTTP session, deadlines and hedging), and who gets told about
+    lookups and tag changes. Tests and worker processes can replace it as a
+    whole, through NixFlakeGitRepo.use_lookup_state().
+
+    Class name: TagLookupState
+
+    Responsibilities:
+        - Remember the latest tags in memory for a while.
+        - Keep the tag index, the snapshot and the remote cache in use.
+        - Keep the gitHub settings, and the latencies hedging depends on.
+        - Keep the listeners of tag lookups and changes.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Looks up tags through it.
+        - pythoneda.artifact.nix.flake.infrastructure.GithubTokenPool: The gitHub tokens.
+        - pythoneda.artifact.nix.flake.infrastructure.TagIndexSnapshot: The snapshot.
+        - pythoneda.artifact.nix.flake.infrastructure.RemoteCache: The remote cache.
+    """
+
+    def __init__(self):
+        """
+        Creates a new TagLookupState instance.
+        """
+        super().__init__()
+        self._github_tokens = GithubTokenPool()
+        self._github_api_url = "https://api.github.com"
+        self._http_session = None
+        self._http_executor = None
+        # the default timeout of NixFlakeGitRepo.deadline()
+        self._resolve_timeout = None
+        self._http_timeout = 30.0
+        # a second request is sent once the first one is slower than this percentile
+        self._hedge_percentile = 0.95
+        self._hedge_min_delay = 0.05
+        self._hedge_min_samples = 20
+        self._latencies = deque(maxlen=256)
+        # (owner, name, prefix) -> (expiration, tag), in front of tag_cache
+        self._latest_tags = {}
+        self._latest_tags_ttl = 300.0
+        # called with (repoOwner, repoName, tag, deleted) on tag changes
+        self._tag_listeners = []
+        # called with (repoOwner, repoName, prefix) on every tag lookup
+        self._tag_lookup_listeners = []
+        # lookups past the in-memory tags, which background work yields to
+        self._lookups_in_flight = 0
+        self._lookups_lock = threading.Lock()
+        # "owner/name" -> [(tag, sha, date)], latest first, as fetched in this process
+        self._tag_index = {}
+        self._tag_index_lock = threading.Lock()
+        # mapped read-only, between the in-memory tags and tag_cache
+        self._tag_snapshot = None
+        # "owner/name" whose tags changed after the snapshot got written
+        self._tag_snapshot_stale = set()
+        # shared by several hosts, underneath tag_cache
+        self._remote_cache = None
+        self._remote_cache_ttl = 3600.0
+        # how long to wait for another host fetching the same tags
+        self._remote_cache_wait = 5.0
+
+    @property
+    def github_tokens(self) -> GithubTokenPool:
+        """
+        Retrieves the gitHub tokens.
+        :return: Such tokens.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.GithubTokenPool
+        """
+        return self._github_tokens
+
+    @github_tokens.setter
+    def github_tokens(self, pool: GithubTokenPool):
+        """
+        Specifies the gitHub tokens.
+        :param pool: The tokens.
+        :type pool: pythoneda.artifact.nix.flake.infrastructure.GithubTokenPool
+        """
+        self._github_tokens = pool
+
+    @property
+    def github_api_url(self) -> str:
+        """
+        Retrieves the base URL of the gitHub API.
+        :return: Such URL, without trailing slash.
+        :rtype: str
+        """
+        return self._github_api_url
+
+    @github_api_url.setter
+    def github_api_url(self, url: str):
+        """
+        Specifies the base URL of the gitHub API.
+        :param url: Such URL, without trailing slash.
+        :type url: str
+        """
+        self._github_api_url = url
+
+    @property
+    def http_session(self):
+        """
+        Retrieves the HTTP session of the gitHub requests, if created already.
+        :return: Such session.
+        :rtype: requests.Session
+        """
+        return self._http_session
+
+    @http_session.setter
+    def http_session(self, session):
+        """
+        Specifies the HTTP session of the gitHub requests.
+        :param session: Such session. None to create a new one when needed.
+        :type session: requests.Session
+        """
+        self._http_session = session
+
+    def http_executor(self) -> ThreadPoolExecutor:
+        """
+        Retrieves the threads sending hedged gitHub requests, creating them if needed.
+        :return: Such threads.
+        :rtype: concurrent.futures.ThreadPoolExecutor
+        """
+        if self._http_executor is None:
+            self._http_executor = ThreadPoolExecutor(thread_name_prefix="github-get")
+        return self._http_executor
+
+    @property
+    def resolve_timeout(self) -> float:
+        """
+        Retrieves the default timeout of the resolutions.
+        :return: The seconds, or None for no deadline.
+        :rtype: float
+        """
+        return self._resolve_timeout
+
+    @property
+    def http_timeout(self) -> float:
+        """
+        Retrieves the timeout of each gitHub request.
+        :return: The seconds.
+        :rtype: float
+        """
+        return self._http_timeout
+
+    def request_deadlines(self, resolveTimeout: float, httpTimeout: float):
+        """
+        Bounds how long resolutions, and each gitHub request, can take.
+        :param resolveTimeout: The default timeout of the resolutions, in seconds. None for no deadline.
+        :type resolveTimeout: float
+        :param httpTimeout: The timeout of each gitHub request, in seconds.
+        :type httpTimeout: float
+        """
+        self._resolve_timeout = resolveTimeout
+        self._http_timeout = httpTimeout
+
+    def hedge_requests(self, percentile: float, minDelay: float):
+        """
+        Specifies when to send a second gitHub request.
+        :param percentile: The latency percentile after which to send it. None disables hedging.
+        :type percentile: float
+        :param minDelay: The minimum delay before sending it, in seconds.
+        :type minDelay: float
+        """
+        self._hedge_percentile = percentile
+        self._hedge_min_delay = minDelay
+
+    def deadline_settings(self) -> Dict[str, float]:
+        """
+        Retrieves the deadline and hedging settings, i.e. to pass them to other processes.
+        :return: The "resolveTimeout", "httpTimeout", "hedgePercentile" and "hedgeMinDelay".
+        :rtype: Dict[str, float]
+        """
+        return {
+            "resolveTimeout": self._resolve_timeout,
+            "httpTimeout": self._http_timeout,
+            "hedgePercentile": self._hedge_percentile,
+            "hedgeMinDelay": self._hedge_min_delay,
+        }
+
+    def record_latency(self, elapsed: float):
+        """
+        Records how long a gitHub request took.
+        :param elapsed: The seconds.
+        :type elapsed: float
+        """
+        self._latencies.append(elapsed)
+
+    def hedge_delay(self) -> float:
+        """
+        Retrieves how long to wait for a gitHub response before sending a second request.
+        :return: The seconds, or None if hedging is disabled, or the latencies are unknown yet.
+        :rtype: float
+        """
+        if self._hedge_percentile is None:
+            return None
+        latencies = sorted(self._latencies)
+        if len(latencies) < self._hedge_min_samples:
+            return None
+        position = min(
+            len(latencies) - 1, int(len(latencies) * self._hedge_percentile)
+        )
+        return max(self._hedge_min_delay, latencies[position])
+
+    @property
+    def latest_tags_ttl(self) -> float:
+        """
+        Retrieves how long tags are remembered in memory.
+        :return: The seconds.
+        :rtype: float
+        """
+        return self._latest_tags_ttl
+
+    @latest_tags_ttl.setter
+    def latest_tags_ttl(self, ttl: float):
+        """
+        Specifies how long tags are remembered in memory.
+        :param ttl: The seconds.
+        :type ttl: float
+        """
+        self._latest_tags_ttl = ttl
+
+    def remember(self, key: Tuple[str, str, str], tag: str):
+        """
+        Remembers the latest tag of a lookup, for the TTL.
+        :param key: The owner and name of the repository, and the prefix.
+        :type key: Tuple[str, str, str]
+        :param tag: The tag, without the prefix.
+        :type tag: str
+        """
+        self._latest_tags[key] = (time.monotonic() + self._latest_tags_ttl, tag)
+
+    def remembered(self, key: Tuple[str, str, str]) -> Tuple[float, str]:
+        """
+        Retrieves the latest tag remembered for a lookup, even if expired.
+        :param key: The owner and name of the repository, and the prefix.
+        :type key: Tuple[str, str, str]
+        :return: Its expiration, in time.monotonic() seconds, and the tag; or None.
+        :rtype: Tuple[float, str]
+        """
+        return self._latest_tags.get(key, None)
+
+    def forget_latest_tags(self, repoOwner: str = None, repoName: str = None):
+        """
+        Forgets the tags remembered in memory.
+        :param repoOwner: The owner of the repository. All of them if omitted.
+        :type repoOwner: str
+        :param repoName: The name of the repository. All of them if omitted.
+        :type repoName: str
+        """
+        if repoOwner is None and repoName is None:
+            self._latest_tags.clear()
+            return
+        for key in list(self._latest_tags):
+            if repoOwner in (None, key[0]) and repoName in (None, key[1]):
+                self._latest_tags.pop(key, None)
+
+    def tag_changed(
+        self, repoOwner: str, repoName: str, tag: str, deleted: bool
+    ) -> int:
+        """
+        Updates the tags remembered in memory for a repository which got a new tag, or lost one.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param tag: The tag.
+        :type tag: str
+        :param deleted: Whether the tag got deleted or moved, so it's forgotten instead.
+        :type deleted: bool
+        :return: The number of lookups updated.
+        :rtype: int
+        """
+        result = 0
+        self._tag_snapshot_stale.add(f"{repoOwner}/{repoName}")
+        for key in list(self._latest_tags):
+            owner, name, prefix = key
+            if (owner, name) != (repoOwner, repoName) or (
+                prefix is not None and not tag.startswith(prefix)
+            ):
+                continue
+            if deleted:
+                self._latest_tags.pop(key, None)
+            else:
+                self.remember(key, tag[len(prefix or "") :])
+            result += 1
+        return result
+
+    @property
+    def tag_listeners(self) -> List[Callable[[str, str, str, bool], None]]:
+        """
+        Retrieves the listeners of tag changes.
+        :return: Such listeners.
+        :rtype: List[Callable[[str, str, str, bool], None]]
+        """
+        return self._tag_listeners
+
+    @property
+    def tag_lookup_listeners(self) -> List[Callable[[str, str, str], None]]:
+        """
+        Retrieves the listeners of tag lookups.
+        :return: Such listeners.
+        :rtype: List[Callable[[str, str, str], None]]
+        """
+        return self._tag_lookup_listeners
+
+    @property
+    def lookups_in_flight(self) -> int:
+        """
+        Retrieves how many tag lookups are reading the disk cache or gitHub right now.
+        :return: Such number.
+        :rtype: int
+        """
+        return self._lookups_in_flight
+
+    def lookup_started(self):
+        """
+        Counts a lookup reading the disk cache or gitHub.
+        """
+        with self._lookups_lock:
+            self._lookups_in_flight += 1
+
+    def lookup_finished(self):
+        """
+        Stops counting a lookup reading the disk cache or gitHub.
+        """
+        with self._lookups_lock:
+            self._lookups_in_flight -= 1
+
+    def index_tags(self, repository: str, tags: List[Tuple[str, str, datetime]]):
+        """
+        Adds the tags of a repository to the tag index.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :param tags: Its tags, as returned by NixFlakeGitRepo.fetch_github_tags().
+        :type tags: List[Tuple[str, str, datetime.datetime]]
+        """
+        with self._tag_index_lock:
+            self._tag_index[repository] = tags
+
+    def tag_index(self) -> Dict[str, List[Tuple[str, str, datetime]]]:
+        """
+        Retrieves the tag index.
+        :return: A copy of it.
+        :rtype: Dict[str, List[Tuple[str, str, datetime.datetime]]]
+        """
+        with self._tag_index_lock:
+            return dict(self._tag_index)
+
+    @property
+    def tag_snapshot(self) -> TagIndexSnapshot:
+        """
+        Retrieves the snapshot of the tag index in use.
+        :return: Such snapshot, or None.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagIndexSnapshot
+        """
+        return self._tag_snapshot
+
+    def use_tag_snapshot(self, snapshot: TagIndexSnapshot):
+        """
+        Answers tag lookups from given snapshot, closing the previous one.
+        :param snapshot: The snapshot, or None.
+        :type snapshot: pythoneda.artifact.nix.flake.infrastructure.TagIndexSnapshot
+        """
+        previous = self._tag_snapshot
+        self._tag_snapshot = snapshot
+        self._tag_snapshot_stale = set()
+        if previous is not None and previous is not snapshot:
+            previous.close()
+
+    def snapshot_stale(self, repository: str) -> bool:
+        """
+        Checks whether the tags of a repository changed after the snapshot got written.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        :return: True in such case.
+        :rtype: bool
+        """
+        return repository in self._tag_snapshot_stale
+
+    def mark_snapshot_stale(self, repository: str):
+        """
+        Stops answering the lookups of a repository from the snapshot.
+        :param repository: The repository, i.e. "rydnr/nix-flakes".
+        :type repository: str
+        """
+        self._tag_snapshot_stale.add(repository)
+
+    @property
+    def remote_cache(self) -> RemoteCache:
+        """
+        Retrieves the remote cache in use.
+        :return: Such cache, or None.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.RemoteCache
+        """
+        return self._remote_cache
+
+    @property
+    def remote_cache_ttl(self) -> float:
+        """
+        Retrieves how long the tags are shared.
+        :return: The seconds.
+        :rtype: float
+        """
+        return self._remote_cache_ttl
+
+    @property
+    def remote_cache_wait(self) -> float:
+        """
+        Retrieves how long to wait for another host fetching the same tags.
+        :return: The seconds.
+        :rtype: float
+        """
+        return self._remote_cache_wait
+
+    def use_remote_cache(self, cache: RemoteCache, ttl: float = None):
+        """
+        Shares the tags through given cache, closing the previous one.
+        :param cache: The cache, or None.
+        :type cache: pythoneda.artifact.nix.flake.infrastructure.RemoteCache
+        :param ttl: How long the tags are shared, in seconds. Optional.
+        :type ttl: float
+        """
+        previous = self._remote_cache
+        self._remote_cache = cache
+        if ttl is not None:
+            self._remote_cache_ttl = ttl
+        if previous is not None and previous is not cache:
+            previous.close()
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,272 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/tag_refresher.py
+
+This file defines the TagRefresher class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import math
+import os
+from pythoneda import BaseObject
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+class TagRefresher(BaseObject):
+
+    """
+    Refreshes hot tags shortly before they expire from memory, in the background.
+
+    Every lookup adds to the score of its (owner, repository, prefix), and
+    scores decay over time, so only the tags looked up often stay hot. The
+    refresher spends at most a budget of gitHub requests per window, and
+    waits while interactive lookups are past the in-memory tags.
+
+    Class name: TagRefresher
+
+    Responsibilities:
+        - Track how often each tag gets looked up.
+        - Refresh the hot ones ahead of their expiration, within a request budget.
+        - Stay out of the way of interactive lookups.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Looks up and remembers the tags.
+    """
+
+    def __init__(
+        self,
+        repoClass: type = None,
+        budget: int = 300,
+        window: float = 3600.0,
+        lead: float = 30.0,
+        halfLife: float = 600.0,
+        minScore: float = 3.0,
+        interval: float = 5.0,
+    ):
+        """
+        Creates a new TagRefresher instance.
+        :param repoClass: The class whose tags get refreshed. NixFlakeGitRepo if omitted.
+        :type repoClass: type
+        :param budget: How many gitHub requests to spend per window, at most.
+        :type budget: int
+        :param window: The length of the budget window, in seconds.
+        :type window: float
+        :param lead: How long before their expiration tags get refreshed, in seconds.
+        :type lead: float
+        :param halfLife: How long it takes the score of a tag to halve, in seconds.
+        :type halfLife: float
+        :param minScore: The score from which a tag is hot.
+        :type minScore: float
+        :param interval: How often to look for tags to refresh, in seconds.
+        :type interval: float
+        """
+        super().__init__()
+        if repoClass is None:
+            from .nix_flake_git_repo import NixFlakeGitRepo
+
+            repoClass = NixFlakeGitRepo
+        self._repo_class = repoClass
+        self._budget = budget
+        self._window = window
+        self._lead = lead
+        self._decay = math.log(2) / halfLife
+        self._min_score = minScore
+        self._interval = interval
+        # (owner, name, prefix) -> [score, last lookup]
+        self._scores = {}
+        # (time, requests) of the refreshes within the window
+        self._spent = []
+        # (owner, name, prefix) -> requests of its last refresh
+        self._costs = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._counters = {"refreshed": 0, "failed": 0, "skipped_budget": 0}
+        self._listening = False
+
+    def _looked_up(self, repoOwner: str, repoName: str, prefix: str):
+        """
+        Adds a lookup to the score of its tag.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param prefix: The prefix of the lookup.
+        :type prefix: str
+        """
+        now = time.monotonic()
+        key = (repoOwner, repoName, prefix)
+        with self._lock:
+            entry = self._scores.get(key, None)
+            if entry is None:
+                self._scores[key] = [1.0, now]
+            else:
+                entry[0] = entry[0] * math.exp(-self._decay * (now - entry[1])) + 1
+                entry[1] = now
+
+    def score(self, repoOwner: str, repoName: str, prefix: str = None) -> float:
+        """
+        Retrieves the current score of a tag.
+        :param repoOwner: The owner of the repository.
+        :type repoOwner: str
+        :param repoName: The name of the repository.
+        :type repoName: str
+        :param prefix: The prefix of the lookup.
+        :type prefix: str
+        :return: The score, decayed until now.
+        :rtype: float
+        """
+        with self._lock:
+            entry = self._scores.get((repoOwner, repoName, prefix), None)
+        if entry is None:
+            return 0.0
+        return entry[0] * math.exp(-self._decay * (time.monotonic() - entry[1]))
+
+    def due(self) -> List[Tuple[str, str, str]]:
+        """
+        Retrieves the hot tags expiring soon, hottest first.
+        Cold tags are forgotten along the way.
+        :return: Their owner, repository and prefix.
+        :rtype: List[Tuple[str, str, str]]
+        """
+        now = time.monotonic()
+        candidates = []
+        with self._lock:
+            keys = list(self._scores)
+        for key in keys:
+            score = self.score(*key)
+            if score < self._min_score / 10:
+                with self._lock:
+                    self._scores.pop(key, None)
+                    self._costs.pop(key, None)
+                continue
+            if score < self._min_score:
+                continue
+            expiration = self._repo_class.latest_tag_expiration(*key)
+            if expiration is not None and expiration - now <= self._lead:
+                candidates.append((score, key))
+        return [key for score, key in sorted(candidates, reverse=True)]
+
+    def remaining_budget(self) -> int:
+        """
+        Retrieves how many requests can still be spent in the current window.
+        :return: Such number.
+        :rtype: int
+        """
+        horizon = time.monotonic() - self._window
+        with self._lock:
+            self._spent = [item for item in self._spent if item[0] > horizon]
+            return self._budget - sum(requests for _, requests in self._spent)
+
+    def refresh_due(self) -> int:
+        """
+        Refreshes the tags which are due, while the budget allows it.
+        :return: The number of refreshed tags.
+        :rtype: int
+        """
+        result = 0
+        for key in self.due():
+            # interactive lookups go first
+            while (
+                self._repo_class.lookups_in_flight() > 0
+                and not self._stopped.wait(0.05)
+            ):
+                pass
+            if self._stopped.is_set():
+                break
+            if self.remaining_budget() < self._costs.get(key, 1):
+                self._counters["skipped_budget"] += 1
+                continue
+            lookup = {}
+            try:
+                tag = self._repo_class.refresh_latest_github_tag(*key, lookup=lookup)
+            except Exception as error:
+                TagRefresher.logger().warning(f"Cannot refresh {key}: {error}")
+                tag = None
+            cost = lookup.get("requests", 1)
+            with self._lock:
+                # a failed request counts too
+                self._spent.append((time.monotonic(), cost))
+                self._costs[key] = cost
+            if tag is None:
+                self._counters["failed"] += 1
+            else:
+                self._counters["refreshed"] += 1
+                result += 1
+        return result
+
+    def stats(self) -> Dict:
+        """
+        Retrieves the counters of this refresher.
+        :return: Such counters, the tracked tags and the remaining budget.
+        :rtype: Dict
+        """
+        return dict(
+            self._counters, tracked=len(self._scores), budget=self.remaining_budget()
+        )
+
+    def start(self) -> "TagRefresher":
+        """
+        Starts tracking lookups, and refreshing in a background thread.
+        :return: This instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.TagRefresher
+        """
+        if not self._listening:
+            self._repo_class.on_tag_lookup(self._looked_up)
+            self._listening = True
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="tag-refresher", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops refreshing.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """
+        Refreshes the tags which are due, periodically, at a lower CPU priority.
+        """
+        try:
+            # on Linux, niceness applies to this thread only
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while not self._stopped.wait(self._interval):
+            try:
+                self.refresh_due()
+            except Exception as error:
+                TagRefresher.logger().warning(f"Tag refresh failed: {error}")
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,245 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/tag_webhook_receiver.py
+
+This file defines the TagWebhookReceiver class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import hashlib
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pythoneda import BaseObject
+import threading
+from typing import Dict, Tuple
+
+
+class TagWebhookReceiver(BaseObject):
+
+    """
+    Receives gitHub webhooks about tags, and updates the remembered tags right away.
+
+    Repositories (or organizations) send their "create", "delete" and "push"
+    events here, signed with a shared secret. Since new tags arrive within
+    seconds, the tags can be remembered for long, without polling gitHub.
+
+    Class name: TagWebhookReceiver
+
+    Responsibilities:
+        - Listen for webhook deliveries on a local HTTP port.
+        - Verify their HMAC-SHA256 signature.
+        - Apply the tag events to NixFlakeGitRepo.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Updates its tags.
+        - pythoneda.artifact.nix.flake.infrastructure.cli.TagWebhookCli: Starts it.
+    """
+
+    # gitHub caps payloads at 25 MB
+    _max_payload = 25 * 1024 * 1024
+
+    def __init__(self, secret: str, repoClass: type = None):
+        """
+        Creates a new TagWebhookReceiver instance.
+        :param secret: The secret of the webhook.
+        :type secret: str
+        :param repoClass: The class whose tags get updated. NixFlakeGitRepo if omitted.
+        :type repoClass: type
+        """
+        super().__init__()
+        if not secret:
+            raise ValueError("A webhook secret is required")
+        self._secret = secret.encode("utf-8")
+        self._repo_class = repoClass
+        self._server = None
+        self._counters = {"deliveries": 0, "rejected": 0, "tags": 0, "updated": 0}
+
+    @property
+    def repo_class(self) -> type:
+        """
+        Retrieves the class whose tags get updated.
+        :return: Such class.
+        :rtype: type
+        """
+        if self._repo_class is None:
+            from .nix_flake_git_repo import NixFlakeGitRepo
+
+            self._repo_class = NixFlakeGitRepo
+        return self._repo_class
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Retrieves the counters of this receiver.
+        :return: Such counters.
+        :rtype: Dict[str, int]
+        """
+        return dict(self._counters)
+
+    def verify(self, body: bytes, signature: str) -> bool:
+        """
+        Checks the signature of a delivery.
+        :param body: The payload, as received.
+        :type body: bytes
+        :param signature: The X-Hub-Signature-256 header, i.e. "sha256=...".
+        :type signature: str
+        :return: True if it's signed with our secret.
+        :rtype: bool
+        """
+        if not signature or not signature.startswith("sha256="):
+            return False
+        expected = hmac.new(self._secret, body, hashlib.sha256).hexdigest()
+        # compare_digest() refuses non-ASCII strings, but not bytes
+        return hmac.compare_digest(
+            expected.encode("ascii"),
+            signature[len("sha256=") :].encode("utf-8", "replace"),
+        )
+
+    @classmethod
+    def tag_event(cls, event: str, payload: Dict) -> Tuple[str, str, bool]:
+        """
+        Extracts the tag change of a webhook event.
+        :param event: The X-GitHub-Event header.
+        :type event: str
+        :param payload: The payload.
+        :type payload: Dict
+        :return: The repository, i.e. "rydnr/nix-flakes", the tag, and whether it got deleted or moved; or None if it's not about tags.
+        :rtype: Tuple[str, str, bool]
+        """
+        if not isinstance(payload, dict) or not isinstance(
+            payload.get("repository", None), dict
+        ):
+            return None
+        repository = payload["repository"].get("full_name", None)
+        if not isinstance(repository, str) or "/" not in repository:
+            return None
+        ref = payload.get("ref", None)
+        if not isinstance(ref, str) or not ref:
+            return None
+        if event in ("create", "delete"):
+            if payload.get("ref_type", None) != "tag":
+                return None
+            return repository, ref, event == "delete"
+        if event == "push":
+            if not ref.startswith("refs/tags/"):
+                return None
+            # a forced push moves the tag, so it's not necessarily the latest
+            created = payload.get("created", False) and not payload.get("forced", False)
+            return repository, ref[len("refs/tags/") :], not created
+        return None
+
+    def deliver(self, event: str, body: bytes, signature: str) -> Tuple[int, Dict]:
+        """
+        Processes a delivery.
+        :param event: The X-GitHub-Event header.
+        :type event: str
+        :param body: The payload, as received.
+        :type body: bytes
+        :param signature: The X-Hub-Signature-256 header.
+        :type signature: str
+        :return: The HTTP status, and the response.
+        :rtype: Tuple[int, Dict]
+        """
+        self._counters["deliveries"] += 1
+        if not self.verify(body, signature):
+            self._counters["rejected"] += 1
+            TagWebhookReceiver.logger().warning("Rejecting unsigned webhook delivery")
+            return 401, {"error": "invalid signature"}
+        if event == "ping":
+            return 200, {"ok": True}
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, {"error": "invalid payload"}
+        change = self.__class__.tag_event(event, payload)
+        if change is None:
+            return 202, {"ignored": event}
+        repository, tag, deleted = change
+        owner, name = repository.split("/", 1)
+        updated = self.repo_class.tag_changed(owner, name, tag, deleted)
+        self._counters["tags"] += 1
+        self._counters["updated"] += updated
+        TagWebhookReceiver.logger().info(
+            f"{'Forgot' if deleted else 'Updated'} {repository}@{tag} "
+            f"({updated} entries)"
+        )
+        return 200, {"repository": repository, "tag": tag, "updated": updated}
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> int:
+        """
+        Starts receiving deliveries on http://host:port/, in a background thread.
+        :param port: The port. 0 picks a free one.
+        :type port: int
+        :param host: The address to listen on. Only local by default, i.e. behind a reverse proxy.
+        :type host: str
+        :return: The port.
+        :rtype: int
+        """
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                if length > receiver.__class__._max_payload:
+                    self._reply(413, {"error": "payload too large"})
+                    return
+                status, response = receiver.deliver(
+                    self.headers.get("X-GitHub-Event", ""),
+                    self.rfile.read(length),
+                    self.headers.get("X-Hub-Signature-256", ""),
+                )
+                self._reply(status, response)
+
+            def _reply(self, status: int, response: Dict):
+                body = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        if self._server is None:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(
+                target=self._server.serve_forever, name="tag-webhook", daemon=True
+            ).start()
+            TagWebhookReceiver.logger().info(
+                f"Receiving tag webhooks on http://{host}:{self._server.server_port}/"
+            )
+        return self._server.server_port
+
+    def stop(self):
+        """
+        Stops receiving deliveries.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
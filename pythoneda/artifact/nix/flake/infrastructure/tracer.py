@@ -0,0 +1,365 @@
+# vim: set fileencoding=utf-8
+"""
+pythoneda/artifact/nix/flake/infrastructure/tracer.py
+
+This file defines the Tracer class.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .span import Span
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import os
+from pythoneda import BaseObject, Event
+import sys
+import threading
+from typing import Any, Dict, Iterator
+
+
+class Tracer(BaseObject):
+
+    """
+    Traces the path of an event, from the d-bus signal to the emission of its outcome.
+
+    Class name: Tracer
+
+    Responsibilities:
+        - Create spans, nesting them under the current one.
+        - Keep the root span of each received event open until its outcome is emitted.
+        - Export finished spans as OTLP/JSON lines, to stdout or to a file.
+
+    Collaborators:
+        - pythoneda.artifact.nix.flake.infrastructure.Span: The traced operations.
+        - pythoneda.artifact.nix.flake.infrastructure.NixFlakeGitRepo: Traces resolutions and tag lookups.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalListener: Starts traces.
+        - pythoneda.artifact.nix.flake.infrastructure.dbus.NixFlakeDbusSignalEmitter: Ends them.
+    """
+
+    _singleton = None
+    # "stdout", a file path, or None to disable tracing
+    _default_destination = os.environ.get("PYTHONEDA_NIX_FLAKE_TRACES", None)
+    _service_name = "pythoneda-artifact-nix-flake-infrastructure"
+
+    _current = ContextVar("nix_flake_current_span", default=None)
+
+    def __init__(self, destination: str = None, maxOpenTraces: int = 1024):
+        """
+        Creates a new Tracer instance.
+        :param destination: Where to export the spans: "stdout", or a file path. None disables tracing.
+        :type destination: str
+        :param maxOpenTraces: How many traces to keep open, waiting for their outcome.
+        :type maxOpenTraces: int
+        """
+        super().__init__()
+        self._destination = destination
+        self._max_open_traces = maxOpenTraces
+        # event id -> root span
+        self._open_traces = OrderedDict()
+        self._lock = threading.Lock()
+        self._noop = Span.noop()
+
+    @classmethod
+    def instance(cls) -> "Tracer":
+        """
+        Retrieves the process-wide instance.
+        :return: Such instance.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Tracer
+        """
+        if cls._singleton is None:
+            cls._singleton = cls(cls._default_destination)
+        return cls._singleton
+
+    @classmethod
+    def export_to(cls, destination: str):
+        """
+        Specifies where to export the spans. Defaults to the PYTHONEDA_NIX_FLAKE_TRACES environment variable.
+        :param destination: "stdout", a file path, or None to disable tracing.
+        :type destination: str
+        """
+        cls._default_destination = destination
+        if cls._singleton is not None:
+            cls._singleton._destination = destination
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Checks whether tracing is enabled.
+        :return: True in such case.
+        :rtype: bool
+        """
+        return self._destination is not None
+
+    def current(self) -> Span:
+        """
+        Retrieves the current span.
+        :return: Such span, or None if there's none.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        return self.__class__._current.get()
+
+    def set_attribute(self, key: str, value: Any):
+        """
+        Sets an attribute of the current span, if any.
+        :param key: The attribute name.
+        :type key: str
+        :param value: Its value.
+        :type value: Any
+        """
+        span = self.current()
+        if span is not None:
+            span.set_attribute(key, value)
+
+    def start(
+        self,
+        name: str,
+        attributes: Dict[str, Any] = None,
+        parent: Span = None,
+        kind: int = Span.INTERNAL,
+    ) -> Span:
+        """
+        Starts a span, without making it the current one.
+        :param name: The name of the operation.
+        :type name: str
+        :param attributes: The initial attributes.
+        :type attributes: Dict[str, Any]
+        :param parent: The parent span. Defaults to the current one.
+        :type parent: pythoneda.artifact.nix.flake.infrastructure.Span
+        :param kind: The span kind.
+        :type kind: int
+        :return: The span.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        if not self.enabled:
+            return self._noop
+        if parent is None:
+            parent = self.current()
+        if parent is None or not parent.recording:
+            return Span(name, kind=kind, attributes=attributes)
+        return Span(
+            name,
+            traceId=parent.trace_id,
+            parentSpanId=parent.span_id,
+            kind=kind,
+            attributes=attributes,
+        )
+
+    def finish(self, span: Span):
+        """
+        Ends given span, and exports it.
+        :param span: The span.
+        :type span: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        if not span.recording or span.ended:
+            return
+        span.end()
+        self._export(span)
+
+    @contextmanager
+    def activate(self, span: Span) -> Iterator[Span]:
+        """
+        Makes given span the current one, within the block.
+        :param span: The span. If None, the current one remains.
+        :type span: pythoneda.artifact.nix.flake.infrastructure.Span
+        :return: The span.
+        :rtype: Iterator[pythoneda.artifact.nix.flake.infrastructure.Span]
+        """
+        if span is None:
+            yield self.current()
+            return
+        token = self.__class__._current.set(span)
+        try:
+            yield span
+        finally:
+            self.__class__._current.reset(token)
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        attributes: Dict[str, Any] = None,
+        parent: Span = None,
+        kind: int = Span.INTERNAL,
+    ) -> Iterator[Span]:
+        """
+        Traces the operation within the block, as the current span.
+        :param name: The name of the operation.
+        :type name: str
+        :param attributes: The initial attributes.
+        :type attributes: Dict[str, Any]
+        :param parent: The parent span. Defaults to the current one.
+        :type parent: pythoneda.artifact.nix.flake.infrastructure.Span
+        :param kind: The span kind.
+        :type kind: int
+        :return: The span.
+        :rtype: Iterator[pythoneda.artifact.nix.flake.infrastructure.Span]
+        """
+        if not self.enabled:
+            yield self._noop
+            return
+        span = self.start(name, attributes, parent, kind)
+        token = self.__class__._current.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.set_error(error)
+            raise
+        finally:
+            self.__class__._current.reset(token)
+            self.finish(span)
+
+    def follow(self, event: Event, span: Span):
+        """
+        Keeps given root span open until the outcome of given event is emitted.
+        :param event: The received event.
+        :type event: pythoneda.Event
+        :param span: Its root span.
+        :type span: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        event_id = getattr(event, "id", None)
+        if not span.recording or event_id is None:
+            return
+        evicted = []
+        with self._lock:
+            self._open_traces[event_id] = span
+            while len(self._open_traces) > self._max_open_traces:
+                evicted.append(self._open_traces.popitem(last=False)[1])
+        for root in evicted:
+            root.set_attribute("trace.incomplete", True)
+            self.finish(root)
+
+    def trace_of(self, event: Event) -> Span:
+        """
+        Retrieves the open root span of given received event.
+        :param event: The received event.
+        :type event: pythoneda.Event
+        :return: Such span, or None if it's not being traced.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        with self._lock:
+            return self._open_traces.get(getattr(event, "id", None), None)
+
+    def outcome_of(self, event: Event) -> Span:
+        """
+        Retrieves the open root span of the event given one is the outcome of.
+        :param event: The outcome.
+        :type event: pythoneda.Event
+        :return: The root span, or None if none is open.
+        :rtype: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        with self._lock:
+            for event_id in getattr(event, "previous_event_ids", None) or []:
+                result = self._open_traces.get(event_id, None)
+                if result is not None:
+                    return result
+        return None
+
+    def conclude(self, event: Event):
+        """
+        Ends the traces given outcome concludes.
+        :param event: The outcome.
+        :type event: pythoneda.Event
+        """
+        roots = []
+        with self._lock:
+            for event_id in getattr(event, "previous_event_ids", None) or []:
+                root = self._open_traces.pop(event_id, None)
+                if root is not None:
+                    roots.append(root)
+        for root in roots:
+            self.finish(root)
+
+    def abort(self, event: Event, error: BaseException):
+        """
+        Ends the trace of given received event, because processing it failed.
+        :param event: The received event.
+        :type event: pythoneda.Event
+        :param error: The error.
+        :type error: BaseException
+        """
+        with self._lock:
+            root = self._open_traces.pop(getattr(event, "id", None), None)
+        if root is not None:
+            root.set_error(error)
+            self.finish(root)
+
+    def discard(self, event: Event, reason: str):
+        """
+        Ends the trace of given received event, which won't be processed.
+        :param event: The received event.
+        :type event: pythoneda.Event
+        :param reason: Why it won't.
+        :type reason: str
+        """
+        with self._lock:
+            root = self._open_traces.pop(getattr(event, "id", None), None)
+        if root is not None:
+            root.set_attribute("event.discarded", reason)
+            self.finish(root)
+
+    def _export(self, span: Span):
+        """
+        Writes given span as an OTLP/JSON line.
+        :param span: The span.
+        :type span: pythoneda.artifact.nix.flake.infrastructure.Span
+        """
+        scope = {"name": self.__class__.full_class_name(self.__class__)}
+        line = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": [
+                                {
+                                    "key": "service.name",
+                                    "value": {
+                                        "stringValue": self.__class__._service_name
+                                    },
+                                }
+                            ]
+                        },
+                        "scopeSpans": [
+                            {
+                                "scope": scope,
+                                "spans": [span.to_otlp()],
+                            }
+                        ],
+                    }
+                ]
+            }
+        )
+        destination = self._destination
+        try:
+            with self._lock:
+                if destination == "stdout":
+                    sys.stdout.write(line + "\n")
+                    sys.stdout.flush()
+                elif destination is not None:
+                    with open(destination, "a") as output:
+                        output.write(line + "\n")
+        except OSError as error:
+            Tracer.logger().warning(f"Cannot export span {span.name}: {error}")
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
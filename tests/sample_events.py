@@ -0,0 +1,109 @@
+# vim: set fileencoding=utf-8
+"""
+tests/sample_events.py
+
+This file defines the events the tests exchange.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from pythoneda import Event
+
+
+class SampleRequested(Event):
+
+    """
+    A request carrying a payload, as ChangeStagingCodeExecutionRequested does.
+
+    Class name: SampleRequested
+
+    Responsibilities:
+        - Carry a payload.
+
+    Collaborators:
+        - None
+    """
+
+    def __init__(self, payload: str, previousEventIds=None):
+        """
+        Creates a new SampleRequested instance.
+        :param payload: The payload.
+        :type payload: str
+        :param previousEventIds: The ids of the events it follows.
+        :type previousEventIds: List[str]
+        """
+        super().__init__(previousEventIds)
+        self._payload = payload
+
+    @property
+    def payload(self) -> str:
+        """
+        Retrieves the payload.
+        :return: Such payload.
+        :rtype: str
+        """
+        return self._payload
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self._payload!r})"
+
+
+class SampleExecutionRequested(SampleRequested):
+
+    """
+    A request to package some code, as ChangeStagingCodeExecutionRequested is.
+
+    Class name: SampleExecutionRequested
+
+    Responsibilities:
+        - Carry a code request.
+
+    Collaborators:
+        - None
+    """
+
+    @property
+    def code_request(self) -> str:
+        """
+        Retrieves the code request.
+        :return: The code, in this case.
+        :rtype: str
+        """
+        return self._payload
+
+
+class SamplePackaged(SampleRequested):
+
+    """
+    The result of a SampleRequested, as ChangeStagingCodeExecutionPackaged is.
+
+    Class name: SamplePackaged
+
+    Responsibilities:
+        - Answer a request.
+
+    Collaborators:
+        - tests.sample_events.SampleRequested: The request.
+    """
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,116 @@
+# vim: set fileencoding=utf-8
+"""
+tests/sample_flakes.py
+
+This file defines the flakes and the repository the tests package.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+from pythoneda.artifact.nix.flake.infrastructure import NixFlakeGitRepo
+from typing import List
+
+
+class SampleFlake:
+
+    """
+    A flake rendering a flake.nix with its code, as CodeExecutionNixFlake does.
+
+    Class name: SampleFlake
+
+    Responsibilities:
+        - Render its files.
+
+    Collaborators:
+        - None
+    """
+
+    renders = 0
+
+    def __init__(self, name: str, version: str, code: str):
+        """
+        Creates a new SampleFlake instance.
+        :param name: The name.
+        :type name: str
+        :param version: The version.
+        :type version: str
+        :param code: The code it packages.
+        :type code: str
+        """
+        self.name = name
+        self.version = version
+        self.url = f"https://example.org/{name}"
+        self.inputs = []
+        self.code = code
+
+    def generate(self, folder: str):
+        """
+        Renders the files of this flake.
+        :param folder: The folder.
+        :type folder: str
+        """
+        SampleFlake.renders += 1
+        with open(os.path.join(folder, "flake.nix"), "w") as output:
+            output.write(f"# {self.name} {self.version}\n{self.code}\n")
+        os.makedirs(os.path.join(folder, "src"), exist_ok=True)
+        with open(os.path.join(folder, "src", "main.py"), "w") as output:
+            output.write(self.code)
+
+    def __repr__(self) -> str:
+        return f"SampleFlake({self.name!r}, {self.version!r})"
+
+
+class SampleRepo(NixFlakeGitRepo):
+
+    """
+    A NixFlakeGitRepo packaging code requests as SampleFlakes, without gitHub.
+
+    Class name: SampleRepo
+
+    Responsibilities:
+        - Resolve code requests offline.
+
+    Collaborators:
+        - tests.sample_flakes.SampleFlake: The flakes.
+    """
+
+    def default_latest_flakes(self) -> List:
+        """
+        Retrieves the flakes every code request depends on: none.
+        :return: Such flakes.
+        :rtype: List
+        """
+        return []
+
+    def latest_code_execution(self, codeRequest: str) -> SampleFlake:
+        """
+        Resolves the flake of given code request.
+        :param codeRequest: The code.
+        :type codeRequest: str
+        :return: Its flake.
+        :rtype: tests.sample_flakes.SampleFlake
+        """
+        return SampleFlake("code-execution", "1.0", codeRequest)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,186 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_dbus_connection_pool.py
+
+This file tests how the d-bus connections survive failures, and buffer messages meanwhile.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from dbus_next import BusType, Message
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    DbusConnectionPool,
+    dbus_connection_pool,
+)
+import pytest
+
+
+class FakeBus:
+    """
+    A d-bus connection recording what it sends, until told to fail.
+    """
+
+    connections = []
+    refused = 0
+
+    def __init__(self, bus_type=None, negotiate_unix_fd=False):
+        self.connected = False
+        self.sent = []
+        self.failing = False
+        self.handlers = []
+        self.rules = []
+
+    async def connect(self):
+        if FakeBus.refused > 0:
+            FakeBus.refused -= 1
+            raise ConnectionRefusedError("no bus")
+        self.connected = True
+        self.disconnected = asyncio.get_running_loop().create_future()
+        FakeBus.connections.append(self)
+        return self
+
+    def add_message_handler(self, handler):
+        self.handlers.append(handler)
+
+    async def call(self, message):
+        self.rules.extend(message.body)
+
+    async def send(self, message):
+        if self.failing or not self.connected:
+            raise EOFError("broken pipe")
+        self.sent.append(message.member)
+
+    def disconnect(self):
+        self.connected = False
+        if not self.disconnected.done():
+            self.disconnected.set_result(None)
+
+    async def wait_for_disconnect(self):
+        await self.disconnected
+
+
+@pytest.fixture(autouse=True)
+def fake_bus(monkeypatch):
+    FakeBus.connections = []
+    FakeBus.refused = 0
+    monkeypatch.setattr(dbus_connection_pool, "MessageBus", FakeBus)
+    yield FakeBus
+
+
+def signal(member):
+    return Message.new_signal("/org/example/sample", "org.example.Sample", member)
+
+
+async def eventually(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def test_messages_are_buffered_until_connected(fake_bus):
+    async def scenario():
+        pool = DbusConnectionPool(initialDelay=0.01)
+        fake_bus.refused = 2
+        sent = []
+        await pool.send(BusType.SESSION, signal("First"), lambda: sent.append(1))
+        await pool.send(BusType.SESSION, signal("Second"))
+        assert pool.stats()["buffered"] == {"SESSION": 2}
+        bus = await pool.connect(BusType.SESSION)
+        await eventually(lambda: len(bus.sent) == 2)
+        assert bus.sent == ["First", "Second"]
+        assert sent == [1]
+        assert pool.stats()["buffered"] == {"SESSION": 0}
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_sends_reconnect_and_get_flushed(fake_bus):
+    async def scenario():
+        pool = DbusConnectionPool(initialDelay=0.01)
+        handler = lambda message: None
+        await pool.subscribe(BusType.SESSION, "type='signal'", handler)
+        first = await pool.connect(BusType.SESSION)
+        await pool.send(BusType.SESSION, signal("Before"))
+        first.failing = True
+        await pool.send(BusType.SESSION, signal("Failed"))
+        await pool.send(BusType.SESSION, signal("Meanwhile"))
+        await eventually(lambda: len(fake_bus.connections) == 2)
+        second = fake_bus.connections[1]
+        await eventually(lambda: len(second.sent) == 2)
+        assert first.sent == ["Before"]
+        assert not first.connected
+        assert second.sent == ["Failed", "Meanwhile"]
+        assert second.handlers == [handler]
+        assert second.rules == ["type='signal'"]
+        assert await pool.connect(BusType.SESSION) is second
+        stats = pool.stats()
+        assert stats["connected"] == {"SESSION": True}
+        assert stats["buffered"] == {"SESSION": 0}
+        assert stats["reconnections"] == 1
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_flushes_reconnect(fake_bus):
+    async def scenario():
+        pool = DbusConnectionPool(initialDelay=0.01)
+        await pool.send(BusType.SESSION, signal("Buffered"))
+        original = FakeBus.send
+
+        async def fail_once(self, message):
+            FakeBus.send = original
+            raise EOFError("broken pipe")
+
+        FakeBus.send = fail_once
+        try:
+            await pool.connect(BusType.SESSION)
+            await eventually(lambda: len(fake_bus.connections) == 2)
+        finally:
+            FakeBus.send = original
+        await eventually(lambda: fake_bus.connections[1].sent == ["Buffered"])
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_full_buffers_drop_the_oldest_messages():
+    async def scenario():
+        pool = DbusConnectionPool(maxBuffered=2)
+        pool._supervise = lambda busType: None
+        dropped = []
+        for member in ("First", "Second", "Third"):
+            on_sent = lambda member=member: dropped.append(member)
+            await pool.send(BusType.SESSION, signal(member), on_sent)
+        assert dropped == ["First"]
+        assert pool.stats()["dropped"] == 1
+        buffered = [message.member for message, _ in pool._buffers[BusType.SESSION]]
+        assert buffered == ["Second", "Third"]
+
+    asyncio.run(scenario())
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,240 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_deadlines.py
+
+This file tests the deadlines, hedged requests and stale fallback of gitHub lookups.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from collections import deque
+from pythoneda.artifact.nix.flake.infrastructure import (
+    Metrics,
+    NixFlakeGitRepo,
+    TagLookupState,
+)
+import pytest
+import requests
+import threading
+import time
+
+
+class Response:
+    """
+    A gitHub response.
+    """
+
+    status_code = 200
+    headers = {}
+    content = b"[]"
+
+
+class SlowSession:
+    """
+    An HTTP session whose responses take the given delays, in order.
+    """
+
+    def __init__(self, *delays):
+        self.delays = deque(delays)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None):
+        with self.lock:
+            self.requests += 1
+            delay = self.delays.popleft() if self.delays else 0.0
+        time.sleep(delay)
+        return Response()
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    previous = NixFlakeGitRepo.use_lookup_state(TagLookupState())
+    Metrics._singleton = Metrics()
+    yield
+    NixFlakeGitRepo.use_lookup_state(previous)
+    Metrics._singleton = None
+
+
+def session(monkeypatch, *delays):
+    result = SlowSession(*delays)
+    monkeypatch.setattr(
+        NixFlakeGitRepo, "http_session", classmethod(lambda cls: result)
+    )
+    return result
+
+
+def warm_up(monkeypatch, latency, count=20):
+    fast = session(monkeypatch, *[latency] * count)
+    for _ in range(count):
+        NixFlakeGitRepo._hedged_get("https://example.org", {}, None)
+    return fast
+
+
+def test_nested_deadlines_cannot_extend_the_enclosing_one():
+    assert NixFlakeGitRepo._deadline.get() is None
+    with NixFlakeGitRepo.deadline() as unbounded:
+        assert unbounded is None
+    with NixFlakeGitRepo.deadline(1) as outer:
+        with NixFlakeGitRepo.deadline(60) as inner:
+            assert inner == outer
+        with NixFlakeGitRepo.deadline(0.5) as inner:
+            assert inner < outer
+    assert NixFlakeGitRepo._deadline.get() is None
+
+
+def test_default_deadlines():
+    NixFlakeGitRepo.request_deadlines(2.0, 1.0)
+    with NixFlakeGitRepo.deadline() as deadline:
+        assert 1.5 < deadline - time.monotonic() <= 2.0
+    assert NixFlakeGitRepo.deadline_settings()["httpTimeout"] == 1.0
+
+
+def test_requests_past_the_deadline_time_out(monkeypatch):
+    slow = session(monkeypatch, 1.0)
+    started = time.monotonic()
+    with NixFlakeGitRepo.deadline(0.1):
+        with pytest.raises(TimeoutError):
+            NixFlakeGitRepo._hedged_get("https://example.org", {}, None)
+    assert time.monotonic() - started < 0.5
+    with NixFlakeGitRepo.deadline(0.1):
+        time.sleep(0.15)
+        with pytest.raises(TimeoutError):
+            NixFlakeGitRepo._hedged_get("https://example.org", {}, None)
+    assert slow.requests == 1
+
+
+def test_hedging_waits_for_enough_latencies(monkeypatch):
+    NixFlakeGitRepo.hedge_requests(0.9, 0.05)
+    assert NixFlakeGitRepo.hedge_delay() is None
+    warm_up(monkeypatch, 0.0, 19)
+    assert NixFlakeGitRepo.hedge_delay() is None
+    warm_up(monkeypatch, 0.0, 1)
+    assert NixFlakeGitRepo.hedge_delay() == 0.05
+    NixFlakeGitRepo.hedge_requests(None)
+    assert NixFlakeGitRepo.hedge_delay() is None
+
+
+def test_slow_requests_get_hedged(monkeypatch):
+    NixFlakeGitRepo.hedge_requests(0.9, 0.05)
+    warm_up(monkeypatch, 0.0)
+    slow = session(monkeypatch, 1.0, 0.0)
+    lookup = {}
+    started = time.monotonic()
+    with NixFlakeGitRepo.deadline(5):
+        NixFlakeGitRepo._hedged_get("https://example.org", {}, lookup)
+    assert time.monotonic() - started < 0.5
+    assert slow.requests == 2
+    assert lookup["requests"] == 2
+    assert (
+        Metrics.instance().value(
+            "nix_flake_http_hedged_requests_total", {"winner": "hedge"}
+        )
+        == 1
+    )
+
+
+def test_fast_requests_are_not_hedged(monkeypatch):
+    NixFlakeGitRepo.hedge_requests(0.9, 0.2)
+    warm_up(monkeypatch, 0.0)
+    fast = session(monkeypatch, 0.0)
+    lookup = {}
+    with NixFlakeGitRepo.deadline(5):
+        NixFlakeGitRepo._hedged_get("https://example.org", {}, lookup)
+    assert fast.requests == 1
+    assert lookup["requests"] == 1
+
+
+def test_requests_without_timeout_still_get_hedged(monkeypatch):
+    NixFlakeGitRepo.request_deadlines(None, None)
+    NixFlakeGitRepo.hedge_requests(0.9, 0.05)
+    warm_up(monkeypatch, 0.0)
+    slow = session(monkeypatch, 1.0, 0.0)
+    lookup = {}
+    started = time.monotonic()
+    NixFlakeGitRepo._hedged_get("https://example.org", {}, lookup)
+    assert time.monotonic() - started < 0.5
+    assert slow.requests == 2
+    # without hedging, they wait for as long as it takes
+    NixFlakeGitRepo.hedge_requests(None)
+    unhedged = session(monkeypatch, 0.2)
+    NixFlakeGitRepo._hedged_get("https://example.org", {}, lookup)
+    with NixFlakeGitRepo.deadline(5):
+        NixFlakeGitRepo._hedged_get("https://example.org", {}, lookup)
+    assert unhedged.requests == 2
+
+
+def test_lookups_past_the_deadline_use_the_last_known_tag(monkeypatch):
+    def timing_out(cls, repoOwner, repoName, prefix=None):
+        raise TimeoutError("too slow")
+
+    monkeypatch.setattr(
+        NixFlakeGitRepo, "_cacheable_get_latest_github_tag", classmethod(timing_out)
+    )
+    repo = NixFlakeGitRepo()
+    # remembered, but expired
+    state = NixFlakeGitRepo.lookup_state()
+    state.latest_tags_ttl = 0
+    state.remember(("rydnr", "nix-flakes", "joblib-"), "1.3.2")
+    assert repo.get_latest_github_tag("rydnr", "nix-flakes", "joblib-") == "1.3.2"
+    assert (
+        Metrics.instance().value(
+            "nix_flake_github_tag_lookups_total", {"outcome": "stale"}
+        )
+        == 1
+    )
+    with pytest.raises(TimeoutError):
+        repo.get_latest_github_tag("rydnr", "unknown", None)
+
+
+def test_unreachable_github_uses_the_last_known_tag(monkeypatch):
+    class UnreachableSession:
+        def get(self, url, headers=None, timeout=None):
+            raise requests.exceptions.ConnectionError("Name or service not known")
+
+    monkeypatch.setattr(
+        NixFlakeGitRepo,
+        "http_session",
+        classmethod(lambda cls: UnreachableSession()),
+    )
+    # skips the disk cache
+    monkeypatch.setattr(
+        NixFlakeGitRepo,
+        "_cacheable_get_latest_github_tag",
+        NixFlakeGitRepo._raw_get_latest_github_tag,
+    )
+    repo = NixFlakeGitRepo()
+    state = NixFlakeGitRepo.lookup_state()
+    state.latest_tags_ttl = 0
+    state.remember(("rydnr", "nix-flakes", "joblib-"), "1.3.2")
+    assert repo.get_latest_github_tag("rydnr", "nix-flakes", "joblib-") == "1.3.2"
+    assert (
+        Metrics.instance().value(
+            "nix_flake_http_requests_total", {"status": "unreachable"}
+        )
+        == 1
+    )
+    with pytest.raises(ConnectionError):
+        repo.get_latest_github_tag("rydnr", "unknown", None)
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
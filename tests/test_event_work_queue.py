@@ -0,0 +1,150 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_event_work_queue.py
+
+This file tests EventWorkQueue, and its admission control.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_events import SamplePackaged, SampleRequested
+import asyncio
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    EventWorkQueue,
+    ExecutionRequestDeduplicator,
+    OverflowPolicy,
+    QueuedApp,
+)
+import pytest
+
+
+class GatedApp:
+    """
+    An application that records the payloads it accepts, holding them until released.
+    """
+
+    def __init__(self):
+        self.processed = []
+        self.gate = asyncio.Event()
+
+    async def accept(self, event):
+        self.processed.append(event.payload)
+        await self.gate.wait()
+
+
+@pytest.fixture(autouse=True)
+def deduplicator():
+    ExecutionRequestDeduplicator._singleton = ExecutionRequestDeduplicator(
+        SampleRequested, SamplePackaged
+    )
+    yield ExecutionRequestDeduplicator._singleton
+    ExecutionRequestDeduplicator._singleton = None
+
+
+def flood(policy, count=50, maxSize=4, paced=False):
+    """
+    Offers many distinct events to a stuck application, as a d-bus flood would.
+    """
+
+    async def scenario():
+        app = GatedApp()
+        queued_app = QueuedApp(app)
+        queue = EventWorkQueue(
+            queued_app.process, maxSize, 1, policy, queued_app.dropped
+        )
+        queued_app.queue = queue
+        before = len(asyncio.all_tasks())
+        offered = []
+        for n in range(count):
+            offered.append(queued_app.offer(SampleRequested(str(n))))
+            if paced:
+                await asyncio.sleep(0)
+        # the worker is a task too
+        spawned = len(asyncio.all_tasks()) - before - 1
+        for _ in range(5):
+            await asyncio.sleep(0)
+        stats = queue.stats()
+        app.gate.set()
+        await asyncio.sleep(0.01)
+        await queue.join()
+        await queue.stop()
+        return offered, spawned, stats, app.processed, queue.stats()
+
+    return asyncio.run(scenario())
+
+
+def test_block_bounds_the_events_waiting_for_room():
+    offered, spawned, stats, processed, _ = flood(OverflowPolicy.BLOCK)
+    # four queued events, plus four waiting for room
+    assert offered.count(True) == 8
+    assert spawned == 8
+    assert stats["rejected"] == 42
+    assert stats["admitting"] <= 4
+    assert len(processed) == offered.count(True)
+
+
+def test_reject_spawns_no_work_when_full():
+    offered, spawned, stats, processed, _ = flood(OverflowPolicy.REJECT)
+    assert offered.count(True) == 4
+    assert spawned == 4
+    assert stats["rejected"] == 46
+
+
+def test_drop_oldest_keeps_the_latest_events():
+    offered, _, stats, processed, final = flood(OverflowPolicy.DROP_OLDEST, paced=True)
+    assert all(offered)
+    assert processed == ["0", "46", "47", "48", "49"]
+    assert final["dropped"] == 50 - len(processed)
+    assert ExecutionRequestDeduplicator.instance().stats()["in_flight"] == 0
+
+
+def test_drop_oldest_bounds_a_burst():
+    offered, spawned, _, _, _ = flood(OverflowPolicy.DROP_OLDEST)
+    assert offered.count(True) == spawned == 8
+
+
+def test_put_blocks_until_there_is_room():
+    async def scenario():
+        processed = []
+        gate = asyncio.Event()
+
+        async def handle(event):
+            await gate.wait()
+            processed.append(event.payload)
+
+        queue = EventWorkQueue(handle, 1, 1, OverflowPolicy.BLOCK)
+        await queue.put(SampleRequested("a"))
+        await asyncio.sleep(0)
+        await queue.put(SampleRequested("b"))
+        blocked = asyncio.ensure_future(queue.put(SampleRequested("c")))
+        await asyncio.sleep(0.01)
+        waiting = not blocked.done()
+        gate.set()
+        await blocked
+        await queue.join()
+        await queue.stop()
+        return waiting, processed
+
+    assert asyncio.run(scenario()) == (True, ["a", "b", "c"])
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,189 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_execution_request_deduplicator.py
+
+This file tests ExecutionRequestDeduplicator, along with QueuedApp.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_events import SamplePackaged, SampleRequested
+import asyncio
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    EventWorkQueue,
+    ExecutionRequestDeduplicator,
+    OverflowPolicy,
+    QueuedApp,
+)
+import pytest
+import time
+import uuid
+
+
+class GatedApp:
+    """
+    An application that records the payloads it accepts, holding them until released.
+    """
+
+    def __init__(self):
+        self.processed = []
+        self.gate = asyncio.Event()
+
+    async def accept(self, event):
+        self.processed.append(event.payload)
+        await self.gate.wait()
+
+
+class NestedRequest:
+    """
+    A code request, with an id and a timestamp of its own, as CodeRequest has.
+    """
+
+    def __init__(self, code):
+        self._id = str(uuid.uuid4())
+        self._timestamp = time.time()
+        self._code = code
+        self._flake = NestedFlake()
+
+
+class NestedFlake:
+    """
+    A flake, with an id of its own, and a value without attributes.
+    """
+
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+        self.lock = object()
+
+
+@pytest.fixture
+def deduplicator():
+    ExecutionRequestDeduplicator._singleton = ExecutionRequestDeduplicator(
+        SampleRequested, SamplePackaged
+    )
+    yield ExecutionRequestDeduplicator._singleton
+    ExecutionRequestDeduplicator._singleton = None
+
+
+def queued(app, maxSize=1, policy=OverflowPolicy.DROP_OLDEST):
+    result = QueuedApp(app)
+    result.queue = EventWorkQueue(result.process, maxSize, 1, policy, result.dropped)
+    return result
+
+
+def test_dropped_request_releases_its_key(deduplicator):
+    async def scenario():
+        app = GatedApp()
+        queued_app = queued(app)
+        await queued_app.enqueue(SampleRequested("a"))
+        await asyncio.sleep(0)
+        await queued_app.enqueue(SampleRequested("b"))
+        # the queue is full: b gets dropped
+        await queued_app.enqueue(SampleRequested("c"))
+        app.gate.set()
+        await queued_app.queue.join()
+        await queued_app.enqueue(SampleRequested("b"))
+        await queued_app.queue.join()
+        await queued_app.queue.stop()
+        return app.processed
+
+    assert asyncio.run(scenario()) == ["a", "c", "b"]
+    assert deduplicator.stats()["collapsed"] == 0
+    assert deduplicator.stats()["in_flight"] == 0
+
+
+def test_request_without_result_lets_its_duplicates_through(deduplicator):
+    async def scenario():
+        app = GatedApp()
+        queued_app = queued(app, 4, OverflowPolicy.BLOCK)
+        await queued_app.enqueue(SampleRequested("a"))
+        await asyncio.sleep(0)
+        await queued_app.enqueue(SampleRequested("a"))
+        app.gate.set()
+        await queued_app.queue.join()
+        await queued_app.enqueue(SampleRequested("a"))
+        await queued_app.queue.join()
+        await queued_app.queue.stop()
+        return app.processed
+
+    # the duplicate takes over once the first one ends with no result,
+    # and later repeats are not collapsed onto a finished job
+    assert asyncio.run(scenario()) == ["a", "a", "a"]
+    assert deduplicator.stats() == {
+        "in_flight": 0,
+        "completed": 0,
+        "hits": 0,
+        "collapsed": 1,
+    }
+
+
+def test_duplicates_get_replays_with_ids_of_their_own(deduplicator):
+    replayed = []
+
+    async def replay(event):
+        replayed.append(event)
+
+    async def scenario():
+        deduplicator.replay_with(replay)
+        first = SampleRequested("a")
+        second = SampleRequested("a")
+        third = SampleRequested("a")
+        assert await deduplicator.admit(first)
+        assert not await deduplicator.admit(second)
+        result = SamplePackaged("done", [first.id])
+        replays = deduplicator.complete(result)
+        assert not await deduplicator.admit(third)
+        return result, replays + replayed, [second.id, third.id]
+
+    result, replays, request_ids = asyncio.run(scenario())
+    assert [replay.previous_event_ids for replay in replays] == [
+        [request_id] for request_id in request_ids
+    ]
+    ids = {result.id} | {replay.id for replay in replays}
+    assert len(ids) == 3
+
+
+def test_expired_requests_are_forgotten():
+    deduplicator = ExecutionRequestDeduplicator(
+        SampleRequested, SamplePackaged, inFlightTimeout=0
+    )
+
+    async def scenario():
+        for _ in range(100):
+            assert await deduplicator.admit(SampleRequested("a"))
+        for payload in range(100):
+            assert await deduplicator.admit(SampleRequested(str(payload)))
+
+    asyncio.run(scenario())
+    assert deduplicator.stats()["in_flight"] <= 1
+    assert len(deduplicator._keys_by_request_id) <= 1
+
+
+def test_nested_ids_do_not_change_the_key():
+    key = ExecutionRequestDeduplicator.idempotency_key
+    first = SampleRequested(NestedRequest("print(1)"))
+    second = SampleRequested(NestedRequest("print(1)"))
+    assert key(first) == key(second)
+    assert key(first) != key(SampleRequested(NestedRequest("print(2)")))
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,196 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_flake_artifact_cache.py
+
+This file tests FlakeArtifactCache, and the packaging of execution requests through it.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_events import SampleExecutionRequested, SamplePackaged
+from .sample_flakes import SampleFlake, SampleRepo
+import asyncio
+import filecmp
+import os
+from pythoneda.artifact.nix.flake.infrastructure import FlakeArtifactCache
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    EventWorkQueue,
+    ExecutionRequestDeduplicator,
+    ExecutionRequestPackager,
+    QueuedApp,
+)
+import pytest
+import sys
+
+
+class RecordingEmitter:
+    """
+    An emitter that records the events instead of sending them.
+    """
+
+    def __init__(self):
+        self.emitted = []
+
+    async def emit(self, event):
+        ExecutionRequestDeduplicator.instance().complete(event)
+        self.emitted.append(event)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return FlakeArtifactCache(str(tmp_path / "cache"), linkMode="auto")
+
+
+@pytest.fixture(autouse=True)
+def deduplicator():
+    ExecutionRequestDeduplicator._singleton = ExecutionRequestDeduplicator(
+        SampleExecutionRequested, SamplePackaged
+    )
+    yield ExecutionRequestDeduplicator._singleton
+    ExecutionRequestDeduplicator._singleton = None
+
+
+def same_files(first, second):
+    comparison = filecmp.dircmp(first, second)
+    return (
+        not comparison.left_only
+        and not comparison.right_only
+        and not comparison.diff_files
+        and all(
+            same_files(os.path.join(first, name), os.path.join(second, name))
+            for name in comparison.common_dirs
+        )
+    )
+
+
+def test_second_identical_generation_is_a_hit(tmp_path, cache):
+    repo = SampleRepo(cache)
+    renders = SampleFlake.renders
+    first = repo.generate_flake(
+        SampleFlake("demo", "1.0", "print(1)"), str(tmp_path / "a"), "print(1)"
+    )
+    second = repo.generate_flake(
+        SampleFlake("demo", "1.0", "print(1)"), str(tmp_path / "b"), "print(1)"
+    )
+    assert (first, second) == (False, True)
+    assert SampleFlake.renders == renders + 1
+    assert same_files(tmp_path / "a", tmp_path / "b")
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_other_code_or_versions_are_misses(tmp_path, cache):
+    repo = SampleRepo(cache)
+    repo.generate_flake(SampleFlake("demo", "1.0", "a"), str(tmp_path / "a"), "a")
+    assert not repo.generate_flake(
+        SampleFlake("demo", "1.0", "b"), str(tmp_path / "b"), "b"
+    )
+    assert not repo.generate_flake(
+        SampleFlake("demo", "1.1", "a"), str(tmp_path / "c"), "a"
+    )
+    assert cache.stats()["hits"] == 0
+
+
+def test_cached_files_survive_edits_of_a_hit(tmp_path, cache):
+    repo = SampleRepo(cache)
+    repo.generate_flake(SampleFlake("demo", "1.0", "a"), str(tmp_path / "a"), "a")
+    repo.generate_flake(SampleFlake("demo", "1.0", "a"), str(tmp_path / "b"), "a")
+    target = tmp_path / "b" / "flake.nix"
+    # consumers replace generated files, rather than editing them in place
+    target.unlink()
+    target.write_text("edited")
+    assert repo.generate_flake(
+        SampleFlake("demo", "1.0", "a"), str(tmp_path / "c"), "a"
+    )
+    assert (tmp_path / "c" / "flake.nix").read_text().startswith("# demo")
+
+
+def test_template_changes_are_misses(tmp_path, monkeypatch):
+    package = tmp_path / "renderers"
+    (package / "templates").mkdir(parents=True)
+    (package / "templates" / "flake.nix.st").write_text("{ inputs }")
+    (package / "__init__.py").write_text(
+        "class RenderedFlake:\n"
+        "    def __init__(self):\n"
+        "        self.name, self.version, self.url, self.inputs = 'a', '1', '', []\n"
+    )
+    (package / "sub").mkdir()
+    (package / "sub" / "__init__.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(FlakeArtifactCache, "_package_digests", {})
+    monkeypatch.delitem(sys.modules, "renderers", raising=False)
+    from renderers import RenderedFlake
+
+    def key():
+        FlakeArtifactCache._package_digests.clear()
+        return FlakeArtifactCache.key_for(RenderedFlake(), "print(1)")
+
+    original = key()
+    # subpackages render flakes of their own
+    (package / "sub" / "__init__.py").write_text("# changed")
+    assert key() == original
+    (package / "templates" / "flake.nix.st").write_text("{ inputs, self }")
+    assert key() != original
+
+
+def test_execution_requests_from_dbus_reuse_cached_flakes(tmp_path, cache):
+    emitter = RecordingEmitter()
+    packager = ExecutionRequestPackager(
+        SampleRepo(cache),
+        emitter,
+        str(tmp_path / "packages"),
+        SampleExecutionRequested,
+        SamplePackaged,
+    )
+
+    class App:
+        async def accept(self, event):
+            raise AssertionError(f"{event} should have been packaged")
+
+    async def scenario():
+        queued_app = QueuedApp(App(), packager)
+        queued_app.queue = EventWorkQueue(queued_app.process, 4, 2)
+        first = SampleExecutionRequested("print(1)")
+        assert queued_app.offer(first)
+        await asyncio.sleep(0.01)
+        await queued_app.queue.join()
+        # an identical request, once the first one is done
+        second = SampleExecutionRequested("print(1)")
+        assert queued_app.offer(second)
+        await asyncio.sleep(0.01)
+        await queued_app.queue.join()
+        await queued_app.queue.stop()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert [event.previous_event_ids for event in emitter.emitted] == [
+        [first.id],
+        [second.id],
+    ]
+    assert cache.stats()["hits"] == 1
+    folders = sorted((tmp_path / "packages").iterdir())
+    assert len(folders) == 2
+    assert same_files(folders[0], folders[1])
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,156 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_github_token_pool.py
+
+This file tests how gitHub requests are spread across tokens, according to their quota.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from pythoneda.artifact.nix.flake.infrastructure import (
+    GithubTokenPool,
+    Metrics,
+    NixFlakeGitRepo,
+    TagLookupState,
+)
+import pytest
+import time
+
+
+class Response:
+    """
+    A gitHub response.
+    """
+
+    content = b"[]"
+
+    def __init__(self, statusCode=200, headers=None):
+        self.status_code = statusCode
+        self.headers = headers or {}
+
+
+class RateLimitedSession:
+    """
+    An HTTP session answering with the responses given for each token.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.tokens = []
+
+    def get(self, url, headers=None, timeout=None):
+        token = (headers or {}).get("Authorization", "token ")[len("token ") :]
+        self.tokens.append(token)
+        return self.responses.get(token, Response())
+
+
+@pytest.fixture(autouse=True)
+def isolated():
+    previous = NixFlakeGitRepo.use_lookup_state(TagLookupState())
+    Metrics._singleton = Metrics()
+    yield
+    NixFlakeGitRepo.use_lookup_state(previous)
+    Metrics._singleton = None
+
+
+def quota(remaining, reset=None):
+    return {
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset or time.time() + 3600),
+    }
+
+
+def test_tokens_are_parsed_without_blanks_or_duplicates():
+    pool = GithubTokenPool.parse(" a, b,,a ,")
+    assert pool.tokens == ["a", "b"]
+    assert len(pool) == 2
+    assert len(GithubTokenPool.parse(None)) == 0
+    assert GithubTokenPool.parse("").acquire() is None
+
+
+def test_unknown_quotas_go_round_robin():
+    pool = GithubTokenPool(["a", "b", "c"])
+    assert [pool.acquire() for _ in range(4)] == ["a", "b", "c", "a"]
+
+
+def test_the_token_with_the_most_remaining_requests_goes_first():
+    pool = GithubTokenPool(["a", "b", "c"])
+    pool.update("a", 200, quota(10))
+    pool.update("b", 200, quota(50))
+    pool.update("c", 200, quota(20))
+    assert pool.acquire() == "b"
+    assert pool.stats()[1]["remaining"] == 49
+    assert pool.acquire(exclude=["b"]) == "c"
+    assert Metrics.instance().value(
+        "nix_flake_github_rate_limit_remaining", {"token": "1"}
+    ) == 50
+
+
+def test_exhausted_tokens_are_skipped_until_their_reset(monkeypatch):
+    now = time.time()
+    pool = GithubTokenPool(["a", "b"])
+    pool.update("a", 403, quota(0, now + 60))
+    pool.update("b", 200, quota(1, now + 60))
+    assert [entry["available"] for entry in pool.stats()] == [False, True]
+    assert pool.acquire() == "b"
+    assert pool.acquire() is None
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert pool.acquire() in ("a", "b")
+    assert [entry["available"] for entry in pool.stats()] == [True, True]
+
+
+@pytest.mark.parametrize("statusCode", [403, 429])
+def test_retry_after_exhausts_the_token(statusCode):
+    pool = GithubTokenPool(["a", "b"])
+    pool.update("a", 200, quota(100))
+    pool.update("a", statusCode, {"Retry-After": "30"})
+    [a, b] = pool.stats()
+    assert a["remaining"] == 0
+    assert not a["available"]
+    assert 25 < a["reset"] - time.time() <= 30
+    assert pool.acquire() == "b"
+    assert pool.acquire(exclude=["b"]) is None
+
+
+def test_retry_after_is_ignored_on_successful_responses():
+    pool = GithubTokenPool(["a"])
+    pool.update("a", 200, {"Retry-After": "30"})
+    assert pool.stats()[0]["available"]
+    assert pool.acquire() == "a"
+
+
+def test_rate_limited_requests_retry_with_the_next_token(monkeypatch):
+    session = RateLimitedSession(
+        {"a": Response(429, {"Retry-After": "30"}), "b": Response(200, quota(10))}
+    )
+    monkeypatch.setattr(
+        NixFlakeGitRepo, "http_session", classmethod(lambda cls: session)
+    )
+    NixFlakeGitRepo.github_tokens(["a", "b"])
+    response = NixFlakeGitRepo._github_get("https://api.github.com/repos/o/r/tags")
+    assert response.status_code == 200
+    assert session.tokens == ["a", "b"]
+    NixFlakeGitRepo._github_get("https://api.github.com/repos/o/r/tags")
+    assert session.tokens == ["a", "b", "b"]
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
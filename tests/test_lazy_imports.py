@@ -0,0 +1,102 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_lazy_imports.py
+
+This file checks entry points import only what they use.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+import os
+import subprocess
+import sys
+
+INFRASTRUCTURE = "pythoneda.artifact.nix.flake.infrastructure"
+
+# heavy modules no CLI parser needs
+HEAVY_MODULES = [
+    "dbus_next",
+    "joblib",
+    "requests",
+    f"{INFRASTRUCTURE}.nix_flake_git_repo",
+]
+
+
+def imported_after(statement: str):
+    """
+    Runs given import statement in a fresh interpreter.
+    :return: The heavy modules it imported.
+    """
+    script = (
+        "import json, sys\n"
+        f"{statement}\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))\n"
+    )
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    completed = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        env=environment,
+        text=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_github_token_cli_imports_nothing_heavy():
+    assert imported_after(f"import {INFRASTRUCTURE}.cli.github_token_cli") == []
+
+
+def test_packages_import_nothing_heavy():
+    assert (
+        imported_after(
+            f"import {INFRASTRUCTURE}, {INFRASTRUCTURE}.cli, {INFRASTRUCTURE}.dbus"
+        )
+        == []
+    )
+
+
+def test_attributes_get_imported_on_first_access():
+    statement = (
+        f"from {INFRASTRUCTURE}.cli import GithubTokenCli\n"
+        f"import {INFRASTRUCTURE} as infrastructure\n"
+        "assert 'NixFlakeGitRepo' in dir(infrastructure)\n"
+        "assert 'NixFlakeGitRepo' not in vars(infrastructure)\n"
+        "infrastructure.NixFlakeGitRepo\n"
+        "assert 'NixFlakeGitRepo' in vars(infrastructure)"
+    )
+    assert f"{INFRASTRUCTURE}.nix_flake_git_repo" in imported_after(statement)
+
+
+def test_unknown_attributes_raise_attribute_error():
+    import pythoneda.artifact.nix.flake.infrastructure.cli as cli
+
+    try:
+        cli.Missing
+    except AttributeError as error:
+        assert "Missing" in str(error)
+    else:
+        raise AssertionError("cli.Missing should not exist")
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
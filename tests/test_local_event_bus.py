@@ -0,0 +1,147 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_local_event_bus.py
+
+This file tests the in-process delivery of events, skipping d-bus.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_events import SamplePackaged, SampleRequested
+import asyncio
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    DbusConnectionPool,
+    EventWorkQueue,
+    ExecutionRequestDeduplicator,
+    LocalEventBus,
+    NixFlakeDbusSignalEmitter,
+    QueuedApp,
+)
+import pytest
+
+
+class RecordingApp:
+    """
+    An application that records the events it accepts.
+    """
+
+    def __init__(self):
+        self.accepted = []
+
+    async def accept(self, event):
+        self.accepted.append(event)
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    LocalEventBus._singleton = LocalEventBus()
+    ExecutionRequestDeduplicator._singleton = ExecutionRequestDeduplicator(
+        SampleRequested, SamplePackaged
+    )
+
+    async def no_dbus(*args, **kwargs):
+        raise AssertionError("d-bus should not be used")
+
+    monkeypatch.setattr(DbusConnectionPool.instance(), "send", no_dbus)
+    yield
+    LocalEventBus._singleton = None
+    ExecutionRequestDeduplicator._singleton = None
+
+
+def full_class_name(cls):
+    return f"{cls.__module__}.{cls.__name__}"
+
+
+def test_requests_emitted_in_process_reach_the_listener_without_dbus():
+    async def scenario():
+        app = RecordingApp()
+        queued_app = QueuedApp(app)
+        queued_app.queue = EventWorkQueue(queued_app.process, 4, 1)
+        # as NixFlakeDbusSignalListener.accept() subscribes it
+        LocalEventBus.instance().subscribe(
+            full_class_name(SampleRequested), queued_app.offer_local
+        )
+        event = SampleRequested("a")
+        await NixFlakeDbusSignalEmitter(window=0).emit(event)
+        # the admission runs as a task of its own
+        await asyncio.sleep(0.01)
+        await queued_app.queue.join()
+        await queued_app.queue.stop()
+        return event, app.accepted
+
+    event, accepted = asyncio.run(scenario())
+    assert accepted == [event]
+    assert LocalEventBus.instance().delivered(event)
+
+
+def test_slow_subscribers_do_not_delay_emission():
+    async def scenario():
+        received = []
+        release = asyncio.Event()
+
+        async def slow(event):
+            await release.wait()
+            received.append(event)
+
+        LocalEventBus.instance().subscribe(full_class_name(SampleRequested), slow)
+        event = SampleRequested("a")
+        await asyncio.wait_for(NixFlakeDbusSignalEmitter(window=0).emit(event), 1)
+        pending = list(received)
+        release.set()
+        await LocalEventBus.instance().join()
+        return pending, received
+
+    pending, received = asyncio.run(scenario())
+    assert pending == []
+    assert len(received) == 1
+
+
+def test_failing_subscribers_do_not_affect_the_others():
+    async def scenario():
+        received = []
+
+        async def failing(event):
+            raise RuntimeError("boom")
+
+        def plain(event):
+            received.append(event)
+
+        name = full_class_name(SampleRequested)
+        LocalEventBus.instance().subscribe(name, failing)
+        LocalEventBus.instance().subscribe(name, plain)
+        delivered = await LocalEventBus.instance().publish(SampleRequested("a"))
+        await LocalEventBus.instance().join()
+        return delivered, received
+
+    delivered, received = asyncio.run(scenario())
+    assert delivered
+    assert len(received) == 1
+
+
+def test_events_without_subscribers_are_not_delivered():
+    async def scenario():
+        return await LocalEventBus.instance().publish(SampleRequested("a"))
+
+    assert not asyncio.run(scenario())
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,118 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_metrics.py
+
+This file tests the Prometheus text format of the metrics.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from pythoneda.artifact.nix.flake.infrastructure import Metrics
+import pytest
+import urllib.request
+
+
+@pytest.fixture
+def metrics():
+    Metrics._singleton = Metrics()
+    yield Metrics.instance()
+    Metrics._singleton = None
+
+
+def samples(text, name):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+def test_every_metric_has_help_and_type(metrics):
+    lines = metrics.render().splitlines()
+    for name, (kind, description, _) in Metrics._definitions.items():
+        help = lines.index(f"# HELP {name} {description}")
+        assert lines[help + 1] == f"# TYPE {name} {kind}"
+    assert metrics.render().endswith("\n")
+
+
+def test_counters_and_gauges(metrics):
+    metrics.inc("nix_flake_github_tag_lookups_total", {"outcome": "network"})
+    metrics.inc("nix_flake_github_tag_lookups_total", {"outcome": "network"}, 2)
+    metrics.inc("nix_flake_github_tag_lookups_total", {"outcome": "disk_hit"})
+    metrics.inc("nix_flake_http_response_bytes_total", value=1.5)
+    metrics.set("nix_flake_github_rate_limit_remaining", 10, {"token": "0"})
+    metrics.set("nix_flake_github_rate_limit_remaining", 7, {"token": "0"})
+    text = metrics.render()
+    assert samples(text, "nix_flake_github_tag_lookups_total{") == [
+        'nix_flake_github_tag_lookups_total{outcome="disk_hit"} 1',
+        'nix_flake_github_tag_lookups_total{outcome="network"} 3',
+    ]
+    assert samples(text, "nix_flake_http_response_bytes_total ") == [
+        "nix_flake_http_response_bytes_total 1.5"
+    ]
+    assert samples(text, "nix_flake_github_rate_limit_remaining{") == [
+        'nix_flake_github_rate_limit_remaining{token="0"} 7'
+    ]
+
+
+def test_histograms_have_cumulative_buckets(metrics):
+    name = "nix_flake_resolve_duration_seconds"
+    for value in (0.0002, 0.001, 0.3, 20.0):
+        metrics.observe(name, value, {"spec": "sample"})
+    text = metrics.render()
+    buckets = samples(text, f"{name}_bucket")
+    assert len(buckets) == len(Metrics._latency_buckets) + 1
+    assert buckets[0] == f'{name}_bucket{{spec="sample",le="0.0005"}} 1'
+    assert buckets[1] == f'{name}_bucket{{spec="sample",le="0.001"}} 2'
+    assert f'{name}_bucket{{spec="sample",le="0.25"}} 2' in buckets
+    assert f'{name}_bucket{{spec="sample",le="0.5"}} 3' in buckets
+    assert buckets[-2] == f'{name}_bucket{{spec="sample",le="10"}} 3'
+    assert buckets[-1] == f'{name}_bucket{{spec="sample",le="+Inf"}} 4'
+    assert samples(text, f"{name}_count") == [f'{name}_count{{spec="sample"}} 4']
+    [total] = samples(text, f"{name}_sum")
+    assert float(total.split(" ")[-1]) == pytest.approx(20.3012)
+
+
+def test_label_values_are_escaped(metrics):
+    metrics.inc("nix_flake_dbus_signals_received_total", {"event": 'a"b\\c\nd'})
+    assert samples(metrics.render(), "nix_flake_dbus_signals_received_total{") == [
+        'nix_flake_dbus_signals_received_total{event="a\\"b\\\\c\\nd"} 1'
+    ]
+
+
+def test_metrics_are_served_over_http(metrics):
+    metrics.inc("nix_flake_dbus_signals_emitted_total", {"event": "Sample"})
+    port = metrics.serve(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode("utf-8") == metrics.render()
+    finally:
+        metrics._server.shutdown()
+        metrics._server.server_close()
+
+
+def test_metrics_are_written_to_a_textfile(metrics, tmp_path):
+    path = tmp_path / "nix_flake.prom"
+    metrics.inc("nix_flake_tag_refreshes_total", {"outcome": "network"})
+    metrics.write_textfile(str(path))
+    assert path.read_text() == metrics.render()
+    assert list(tmp_path.iterdir()) == [path]
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,181 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_nix_flake_dbus_signal_emitter.py
+
+This file tests how NixFlakeDbusSignalEmitter coalesces events.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_events import SamplePackaged, SampleRequested
+import asyncio
+from dbus_next import BusType
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    DbusConnectionPool,
+    ExecutionRequestDeduplicator,
+    LocalEventBus,
+    NixFlakeDbusSignalEmitter,
+    NixFlakeDbusSignalListener,
+)
+import pytest
+
+
+class SamplePackagedInterface:
+    """
+    The d-bus interface of SamplePackaged.
+    """
+
+    name = "org.example.SamplePackaged"
+
+    @classmethod
+    def path(cls):
+        return "/org/example/sample"
+
+    @classmethod
+    def sign(cls, event):
+        return "s"
+
+    @classmethod
+    def transform(cls, event):
+        return [event.payload]
+
+    @classmethod
+    def parse(cls, message):
+        return SamplePackaged(message.body[0])
+
+
+@pytest.fixture(autouse=True)
+def isolated():
+    DbusConnectionPool._singleton = DbusConnectionPool()
+    LocalEventBus._singleton = LocalEventBus()
+    ExecutionRequestDeduplicator._singleton = ExecutionRequestDeduplicator(
+        SampleRequested, SamplePackaged
+    )
+    yield
+    DbusConnectionPool._singleton = None
+    LocalEventBus._singleton = None
+    ExecutionRequestDeduplicator._singleton = None
+
+
+def recording_emitter(monkeypatch, window):
+    """
+    Creates an emitter that records what it would send, instead of using d-bus.
+    """
+    emitter = NixFlakeDbusSignalEmitter(window=window, maxBatch=100)
+    sent = []
+
+    async def send(event):
+        sent.append(event)
+
+    name = f"{SamplePackaged.__module__}.{SamplePackaged.__name__}"
+    monkeypatch.setattr(emitter, "_send", send)
+    monkeypatch.setattr(emitter, "signal_emitters", lambda: {name: None})
+    return emitter, sent
+
+
+def test_events_pending_at_shutdown_get_sent(monkeypatch):
+    async def scenario():
+        emitter, sent = recording_emitter(monkeypatch, 60)
+        events = [SamplePackaged(str(index)) for index in range(3)]
+        for event in events:
+            await emitter.emit(event)
+        pending = list(sent)
+        await DbusConnectionPool.instance().close()
+        return events, pending, sent, emitter
+
+    events, pending, sent, emitter = asyncio.run(scenario())
+    assert pending == []
+    assert sorted(event.payload for event in sent) == ["0", "1", "2"]
+    assert emitter.pending == 0
+
+
+def test_events_after_shutdown_are_not_buffered(monkeypatch):
+    async def scenario():
+        emitter, sent = recording_emitter(monkeypatch, 60)
+        await DbusConnectionPool.instance().close()
+        await emitter.emit(SamplePackaged("late"))
+        return sent, emitter
+
+    sent, emitter = asyncio.run(scenario())
+    assert [event.payload for event in sent] == ["late"]
+    assert emitter.pending == 0
+
+
+def test_hooks_are_registered_once_per_process(monkeypatch):
+    async def scenario():
+        first, first_sent = recording_emitter(monkeypatch, 0)
+        # i.e. the one ExecutionRequestPackager creates
+        second, second_sent = recording_emitter(monkeypatch, 60)
+        deduplicator = ExecutionRequestDeduplicator.instance()
+        request = SampleRequested("x")
+        assert await deduplicator.admit(request)
+        await second.emit(SamplePackaged("x", [request.id]))
+        repeated = SampleRequested("x")
+        assert not await deduplicator.admit(repeated)
+        replays = [event.previous_event_ids for event in first_sent]
+        closing = len(DbusConnectionPool.instance()._closing)
+        await DbusConnectionPool.instance().close()
+        return repeated, replays, closing, second_sent
+
+    repeated, replays, closing, second_sent = asyncio.run(scenario())
+    assert replays == [[repeated.id]]
+    assert closing == 1
+    # the result was still coalescing when the pool closed
+    assert [event.payload for event in second_sent] == ["x"]
+
+
+def test_large_payloads_reach_listeners_of_the_original_signal(monkeypatch):
+    sent = []
+
+    async def send(busType, message, onSent=None):
+        sent.append(message)
+
+    async def scenario():
+        emitter = NixFlakeDbusSignalEmitter(window=0)
+        name = f"{SamplePackaged.__module__}.{SamplePackaged.__name__}"
+        monkeypatch.setattr(
+            emitter,
+            "signal_emitters",
+            lambda: {name: [SamplePackagedInterface, BusType.SESSION]},
+        )
+        monkeypatch.setattr(DbusConnectionPool.instance(), "send", send)
+        await emitter.emit(SamplePackaged("x" * (256 * 1024)))
+
+    asyncio.run(scenario())
+    assert [message.member for message in sent] == ["SamplePackaged"]
+    offered = []
+
+    class Queued:
+        def offer(self, event):
+            offered.append(event)
+
+    NixFlakeDbusSignalListener()._on_signal(
+        SamplePackagedInterface,
+        SamplePackagedInterface.name,
+        "SamplePackaged",
+        Queued(),
+        sent[0],
+    )
+    assert [event.payload for event in offered] == ["x" * (256 * 1024)]
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
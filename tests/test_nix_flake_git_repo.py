@@ -0,0 +1,170 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_nix_flake_git_repo.py
+
+This file tests how NixFlakeGitRepo resolves flakes.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_flakes import SampleFlake, SampleRepo
+import json
+import os
+from pythoneda.artifact.nix.flake.infrastructure import (
+    Metrics,
+    NixFlakeGitRepo,
+    RemoteCache,
+    TagLookupState,
+)
+import pytest
+
+
+class OfflineRepo(SampleRepo):
+    """
+    Resolves a few spec names offline, counting the resolutions.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.resolved = []
+
+    def _sample(self, name):
+        self.resolved.append(name)
+        return SampleFlake(name, "1.0", "")
+
+    def latest_Joblib(self):
+        return self._sample("joblib")
+
+    def latest_Requests(self):
+        return self._sample("requests")
+
+    def latest_Unidiff(self):
+        return self._sample("unidiff")
+
+
+class BulkRepo(SampleRepo):
+    """
+    Builds flakes describing the process, and the settings, they got built with.
+    """
+
+    def version_finder(self, specName):
+        def find(version):
+            state = NixFlakeGitRepo.lookup_state()
+            settings = [
+                os.getpid(),
+                state.github_api_url,
+                state.http_timeout,
+                state.hedge_delay() is None,
+                state.latest_tags_ttl,
+                NixFlakeGitRepo.remote_cache_settings(),
+            ]
+            return SampleFlake(specName, version, json.dumps(settings))
+
+        return find
+
+
+@pytest.fixture(autouse=True)
+def isolated():
+    Metrics._singleton = Metrics()
+    yield
+    Metrics._singleton = None
+
+
+def resolutions(spec):
+    return Metrics.instance().value(
+        "nix_flake_resolve_duration_seconds", {"spec": spec}
+    )
+
+
+def test_resolutions_by_name_are_timed():
+    repo = OfflineRepo()
+    assert repo.resolve_by_name("joblib").name == "joblib"
+    assert repo.resolve_by_name("unknown") is None
+    assert resolutions("joblib")[-1] == 1
+    assert resolutions("other")[-1] == 1
+
+
+def test_resolutions_by_name_run_within_a_deadline():
+    repo = OfflineRepo()
+    deadlines = []
+
+    def latest_Joblib():
+        deadlines.append(NixFlakeGitRepo._deadline.get())
+        return None
+
+    repo.__dict__["latest_Joblib"] = latest_Joblib
+    repo._flake_mapping = None
+    repo.resolve_by_name("joblib", 10)
+    assert deadlines[0] is not None
+
+
+def test_shared_latest_flakes_are_bounded(monkeypatch):
+    monkeypatch.setattr(OfflineRepo, "_max_shared_latest_flakes", 2)
+    repo = OfflineRepo()
+    with repo.shared_latest_flakes():
+        repo.latest_Joblib()
+        repo.latest_Requests()
+        repo.latest_Joblib()
+        repo.latest_Unidiff()
+        assert len(repo._shared_latest_flakes) == 2
+        # Requests was the least recently used one
+        repo.latest_Joblib()
+        repo.latest_Requests()
+    assert repo.resolved == ["joblib", "requests", "unidiff", "requests"]
+
+
+def test_snapshots_share_latest_flakes_only():
+    repo = OfflineRepo()
+    flake = SampleFlake("joblib", "2.0", "")
+    repo.restore_latest_flakes({"latest_Joblib": flake, "unrelated": flake})
+    assert repo.latest_Joblib() is flake
+    assert list(repo._shared_latest_flakes) == ["latest_Joblib"]
+
+
+def test_bulk_workers_share_the_settings_of_this_process():
+    previous = NixFlakeGitRepo.use_lookup_state(TagLookupState())
+    try:
+        NixFlakeGitRepo.github_api_url("http://127.0.0.1:1")
+        NixFlakeGitRepo.request_deadlines(5.0, 2.0)
+        NixFlakeGitRepo.latest_tags_ttl(42.0)
+        NixFlakeGitRepo.remote_cache(RemoteCache.from_url("memory://bulk"), 60.0)
+        flakes = BulkRepo().find_versions("sample", ["1", "2", "3", "4"], 2)
+    finally:
+        NixFlakeGitRepo.remote_cache(None)
+        NixFlakeGitRepo.use_lookup_state(previous)
+    assert sorted(flakes) == ["1", "2", "3", "4"]
+    pids = set()
+    for flake in flakes.values():
+        pid, *settings = json.loads(flake.code)
+        pids.add(pid)
+        assert settings == [
+            "http://127.0.0.1:1",
+            2.0,
+            True,
+            42.0,
+            ["memory://bulk", 60.0],
+        ]
+    # the first version gets built here, the rest in spawned workers
+    assert os.getpid() in pids and len(pids) > 1
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
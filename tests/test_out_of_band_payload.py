@@ -0,0 +1,139 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_out_of_band_payload.py
+
+This file tests how OutOfBandPayload moves large payloads through file descriptors.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_events import SampleRequested
+from dbus_next import Message
+import fcntl
+import os
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    NixFlakeDbusSignalListener,
+    OutOfBandPayload,
+)
+import pytest
+import tempfile
+
+PATH = "/sample"
+INTERFACE = "org.example.Sample"
+
+
+def received(message, fds):
+    """
+    Rebuilds given signal as the receiving side gets it, with its own descriptors.
+    """
+    return Message(
+        path=message.path,
+        interface=message.interface,
+        member=message.member,
+        message_type=message.message_type,
+        signature=message.signature,
+        body=message.body,
+        unix_fds=fds,
+        sender=":1.42",
+    )
+
+
+def test_large_bodies_travel_out_of_band(monkeypatch):
+    monkeypatch.setattr(OutOfBandPayload, "_threshold", 16)
+    assert not OutOfBandPayload.is_large(["small"])
+    assert OutOfBandPayload.is_large(["x" * 16])
+    assert OutOfBandPayload.is_large(["x" * 10, "y" * 10])
+
+
+def test_payloads_round_trip_through_a_file_descriptor():
+    body = ["x" * 100_000, '{"id": "\u00e9"}']
+    message, fd = OutOfBandPayload.signal(
+        SampleRequested("a"), PATH, INTERFACE, "ss", body
+    )
+    assert message.unix_fds == [fd]
+    name, original = OutOfBandPayload.original(received(message, [os.dup(fd)]))
+    os.close(fd)
+    assert name.endswith(".SampleRequested")
+    assert (original.path, original.interface) == (PATH, INTERFACE)
+    assert original.member == "SampleRequested"
+    assert (original.signature, original.body) == ("ss", body)
+    assert original.sender == ":1.42"
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "memfd_create") or not hasattr(fcntl, "F_ADD_SEALS"),
+    reason="memfd sealing is not supported",
+)
+def test_payloads_cannot_change_once_sent():
+    fd = OutOfBandPayload.write("s", ["body"])
+    try:
+        with pytest.raises(OSError):
+            os.write(fd, b"tampered")
+    finally:
+        os.close(fd)
+
+
+def test_empty_payloads_are_rejected():
+    with tempfile.TemporaryFile() as handle:
+        empty = os.dup(handle.fileno())
+    with pytest.raises(ValueError):
+        OutOfBandPayload.read(empty)
+    # read() closes the descriptor, even then
+    with pytest.raises(OSError):
+        os.fstat(empty)
+
+
+def test_signals_without_their_descriptor_are_rejected(monkeypatch):
+    message, fd = OutOfBandPayload.signal(
+        SampleRequested("a"), PATH, INTERFACE, "s", ["body"]
+    )
+    os.close(fd)
+    reads = []
+    monkeypatch.setattr(
+        OutOfBandPayload, "read", classmethod(lambda cls, fd: reads.append(fd))
+    )
+    with pytest.raises(ValueError):
+        OutOfBandPayload.original(received(message, []))
+    assert reads == []
+
+
+def test_the_listener_drops_unreadable_payloads():
+    message, fd = OutOfBandPayload.signal(
+        SampleRequested("a"), PATH, INTERFACE, "s", ["body"]
+    )
+    os.close(fd)
+    offered = []
+
+    class Queued:
+        def offer(self, event):
+            offered.append(event)
+
+    name = message.body[0]
+    receivers = {name: [None, None]}
+    listener = NixFlakeDbusSignalListener()
+    assert (
+        listener._on_out_of_band(receivers, Queued(), received(message, [])) is None
+    )
+    assert offered == []
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,135 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_packaging_executor.py
+
+This file tests PackagingExecutor, through spawned worker processes.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_events import SampleExecutionRequested, SamplePackaged
+from .sample_flakes import SampleRepo
+import asyncio
+import os
+from pythoneda.artifact.nix.flake.infrastructure import (
+    FlakeArtifactCache,
+    NixFlakeGitRepo,
+    PackagingExecutor,
+)
+from pythoneda.artifact.nix.flake.infrastructure.dbus import (
+    EventWorkQueue,
+    ExecutionRequestDeduplicator,
+    ExecutionRequestPackager,
+    QueuedApp,
+)
+import pytest
+
+
+class RecordingEmitter:
+    """
+    An emitter that records the events instead of sending them.
+    """
+
+    def __init__(self):
+        self.emitted = []
+
+    async def emit(self, event):
+        ExecutionRequestDeduplicator.instance().complete(event)
+        self.emitted.append(event)
+
+
+@pytest.fixture
+def executor(tmp_path):
+    ttl = NixFlakeGitRepo.latest_tags_settings()
+    NixFlakeGitRepo.latest_tags_ttl(42.0)
+    result = PackagingExecutor(
+        1, SampleRepo(FlakeArtifactCache(str(tmp_path / "cache")))
+    )
+    yield result
+    result.shutdown(wait=True)
+    NixFlakeGitRepo.latest_tags_ttl(ttl)
+
+
+def test_round_trip_through_a_spawned_worker(tmp_path, executor):
+    async def scenario():
+        first = await executor.package(
+            PackagingExecutor.CODE_EXECUTION, "print(1)", str(tmp_path / "a")
+        )
+        second = await executor.package(
+            PackagingExecutor.CODE_EXECUTION, "print(1)", str(tmp_path / "b")
+        )
+        return first, second
+
+    (flake, reused), (_, reused_again) = asyncio.run(scenario())
+    assert (flake.name, flake.code) == ("code-execution", "print(1)")
+    assert (reused, reused_again) == (False, True)
+    assert (tmp_path / "b" / "flake.nix").read_text().endswith("print(1)\n")
+    assert executor.stats()["completed"] == 2
+    assert executor.stats()["reused"] == 1
+
+
+def test_workers_share_the_settings_of_this_process(tmp_path, executor):
+    pool = executor._current_pool()
+    assert pool.submit(os.getpid).result() != os.getpid()
+    assert pool.submit(NixFlakeGitRepo.latest_tags_settings).result() == 42.0
+    assert pool.submit(os.getcwd).result() == os.getcwd()
+
+
+def test_execution_requests_from_dbus_package_in_workers(tmp_path, executor):
+    ExecutionRequestDeduplicator._singleton = ExecutionRequestDeduplicator(
+        SampleExecutionRequested, SamplePackaged
+    )
+    emitter = RecordingEmitter()
+    packager = ExecutionRequestPackager(
+        emitter=emitter,
+        folder=str(tmp_path / "packages"),
+        requestClass=SampleExecutionRequested,
+        resultClass=SamplePackaged,
+        executor=executor,
+    )
+
+    async def scenario():
+        queued_app = QueuedApp(None, packager)
+        queued_app.queue = EventWorkQueue(queued_app.process, 4, 2)
+        requests = [SampleExecutionRequested(f"print({n})") for n in range(3)]
+        for request in requests:
+            assert queued_app.offer(request)
+        await asyncio.sleep(0.01)
+        await queued_app.queue.join()
+        await queued_app.queue.stop()
+        return requests
+
+    try:
+        requests = asyncio.run(scenario())
+    finally:
+        ExecutionRequestDeduplicator._singleton = None
+    assert sorted(event.previous_event_ids[0] for event in emitter.emitted) == sorted(
+        request.id for request in requests
+    )
+    assert sorted(event.payload.code for event in emitter.emitted) == [
+        "print(0)",
+        "print(1)",
+        "print(2)",
+    ]
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
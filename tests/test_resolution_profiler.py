@@ -0,0 +1,146 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_resolution_profiler.py
+
+This file tests the call tree the profiler records while resolving flakes.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from .sample_flakes import SampleFlake, SampleRepo
+from pythoneda.artifact.nix.flake.infrastructure import ResolutionProfiler
+import pytest
+import time
+
+
+class ProfiledRepo(SampleRepo):
+    """
+    A SampleRepo whose phases take known times.
+    """
+
+    def latest_sample_version(self):
+        time.sleep(0.02)
+        self._profiler.lookup("network", 2)
+        return "1.0"
+
+    def find_dependency_version(self, version):
+        time.sleep(0.01)
+        self._profiler.lookup("disk_hit", 0)
+        return SampleFlake("dependency", version, "")
+
+    def find_sample_version(self, version):
+        time.sleep(0.03)
+        self.find_dependency_version(version)
+        self.find_dependency_version(version)
+        return SampleFlake("sample", version, "")
+
+    def resolve_by_name(self, specName):
+        return self.find_sample_version(self.latest_sample_version())
+
+
+@pytest.fixture
+def repo():
+    return ProfiledRepo()
+
+
+def node(profiler, *path):
+    result = profiler._root
+    for frame in path:
+        result = result["children"][frame]
+    return result
+
+
+def test_each_phase_gets_its_own_and_inclusive_time(repo):
+    with repo.profiling() as profiler:
+        repo.resolve_by_name("sample")
+    resolve = node(profiler, "resolve_by_name(sample)")
+    latest = node(profiler, "resolve_by_name(sample)", "latest_sample_version")
+    sample = node(profiler, "resolve_by_name(sample)", "find_sample_version")
+    dependency = node(
+        profiler,
+        "resolve_by_name(sample)",
+        "find_sample_version",
+        "find_dependency_version",
+    )
+    assert latest["calls"] == sample["calls"] == resolve["calls"] == 1
+    assert dependency["calls"] == 2
+    assert latest["own"] == pytest.approx(latest["inclusive"])
+    assert latest["own"] >= 0.02
+    assert dependency["inclusive"] >= 0.02
+    assert sample["own"] >= 0.03
+    assert sample["own"] < sample["inclusive"] - 0.02
+    assert sample["inclusive"] == pytest.approx(
+        sample["own"] + dependency["inclusive"]
+    )
+    assert resolve["own"] < 0.01
+    assert resolve["inclusive"] == pytest.approx(
+        resolve["own"] + latest["inclusive"] + sample["inclusive"]
+    )
+
+
+def test_lookups_count_towards_the_current_phase(repo):
+    with repo.profiling() as profiler:
+        repo.resolve_by_name("sample")
+    latest = node(profiler, "resolve_by_name(sample)", "latest_sample_version")
+    dependency = node(
+        profiler,
+        "resolve_by_name(sample)",
+        "find_sample_version",
+        "find_dependency_version",
+    )
+    assert (latest["network"], latest["hits"]) == (2, 0)
+    assert (dependency["network"], dependency["hits"]) == (0, 2)
+
+
+def test_rebuilt_flakes_are_reported(repo):
+    with repo.profiling() as profiler:
+        repo.resolve_by_name("sample")
+        repo.resolve_by_name("sample")
+    assert profiler.builds()["find_dependency_version"] == 4
+    assert node(profiler, "resolve_by_name(sample)")["calls"] == 2
+    tree = profiler.tree()
+    assert tree.splitlines()[1].endswith("  resolve_by_name(sample)")
+    assert "Built more than once:" in tree
+    assert "    4  find_dependency_version" in tree
+
+
+def test_folded_stacks_hold_the_own_time(repo):
+    with repo.profiling() as profiler:
+        repo.resolve_by_name("sample")
+    stacks = dict(line.rsplit(" ", 1) for line in profiler.folded().splitlines())
+    sample = "resolve_by_name(sample);find_sample_version"
+    assert int(stacks[sample]) >= 30000
+    assert int(stacks[f"{sample};find_dependency_version"]) >= 20000
+
+
+def test_profiling_ends_with_the_block(repo):
+    profiler = ResolutionProfiler()
+    with repo.profiling(profiler) as attached:
+        assert attached is profiler
+        with repo.profiling() as nested:
+            assert nested is profiler
+        assert "find_sample_version" in repo.__dict__
+    assert "find_sample_version" not in repo.__dict__
+    assert repo._profiler is None
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,111 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_resolver_daemon.py
+
+This file tests how ResolverDaemon caches resolutions.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from pythoneda.artifact.nix.flake.infrastructure import ResolverDaemon
+import threading
+
+
+class GatedResolver:
+    """
+    Resolves specs once released, counting the resolutions.
+    """
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.resolutions = 0
+        self.results = []
+
+    def resolve_line(self, index, line):
+        self.released.wait(5)
+        self.resolutions += 1
+        result = {"index": index, "input": line, "ok": True, "version": "1.0"}
+        self.results.append(result)
+        return result
+
+
+def gated_daemon():
+    daemon = ResolverDaemon("/nonexistent/resolver.sock", ttl=60)
+    resolver = GatedResolver()
+    daemon._resolver = resolver
+    return daemon, resolver
+
+
+def test_results_are_cached():
+    async def scenario():
+        daemon, resolver = gated_daemon()
+        resolver.released.set()
+        first = await daemon.resolve("owner/name")
+        second = await daemon.resolve("owner/name")
+        daemon._executor.shutdown()
+        return first, second, resolver.resolutions
+
+    first, second, resolutions = asyncio.run(scenario())
+    assert resolutions == 1
+    assert not first["cached"]
+    assert second["cached"]
+
+
+def test_results_of_resolutions_ongoing_when_a_tag_changes_are_not_cached():
+    async def scenario():
+        daemon, resolver = gated_daemon()
+        ongoing = asyncio.ensure_future(daemon.resolve("owner/name"))
+        await asyncio.sleep(0.01)
+        # as _tag_changed() does, from the loop
+        daemon._forget()
+        resolver.released.set()
+        first = await ongoing
+        second = await daemon.resolve("owner/name")
+        daemon._executor.shutdown()
+        return first, second, resolver.resolutions
+
+    first, second, resolutions = asyncio.run(scenario())
+    assert resolutions == 2
+    assert not first["cached"]
+    assert not second["cached"]
+
+
+def test_concurrent_resolutions_share_an_unmodified_result():
+    async def scenario():
+        daemon, resolver = gated_daemon()
+        resolutions = [
+            asyncio.ensure_future(daemon.resolve("owner/name")) for _ in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        resolver.released.set()
+        results = await asyncio.gather(*resolutions)
+        daemon._executor.shutdown()
+        return results, resolver
+
+    results, resolver = asyncio.run(scenario())
+    assert resolver.resolutions == 1
+    assert all("index" not in result for result in results)
+    assert resolver.results[0]["index"] == 0
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,91 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_tag_cache_manager.py
+
+This file tests how TagCacheManager updates the on-disk cache of gitHub tags.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from joblib import Memory
+from pythoneda.artifact.nix.flake.infrastructure import TagCacheManager
+import pytest
+
+
+def latest_tag(repoOwner, repoName, prefix=None):
+    """
+    Stands for the cached gitHub lookup of NixFlakeGitRepo.
+    """
+    return f"{prefix or ''}1.0"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    memory = Memory(str(tmp_path), verbose=0)
+    return memory.cache(latest_tag), TagCacheManager(str(tmp_path))
+
+
+def counting_keys(monkeypatch):
+    read = []
+    key = TagCacheManager._key.__func__
+
+    def counting(cls, metadata):
+        read.append(metadata)
+        return key(cls, metadata)
+
+    monkeypatch.setattr(TagCacheManager, "_key", classmethod(counting))
+    return read
+
+
+def test_refresh_rewrites_the_entries_of_the_repository(cache):
+    cached, manager = cache
+    cached("rydnr", "nix-flakes", "joblib-")
+    cached("rydnr", "other", "joblib-")
+    assert manager.refresh("rydnr/nix-flakes", "joblib-", "2.0")
+    assert cached("rydnr", "nix-flakes", "joblib-") == "2.0"
+    assert cached("rydnr", "other", "joblib-") == "joblib-1.0"
+
+
+def test_update_removes_deleted_tags(cache):
+    cached, manager = cache
+    cached("rydnr", "nix-flakes", "joblib-")
+    cached("rydnr", "nix-flakes", "requests-")
+    affected = manager.update("rydnr/nix-flakes", "joblib-1.0", deleted=True)
+    assert [entry["prefix"] for entry in affected] == ["joblib-"]
+    assert [entry["prefix"] for entry in manager.entries()] == ["requests-"]
+
+
+def test_index_reads_the_metadata_of_new_entries_only(cache, monkeypatch):
+    cached, manager = cache
+    for index in range(20):
+        cached("rydnr", f"repo-{index}", None)
+    read = counting_keys(monkeypatch)
+    manager.refresh("rydnr/repo-0", None, "2.0")
+    assert len(read) == 20
+    cached("rydnr", "nix-flakes", None)
+    manager.refresh("rydnr/repo-1", None, "2.0")
+    manager.update("rydnr/nix-flakes", "3.0")
+    assert len(read) == 21
+    assert cached("rydnr", "nix-flakes", None) == "3.0"
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,104 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_tag_index_snapshot.py
+
+This file tests how TagIndexSnapshot maps snapshots of the tag index.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from datetime import datetime
+from pythoneda.artifact.nix.flake.infrastructure import (
+    NixFlakeGitRepo,
+    TagIndexSnapshot,
+)
+import pytest
+
+INDEX = {
+    "rydnr/nix-flakes": [
+        ("joblib-1.3.2", "ab" * 20, datetime(2023, 8, 8)),
+        ("requests-2.31.0", None, None),
+        ("joblib-1.3.1", "cd" * 20, datetime(2023, 6, 29)),
+    ],
+    "rydnr/other": [("0.1", None, None)],
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated():
+    yield
+    NixFlakeGitRepo.tag_snapshot(None)
+
+
+@pytest.fixture
+def written(tmp_path):
+    path = str(tmp_path / "tags.snapshot")
+    TagIndexSnapshot.write(path, INDEX)
+    return path
+
+
+def test_snapshots_answer_latest_tags(written):
+    snapshot = TagIndexSnapshot(written)
+    assert len(snapshot) == 2
+    assert snapshot.latest("rydnr", "nix-flakes", "joblib-") == "1.3.2"
+    assert snapshot.latest("rydnr", "nix-flakes", "unidiff-") is None
+    assert "rydnr/unknown" not in snapshot
+    assert snapshot.tags("rydnr/nix-flakes")[0] == INDEX["rydnr/nix-flakes"][0]
+    snapshot.close()
+
+
+@pytest.mark.parametrize("size", [0, 10, 60])
+def test_truncated_snapshots_are_rejected(written, size):
+    with open(written, "r+b") as handle:
+        handle.truncate(size)
+    with pytest.raises(ValueError):
+        TagIndexSnapshot(written)
+
+
+def test_unreadable_snapshots_are_misses(tmp_path):
+    empty = tmp_path / "empty.snapshot"
+    empty.write_bytes(b"")
+    assert NixFlakeGitRepo.tag_snapshot(str(empty)) is None
+    assert NixFlakeGitRepo.tag_snapshot(str(tmp_path / "missing")) is None
+    assert NixFlakeGitRepo._snapshot_latest("rydnr", "nix-flakes", None) == (
+        False,
+        None,
+    )
+
+
+def test_damaged_records_are_misses(written):
+    snapshot = NixFlakeGitRepo.tag_snapshot(written)
+    assert NixFlakeGitRepo._snapshot_latest("rydnr", "nix-flakes", "joblib-") == (
+        True,
+        "1.3.2",
+    )
+    # a repository whose tags lie past the tag table
+    with open(written, "r+b") as handle:
+        handle.seek(snapshot._repositories + 8)
+        handle.write((1000).to_bytes(4, "little"))
+    assert NixFlakeGitRepo._snapshot_latest("rydnr", "nix-flakes", "joblib-") == (
+        False,
+        None,
+    )
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,199 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_tag_refresher.py
+
+This file tests how hot tags get refreshed ahead of their expiration.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from pythoneda.artifact.nix.flake.infrastructure import TagRefresher
+import pytest
+import threading
+import time
+
+
+class Clock:
+    """
+    A monotonic clock moving only when told.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRepo:
+    """
+    A repository class whose tags expire when told, and cost given requests.
+    """
+
+    expirations = {}
+    in_flight = 0
+    cost = 1
+    refreshed = []
+    listeners = []
+
+    @classmethod
+    def latest_tag_expiration(cls, repoOwner, repoName, prefix):
+        return cls.expirations.get((repoOwner, repoName, prefix), None)
+
+    @classmethod
+    def lookups_in_flight(cls):
+        return cls.in_flight
+
+    @classmethod
+    def refresh_latest_github_tag(cls, repoOwner, repoName, prefix, lookup=None):
+        lookup["requests"] = cls.cost
+        cls.refreshed.append((repoOwner, repoName, prefix))
+        return "1.0"
+
+    @classmethod
+    def on_tag_lookup(cls, listener):
+        cls.listeners.append(listener)
+
+
+@pytest.fixture(autouse=True)
+def repo():
+    FakeRepo.expirations = {}
+    FakeRepo.in_flight = 0
+    FakeRepo.cost = 1
+    FakeRepo.refreshed = []
+    FakeRepo.listeners = []
+    yield FakeRepo
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    result = Clock()
+    monkeypatch.setattr(time, "monotonic", result)
+    return result
+
+
+def look_up(refresher, times, repoOwner="rydnr", repoName="sample", prefix=None):
+    for _ in range(times):
+        refresher._looked_up(repoOwner, repoName, prefix)
+
+
+def test_scores_decay_with_their_half_life(clock):
+    refresher = TagRefresher(FakeRepo, halfLife=60.0)
+    look_up(refresher, 4)
+    assert refresher.score("rydnr", "sample") == pytest.approx(4.0)
+    clock.now += 60
+    assert refresher.score("rydnr", "sample") == pytest.approx(2.0)
+    look_up(refresher, 1)
+    clock.now += 120
+    assert refresher.score("rydnr", "sample") == pytest.approx(0.75)
+    assert refresher.score("rydnr", "unknown") == 0.0
+
+
+def test_due_tags_are_hot_and_expiring_soon(clock, repo):
+    refresher = TagRefresher(FakeRepo, lead=30.0, minScore=3.0)
+    look_up(refresher, 5, repoName="hot")
+    look_up(refresher, 8, repoName="hotter")
+    look_up(refresher, 5, repoName="fresh")
+    look_up(refresher, 2, repoName="cold")
+    look_up(refresher, 5, repoName="forgotten")
+    repo.expirations = {
+        ("rydnr", "hot", None): clock.now + 10,
+        ("rydnr", "hotter", None): clock.now + 30,
+        ("rydnr", "fresh", None): clock.now + 300,
+        ("rydnr", "cold", None): clock.now,
+    }
+    assert refresher.due() == [("rydnr", "hotter", None), ("rydnr", "hot", None)]
+
+
+def test_cold_tags_are_forgotten(clock):
+    refresher = TagRefresher(FakeRepo, halfLife=60.0, minScore=3.0)
+    look_up(refresher, 1, repoName="cold")
+    look_up(refresher, 10, repoName="hot")
+    clock.now += 120
+    refresher.due()
+    assert refresher.stats()["tracked"] == 1
+    assert refresher.score("rydnr", "hot") == pytest.approx(2.5)
+
+
+def test_refreshes_stay_within_the_budget(clock, repo):
+    refresher = TagRefresher(FakeRepo, budget=4, window=3600.0)
+    for name in ("a", "b", "c"):
+        look_up(refresher, 10 + len(repo.expirations), repoName=name)
+        repo.expirations[("rydnr", name, None)] = clock.now
+    repo.cost = 2
+    assert refresher.refresh_due() == 2
+    assert repo.refreshed == [("rydnr", "c", None), ("rydnr", "b", None)]
+    assert refresher.remaining_budget() == 0
+    assert refresher.stats()["skipped_budget"] == 1
+    assert refresher.refresh_due() == 0
+    assert refresher.stats()["skipped_budget"] == 4
+    clock.now += 3601
+    assert refresher.remaining_budget() == 4
+    for name in ("a", "b", "c"):
+        look_up(refresher, 10, repoName=name)
+    assert refresher.refresh_due() == 2
+    assert refresher.stats()["refreshed"] == 4
+
+
+def test_refreshes_wait_for_interactive_lookups(repo):
+    refresher = TagRefresher(FakeRepo)
+    look_up(refresher, 10)
+    repo.expirations[("rydnr", "sample", None)] = time.monotonic()
+    repo.in_flight = 1
+
+    def finish_lookup():
+        time.sleep(0.2)
+        assert repo.refreshed == []
+        repo.in_flight = 0
+
+    lookup = threading.Thread(target=finish_lookup)
+    lookup.start()
+    started = time.monotonic()
+    assert refresher.refresh_due() == 1
+    lookup.join()
+    assert time.monotonic() - started >= 0.2
+    assert repo.refreshed == [("rydnr", "sample", None)]
+
+
+def test_stopping_while_waiting_refreshes_nothing(repo):
+    refresher = TagRefresher(FakeRepo)
+    look_up(refresher, 10)
+    repo.expirations[("rydnr", "sample", None)] = time.monotonic()
+    repo.in_flight = 1
+    threading.Timer(0.1, refresher.stop).start()
+    assert refresher.refresh_due() == 0
+    assert repo.refreshed == []
+
+
+def test_lookups_are_tracked_once_started(repo):
+    refresher = TagRefresher(FakeRepo, interval=60.0).start()
+    refresher.start()
+    try:
+        assert repo.listeners == [refresher._looked_up]
+        repo.listeners[0]("rydnr", "sample", None)
+        assert refresher.score("rydnr", "sample") == pytest.approx(1.0, rel=1e-3)
+    finally:
+        refresher.stop()
+    assert refresher._thread is None
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
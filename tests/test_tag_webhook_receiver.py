@@ -0,0 +1,171 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_tag_webhook_receiver.py
+
+This file tests how TagWebhookReceiver verifies and applies gitHub tag webhooks.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import hashlib
+import hmac
+import json
+from pythoneda.artifact.nix.flake.infrastructure import TagWebhookReceiver
+import pytest
+import urllib.error
+import urllib.request
+
+SECRET = "webhook secret"
+
+
+class RecordingRepo:
+    """
+    Records the tag changes, as NixFlakeGitRepo.tag_changed() gets them.
+    """
+
+    changes = []
+
+    @classmethod
+    def tag_changed(cls, repoOwner, repoName, tag, deleted=False):
+        cls.changes.append((f"{repoOwner}/{repoName}", tag, deleted))
+        return 2
+
+
+@pytest.fixture
+def receiver():
+    RecordingRepo.changes = []
+    result = TagWebhookReceiver(SECRET, RecordingRepo)
+    yield result
+    result.stop()
+
+
+def signed(payload, secret=SECRET):
+    body = json.dumps(payload).encode("utf-8")
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return body, f"sha256={digest}"
+
+
+def created(tag, repository="rydnr/nix-flakes"):
+    return {"ref": tag, "ref_type": "tag", "repository": {"full_name": repository}}
+
+
+def test_a_secret_is_required():
+    with pytest.raises(ValueError):
+        TagWebhookReceiver("")
+
+
+def test_signed_deliveries_update_the_tags(receiver):
+    body, signature = signed(created("joblib-1.4.0"))
+    status, response = receiver.deliver("create", body, signature)
+    assert status == 200
+    assert response["updated"] == 2
+    assert RecordingRepo.changes == [("rydnr/nix-flakes", "joblib-1.4.0", False)]
+
+
+@pytest.mark.parametrize(
+    "signature",
+    [
+        "",
+        "sha1=0123",
+        "sha256=",
+        "sha256=" + "0" * 64,
+        "sha256=\u00e9" * 8,
+        signed(created("joblib-1.4.0"), "another secret")[1],
+    ],
+)
+def test_deliveries_not_signed_with_the_secret_are_rejected(receiver, signature):
+    body, _ = signed(created("joblib-1.4.0"))
+    status, _ = receiver.deliver("create", body, signature)
+    assert status == 401
+    assert RecordingRepo.changes == []
+    assert receiver.stats()["rejected"] == 1
+
+
+def test_tampered_deliveries_are_rejected(receiver):
+    body, signature = signed(created("joblib-1.4.0"))
+    tampered = body.replace(b"1.4.0", b"9.9.9")
+    status, _ = receiver.deliver("create", tampered, signature)
+    assert status == 401
+
+
+@pytest.mark.parametrize(
+    "event, payload, expected",
+    [
+        (
+            "delete",
+            created("joblib-1.3.2"),
+            ("rydnr/nix-flakes", "joblib-1.3.2", True),
+        ),
+        (
+            "push",
+            dict(created("refs/tags/v2"), created=True),
+            ("rydnr/nix-flakes", "v2", False),
+        ),
+        (
+            "push",
+            dict(created("refs/tags/v2"), created=True, forced=True),
+            ("rydnr/nix-flakes", "v2", True),
+        ),
+        ("push", created("refs/heads/main"), None),
+        ("create", dict(created("main"), ref_type="branch"), None),
+        ("create", {"ref": "v1", "ref_type": "tag", "repository": "x/y"}, None),
+        ("create", dict(created("v1"), ref=None), None),
+        ("create", [], None),
+        ("issues", created("v1"), None),
+    ],
+)
+def test_tag_events(event, payload, expected):
+    assert TagWebhookReceiver.tag_event(event, payload) == expected
+
+
+def test_invalid_payloads_are_rejected(receiver):
+    body = b"not json"
+    digest = hmac.new(SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    status, _ = receiver.deliver("create", body, f"sha256={digest}")
+    assert status == 400
+    body, signature = signed(["not", "an", "object"])
+    status, _ = receiver.deliver("create", body, signature)
+    assert status == 202
+
+
+def test_deliveries_over_http(receiver):
+    port = receiver.serve(0)
+    body, signature = signed(created("joblib-1.4.0"))
+
+    def post(signature):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{port}/",
+            data=body,
+            headers={"X-GitHub-Event": "create", "X-Hub-Signature-256": signature},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    assert post(signature) == 200
+    assert post("sha256=" + "0" * 64) == 401
+    assert RecordingRepo.changes == [("rydnr/nix-flakes", "joblib-1.4.0", False)]
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End:
@@ -0,0 +1,143 @@
+# vim: set fileencoding=utf-8
+"""
+tests/test_tracer.py
+
+This file tests the tracing of events, and the export of their spans.
+
+Copyright (C) 2023-today rydnr's pythoneda-artifact/nix-flake-infrastructure
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+from pythoneda.artifact.nix.flake.infrastructure import Span, Tracer
+import pytest
+
+
+class Received:
+    """
+    A received event.
+    """
+
+    def __init__(self, id):
+        self.id = id
+
+
+class Outcome:
+    """
+    The outcome of received events.
+    """
+
+    def __init__(self, *previousEventIds):
+        self.previous_event_ids = list(previousEventIds)
+
+
+@pytest.fixture
+def exported(tmp_path):
+    destination = tmp_path / "spans.jsonl"
+    Tracer._singleton = Tracer(str(destination))
+
+    def spans():
+        if not destination.exists():
+            return []
+        lines = destination.read_text().splitlines()
+        return [json.loads(line) for line in lines]
+
+    yield spans
+    Tracer._singleton = None
+
+
+def test_nested_spans_link_to_their_parent(exported):
+    tracer = Tracer.instance()
+    with tracer.span("resolve", {"flake": "sample"}) as parent:
+        assert tracer.current() is parent
+        with tracer.span("lookup", kind=Span.CLIENT) as child:
+            assert tracer.current() is child
+        assert tracer.current() is parent
+    assert tracer.current() is None
+    assert child.trace_id == parent.trace_id
+    assert child.span_id != parent.span_id
+    child_span, parent_span = [
+        line["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for line in exported()
+    ]
+    assert child_span["parentSpanId"] == parent_span["spanId"]
+    assert "parentSpanId" not in parent_span
+    assert child_span["traceId"] == parent_span["traceId"] == parent.trace_id
+
+
+def test_spans_are_exported_as_otlp_json(exported):
+    tracer = Tracer.instance()
+    with pytest.raises(ValueError):
+        with tracer.span(
+            "resolve", {"flake": "sample", "retries": 2, "cached": False, "ratio": 0.5}
+        ):
+            raise ValueError("no such flake")
+    [line] = exported()
+    [resource_spans] = line["resourceSpans"]
+    assert resource_spans["resource"]["attributes"] == [
+        {"key": "service.name", "value": {"stringValue": Tracer._service_name}}
+    ]
+    [scope_spans] = resource_spans["scopeSpans"]
+    assert scope_spans["scope"]["name"].endswith("Tracer")
+    [span] = scope_spans["spans"]
+    assert len(span["traceId"]) == 32
+    assert len(span["spanId"]) == 16
+    assert span["name"] == "resolve"
+    assert span["kind"] == Span.INTERNAL
+    assert int(span["startTimeUnixNano"]) <= int(span["endTimeUnixNano"])
+    assert span["attributes"] == [
+        {"key": "flake", "value": {"stringValue": "sample"}},
+        {"key": "retries", "value": {"intValue": "2"}},
+        {"key": "cached", "value": {"boolValue": False}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+    ]
+    assert span["status"] == {"code": 2, "message": "ValueError: no such flake"}
+
+
+def test_root_spans_stay_open_until_the_outcome(exported):
+    tracer = Tracer.instance()
+    root = tracer.start("received", kind=Span.CONSUMER)
+    tracer.follow(Received("event-1"), root)
+    assert tracer.trace_of(Received("event-1")) is root
+    with tracer.activate(root):
+        with tracer.span("package"):
+            pass
+    assert len(exported()) == 1
+    assert tracer.outcome_of(Outcome("other", "event-1")) is root
+    tracer.conclude(Outcome("event-1"))
+    assert root.ended
+    assert tracer.trace_of(Received("event-1")) is None
+    package, received = [
+        line["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for line in exported()
+    ]
+    assert package["parentSpanId"] == received["spanId"]
+
+
+def test_nothing_is_recorded_when_disabled(exported):
+    Tracer._singleton = Tracer(None)
+    tracer = Tracer.instance()
+    with tracer.span("resolve") as span:
+        assert not span.recording
+        with tracer.span("lookup") as child:
+            assert child is span
+    assert exported() == []
+
+
+# vim: syntax=python ts=4 sw=4 sts=4 tw=79 sr et
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# fill-column: 79
+# End: